@@ -0,0 +1,130 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the memory footprint and lookup throughput of the lookup hash index,
+compared to a plain dict of lookup hashes to MXIDs.
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import random
+import time
+import tracemalloc
+from typing import Dict, List
+
+import unpaddedbase64
+
+from sydent.util.hash_index import LookupHashIndex
+
+NOW = 1000
+NOT_AFTER = 2 * NOW
+
+
+def _lookup_hash(n: int) -> str:
+    digest = hashlib.sha256(b"%d" % n).digest()
+    return unpaddedbase64.encode_base64(digest, urlsafe=True)
+
+
+def _mxid(n: int, threepids_per_user: int) -> str:
+    return "@user%d:example.com" % (n // threepids_per_user)
+
+
+def build_index(entries: int, threepids_per_user: int) -> LookupHashIndex:
+    mxids = sorted(
+        {_mxid(n, threepids_per_user) for n in range(entries)},
+        key=lambda m: m.encode("utf-8"),
+    )
+    mxid_ids = {mxid: i for i, mxid in enumerate(mxids)}
+    rows = sorted(
+        (
+            hashlib.sha256(b"%d" % n).digest(),
+            mxid_ids[_mxid(n, threepids_per_user)],
+            n,
+            0,
+            NOT_AFTER,
+        )
+        for n in range(entries)
+    )
+    del mxid_ids
+    return LookupHashIndex.build(rows, mxids, last_id=entries)
+
+
+def build_dict(entries: int, threepids_per_user: int) -> Dict[str, str]:
+    return {_lookup_hash(n): _mxid(n, threepids_per_user) for n in range(entries)}
+
+
+def _measure_size(entries: int, threepids_per_user: int, use_index: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    if use_index:
+        structure: object = build_index(entries, threepids_per_user)
+    else:
+        structure = build_dict(entries, threepids_per_user)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structure
+    return size
+
+
+def _queries(entries: int, batch_size: int, hit_ratio: float) -> List[str]:
+    return [
+        _lookup_hash(random.randrange(entries))
+        if random.random() < hit_ratio
+        else _lookup_hash(entries + random.randrange(entries))
+        for _ in range(batch_size)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--threepids-per-user", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--batches", type=int, default=100)
+    parser.add_argument("--hit-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {
+        "entries": args.entries,
+        "index_bytes_per_entry": _measure_size(
+            args.entries, args.threepids_per_user, True
+        )
+        / args.entries,
+        "dict_bytes_per_entry": _measure_size(
+            args.entries, args.threepids_per_user, False
+        )
+        / args.entries,
+    }
+
+    index = build_index(args.entries, args.threepids_per_user)
+    batches = [
+        _queries(args.entries, args.batch_size, args.hit_ratio)
+        for _ in range(args.batches)
+    ]
+
+    start = time.perf_counter()
+    for batch in batches:
+        index.lookup_many(batch, NOW)
+    elapsed = time.perf_counter() - start
+
+    results["index_lookups_per_second"] = args.batch_size * args.batches / elapsed
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
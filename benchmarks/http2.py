@@ -0,0 +1,192 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the request throughput of a running Sydent's HTTPS client API listener
+over HTTP/1.1 with keep-alive and over HTTP/2.
+
+Over HTTP/1.1, each of --concurrency threads sends its share of the requests one
+after the other on its own keep-alive connection. Over HTTP/2, a single connection
+keeps --concurrency requests in flight at once, as separate streams.
+
+Sydent must be configured with clientapi.https.port, and clientapi.https.http2 for
+the HTTP/2 run, which needs the h2 package (pip install "twisted[http2]").
+
+Results are printed as JSON.
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Dict, List
+
+
+def _ssl_context(insecure: bool, alpn: List[str]) -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(alpn)
+    return context
+
+
+def bench_http11(
+    host: str, port: int, path: str, requests: int, concurrency: int, insecure: bool
+) -> Dict[str, Any]:
+    context = _ssl_context(insecure, ["http/1.1"])
+    errors: List[int] = []
+    failures: List[Exception] = []
+
+    def worker(count: int) -> None:
+        conn = http.client.HTTPSConnection(host, port, context=context)
+        try:
+            for _ in range(count):
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            conn.close()
+
+    counts = [requests // concurrency] * concurrency
+    counts[0] += requests % concurrency
+    threads = [threading.Thread(target=worker, args=(count,)) for count in counts]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        raise failures[0]
+
+    return {
+        "connections": concurrency,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "errors": len(errors),
+    }
+
+
+def bench_http2(
+    host: str, port: int, path: str, requests: int, concurrency: int, insecure: bool
+) -> Dict[str, Any]:
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    context = _ssl_context(insecure, ["h2"])
+    sock = context.wrap_socket(
+        socket.create_connection((host, port)), server_hostname=host
+    )
+    if sock.selected_alpn_protocol() != "h2":
+        raise RuntimeError("The server didn't negotiate HTTP/2")
+
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    conn.initiate_connection()
+    sock.sendall(conn.data_to_send())
+
+    headers = [
+        (":method", "GET"),
+        (":path", path),
+        (":scheme", "https"),
+        (":authority", "%s:%d" % (host, port)),
+    ]
+
+    sent = 0
+    done = 0
+    errors = 0
+    in_flight = 0
+
+    start = time.perf_counter()
+    while done < requests:
+        while in_flight < concurrency and sent < requests:
+            conn.send_headers(conn.get_next_available_stream_id(), headers, True)
+            sent += 1
+            in_flight += 1
+        sock.sendall(conn.data_to_send())
+
+        data = sock.recv(65536)
+        if not data:
+            raise RuntimeError("The server closed the connection")
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.ResponseReceived):
+                if dict(event.headers).get(b":status") != b"200":
+                    errors += 1
+            elif isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id
+                )
+            elif isinstance(event, (h2.events.StreamEnded, h2.events.StreamReset)):
+                done += 1
+                in_flight -= 1
+    elapsed = time.perf_counter() - start
+
+    conn.close_connection()
+    sock.sendall(conn.data_to_send())
+    sock.close()
+
+    return {
+        "connections": 1,
+        "streams": concurrency,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed,
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--path", default="/_matrix/identity/versions")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--insecure",
+        action="store_true",
+        help="Don't verify the server's certificate, e.g. if it's self-signed",
+    )
+    parser.add_argument("--skip-http2", action="store_true")
+    args = parser.parse_args()
+
+    bench_args = (
+        args.host,
+        args.port,
+        args.path,
+        args.requests,
+        args.concurrency,
+        args.insecure,
+    )
+    results: Dict[str, Any] = {
+        "path": args.path,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "http/1.1": bench_http11(*bench_args),
+    }
+    if not args.skip_http2:
+        results["h2"] = bench_http2(*bench_args)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
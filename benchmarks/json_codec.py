@@ -0,0 +1,135 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the encoding and decoding time of the JSON backends of
+sydent.util.json_codec on lookup and replication payloads.
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+import signedjson.key
+import signedjson.sign
+
+from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.json_codec import BACKEND, BACKENDS
+
+NOT_AFTER = 99999999999999
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the best time out of several runs of the function, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _signed_assocs(count: int) -> List[Dict[str, Any]]:
+    """Build signed associations, as they're pushed to replication peers."""
+    signing_key = signedjson.key.generate_signing_key("0")
+    assocs = []
+    for n in range(count):
+        assoc = {
+            "medium": "email",
+            "address": "user%d@example.com" % (n,),
+            "mxid": "@user%d:example.com" % (n,),
+            "ts": 1000 * n,
+            "not_before": 0,
+            "not_after": NOT_AFTER,
+        }
+        assocs.append(signedjson.sign.sign_json(assoc, "example.com", signing_key))
+    return assocs
+
+
+def _payloads(batch_size: int, hit_ratio: float) -> Dict[str, Any]:
+    rng = random.Random(batch_size)
+    hashes = [
+        sha256_and_url_safe_base64("user%d@example.com email pepper" % (n,))
+        for n in range(batch_size)
+    ]
+    hits = [h for h in hashes if rng.random() < hit_ratio]
+    assocs = _signed_assocs(batch_size)
+
+    return {
+        "v2_lookup_request": {
+            "addresses": hashes,
+            "algorithm": "sha256",
+            "pepper": "pepper",
+        },
+        "v2_lookup_response": {
+            "mappings": {h: "@user%d:example.com" % (i,) for i, h in enumerate(hits)}
+        },
+        "v1_bulk_lookup_response": {
+            "threepids": [
+                ["email", a["address"], a["mxid"]] for a in assocs if a["ts"] % 3
+            ]
+        },
+        "v1_lookup_response": assocs[0],
+        "replication_push": {
+            "sgAssocs": {str(i): assoc for i, assoc in enumerate(assocs)}
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--hit-ratio", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = _payloads(args.batch_size, args.hit_ratio)
+    assocs = list(payloads["replication_push"]["sgAssocs"].values())
+
+    results: Dict[str, Any] = {
+        "default_backend": BACKEND,
+        "batch_size": args.batch_size,
+        "hit_ratio": args.hit_ratio,
+        "payloads": {},
+    }
+    for name, payload in payloads.items():
+        result: Dict[str, Any] = {}
+        for backend, (encode, decode) in BACKENDS.items():
+            encoded = encode(payload)
+            # Check the backends agree, to compare like with like.
+            assert decode(encoded) == payload, (backend, name)
+            result[backend] = {
+                "bytes": len(encoded),
+                "encode_ms": _time(lambda: encode(payload), args.repeat),
+                "decode_ms": _time(lambda: decode(encoded), args.repeat),
+            }
+        results["payloads"][name] = result
+
+    # Replication ingest encodes each signed association separately, to store it.
+    results["replication_ingest_rows"] = {
+        backend: {
+            "encode_ms": _time(
+                lambda: [encode(assoc).decode("UTF-8") for assoc in assocs],
+                args.repeat,
+            )
+        }
+        for backend, (encode, _) in BACKENDS.items()
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the latency and throughput of the lookup endpoints (v1 single and bulk
+lookups, and v2 lookups with both algorithms) against a synthetic dataset of
+associations.
+
+Requests are driven through the real client API resources, using the fake reactor
+from the tests, so the results include request parsing, authentication, the
+database queries and response encoding, but not the network. Each dataset size is
+measured on a fresh on-disk database.
+
+Results are printed as JSON (or written to the --output file), so they can be
+compared between releases.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.sydent import Sydent
+from sydent.util.hash import sha256_and_url_safe_base64
+from tests.utils import make_request, make_sydent
+
+NOT_AFTER = 99999999999999
+
+ACCESS_TOKEN = "benchmark_token"
+
+# Config which is always applied, so that the benchmark isn't ratelimited and can
+# use large batches.
+BASE_CONFIG = {
+    "general": {
+        "enable_v1_access": "true",
+        "address_lookup_limit": "100000",
+        "bulk_lookup_limit": "100000",
+    },
+    "lookup": {
+        "ratelimit.account.burst": "1000000000",
+        "ratelimit.ip.burst": "1000000000",
+    },
+}
+
+# The rows of the global associations table, minus the ID.
+Row = Tuple[str, str, Optional[str], str, int, int, int, str, int, str]
+
+
+def _address(n: int) -> str:
+    return "user%d@example.com" % (n,)
+
+
+def _rows(
+    count: int, pepper: str, deletion_ratio: float, duplicate_ratio: float
+) -> Iterator[Tuple[int, Row, bool]]:
+    """Generate the rows of a synthetic dataset.
+
+    Each 3PID gets one row, plus older rows binding it to other MXIDs (which
+    lookups must skip over) at the given ratio. Rows are marked for deletion at the
+    given ratio, to leave gaps in the table like unbinds do.
+
+    :return: The number of the 3PID of each row (used to build its address), the
+        row, and whether it's to be deleted.
+    """
+    rng = random.Random(count)
+    origin_id = 0
+    n = 0
+    while origin_id < count:
+        address = _address(n)
+        lookup_hash = sha256_and_url_safe_base64(
+            "%s %s %s" % (address, "email", pepper)
+        )
+        versions = 2 if rng.random() < duplicate_ratio else 1
+        for version in range(versions):
+            mxid = "@user%d_%d:example.com" % (n, version)
+            ts = 1000 * (version + 1)
+            sg_assoc = json.dumps(
+                {
+                    "medium": "email",
+                    "address": address,
+                    "mxid": mxid,
+                    "ts": ts,
+                    "not_before": 0,
+                    "not_after": NOT_AFTER,
+                    "signatures": {"origin.example.com": {"ed25519:0": "x" * 86}},
+                }
+            )
+            origin_id += 1
+            row: Row = (
+                "email",
+                address,
+                lookup_hash,
+                mxid,
+                ts,
+                0,
+                NOT_AFTER,
+                "origin.example.com",
+                origin_id,
+                sg_assoc,
+            )
+            yield n, row, rng.random() < deletion_ratio
+        n += 1
+
+
+def populate(
+    db_file: str, rows: int, deletion_ratio: float, duplicate_ratio: float
+) -> Tuple[str, int]:
+    """Create a database and fill it with a synthetic dataset.
+
+    :return: The lookup pepper, and the number of 3PIDs in the dataset.
+    """
+    sydent = make_sydent({"db": {"db.file": db_file}})
+    pepper = HashingMetadataStore(sydent).get_lookup_pepper()
+    assert pepper is not None
+    sydent.db.close()
+
+    db = sqlite3.connect(db_file)
+    deleted: List[int] = []
+    threepids = 0
+
+    def generate() -> Iterator[Row]:
+        nonlocal threepids
+        for n, row, delete in _rows(rows, pepper, deletion_ratio, duplicate_ratio):
+            if delete:
+                deleted.append(row[8])
+            threepids = n + 1
+            yield row
+
+    db.executemany(
+        "INSERT INTO global_threepid_associations (medium, address, lookup_hash, "
+        "mxid, ts, notBefore, notAfter, originServer, originId, sgAssoc) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        generate(),
+    )
+    db.executemany(
+        "DELETE FROM global_threepid_associations "
+        "WHERE originServer = 'origin.example.com' AND originId = ?",
+        ((origin_id,) for origin_id in deleted),
+    )
+    db.execute(
+        "INSERT INTO accounts (user_id, created_ts, consent_version) "
+        "VALUES ('@benchmark:example.com', 0, NULL)"
+    )
+    db.execute(
+        "INSERT INTO tokens (user_id, token) VALUES (?, ?)",
+        ("@benchmark:example.com", ACCESS_TOKEN),
+    )
+    db.commit()
+    db.close()
+    return pepper, threepids
+
+
+class Endpoint:
+    """A lookup endpoint to benchmark.
+
+    :param name: The name of the endpoint in the results.
+    :param method: The HTTP method of the requests.
+    :param request: A function building the path and body of a request, given the
+        addresses to look up and the lookup pepper.
+    :param max_batch_size: The maximum number of addresses looked up by a request.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        request: Callable[[List[str], str], Tuple[str, bytes]],
+        max_batch_size: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.method = method
+        self.request = request
+        self.max_batch_size = max_batch_size
+
+
+def _v1_lookup(addresses: List[str], pepper: str) -> Tuple[str, bytes]:
+    return (
+        "/_matrix/identity/api/v1/lookup?medium=email&address=%s" % (addresses[0],),
+        b"",
+    )
+
+
+def _bulk_lookup(addresses: List[str], pepper: str) -> Tuple[str, bytes]:
+    body = {"threepids": [["email", address] for address in addresses]}
+    return "/_matrix/identity/api/v1/bulk_lookup", json.dumps(body).encode("UTF-8")
+
+
+def _v2_lookup_sha256(addresses: List[str], pepper: str) -> Tuple[str, bytes]:
+    body = {
+        "addresses": [
+            sha256_and_url_safe_base64("%s email %s" % (address, pepper))
+            for address in addresses
+        ],
+        "algorithm": "sha256",
+        "pepper": pepper,
+    }
+    return "/_matrix/identity/v2/lookup", json.dumps(body).encode("UTF-8")
+
+
+def _v2_lookup_none(addresses: List[str], pepper: str) -> Tuple[str, bytes]:
+    body = {
+        "addresses": ["%s email" % (address,) for address in addresses],
+        "algorithm": "none",
+        "pepper": pepper,
+    }
+    return "/_matrix/identity/v2/lookup", json.dumps(body).encode("UTF-8")
+
+
+ENDPOINTS = [
+    Endpoint("v1_lookup", "GET", _v1_lookup, max_batch_size=1),
+    Endpoint("v1_bulk_lookup", "POST", _bulk_lookup),
+    Endpoint("v2_lookup_sha256", "POST", _v2_lookup_sha256),
+    Endpoint("v2_lookup_none", "POST", _v2_lookup_none),
+]
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))
+    return sorted_values[index]
+
+
+def run_endpoint(
+    sydent: Sydent,
+    endpoint: Endpoint,
+    pepper: str,
+    threepids: int,
+    batch_size: int,
+    requests: int,
+    hit_ratio: float,
+) -> Dict[str, Any]:
+    """Send lookup requests to an endpoint, and measure how long they take.
+
+    :return: The latency percentiles (in milliseconds) and the throughput.
+    """
+    rng = random.Random(batch_size)
+    bodies = []
+    for _ in range(requests):
+        addresses = [
+            _address(rng.randrange(threepids))
+            if rng.random() < hit_ratio
+            else _address(threepids + rng.randrange(threepids))
+            for _ in range(batch_size)
+        ]
+        bodies.append(endpoint.request(addresses, pepper))
+
+    latencies = []
+    start = time.perf_counter()
+    for path, body in bodies:
+        request_start = time.perf_counter()
+        _, channel = make_request(
+            sydent.reactor,
+            sydent.clientApiHttpServer.factory,
+            endpoint.method,
+            path,
+            body,
+            access_token=ACCESS_TOKEN,
+        )
+        # Let streamed responses finish.
+        while not channel.result.get("done"):
+            sydent.reactor.advance(0)
+        latencies.append((time.perf_counter() - request_start) * 1000)
+        if channel.code != 200:
+            raise RuntimeError(
+                "%s returned %s: %s" % (endpoint.name, channel.code, channel.json_body)
+            )
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint.name,
+        "batch_size": batch_size,
+        "requests": requests,
+        "p50_ms": _percentile(latencies, 50),
+        "p90_ms": _percentile(latencies, 90),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": latencies[-1],
+        "requests_per_second": requests / elapsed,
+        "addresses_per_second": requests * batch_size / elapsed,
+    }
+
+
+def _parse_overrides(overrides: List[str]) -> Dict[str, Dict[str, str]]:
+    config: Dict[str, Dict[str, str]] = {}
+    for section, values in BASE_CONFIG.items():
+        config[section] = dict(values)
+    for override in overrides:
+        option, _, value = override.partition("=")
+        section, _, key = option.partition(".")
+        config.setdefault(section, {})[key] = value
+    return config
+
+
+def _sydent_version() -> Optional[str]:
+    try:
+        return version("matrix-sydent")
+    except PackageNotFoundError:
+        # Sydent is run from a checkout without being installed.
+        return None
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(x) for x in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--rows",
+        type=_int_list,
+        default=[100000],
+        help="Comma-separated sizes of the datasets, e.g. 100000,1000000,10000000",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=_int_list,
+        default=[1, 100, 1000, 10000],
+        help="Comma-separated numbers of addresses to look up per request",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=50, help="Requests per endpoint and batch size"
+    )
+    parser.add_argument(
+        "--hit-ratio",
+        type=float,
+        default=0.1,
+        help="The ratio of looked up addresses which are bound to an MXID",
+    )
+    parser.add_argument(
+        "--deletion-ratio",
+        type=float,
+        default=0.05,
+        help="The ratio of associations which are deleted from the dataset",
+    )
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.05,
+        help="The ratio of 3PIDs which have an older association to another MXID",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.OPTION=VALUE",
+        help="Override a config option, e.g. --set lookup.cache.enabled=true",
+    )
+    parser.add_argument(
+        "--output", help="Write the results to this file rather than stdout"
+    )
+    args = parser.parse_args()
+
+    # Sydent logs every lookup.
+    logging.disable(logging.INFO)
+
+    config = _parse_overrides(args.set)
+    results: Dict[str, Any] = {
+        "sydent_version": _sydent_version(),
+        "python_version": platform.python_version(),
+        "timestamp": int(time.time()),
+        "config": config,
+        "hit_ratio": args.hit_ratio,
+        "deletion_ratio": args.deletion_ratio,
+        "duplicate_ratio": args.duplicate_ratio,
+        "datasets": [],
+    }
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_file = os.path.join(tmpdir, "sydent.db")
+
+            start = time.perf_counter()
+            pepper, threepids = populate(
+                db_file, rows, args.deletion_ratio, args.duplicate_ratio
+            )
+            populate_seconds = time.perf_counter() - start
+
+            sydent_config = copy.deepcopy(config)
+            sydent_config["db"] = {"db.file": db_file}
+            sydent_config["general"]["pidfile.path"] = os.path.join(
+                tmpdir, "sydent.pid"
+            )
+            start = time.perf_counter()
+            sydent = make_sydent(sydent_config)
+            sydent.run()
+            startup_seconds = time.perf_counter() - start
+
+            dataset: Dict[str, Any] = {
+                "rows": rows,
+                "threepids": threepids,
+                "populate_seconds": populate_seconds,
+                "startup_seconds": startup_seconds,
+                "results": [],
+            }
+            for endpoint in ENDPOINTS:
+                for batch_size in args.batch_sizes:
+                    if (
+                        endpoint.max_batch_size is not None
+                        and batch_size > endpoint.max_batch_size
+                    ):
+                        continue
+                    dataset["results"].append(
+                        run_endpoint(
+                            sydent,
+                            endpoint,
+                            pepper,
+                            threepids,
+                            batch_size,
+                            args.requests,
+                            args.hit_ratio,
+                        )
+                    )
+
+            sydent.db.close()
+            results["datasets"].append(dataset)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure how long Sydent takes to start: the time to import `sydent.sydent`, and
+the time from starting a Sydent process to it answering its first request, with an
+empty database and with a large one.
+
+Each measurement runs in a new Python process, so that nothing is already imported
+or cached. The large database is filled with a synthetic dataset of associations
+(see benchmarks.lookups), once, before it's measured.
+
+Results are printed as JSON.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from configparser import ConfigParser
+from typing import Any, Dict, List
+
+from benchmarks.lookups import populate
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import sydent.sydent
+print(time.perf_counter() - start, len(sys.modules))
+"""
+
+# How long to wait for Sydent to start before giving up, in seconds.
+START_TIMEOUT = 300.0
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    return {
+        "min_seconds": min(samples),
+        "median_seconds": statistics.median(samples),
+        "max_seconds": max(samples),
+    }
+
+
+def bench_import(repeat: int) -> Dict[str, Any]:
+    samples = []
+    modules = 0
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        samples.append(float(output[0]))
+        modules = int(output[1])
+
+    result: Dict[str, Any] = _summary(samples)
+    result["modules"] = modules
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _write_config(directory: str, db_file: str, port: int) -> str:
+    cfg = ConfigParser()
+    cfg.read_dict(
+        {
+            "general": {
+                "server.name": "benchmark.example.com",
+                "templates.path": os.path.abspath("res"),
+                "log.path": os.path.join(directory, "sydent.log"),
+                "pidfile.path": os.path.join(directory, "sydent.pid"),
+            },
+            "db": {"db.file": db_file},
+            "http": {
+                "clientapi.http.bind_address": "127.0.0.1",
+                "clientapi.http.port": str(port),
+            },
+        }
+    )
+    path = os.path.join(directory, "sydent.conf")
+    with open(path, "w") as f:
+        cfg.write(f)
+    return path
+
+
+def _first_request(config_path: str, port: int) -> float:
+    """Start Sydent, and wait until it answers a request.
+
+    :return: The number of seconds it took.
+    """
+    url = "http://127.0.0.1:%d/_matrix/identity/v2" % (port,)
+    env = dict(os.environ, SYDENT_CONF=config_path)
+
+    start = time.perf_counter()
+    # Sydent prints some notices, which would get mixed up with the results.
+    process = subprocess.Popen(
+        [sys.executable, "-m", "sydent.sydent"], env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("Sydent exited with code %d" % process.returncode)
+            if time.perf_counter() - start > START_TIMEOUT:
+                raise RuntimeError("Sydent didn't start in time")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_first_request(repeat: int, rows: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "sydent.db")
+        threepids = 0
+        if rows > 0:
+            with contextlib.redirect_stdout(sys.stderr):
+                _, threepids = populate(
+                    db_file, rows, deletion_ratio=0.0, duplicate_ratio=0.0
+                )
+        port = _free_port()
+        config_path = _write_config(directory, db_file, port)
+
+        # The first start of an empty database creates it, which isn't what's
+        # measured.
+        _first_request(config_path, port)
+
+        samples = [_first_request(config_path, port) for _ in range(repeat)]
+
+    result: Dict[str, Any] = _summary(samples)
+    result["threepids"] = threepids
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1000000,
+        help="The number of associations in the large database",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "import": bench_import(args.repeat),
+        "first_request": {
+            "empty_db": bench_first_request(args.repeat, 0),
+            "large_db": bench_first_request(args.repeat, args.rows),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the size and encoding/decoding time of /v2/lookup requests and
+responses in JSON (with base64 lookup hashes) and in CBOR (with raw digests).
+
+Requests are parsed with get_lookup_args, as the server parses them, and
+responses are encoded with the codecs the server uses.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+import unpaddedbase64
+from twisted.web.server import Request
+from twisted.web.test.requesthelper import DummyChannel
+
+from sydent.http.servlets import CBOR_CONTENT_TYPE, get_lookup_args
+from sydent.http.servlets.lookupv2servlet import parse_address
+from sydent.util import cbor, json_codec
+from sydent.util.json_codec import decode_json, encode_json
+
+
+def _digest(n: int) -> bytes:
+    return hashlib.sha256(b"%d" % n).digest()
+
+
+def _b64(digest: bytes) -> str:
+    return unpaddedbase64.encode_base64(digest, urlsafe=True)
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the best time out of several runs of the function, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _json_request(digests: List[bytes]) -> bytes:
+    return json.dumps(
+        {"addresses": [_b64(d) for d in digests], "algorithm": "sha256", "pepper": "x"}
+    ).encode("UTF-8")
+
+
+def _cbor_request(digests: List[bytes]) -> bytes:
+    return cbor.encode({"addresses": digests, "algorithm": "sha256", "pepper": "x"})
+
+
+def _parse_request(body: bytes, content_type: str, max_items: int) -> List[str]:
+    """Parse a /v2/lookup request's body as the server does.
+
+    :param body: The body of the request.
+    :param content_type: The content type of the body.
+    :param max_items: The maximum number of addresses allowed in the request.
+
+    :return: The lookup hashes to look up.
+    """
+    request = Request(DummyChannel())
+    request.method = b"POST"
+    request.path = b"/_matrix/identity/v2/lookup"
+    request.requestHeaders.setRawHeaders(b"Content-Type", [content_type])
+    request.content = BytesIO(body)
+
+    _, addresses = get_lookup_args(
+        request,
+        ("addresses", "algorithm", "pepper"),
+        "addresses",
+        parse_address,
+        max_items,
+    )
+    # The server looks raw digests up by their base64 encoding.
+    return [_b64(a) if isinstance(a, bytes) else a for a in addresses]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--hit-ratio", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    digests = [_digest(n) for n in range(args.batch_size)]
+    hits = [d for d in digests if random.random() < args.hit_ratio]
+    json_mappings = {_b64(d): "@user%d:example.com" % i for i, d in enumerate(hits)}
+    cbor_mappings = {d: "@user%d:example.com" % i for i, d in enumerate(hits)}
+
+    json_request = _json_request(digests)
+    cbor_request = _cbor_request(digests)
+    json_response = encode_json({"mappings": json_mappings})
+    cbor_response = cbor.encode({"mappings": cbor_mappings})
+
+    results: Dict[str, Any] = {
+        "batch_size": args.batch_size,
+        "hit_ratio": args.hit_ratio,
+        "json": {
+            "backend": json_codec.BACKEND,
+            "request_bytes": len(json_request),
+            "response_bytes": len(json_response),
+            "request_encode_ms": _time(lambda: _json_request(digests), args.repeat),
+            "request_decode_ms": _time(
+                lambda: _parse_request(
+                    json_request, "application/json", args.batch_size
+                ),
+                args.repeat,
+            ),
+            "response_encode_ms": _time(
+                lambda: encode_json({"mappings": json_mappings}), args.repeat
+            ),
+            "response_decode_ms": _time(
+                lambda: decode_json(json_response), args.repeat
+            ),
+        },
+        "cbor": {
+            "backend": cbor.BACKEND,
+            "request_bytes": len(cbor_request),
+            "response_bytes": len(cbor_response),
+            "request_encode_ms": _time(lambda: _cbor_request(digests), args.repeat),
+            "request_decode_ms": _time(
+                lambda: _parse_request(
+                    cbor_request, CBOR_CONTENT_TYPE, args.batch_size
+                ),
+                args.repeat,
+            ),
+            "response_encode_ms": _time(
+                lambda: cbor.encode({"mappings": cbor_mappings}), args.repeat
+            ),
+            "response_decode_ms": _time(
+                lambda: cbor.decode(cbor_response), args.repeat
+            ),
+        },
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 from typing import Any, Optional
 
+class BindError(Exception): ...
+
+class CannotListenError(BindError):
+    def __init__(self, interface: Optional[str], port: Any, socketError: Any): ...
+
 class ConnectError(Exception):
     def __init__(self, osError: Optional[Any] = ..., string: str = ...): ...
 
 class DNSLookupError(IOError): ...
+class ProcessExitedAlready(Exception): ...
@@ -0,0 +1,7 @@
+class FilesystemLock:
+    name: str
+    clean: bool
+    locked: bool
+    def __init__(self, name: str) -> None: ...
+    def lock(self) -> bool: ...
+    def unlock(self) -> None: ...
@@ -1,14 +1,21 @@
 import typing
-from typing import AnyStr, Dict, List, Optional
+from typing import AnyStr, Dict, List, Optional, Union
 
 from twisted.internet import protocol
 from twisted.internet.defer import Deferred
-from twisted.internet.interfaces import IAddress, ITCPTransport
+from twisted.internet.interfaces import (
+    IAddress,
+    IPullProducer,
+    IPushProducer,
+    ITCPTransport,
+)
 from twisted.logger import Logger
 from twisted.web.http_headers import Headers
 from twisted.web.iweb import IRequest
 from zope.interface import implementer
 
+H2_ENABLED: bool
+
 class HTTPFactory(protocol.ServerFactory): ...
 class HTTPChannel: ...
 
@@ -26,6 +33,8 @@ class Request:
     requestHeaders: Headers
     responseHeaders: Headers
     notifications: List[Deferred[None]]
+    code: int
+    sentLength: int
     _disconnected: bool
     _log: Logger
 
@@ -54,6 +63,12 @@ class Request:
     def write(self, data: bytes) -> None: ...
     def finish(self) -> None: ...
     def getClientAddress(self) -> IAddress: ...
+    def registerProducer(
+        self, producer: Union[IPushProducer, IPullProducer], streaming: bool
+    ) -> None: ...
+    def unregisterProducer(self) -> None: ...
+    def notifyFinish(self) -> Deferred[None]: ...
+    def loseConnection(self) -> None: ...
 
 class PotentialDataLoss(Exception): ...
 
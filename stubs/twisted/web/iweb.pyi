@@ -99,4 +99,11 @@ class IPolicyForHTTPS(Interface):
 class IAgentEndpointFactory(Interface):
     def endpointForURI(uri: URI) -> IStreamClientEndpoint: ...
 
+class _IRequestEncoder(Interface):
+    def encode(data: bytes) -> bytes: ...
+    def finish() -> bytes: ...
+
+class _IRequestEncoderFactory(Interface):
+    def encoderForRequest(request: IRequest) -> Optional[_IRequestEncoder]: ...
+
 UNKNOWN_LENGTH: object
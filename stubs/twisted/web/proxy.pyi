@@ -0,0 +1,15 @@
+from typing import Any
+
+from twisted.web.resource import Resource
+from twisted.web.server import Request
+
+class ReverseProxyResource(Resource):
+    host: str
+    port: int
+    path: bytes
+    reactor: Any
+    def __init__(
+        self, host: str, port: int, path: bytes, reactor: Any = ...
+    ) -> None: ...
+    def getChild(self, path: bytes, request: Request) -> Resource: ...
+    def render(self, request: Request) -> object: ...
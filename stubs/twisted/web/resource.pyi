@@ -1,5 +1,6 @@
-from typing import Any, ClassVar
+from typing import Any, ClassVar, Dict, List
 
+from twisted.web.iweb import _IRequestEncoderFactory
 from twisted.web.server import Request
 from zope.interface import Interface, implementer
 
@@ -11,5 +12,15 @@ class IResource(Interface):
 @implementer(IResource)
 class Resource:
     isLeaf: ClassVar[bool]
+    children: Dict[bytes, IResource]
     def putChild(self, path: bytes, child: IResource) -> None: ...
+    def getChildWithDefault(self, path: bytes, request: Request) -> IResource: ...
     def render(self, request: Request) -> Any: ...
+
+@implementer(IResource)
+class EncodingResourceWrapper:
+    isLeaf: ClassVar[bool]
+    def __init__(  # type: ignore[override]
+        self, original: IResource, encoders: List[_IRequestEncoderFactory]
+    ) -> None: ...
+    def putChild(self, path: bytes, child: IResource) -> None: ...
@@ -1,9 +1,11 @@
 from typing import Callable, Optional
 
+from twisted.python.failure import Failure
 from twisted.web import http
 from twisted.web.resource import IResource
 
-class Request(http.Request): ...
+class Request(http.Request):
+    def processingFailed(self, reason: Failure) -> None: ...
 
 # A requestFactory is allowed to be "[a] factory which is called with (channel)
 # and creates L{Request} instances.".
@@ -16,13 +16,15 @@ import copy
 import logging.handlers
 import os
 from configparser import DEFAULTSECT, ConfigParser
-from typing import Dict
+from typing import Dict, List, Optional
 
+from sydent.config._base import BaseConfig
 from sydent.config.crypto import CryptoConfig
 from sydent.config.database import DatabaseConfig
 from sydent.config.email import EmailConfig
 from sydent.config.general import GeneralConfig
 from sydent.config.http import HTTPConfig
+from sydent.config.lookup import LookupConfig
 from sydent.config.sms import SMSConfig
 
 logger = logging.getLogger(__name__)
@@ -34,7 +36,12 @@ CONFIG_DEFAULTS = {
         "log.level": "INFO",
         "pidfile.path": os.environ.get("SYDENT_PID_FILE", "sydent.pid"),
         "terms.path": "",
+        # How often to check whether the terms' file changed, to reload it, in
+        # seconds. 0 disables the checks; the terms can still be reloaded by
+        # sending SIGHUP to Sydent.
+        "terms.reload_interval": "10",
         "address_lookup_limit": "10000",  # Maximum amount of addresses in a single /lookup request
+        "bulk_lookup_limit": "10000",  # Maximum amount of 3PIDs in a single /bulk_lookup request
         # The root path to use for load templates. This should contain branded
         # directories. Each directory should contain the following templates:
         #
@@ -49,6 +56,10 @@ CONFIG_DEFAULTS = {
         # support.
         # 'prometheus_port': '8080',  # The port to serve metrics on
         # 'prometheus_addr': '',  # The address to bind to. Empty string means bind to all.
+        # The path of a Unix socket to serve metrics on, in addition to (or instead
+        # of) prometheus_port, and the permissions of the socket, in octal.
+        "prometheus_unix_socket.path": "",
+        "prometheus_unix_socket.mode": "660",
         # The following can be added to your local config file to enable sentry support.
         # 'sentry_dsn': 'https://...'  # The DSN has configured in the sentry instance project.
         # Whether clients and homeservers can register an association using v1 endpoints. This
@@ -79,6 +90,19 @@ CONFIG_DEFAULTS = {
         "homeserver_allow_list": "",
         # If set to 'false', entirely disable access via the V1 api.
         "enable_v1_access": "true",
+        # The maximum number of access tokens whose accounts are cached, so that
+        # authenticating requests doesn't query the database. 0 disables the cache.
+        "account_cache.max_entries": "10000",
+        # How long the accounts of access tokens stay cached, in seconds.
+        "account_cache.ttl": "300",
+        # Where to export traces to, which record how long requests spend in each
+        # step of processing them (database queries, signing, outbound HTTP
+        # requests, emails, ...). Either "log", to log them, or "json", to append
+        # them as JSON lines to tracing.json_path. Tracing is disabled if empty.
+        "tracing.exporter": "",
+        "tracing.json_path": "sydent-traces.jsonl",
+        # The ratio of requests to trace, between 0 and 1.
+        "tracing.sample_rate": "1",
     },
     "db": {
         "db.file": os.environ.get("SYDENT_DB_PATH", "sydent.db"),
@@ -86,8 +110,42 @@ CONFIG_DEFAULTS = {
     "http": {
         "clientapi.http.bind_address": "::",
         "clientapi.http.port": "8090",
+        # The path of a Unix socket to serve the client API on instead of
+        # clientapi.http.bind_address and clientapi.http.port, e.g. when behind a
+        # local reverse proxy, and the permissions of the socket, in octal. Set
+        # obey_x_forwarded_for so that the proxy can pass on clients' addresses.
+        "clientapi.unix_socket.path": "",
+        "clientapi.unix_socket.mode": "660",
+        # The number of worker processes to serve the client API with, to use more
+        # than one CPU core. Workers share the client API's listening socket, serve
+        # lookups themselves, and forward every other request to the main
+        # process, which handles all writes, replication and background jobs. When
+        # using workers, in-memory lookup caches are disabled in the workers.
+        "clientapi.workers": "0",
+        # The loopback address and port the main process listens on for the
+        # requests forwarded by workers. Workers authenticate the requests they
+        # forward with a secret generated on each start, and only then is the
+        # client's address they pass in X-Forwarded-For trusted.
+        "clientapi.workers.master_bind_address": "127.0.0.1",
+        "clientapi.workers.master_port": "8091",
+        # The port to serve the client API on over HTTPS, in addition to plain
+        # HTTP. Leave empty to only serve it over plain HTTP. The certificate file
+        # must contain the private key and the certificate, in PEM format. When
+        # using client API workers, the main process serves the HTTPS listener.
+        "clientapi.https.bind_address": "::",
+        "clientapi.https.port": "",
+        "clientapi.https.certfile": "",
+        # Whether to offer HTTP/2 (negotiated with ALPN) on the HTTPS listener, so
+        # that clients can multiplex their requests over a single connection.
+        # This requires Twisted's HTTP/2 support: pip install "twisted[http2]".
+        "clientapi.https.http2": "false",
         "internalapi.http.bind_address": "::1",
         "internalapi.http.port": "",
+        # The path of a Unix socket to serve the internal API on, in addition to
+        # (or instead of) internalapi.http.port, and the permissions of the
+        # socket, in octal.
+        "internalapi.unix_socket.path": "",
+        "internalapi.unix_socket.mode": "660",
         "replication.https.certfile": "",
         "replication.https.cacert": "",  # This should only be used for testing
         "replication.https.bind_address": "::",
@@ -99,6 +157,47 @@ CONFIG_DEFAULTS = {
         #
         # 'verify_response_template': 'res/verify_response_page_template',
         "client_http_base": "",
+        # Comma-separated list of the client API endpoints whose responses should be
+        # compressed, if the client accepts it. Responses are compressed with brotli
+        # if the brotli module is installed and the client supports it, or with
+        # gzip otherwise. Each path can be followed by "=" and the minimum size of
+        # the responses to compress, in bytes. Responses produced in parts (e.g.
+        # large lookups, which are done in chunks) are always compressed once
+        # they're longer than 64KiB, regardless of this size. For example:
+        #
+        # clientapi.compression.endpoints = /_matrix/identity/v2/lookup=4096,
+        #     /_matrix/identity/api/v1/bulk_lookup
+        "clientapi.compression.endpoints": "",
+        # The default minimum size of the responses to compress, in bytes.
+        # Compressing smaller responses costs more CPU than it saves bandwidth.
+        "clientapi.compression.min_size": "1024",
+        # Admission control, which sheds load when Sydent is overloaded rather
+        # than queueing work without limit. Endpoints are split into classes:
+        # lookup, validation (requesting and submitting tokens, invites), bind
+        # (binds and unbinds), replication and internal (the internal API).
+        #
+        # For each class, admission.<class>.max_concurrent is the number of
+        # requests processed at once (0 means no limit), and
+        # admission.<class>.max_queued the number of requests waiting for their
+        # turn beyond that. Requests which don't fit in the queue get a 503 with a
+        # Retry-After header.
+        "admission.lookup.max_concurrent": "0",
+        "admission.lookup.max_queued": "100",
+        "admission.validation.max_concurrent": "0",
+        "admission.validation.max_queued": "100",
+        "admission.bind.max_concurrent": "0",
+        "admission.bind.max_queued": "100",
+        "admission.replication.max_concurrent": "0",
+        "admission.replication.max_queued": "100",
+        "admission.internal.max_concurrent": "0",
+        "admission.internal.max_queued": "100",
+        # The number of requests of all classes processed at once (0 means no
+        # limit). Replication and internal requests aren't held back by this
+        # limit, so that they keep flowing during lookup storms, and when requests
+        # are waiting, binds go first, then validations, then lookups.
+        "admission.max_concurrent": "0",
+        # The number of seconds rejected clients are told to wait before retrying.
+        "admission.retry_after": "1",
     },
     "email": {
         # email.template and email.invite_template are deprecated, but still used
@@ -152,6 +251,65 @@ CONFIG_DEFAULTS = {
     "crypto": {
         "ed25519.signingkey": "",
     },
+    "lookup": {
+        # If enabled, /v2/lookup requests using the sha256 algorithm are answered
+        # from a compact in-memory index of lookup hashes rather than from the
+        # database. The index costs roughly 75 bytes per association, and takes a
+        # while to build on startup on large deployments.
+        "hash_index.enabled": "false",
+        # New associations are first added to a small mutable overlay, which is
+        # merged into the index once it holds this many entries...
+        "hash_index.overlay_size": "10000",
+        # ... or periodically, at this interval (in seconds).
+        "hash_index.merge_interval": "60",
+        # If enabled, a Bloom filter of the lookup hashes and 3PIDs of all the
+        # associations is kept in memory, so that lookups for 3PIDs that aren't
+        # bound to any MXID can be answered without querying the database.
+        "bloom_filter.enabled": "false",
+        # The number of associations the filter is sized for. Each association
+        # costs about 20 bytes at the default false positive rate. If 0, this is
+        # twice the number of associations in the database on startup.
+        "bloom_filter.capacity": "0",
+        # The rate of false positives the filter is sized for, i.e. the ratio of
+        # lookups for unbound 3PIDs that still hit the database.
+        "bloom_filter.false_positive_rate": "0.01",
+        # If enabled, the associations for recently looked up 3PIDs and lookup
+        # hashes are cached in memory. Entries are invalidated whenever these
+        # associations change, so this doesn't affect the results of lookups.
+        "cache.enabled": "false",
+        # The maximum number of 3PIDs, and of lookup hashes, to cache.
+        "cache.max_entries": "100000",
+        # How long to cache entries for, in seconds.
+        "cache.ttl": "600",
+        # The maximum number of responses to (deprecated) v1 single 3PID lookups
+        # to cache, once signed by this server. Set to 0 to disable the cache.
+        "signed_cache.max_entries": "10000",
+        # Lookups of more addresses than this are done in chunks of this size,
+        # which lets Sydent serve other requests while processing them.
+        "chunk_size": "1000",
+        # How long (in seconds) to keep the history of association changes used
+        # to answer delta lookups. Sets of addresses registered for delta lookups
+        # which aren't used for this long are deleted too, and clients then have
+        # to register them again.
+        "delta_lookup.retention": "2592000",
+        # The maximum number of sets of addresses each account can have registered
+        # for delta lookups. Registering more deletes the ones least recently used.
+        "delta_lookup.max_sets": "10",
+        # Limits on the rate of lookups, counted in addresses (or 3PIDs) looked
+        # up rather than in requests. Lookups are limited per account (for
+        # authenticated lookups) and per client IP address: the given number of
+        # addresses can be looked up at once, after which clients are limited to
+        # the given rate (in addresses per second). Leave a burst empty to not
+        # limit lookups that way, which is the default.
+        #
+        # Behind a reverse proxy, the IP address limit needs
+        # `obey_x_forwarded_for` to be set in the `http` section, or else all
+        # clients share the proxy's address and are limited together.
+        "ratelimit.account.burst": "",
+        "ratelimit.account.rate_hz": "100",
+        "ratelimit.ip.burst": "",
+        "ratelimit.ip.rate_hz": "100",
+    },
 }
 
 
@@ -172,6 +330,7 @@ class SydentConfig:
         self.sms = SMSConfig()
         self.email = EmailConfig()
         self.http = HTTPConfig()
+        self.lookup = LookupConfig()
 
         self.config_sections = [
             self.general,
@@ -180,8 +339,12 @@ class SydentConfig:
             self.sms,
             self.email,
             self.http,
+            self.lookup,
         ]
 
+        # The file the config was read from, if any, to read it again on reload.
+        self.config_file: Optional[str] = None
+
     def _parse_config(self, cfg: ConfigParser) -> bool:
         """
         Run the parse_config method on each of the objects in
@@ -219,6 +382,8 @@ class SydentConfig:
 
         :param config_file: the file to be parsed
         """
+        self.config_file = config_file
+
         # If the config file already exists, place all config options in
         # the DEFAULT section, to avoid overriding any of the user's
         # configured values in the sections other than DEFAULT.
@@ -268,3 +433,22 @@ class SydentConfig:
                 cfg.set(section, option, value)
 
         self.parse_from_config_parser(cfg)
+
+    def reload(self, new_config: "SydentConfig") -> List[str]:
+        """
+        Apply the options of a newly parsed config which can be changed without
+        restarting Sydent. The others keep their current value.
+
+        :param new_config: the newly parsed config
+
+        :return: the options which changed, but which can't be changed without
+            restarting Sydent, e.g. "http.client_port"
+        """
+        restart_required: List[str] = []
+        for name, section in vars(self).items():
+            if isinstance(section, BaseConfig):
+                restart_required.extend(
+                    f"{name}.{attribute}"
+                    for attribute in section.reload(getattr(new_config, name))
+                )
+        return restart_required
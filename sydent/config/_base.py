@@ -14,9 +14,14 @@
 
 from abc import ABC, abstractmethod
 from configparser import ConfigParser
+from typing import ClassVar, FrozenSet, List
 
 
 class BaseConfig(ABC):
+    # The attributes which can be changed without restarting Sydent, because
+    # they're read again whenever they're needed (or are applied on reload).
+    reloadable: ClassVar[FrozenSet[str]] = frozenset()
+
     @abstractmethod
     def parse_config(self, cfg: ConfigParser) -> bool:
         """
@@ -29,3 +34,21 @@ class BaseConfig(ABC):
             config file.
         """
         pass
+
+    def reload(self, new: "BaseConfig") -> List[str]:
+        """
+        Apply the reloadable attributes of a newly parsed version of this section
+        of the config
+
+        :param new: the newly parsed section
+
+        :return: the names of the attributes which changed, but which can't be
+            changed without restarting Sydent
+        """
+        restart_required = []
+        for name, value in vars(new).items():
+            if name in self.reloadable:
+                setattr(self, name, value)
+            elif getattr(self, name, None) != value:
+                restart_required.append(name)
+        return restart_required
@@ -26,4 +26,9 @@ class DatabaseConfig(BaseConfig):
         """
         self.database_path = cfg.get("db", "db.file")
 
+        # How long to wait for another process to release its lock on the database,
+        # in seconds. This isn't read from the config file, but client API workers
+        # lower it (see sydent.workers).
+        self.busy_timeout = 5.0
+
         return False
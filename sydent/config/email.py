@@ -21,6 +21,32 @@ from sydent.util.emailutils import EmailAddressException, check_valid_email_addr
 
 
 class EmailConfig(BaseConfig):
+    # Everything, as the email settings are read whenever an email is sent.
+    reloadable = frozenset(
+        {
+            "template",
+            "invite_template",
+            "validation_subject",
+            "invite_subject",
+            "invite_subject_space",
+            "smtp_server",
+            "smtp_port",
+            "smtp_username",
+            "smtp_password",
+            "tls_mode",
+            "host_name",
+            "sender",
+            "default_web_client_location",
+            "username_obfuscate_characters",
+            "domain_obfuscate_characters",
+            "third_party_invite_homeserver_blocklist",
+            "third_party_invite_room_blocklist",
+            "third_party_invite_keyword_blocklist",
+            "email_sender_ratelimit_burst",
+            "email_sender_ratelimit_rate_hz",
+        }
+    )
+
     def parse_config(self, cfg: ConfigParser) -> bool:
         """
         Parse the email section of the config
@@ -101,5 +127,7 @@ class EmailConfig(BaseConfig):
         self.email_sender_ratelimit_rate_hz = cfg.getfloat(
             "email", "email.ratelimit_sender.rate_hz", fallback=1.0 / (5 * 60.0)
         )
+        if self.email_sender_ratelimit_rate_hz <= 0:
+            raise ConfigError("email.ratelimit_sender.rate_hz must be greater than 0")
 
         return False
@@ -14,16 +14,32 @@
 
 import os
 from configparser import ConfigParser
-from typing import List
-
-from jinja2.environment import Environment
-from jinja2.loaders import FileSystemLoader
+from typing import TYPE_CHECKING, List, Optional
 
 from sydent.config._base import BaseConfig
+from sydent.config.exceptions import ConfigError
 from sydent.util.ip_range import DEFAULT_IP_RANGE_BLACKLIST, generate_ip_set
 
+if TYPE_CHECKING:
+    from jinja2.environment import Environment
+
 
 class GeneralConfig(BaseConfig):
+    reloadable = frozenset(
+        {
+            "templates_path",
+            "valid_brands",
+            "_template_environment",
+            "default_brand",
+            "ip_blacklist",
+            "ip_whitelist",
+            "homeserver_allow_list",
+            "address_lookup_limit",
+            "bulk_lookup_limit",
+            "delete_tokens_on_bind",
+        }
+    )
+
     def parse_config(self, cfg: "ConfigParser") -> bool:
         """
         Parse the 'general' section of the config
@@ -60,24 +76,45 @@ class GeneralConfig(BaseConfig):
             # email.template, and email.invite_template are defined.
             self.valid_brands = set()
 
-        self.template_environment = Environment(
-            loader=FileSystemLoader(cfg.get("general", "templates.path")),
-            autoescape=True,
-        )
+        # Built on first use, see template_environment.
+        self._template_environment: Optional["Environment"] = None
 
         self.default_brand = cfg.get("general", "brand.default")
 
         self.pidfile = cfg.get("general", "pidfile.path")
 
         self.terms_path = cfg.get("general", "terms.path")
+        self.terms_reload_interval = cfg.getfloat("general", "terms.reload_interval")
 
         self.address_lookup_limit = cfg.getint("general", "address_lookup_limit")
+        self.bulk_lookup_limit = cfg.getint("general", "bulk_lookup_limit")
 
         self.prometheus_port = cfg.getint("general", "prometheus_port", fallback=None)
         self.prometheus_addr = cfg.get("general", "prometheus_addr", fallback=None)
         self.prometheus_enabled = (
             self.prometheus_port is not None and self.prometheus_addr is not None
         )
+        self.prometheus_unix_socket = cfg.get("general", "prometheus_unix_socket.path")
+        self.prometheus_unix_socket_mode = parse_socket_mode(
+            cfg.get("general", "prometheus_unix_socket.mode"),
+            "prometheus_unix_socket.mode",
+        )
+
+        self.account_cache_max_entries = cfg.getint(
+            "general", "account_cache.max_entries"
+        )
+        self.account_cache_ttl = cfg.getfloat("general", "account_cache.ttl")
+
+        self.tracing_exporter = cfg.get("general", "tracing.exporter")
+        if self.tracing_exporter not in ("", "log", "json"):
+            raise ConfigError(
+                "Invalid tracing.exporter %r: must be 'log', 'json' or empty"
+                % (self.tracing_exporter,)
+            )
+        self.tracing_json_path = cfg.get("general", "tracing.json_path")
+        self.tracing_sample_rate = cfg.getfloat("general", "tracing.sample_rate")
+        if not 0 <= self.tracing_sample_rate <= 1:
+            raise ConfigError("tracing.sample_rate must be between 0 and 1")
 
         self.sentry_enabled = cfg.has_option("general", "sentry_dsn")
         self.sentry_dsn = cfg.get("general", "sentry_dsn", fallback=None)
@@ -117,6 +154,39 @@ class GeneralConfig(BaseConfig):
 
         return False
 
+    @property
+    def template_environment(self) -> "Environment":
+        """The Jinja environment to render the templates with."""
+        if self._template_environment is None:
+            # Imported here as jinja2 is slow to import, and only needed to send
+            # emails.
+            from jinja2.environment import Environment
+            from jinja2.loaders import FileSystemLoader
+
+            self._template_environment = Environment(
+                loader=FileSystemLoader(self.templates_path),
+                autoescape=True,
+            )
+        return self._template_environment
+
+    def reload(self, new: BaseConfig) -> List[str]:
+        assert isinstance(new, GeneralConfig)
+        ip_blacklist = self.ip_blacklist
+        ip_whitelist = self.ip_whitelist
+        restart_required = super().reload(new)
+
+        # The HTTP clients hold on to the IP sets, so update them in place instead.
+        for current, updated in (
+            (ip_blacklist, new.ip_blacklist),
+            (ip_whitelist, new.ip_whitelist),
+        ):
+            current.clear()
+            current.update(updated)
+        self.ip_blacklist = ip_blacklist
+        self.ip_whitelist = ip_whitelist
+
+        return restart_required
+
 
 def list_from_comma_sep_string(rawstr: str) -> List[str]:
     """
@@ -129,6 +199,24 @@ def list_from_comma_sep_string(rawstr: str) -> List[str]:
     return [x.strip() for x in rawstr.split(",")]
 
 
+def parse_socket_mode(value: str, option: str) -> int:
+    """
+    Parse the permissions of a Unix socket, given in octal
+
+    :param value: the string to be parsed
+    :param option: the name of the option, for error messages
+
+    :raises ConfigError: if the value isn't valid permissions
+    """
+    try:
+        mode = int(value, 8)
+    except ValueError:
+        mode = -1
+    if not 0 <= mode <= 0o777:
+        raise ConfigError(f"{option} must be permissions in octal, not {value!r}")
+    return mode
+
+
 def parse_cfg_bool(value: str) -> bool:
     """
     Parse a string config option into a boolean
@@ -12,13 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ipaddress
 from configparser import ConfigParser
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+from twisted.web.http import H2_ENABLED
 
 from sydent.config._base import BaseConfig
+from sydent.config.exceptions import ConfigError
+from sydent.config.general import parse_socket_mode
+
+# The classes of endpoints whose concurrency is limited by admission control.
+ADMISSION_CLASSES = ("lookup", "validation", "bind", "replication", "internal")
 
 
 class HTTPConfig(BaseConfig):
+    reloadable = frozenset(
+        {
+            "obey_x_forwarded_for",
+            "verify_response_template",
+            # The replication certificate is reloaded with them.
+            "cert_file",
+            "ca_cert_file",
+            # As is the client API's HTTPS certificate.
+            "client_https_cert_file",
+        }
+    )
+
     def parse_config(self, cfg: "ConfigParser") -> bool:
         """
         Parse the http section of the config
@@ -32,6 +52,44 @@ class HTTPConfig(BaseConfig):
 
         self.client_bind_address = cfg.get("http", "clientapi.http.bind_address")
         self.client_port = cfg.getint("http", "clientapi.http.port")
+        self.client_unix_socket = cfg.get("http", "clientapi.unix_socket.path")
+        self.client_unix_socket_mode = parse_socket_mode(
+            cfg.get("http", "clientapi.unix_socket.mode"), "clientapi.unix_socket.mode"
+        )
+
+        self.client_workers = cfg.getint("http", "clientapi.workers")
+        self.client_workers_master_bind_address = cfg.get(
+            "http", "clientapi.workers.master_bind_address"
+        )
+        self.client_workers_master_port = cfg.getint(
+            "http", "clientapi.workers.master_port"
+        )
+        if not _is_loopback(self.client_workers_master_bind_address):
+            raise ConfigError(
+                "clientapi.workers.master_bind_address must be a loopback address, "
+                "e.g. 127.0.0.1 or ::1"
+            )
+
+        self.client_https_bind_address = cfg.get("http", "clientapi.https.bind_address")
+        client_https_port = cfg.get("http", "clientapi.https.port")
+        self.client_https_port: Optional[int] = None
+        if client_https_port != "":
+            self.client_https_port = int(client_https_port)
+        self.client_https_cert_file = cfg.get("http", "clientapi.https.certfile")
+        if self.client_https_port is not None and self.client_https_cert_file == "":
+            raise ConfigError(
+                "clientapi.https.certfile must be set to serve the client API over "
+                "HTTPS"
+            )
+        self.client_http2 = cfg.getboolean("http", "clientapi.https.http2")
+        if self.client_http2:
+            if self.client_https_port is None:
+                raise ConfigError("clientapi.https.http2 requires clientapi.https.port")
+            if not H2_ENABLED:
+                raise ConfigError(
+                    "clientapi.https.http2 requires Twisted's HTTP/2 support, which "
+                    'is installed with: pip install "twisted[http2]"'
+                )
 
         # internal port is allowed to be set to an empty string in the config
         internal_api_port = cfg.get("http", "internalapi.http.port")
@@ -41,6 +99,11 @@ class HTTPConfig(BaseConfig):
         self.internal_port: Optional[int] = None
         if internal_api_port != "":
             self.internal_port = int(internal_api_port)
+        self.internal_unix_socket = cfg.get("http", "internalapi.unix_socket.path")
+        self.internal_unix_socket_mode = parse_socket_mode(
+            cfg.get("http", "internalapi.unix_socket.mode"),
+            "internalapi.unix_socket.mode",
+        )
 
         self.cert_file = cfg.get("http", "replication.https.certfile")
         self.ca_cert_file = cfg.get("http", "replication.https.cacert")
@@ -56,6 +119,28 @@ class HTTPConfig(BaseConfig):
 
         self.server_http_url_base = cfg.get("http", "client_http_base")
 
+        # Maps the paths of the client API endpoints whose responses to compress to
+        # the minimum size of the responses to compress.
+        self.compressed_endpoints: Dict[str, int] = {}
+        min_size = cfg.getint("http", "clientapi.compression.min_size")
+        for endpoint in cfg.get("http", "clientapi.compression.endpoints").split(","):
+            path, _, endpoint_min_size = endpoint.strip().partition("=")
+            if path:
+                self.compressed_endpoints[path] = (
+                    int(endpoint_min_size) if endpoint_min_size else min_size
+                )
+
+        # Maps each class of endpoints to the number of its requests processed at
+        # once (0 for no limit) and the number of its requests waiting beyond that.
+        self.admission_limits: Dict[str, Tuple[int, int]] = {}
+        for name in ADMISSION_CLASSES:
+            self.admission_limits[name] = (
+                cfg.getint("http", "admission.%s.max_concurrent" % (name,)),
+                cfg.getint("http", "admission.%s.max_queued" % (name,)),
+            )
+        self.admission_max_concurrent = cfg.getint("http", "admission.max_concurrent")
+        self.admission_retry_after = cfg.getint("http", "admission.retry_after")
+
         self.base_replication_urls = {}
 
         for section in cfg.sections():
@@ -67,3 +152,16 @@ class HTTPConfig(BaseConfig):
                     self.base_replication_urls[peer] = base_url
 
         return False
+
+
+def _is_loopback(address: str) -> bool:
+    """Check whether an address to bind to is a loopback address.
+
+    :param address: The address, which should be an IP address.
+
+    :return: Whether it's a loopback IP address.
+    """
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
@@ -0,0 +1,89 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from configparser import ConfigParser
+from typing import Optional
+
+from sydent.config._base import BaseConfig
+from sydent.config.exceptions import ConfigError
+from sydent.config.general import parse_cfg_bool
+
+
+class LookupConfig(BaseConfig):
+    reloadable = frozenset(
+        {
+            "chunk_size",
+            "delta_lookup_max_sets",
+            "account_ratelimit_burst",
+            "account_ratelimit_rate_hz",
+            "ip_ratelimit_burst",
+            "ip_ratelimit_rate_hz",
+        }
+    )
+
+    def parse_config(self, cfg: "ConfigParser") -> bool:
+        """
+        Parse the lookup section of the config
+
+        :param cfg: the configuration to be parsed
+        """
+        self.hash_index_enabled = parse_cfg_bool(
+            cfg.get("lookup", "hash_index.enabled")
+        )
+        self.hash_index_overlay_size = cfg.getint("lookup", "hash_index.overlay_size")
+        self.hash_index_merge_interval = cfg.getfloat(
+            "lookup", "hash_index.merge_interval"
+        )
+        self.bloom_filter_enabled = parse_cfg_bool(
+            cfg.get("lookup", "bloom_filter.enabled")
+        )
+        self.bloom_filter_capacity = cfg.getint("lookup", "bloom_filter.capacity")
+        self.bloom_filter_false_positive_rate = cfg.getfloat(
+            "lookup", "bloom_filter.false_positive_rate"
+        )
+        self.cache_enabled = parse_cfg_bool(cfg.get("lookup", "cache.enabled"))
+        self.cache_max_entries = cfg.getint("lookup", "cache.max_entries")
+        self.cache_ttl = cfg.getfloat("lookup", "cache.ttl")
+        self.signed_cache_max_entries = cfg.getint("lookup", "signed_cache.max_entries")
+        self.chunk_size = cfg.getint("lookup", "chunk_size")
+        if self.chunk_size < 1:
+            raise ConfigError("chunk_size must be at least 1")
+        self.delta_lookup_retention_ms = int(
+            cfg.getfloat("lookup", "delta_lookup.retention") * 1000
+        )
+        self.delta_lookup_max_sets = cfg.getint("lookup", "delta_lookup.max_sets")
+        if self.delta_lookup_max_sets < 1:
+            raise ConfigError("delta_lookup.max_sets must be at least 1")
+        # An empty burst means that lookups aren't ratelimited that way.
+        account_ratelimit_burst = cfg.get("lookup", "ratelimit.account.burst")
+        self.account_ratelimit_burst: Optional[int] = None
+        if account_ratelimit_burst != "":
+            self.account_ratelimit_burst = int(account_ratelimit_burst)
+        self.account_ratelimit_rate_hz = cfg.getfloat(
+            "lookup", "ratelimit.account.rate_hz"
+        )
+        if (
+            self.account_ratelimit_burst is not None
+            and self.account_ratelimit_rate_hz <= 0
+        ):
+            raise ConfigError("ratelimit.account.rate_hz must be greater than 0")
+        ip_ratelimit_burst = cfg.get("lookup", "ratelimit.ip.burst")
+        self.ip_ratelimit_burst: Optional[int] = None
+        if ip_ratelimit_burst != "":
+            self.ip_ratelimit_burst = int(ip_ratelimit_burst)
+        self.ip_ratelimit_rate_hz = cfg.getfloat("lookup", "ratelimit.ip.rate_hz")
+        if self.ip_ratelimit_burst is not None and self.ip_ratelimit_rate_hz <= 0:
+            raise ConfigError("ratelimit.ip.rate_hz must be greater than 0")
+
+        return False
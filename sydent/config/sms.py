@@ -20,6 +20,21 @@ from sydent.config.exceptions import ConfigError
 
 
 class SMSConfig(BaseConfig):
+    # Everything, as the SMS settings are read whenever a message is sent.
+    reloadable = frozenset(
+        {
+            "body_template",
+            "api_username",
+            "api_password",
+            "originators",
+            "smsRules",
+            "msisdn_ratelimit_burst",
+            "msisdn_ratelimit_rate_hz",
+            "country_ratelimit_burst",
+            "country_ratelimit_rate_hz",
+        }
+    )
+
     def parse_config(self, cfg: "ConfigParser") -> bool:
         """
         Parse the sms section of the config
@@ -12,14 +12,83 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import TYPE_CHECKING, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
+from weakref import WeakValueDictionary
+
+import attr
 
 from sydent.users.accounts import Account
+from sydent.util.lrucache import LruTtlCache
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
 
 
+@attr.s(slots=True, auto_attribs=True)
+class _CachedAccount:
+    account: Account
+    # Set when the account changes, for all the tokens it's cached under at once.
+    stale: bool = False
+
+
+class AccountCache:
+    """Caches the accounts of recently used access tokens.
+
+    Entries must be invalidated whenever a token is deleted, or its account
+    changes.
+
+    :param max_size: The maximum number of tokens in the cache.
+    :param ttl: How long entries stay in the cache, in seconds.
+    :param timer: A function returning the current time, in seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float, timer: Callable[[], float]) -> None:
+        self._tokens: LruTtlCache[str, _CachedAccount] = LruTtlCache(
+            "accounts", max_size, ttl, timer
+        )
+        # The cached accounts by user ID, which the entries of all the user's
+        # tokens share. Accounts are dropped from here once no token refers to
+        # them anymore.
+        self._users: "WeakValueDictionary[str, _CachedAccount]" = WeakValueDictionary()
+
+    def get(self, token: str) -> Optional[Account]:
+        """
+        :param token: An access token.
+
+        :return: The account of the token, or None if it isn't in the cache.
+        """
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        if entry.stale:
+            self._tokens.invalidate(token)
+            return None
+        return entry.account
+
+    def set(self, token: str, account: Account) -> None:
+        """
+        :param token: An access token.
+        :param account: The account of the token, as stored in the database.
+        """
+        entry = self._users.get(account.userId)
+        if entry is None:
+            entry = _CachedAccount(account)
+            self._users[account.userId] = entry
+        self._tokens.set(token, entry)
+
+    def invalidate_token(self, token: str) -> None:
+        self._tokens.invalidate(token)
+
+    def invalidate_user(self, user_id: str) -> None:
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            entry.stale = True
+
+    def clear(self) -> None:
+        self._tokens.clear()
+        self._users.clear()
+
+
 class AccountStore:
     def __init__(self, sydent: "Sydent") -> None:
         self.sydent = sydent
@@ -32,6 +101,12 @@ class AccountStore:
 
         :return: The account matching the token, or None if no account matched.
         """
+        cache = self.sydent.account_cache
+        if cache is not None:
+            account = cache.get(token)
+            if account is not None:
+                return account
+
         cur = self.sydent.db.cursor()
         res = cur.execute(
             "select a.user_id, a.created_ts, a.consent_version from accounts a, tokens t "
@@ -43,7 +118,10 @@ class AccountStore:
         if row is None:
             return None
 
-        return Account(*row)
+        account = Account(*row)
+        if cache is not None:
+            cache.set(token, account)
+        return account
 
     def storeAccount(
         self, user_id: str, creation_ts: int, consent_version: Optional[str]
@@ -79,6 +157,9 @@ class AccountStore:
         )
         self.sydent.db.commit()
 
+        if self.sydent.account_cache is not None:
+            self.sydent.account_cache.invalidate_user(user_id)
+
     def addToken(self, user_id: str, token: str) -> None:
         """
         Stores the authentication token for a given user.
@@ -106,4 +187,7 @@ class AccountStore:
         )
         deleted = cur.rowcount
         self.sydent.db.commit()
+
+        if self.sydent.account_cache is not None:
+            self.sydent.account_cache.invalidate_token(token)
         return deleted
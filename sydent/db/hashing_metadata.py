@@ -94,6 +94,10 @@ class HashingMetadataStore:
         # Update the cached pepper (only once the transaction has committed successfully!)
         self._cached_lookup_pepper = pepper
 
+        # All the lookup hashes have changed.
+        if self.sydent.lookup_cache is not None:
+            self.sydent.lookup_cache.clear()
+
     def _rehash_threepids(
         self,
         cur: Cursor,
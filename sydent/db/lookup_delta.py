@@ -0,0 +1,217 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import attr
+
+from sydent.util import time_msec
+from sydent.util.tokenutils import generateAlphanumericTokenOfLength
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class LookupDeltaSet:
+    """A set of lookup hashes registered for delta lookups."""
+
+    id: int
+    user_id: str
+    lookup_pepper: str
+
+
+class LookupDeltaStore:
+    def __init__(self, sydent: "Sydent") -> None:
+        self.sydent = sydent
+
+    def getStreamPosition(self) -> int:
+        """
+        Retrieves the position of the latest change to the global associations.
+
+        :return: The ID of the latest change, or 0 if there hasn't been any.
+        """
+        cur = self.sydent.db.cursor()
+        res = cur.execute(
+            "SELECT seq FROM sqlite_sequence "
+            "WHERE name = 'global_threepid_association_changes'"
+        )
+        row: Optional[Tuple[int]] = res.fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def getEarliestStreamPosition(self) -> int:
+        """
+        Retrieves the earliest position from which all of the changes to the global
+        associations are still known, i.e. haven't been deleted for being too old.
+
+        :return: The earliest position deltas can be computed from.
+        """
+        cur = self.sydent.db.cursor()
+        res = cur.execute("SELECT MIN(id) FROM global_threepid_association_changes")
+        row: Tuple[Optional[int]] = res.fetchone()
+        if row[0] is None:
+            return self.getStreamPosition()
+        return row[0] - 1
+
+    def addSet(self, user_id: str, lookup_pepper: str, lookup_hashes: List[str]) -> str:
+        """
+        Registers a set of lookup hashes for delta lookups.
+
+        :param user_id: The user registering the set.
+        :param lookup_pepper: The pepper the lookup hashes were computed with.
+        :param lookup_hashes: The lookup hashes to register.
+
+        :return: The token identifying the set.
+        """
+        token = generateAlphanumericTokenOfLength(32)
+
+        cur = self.sydent.db.cursor()
+        cur.execute(
+            "INSERT INTO lookup_delta_sets (token, user_id, lookup_pepper, last_used_ts) "
+            "VALUES (?, ?, ?, ?)",
+            (token, user_id, lookup_pepper, time_msec()),
+        )
+        set_id = cur.lastrowid
+        cur.executemany(
+            "INSERT OR IGNORE INTO lookup_delta_set_hashes (set_id, lookup_hash) "
+            "VALUES (?, ?)",
+            ((set_id, lookup_hash) for lookup_hash in lookup_hashes),
+        )
+
+        # Only keep the sets the user used most recently, so that the storage used
+        # by each account is bounded.
+        res = cur.execute(
+            "SELECT id FROM lookup_delta_sets WHERE user_id = ? "
+            "ORDER BY last_used_ts DESC, id DESC LIMIT -1 OFFSET ?",
+            (user_id, self.sydent.config.lookup.delta_lookup_max_sets),
+        )
+        evicted: List[Tuple[int]] = res.fetchall()
+        cur.executemany("DELETE FROM lookup_delta_set_hashes WHERE set_id = ?", evicted)
+        cur.executemany("DELETE FROM lookup_delta_sets WHERE id = ?", evicted)
+        if evicted:
+            logger.info(
+                "Deleted %d lookup delta set(s) of %s over the limit",
+                len(evicted),
+                user_id,
+            )
+
+        self.sydent.db.commit()
+
+        return token
+
+    def getSet(self, token: str) -> Optional[LookupDeltaSet]:
+        """
+        Retrieves the set of lookup hashes with the given token, and marks it as used.
+
+        :param token: The token identifying the set.
+
+        :return: The set, or None if there is no set with this token.
+        """
+        cur = self.sydent.db.cursor()
+        res = cur.execute(
+            "SELECT id, user_id, lookup_pepper FROM lookup_delta_sets WHERE token = ?",
+            (token,),
+        )
+        row: Optional[Tuple[int, str, str]] = res.fetchone()
+        if row is None:
+            return None
+
+        cur.execute(
+            "UPDATE lookup_delta_sets SET last_used_ts = ? WHERE id = ?",
+            (time_msec(), row[0]),
+        )
+        self.sydent.db.commit()
+
+        return LookupDeltaSet(*row)
+
+    def getChangedHashes(self, set_id: int, since: int, until: int) -> List[str]:
+        """
+        Retrieves the lookup hashes of the given set whose associations changed
+        between the two given stream positions.
+
+        :param set_id: The ID of the set.
+        :param since: The position to look for changes after.
+        :param until: The position to look for changes up to (inclusive).
+
+        :return: The lookup hashes which changed.
+        """
+        cur = self.sydent.db.cursor()
+        res = cur.execute(
+            "SELECT DISTINCT c.lookup_hash FROM global_threepid_association_changes c "
+            "JOIN lookup_delta_set_hashes s ON s.lookup_hash = c.lookup_hash "
+            "WHERE s.set_id = ? AND c.id > ? AND c.id <= ?",
+            (set_id, since, until),
+        )
+        rows: List[Tuple[str]] = res.fetchall()
+        return [row[0] for row in rows]
+
+    def recordExpiredAssociations(self) -> None:
+        """
+        Records a change for the lookup hash of every association whose notAfter
+        has passed since this was last done, so that delta lookups return them as
+        removed. Until this runs, delta lookups keep returning expired associations
+        as unchanged.
+        """
+        now = time_msec()
+
+        cur = self.sydent.db.cursor()
+        res = cur.execute("SELECT ts FROM lookup_delta_expiry_position")
+        row: Tuple[int] = res.fetchone()
+        # Associations are valid while notAfter > now, so the ones which expired are
+        # those with last position < notAfter <= now.
+        cur.execute(
+            "INSERT INTO global_threepid_association_changes (lookup_hash, ts) "
+            "SELECT DISTINCT lookup_hash, ? FROM global_threepid_associations "
+            "WHERE notAfter > ? AND notAfter <= ? AND lookup_hash IS NOT NULL",
+            (now, row[0], now),
+        )
+        logger.info("Recorded %d expired association(s)", cur.rowcount)
+        cur.execute("UPDATE lookup_delta_expiry_position SET ts = ?", (now,))
+        self.sydent.db.commit()
+
+    def deleteOldEntries(self, retention_ms: int) -> None:
+        """
+        Deletes the changes which are older than the given retention period, and
+        the sets which haven't been used during that period.
+
+        :param retention_ms: The retention period, in milliseconds.
+        """
+        delete_before_ts = time_msec() - retention_ms
+
+        cur = self.sydent.db.cursor()
+        # Only ever delete the oldest changes, so that the ones which are left are
+        # always all of the changes since a given position, even if the clock jumps.
+        cur.execute(
+            "DELETE FROM global_threepid_association_changes WHERE id <= ("
+            "SELECT MAX(id) FROM global_threepid_association_changes WHERE ts < ?"
+            ")",
+            (delete_before_ts,),
+        )
+        cur.execute(
+            "DELETE FROM lookup_delta_set_hashes WHERE set_id IN ("
+            "SELECT id FROM lookup_delta_sets WHERE last_used_ts < ?"
+            ")",
+            (delete_before_ts,),
+        )
+        cur.execute(
+            "DELETE FROM lookup_delta_sets WHERE last_used_ts < ?",
+            (delete_before_ts,),
+        )
+        logger.info("Deleted %d unused lookup delta sets", cur.rowcount)
+        self.sydent.db.commit()
@@ -16,13 +16,54 @@
 import logging
 import os
 import sqlite3
-from typing import TYPE_CHECKING, Tuple
+from typing import TYPE_CHECKING, Any, Iterable, Tuple, Type
+
+from sydent.util import time_msec, tracing
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
 
 logger = logging.getLogger(__name__)
 
+# How much of statements to record in traces.
+_TRACED_STATEMENT_LENGTH = 200
+
+
+def _statement(sql: str) -> str:
+    return " ".join(sql.split())[:_TRACED_STATEMENT_LENGTH]
+
+
+class TracingCursor(sqlite3.Cursor):
+    """A cursor recording a span for each statement it executes."""
+
+    def execute(self, __sql: str, __parameters: Any = ()) -> "TracingCursor":
+        with tracing.trace("db.execute", {"db.statement": _statement(__sql)}):
+            super().execute(__sql, __parameters)
+        return self
+
+    def executemany(
+        self, __sql: str, __seq_of_parameters: Iterable[Any]
+    ) -> "TracingCursor":
+        with tracing.trace("db.executemany", {"db.statement": _statement(__sql)}):
+            super().executemany(__sql, __seq_of_parameters)
+        return self
+
+
+class TracingConnection(sqlite3.Connection):
+    """A connection whose cursors record spans, and which records a span for each
+    commit.
+    """
+
+    # Type-ignore: typeshed's overloads don't allow for a default factory.
+    def cursor(  # type: ignore[override]
+        self, factory: Type[sqlite3.Cursor] = TracingCursor
+    ) -> Any:
+        return super().cursor(factory)
+
+    def commit(self) -> None:
+        with tracing.trace("db.commit"):
+            super().commit()
+
 
 class SqliteDatabase:
     def __init__(self, syd: "Sydent") -> None:
@@ -31,7 +72,20 @@ class SqliteDatabase:
         dbFilePath = self.sydent.config.database.database_path
         logger.info("Using DB file %s", dbFilePath)
 
-        self.db = sqlite3.connect(dbFilePath)
+        timeout = self.sydent.config.database.busy_timeout
+        if tracing.is_enabled():
+            self.db = sqlite3.connect(
+                dbFilePath, timeout=timeout, factory=TracingConnection
+            )
+        else:
+            # Don't slow every query down when not tracing.
+            self.db = sqlite3.connect(dbFilePath, timeout=timeout)
+
+        if self.sydent.config.http.client_workers > 0:
+            # So that the workers' reads and the main process' writes don't wait for
+            # each other. This is recorded in the database file, so it's already
+            # set by the time the workers (started by the main process) connect.
+            self.db.execute("PRAGMA journal_mode=WAL")
         curVer = self._getSchemaVersion()
 
         # We always run the schema files if the version is zero: either the db is
@@ -212,6 +266,69 @@ class SqliteDatabase:
             logger.info("v4 -> v5 schema migration complete")
             self._setSchemaVersion(5)
 
+        if curVer < 6:
+            cur = self.db.cursor()
+
+            # Record which lookup hashes had their associations changed, so that
+            # delta lookups only need to look at what changed since the last one.
+            cur.execute(
+                "CREATE TABLE global_threepid_association_changes "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "lookup_hash VARCHAR(256) NOT NULL, "
+                "ts BIGINT NOT NULL)"
+            )
+            cur.execute(
+                "CREATE INDEX global_threepid_association_changes_ts "
+                "ON global_threepid_association_changes(ts)"
+            )
+
+            # The sets of lookup hashes registered for delta lookups.
+            cur.execute(
+                "CREATE TABLE lookup_delta_sets "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "token TEXT NOT NULL, "
+                "user_id TEXT NOT NULL, "
+                "lookup_pepper TEXT NOT NULL, "
+                "last_used_ts BIGINT NOT NULL)"
+            )
+            cur.execute(
+                "CREATE UNIQUE INDEX lookup_delta_sets_token ON lookup_delta_sets(token)"
+            )
+            cur.execute(
+                "CREATE INDEX lookup_delta_sets_user_id ON lookup_delta_sets(user_id)"
+            )
+            cur.execute(
+                "CREATE INDEX lookup_delta_sets_last_used_ts "
+                "ON lookup_delta_sets(last_used_ts)"
+            )
+            cur.execute(
+                "CREATE TABLE lookup_delta_set_hashes "
+                "(set_id INTEGER NOT NULL, lookup_hash VARCHAR(256) NOT NULL)"
+            )
+            cur.execute(
+                "CREATE UNIQUE INDEX lookup_delta_set_hashes_set_id_lookup_hash "
+                "ON lookup_delta_set_hashes(set_id, lookup_hash)"
+            )
+
+            # Associations stop being valid once their notAfter passes, which is
+            # recorded as a change by a periodic sweep. This is the time up to which
+            # that has been done, starting from the migration, as delta lookups
+            # didn't exist before.
+            cur.execute(
+                "CREATE INDEX global_threepid_associations_notAfter "
+                "ON global_threepid_associations(notAfter)"
+            )
+            cur.execute(
+                "CREATE TABLE lookup_delta_expiry_position (ts BIGINT NOT NULL)"
+            )
+            cur.execute(
+                "INSERT INTO lookup_delta_expiry_position (ts) VALUES (?)",
+                (time_msec(),),
+            )
+            self.db.commit()
+            logger.info("v5 -> v6 schema migration complete")
+            self._setSchemaVersion(6)
+
     def _getSchemaVersion(self) -> int:
         cur = self.db.cursor()
         cur.execute("PRAGMA user_version")
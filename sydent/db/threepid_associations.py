@@ -13,11 +13,19 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import sqlite3
+import string
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import attr
+from prometheus_client import Counter, Gauge
 
 from sydent.threepid import ThreepidAssociation
 from sydent.threepid.signer import Signer
 from sydent.util import time_msec
+from sydent.util.bloom import CountingBloomFilter
+from sydent.util.hash_index import LookupHashIndex, decode_lookup_hash
+from sydent.util.lrucache import LruTtlCache
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -30,6 +38,130 @@ SignedAssociations = Dict[int, Dict[str, Any]]
 
 logger = logging.getLogger(__name__)
 
+association_filter_size = Gauge(
+    "sydent_association_filter_size_bytes",
+    "Size of the Bloom filter of associations",
+)
+association_filter_false_positive_rate = Gauge(
+    "sydent_association_filter_false_positive_rate",
+    "Expected false positive rate of the Bloom filter of associations",
+)
+association_filter_checks = Counter(
+    "sydent_association_filter_checks",
+    "Number of 3PIDs and lookup hashes checked against the Bloom filter of "
+    "associations, by result: 'filtered' if the filter ruled out an association, "
+    "'hit' or 'miss' if it didn't and the database did or didn't have a valid one",
+    ["result"],
+)
+
+
+def _hash_filter_key(lookup_hash: str) -> str:
+    return "hash\0" + lookup_hash
+
+
+def _threepid_filter_key(medium: str, address: str) -> str:
+    # Lookups compare addresses case-insensitively. Python lowercases more
+    # characters than SQLite's lower() does, which can only cause false positives.
+    return "3pid\0%s\0%s" % (medium, address.lower())
+
+
+def _update_filter_metrics(association_filter: CountingBloomFilter) -> None:
+    association_filter_size.set(association_filter.memory_usage())
+    association_filter_false_positive_rate.set(association_filter.false_positive_rate())
+
+
+def _end_temporary_transaction(
+    db: sqlite3.Connection, was_in_transaction: bool
+) -> None:
+    """End the transaction that inserting into a temporary table opened, unless one
+    was already open.
+
+    sqlite3 opens a transaction before inserting, and dropping the table doesn't end
+    it. Until it ends, the connection keeps a lock on the database, which stops
+    other processes (e.g. the main process, for client API workers) from writing.
+
+    :param db: The connection the temporary table was used on.
+    :param was_in_transaction: Whether a transaction was open before the temporary
+        table was used, in which case it's left for its owner to end.
+    """
+    if not was_in_transaction:
+        # The transaction only changed the (now dropped) temporary table.
+        db.commit()
+
+
+_SQLITE_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def sqlite_lower(value: str) -> str:
+    """Lowercase a string like SQLite's lower() does, i.e. only ASCII characters."""
+    return value.translate(_SQLITE_LOWER)
+
+
+def unique_threepids(threepids: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Drop the 3PIDs which would be looked up the same as a previous one, as lookups
+    compare addresses case-insensitively.
+
+    :param threepids: The (medium, address) tuples to deduplicate.
+
+    :return: The remaining 3PIDs, sorted by medium then lowercased address.
+    """
+    keyed = {
+        (medium, sqlite_lower(address)): (medium, address)
+        for medium, address in threepids
+    }
+    return [keyed[key] for key in sorted(keyed)]
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class _CachedAssociation:
+    """A row of the global associations table, minus the signed association."""
+
+    id: int
+    address: str
+    mxid: str
+    ts: int
+    not_before: int
+    not_after: int
+
+    def is_valid(self, now: int) -> bool:
+        return self.not_before < now < self.not_after
+
+
+class LookupCache:
+    """Caches the associations for recently looked up 3PIDs and lookup hashes,
+    regardless of whether they're currently valid.
+
+    Entries must be invalidated whenever an association is added or removed for
+    their 3PID or lookup hash.
+
+    :param max_size: The maximum number of entries in each of the caches.
+    :param ttl: How long entries stay in the caches, in seconds.
+    :param timer: A function returning the current time, in seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float, timer: Callable[[], float]) -> None:
+        # Keyed on (medium, address), with the address lowercased like SQLite does.
+        self.threepids: LruTtlCache[
+            Tuple[str, str], Tuple[_CachedAssociation, ...]
+        ] = LruTtlCache("lookup_threepids", max_size, ttl, timer)
+        self.hashes: LruTtlCache[str, Tuple[_CachedAssociation, ...]] = LruTtlCache(
+            "lookup_hashes", max_size, ttl, timer
+        )
+
+    @staticmethod
+    def threepid_key(medium: str, address: str) -> Tuple[str, str]:
+        return medium, sqlite_lower(address)
+
+    def invalidate_threepid(self, medium: str, address: str) -> None:
+        self.threepids.invalidate(self.threepid_key(medium, address))
+
+    def invalidate_hash(self, lookup_hash: str) -> None:
+        self.hashes.invalidate(lookup_hash)
+
+    def clear(self) -> None:
+        self.threepids.clear()
+        self.hashes.clear()
+
 
 class LocalAssociationStore:
     def __init__(self, sydent: "Sydent") -> None:
@@ -207,27 +339,55 @@ class GlobalAssociationStore:
         :return: The signed association, or None if no association was found for this
             3PID.
         """
+        result = self.signedAssociationForThreepid(medium, address)
+        if result is None:
+            return None
+        return result[1]
+
+    def signedAssociationForThreepid(
+        self, medium: str, address: str
+    ) -> Optional[Tuple[int, str]]:
+        """
+        Retrieve the ID and the JSON for the signed association matching the
+        provided 3PID, if one exists.
+
+        :param medium: The medium of the 3PID.
+        :param address: The address of the 3PID.
+
+        :return: The ID of the association and the signed association, or None if no
+            association was found for this 3PID.
+        """
+        if not self._filterKeys([_threepid_filter_key(medium, address)])[0]:
+            return None
 
         cur = self.sydent.db.cursor()
+
+        if self.sydent.lookup_cache is not None:
+            latest = self._latestCachedAssociation(medium, address)
+            if latest is None:
+                return None
+            res = cur.execute(
+                "SELECT sgAssoc FROM global_threepid_associations WHERE id = ?",
+                (latest.id,),
+            )
+            cached_row: Optional[Tuple[str]] = res.fetchone()
+            return (latest.id, cached_row[0]) if cached_row else None
+
         # We treat address as case-insensitive because that's true for all the
         # threepids we have currently (we treat the local part of email addresses as
         # case insensitive which is technically incorrect). If we someday get a
         # case-sensitive threepid, this can change.
         res = cur.execute(
-            "select sgAssoc from global_threepid_associations where "
+            "select id, sgAssoc from global_threepid_associations where "
             "medium = ? and lower(address) = lower(?) and notBefore < ? and notAfter > ? "
             "order by ts desc limit 1",
             (medium, address, time_msec(), time_msec()),
         )
 
-        row: Optional[Tuple[str]] = res.fetchone()
+        row: Optional[Tuple[int, str]] = res.fetchone()
+        self._recordFilterResults(1, 1 if row else 0)
 
-        if not row:
-            return None
-
-        sgAssocStr = row[0]
-
-        return sgAssocStr
+        return row
 
     def getMxid(self, medium: str, normalised_address: str) -> Optional[str]:
         """
@@ -239,6 +399,12 @@ class GlobalAssociationStore:
 
         :return: The associated MXID, or None if no MXID is associated with this 3PID.
         """
+        if not self._filterKeys([_threepid_filter_key(medium, normalised_address)])[0]:
+            return None
+
+        if self.sydent.lookup_cache is not None:
+            latest = self._latestCachedAssociation(medium, normalised_address)
+            return latest.mxid if latest is not None else None
 
         cur = self.sydent.db.cursor()
         res = cur.execute(
@@ -249,6 +415,7 @@ class GlobalAssociationStore:
         )
 
         row: Tuple[Optional[str]] = res.fetchone()
+        self._recordFilterResults(1, 1 if row else 0)
 
         if not row:
             return None
@@ -266,14 +433,30 @@ class GlobalAssociationStore:
 
         :return: a list of (medium, address, mxid) tuples
         """
+        if self.sydent.association_filter is not None:
+            candidates = self._filterKeys(
+                [
+                    _threepid_filter_key(medium, address)
+                    for medium, address in threepid_tuples
+                ]
+            )
+            threepid_tuples = [
+                threepid
+                for threepid, candidate in zip(threepid_tuples, candidates)
+                if candidate
+            ]
+            if not threepid_tuples:
+                return []
+
+        if self.sydent.lookup_cache is not None:
+            return self._getMxidsFromCache(threepid_tuples)
+
         cur = self.sydent.db.cursor()
+        was_in_transaction = self.sydent.db.in_transaction
 
         cur.execute(
             "CREATE TEMPORARY TABLE tmp_getmxids (medium VARCHAR(16), address VARCHAR(256))"
         )
-        cur.execute(
-            "CREATE INDEX tmp_getmxids_medium_lower_address ON tmp_getmxids (medium, lower(address))"
-        )
 
         try:
             inserted_cap = 0
@@ -287,8 +470,11 @@ class GlobalAssociationStore:
             res = cur.execute(
                 # 'notBefore' is the time the association starts being valid, 'notAfter' the the time at which
                 # it ceases to be valid, so the ts must be greater than 'notBefore' and less than 'notAfter'.
-                "SELECT gte.medium, gte.address, gte.ts, gte.mxid FROM global_threepid_associations gte "
-                "JOIN tmp_getmxids ON gte.medium = tmp_getmxids.medium AND lower(gte.address) = lower(tmp_getmxids.address) "
+                # The CROSS JOIN makes SQLite loop over the temporary table, and look
+                # each 3PID up in the index on global_threepid_associations, rather
+                # than scan the whole table.
+                "SELECT gte.medium, gte.address, gte.ts, gte.mxid FROM tmp_getmxids "
+                "CROSS JOIN global_threepid_associations gte ON gte.medium = tmp_getmxids.medium AND lower(gte.address) = lower(tmp_getmxids.address) "
                 "WHERE gte.notBefore < ? AND gte.notAfter > ? "
                 "ORDER BY gte.medium, gte.address, gte.ts DESC",
                 (time_msec(), time_msec()),
@@ -307,7 +493,9 @@ class GlobalAssociationStore:
 
         finally:
             cur.execute("DROP TABLE tmp_getmxids")
+            _end_temporary_transaction(self.sydent.db, was_in_transaction)
 
+        self._recordFilterResults(len(threepid_tuples), len(results))
         return results
 
     def addAssociation(
@@ -350,8 +538,30 @@ class GlobalAssociationStore:
                 rawSgAssoc,
             ),
         )
+        if assoc.lookup_hash is not None and cur.rowcount > 0:
+            cur.execute(
+                "INSERT INTO global_threepid_association_changes (lookup_hash, ts) "
+                "VALUES (?, ?)",
+                (assoc.lookup_hash, time_msec()),
+            )
+
+        # If the transaction ends up being rolled back, the filter keeps keys for
+        # an association that doesn't exist, which only causes false positives.
+        lookup_cache = self.sydent.lookup_cache
+        if lookup_cache is not None and cur.rowcount > 0:
+            lookup_cache.invalidate_threepid(assoc.medium, assoc.address)
+            if assoc.lookup_hash is not None:
+                lookup_cache.invalidate_hash(assoc.lookup_hash)
+
+        association_filter = self.sydent.association_filter
+        if association_filter is not None and cur.rowcount > 0:
+            self._addToFilter(
+                association_filter, assoc.medium, assoc.address, assoc.lookup_hash
+            )
+            _update_filter_metrics(association_filter)
         if commit:
             self.sydent.db.commit()
+            self.syncLookupHashIndex()
 
     def lastIdFromServer(self, server: str) -> Optional[int]:
         """
@@ -386,6 +596,30 @@ class GlobalAssociationStore:
         """
 
         cur = self.sydent.db.cursor()
+
+        deleted_ids: List[int] = []
+        deleted_hashes: List[Optional[str]] = []
+        if (
+            self.sydent.lookup_hash_index is not None
+            or self.sydent.association_filter is not None
+            or self.sydent.lookup_cache is not None
+            or self.sydent.signed_lookup_cache is not None
+        ):
+            res = cur.execute(
+                "SELECT id, lookup_hash FROM global_threepid_associations WHERE "
+                "medium = ? AND address = ?",
+                (medium, normalised_address),
+            )
+            for row in res.fetchall():
+                deleted_ids.append(row[0])
+                deleted_hashes.append(row[1])
+
+        cur.execute(
+            "INSERT INTO global_threepid_association_changes (lookup_hash, ts) "
+            "SELECT lookup_hash, ? FROM global_threepid_associations WHERE "
+            "medium = ? AND address = ? AND lookup_hash IS NOT NULL",
+            (time_msec(), medium, normalised_address),
+        )
         cur.execute(
             "DELETE FROM global_threepid_associations WHERE "
             "medium = ? AND address = ?",
@@ -399,23 +633,81 @@ class GlobalAssociationStore:
         )
         self.sydent.db.commit()
 
+        if self.sydent.lookup_hash_index is not None:
+            self.syncLookupHashIndex()
+            for lookup_hash in deleted_hashes:
+                if lookup_hash is not None:
+                    self.sydent.lookup_hash_index.remove(lookup_hash)
+
+        lookup_cache = self.sydent.lookup_cache
+        if lookup_cache is not None:
+            lookup_cache.invalidate_threepid(medium, normalised_address)
+            for lookup_hash in deleted_hashes:
+                if lookup_hash is not None:
+                    lookup_cache.invalidate_hash(lookup_hash)
+
+        # The IDs of deleted rows can be reused by new associations.
+        signed_lookup_cache = self.sydent.signed_lookup_cache
+        if signed_lookup_cache is not None:
+            for association_id in deleted_ids:
+                signed_lookup_cache.invalidate(association_id)
+
+        association_filter = self.sydent.association_filter
+        if association_filter is not None:
+            for lookup_hash in deleted_hashes:
+                association_filter.remove(
+                    _threepid_filter_key(medium, normalised_address)
+                )
+                if lookup_hash is not None:
+                    association_filter.remove(_hash_filter_key(lookup_hash))
+            _update_filter_metrics(association_filter)
+
     def retrieveMxidsForHashes(self, addresses: List[str]) -> Dict[str, str]:
         """Returns a mapping from hash: mxid from a list of given lookup_hash values
 
         :param addresses: An array of lookup_hash values to check against the db
 
+        :returns a dictionary of lookup_hash values to mxids of all discovered matches
+        """
+        if self.sydent.association_filter is not None:
+            candidates = self._filterKeys([_hash_filter_key(x) for x in addresses])
+            addresses = [x for x, candidate in zip(addresses, candidates) if candidate]
+            if not addresses:
+                return {}
+
+        if self.sydent.lookup_hash_index is not None:
+            results, expired = self.sydent.lookup_hash_index.lookup_many(
+                addresses, time_msec()
+            )
+            if expired:
+                # An older association for these hashes might still be valid, but
+                # the index only keeps the most recent one.
+                results.update(self._retrieveMxidsForHashesFromDb(expired))
+            self._recordFilterResults(len(addresses), len(results))
+            return results
+
+        if self.sydent.lookup_cache is not None:
+            return self._retrieveMxidsForHashesFromCache(addresses)
+
+        results = self._retrieveMxidsForHashesFromDb(addresses)
+        self._recordFilterResults(len(addresses), len(results))
+        return results
+
+    def _retrieveMxidsForHashesFromDb(self, addresses: List[str]) -> Dict[str, str]:
+        """Returns a mapping from hash: mxid from a list of given lookup_hash values,
+        straight from the database.
+
+        :param addresses: An array of lookup_hash values to check against the db
+
         :returns a dictionary of lookup_hash values to mxids of all discovered matches
         """
         cur = self.sydent.db.cursor()
+        was_in_transaction = self.sydent.db.in_transaction
 
         cur.execute(
             "CREATE TEMPORARY TABLE tmp_retrieve_mxids_for_hashes "
             "(lookup_hash VARCHAR)"
         )
-        cur.execute(
-            "CREATE INDEX tmp_retrieve_mxids_for_hashes_lookup_hash ON "
-            "tmp_retrieve_mxids_for_hashes(lookup_hash)"
-        )
 
         results = {}
         try:
@@ -434,8 +726,9 @@ class GlobalAssociationStore:
             res = cur.execute(
                 # 'notBefore' is the time the association starts being valid, 'notAfter' the the time at which
                 # it ceases to be valid, so the ts must be greater than 'notBefore' and less than 'notAfter'.
-                "SELECT gta.lookup_hash, gta.mxid FROM global_threepid_associations gta "
-                "JOIN tmp_retrieve_mxids_for_hashes "
+                # See getMxids for the CROSS JOIN.
+                "SELECT gta.lookup_hash, gta.mxid FROM tmp_retrieve_mxids_for_hashes "
+                "CROSS JOIN global_threepid_associations gta "
                 "ON gta.lookup_hash = tmp_retrieve_mxids_for_hashes.lookup_hash "
                 "WHERE gta.notBefore < ? AND gta.notAfter > ? "
                 "ORDER BY gta.lookup_hash, gta.mxid, gta.ts",
@@ -459,5 +752,341 @@ class GlobalAssociationStore:
 
         finally:
             cur.execute("DROP TABLE tmp_retrieve_mxids_for_hashes")
+            _end_temporary_transaction(self.sydent.db, was_in_transaction)
+
+        return results
+
+    def buildLookupHashIndex(self, overlay_size: int) -> LookupHashIndex:
+        """Build an in-memory index of the lookup hashes of all the associations
+        in the global associations table.
+
+        The sorting and the deduplication of MXIDs are left to SQLite (using
+        temporary tables), so that building the index doesn't need much more
+        memory than the index itself.
+
+        :param overlay_size: How many changes the index should buffer before
+            merging them.
+
+        :return: The index.
+        """
+        cur = self.sydent.db.cursor()
+
+        self.sydent.db.create_function("sydent_lookup_digest", 1, decode_lookup_hash)
+
+        res = cur.execute("SELECT MAX(id) FROM global_threepid_associations")
+        row: Tuple[Optional[int]] = res.fetchone()
+        last_id = row[0] if row[0] is not None else -1
+
+        was_in_transaction = self.sydent.db.in_transaction
+        cur.execute(
+            "CREATE TEMPORARY TABLE tmp_lookup_index_mxids "
+            "(id INTEGER PRIMARY KEY, mxid VARCHAR(256) UNIQUE)"
+        )
+        try:
+            cur.execute(
+                "INSERT INTO tmp_lookup_index_mxids (mxid) "
+                "SELECT DISTINCT mxid FROM global_threepid_associations "
+                "WHERE lookup_hash IS NOT NULL AND id <= ? ORDER BY mxid",
+                (last_id,),
+            )
+            mxids = (
+                mxid
+                for mxid, in self.sydent.db.cursor().execute(
+                    "SELECT mxid FROM tmp_lookup_index_mxids ORDER BY id"
+                )
+            )
+            rows = self.sydent.db.cursor().execute(
+                "SELECT * FROM ("
+                "  SELECT sydent_lookup_digest(gta.lookup_hash) AS digest,"
+                "  mxids.id - 1, gta.ts, gta.notBefore, gta.notAfter"
+                "  FROM global_threepid_associations gta"
+                "  JOIN tmp_lookup_index_mxids mxids ON gta.mxid = mxids.mxid"
+                "  WHERE gta.lookup_hash IS NOT NULL AND gta.id <= ?"
+                ") WHERE digest IS NOT NULL ORDER BY digest, ts",
+                (last_id,),
+            )
+
+            index = LookupHashIndex.build(rows, mxids, last_id, overlay_size)
+        finally:
+            cur.execute("DROP TABLE tmp_lookup_index_mxids")
+            _end_temporary_transaction(self.sydent.db, was_in_transaction)
+
+        logger.info(
+            "Built lookup hash index with %d entries, using %d bytes",
+            len(index),
+            index.memory_usage(),
+        )
+        return index
+
+    def syncLookupHashIndex(self) -> None:
+        """Add the associations that were committed to the global associations table
+        since the lookup hash index was last updated, if there is an index.
+
+        This must only be called right after committing, so that the index never
+        sees associations that may yet be rolled back.
+        """
+        index = self.sydent.lookup_hash_index
+        if index is None:
+            return
+
+        cur = self.sydent.db.cursor()
+        res = cur.execute(
+            "SELECT id, lookup_hash, mxid, ts, notBefore, notAfter "
+            "FROM global_threepid_associations WHERE id > ? ORDER BY id",
+            (index.last_id,),
+        )
+        row: Tuple[int, Optional[str], str, int, int, int]
+        for row in res.fetchall():
+            assoc_id, lookup_hash, mxid, ts, not_before, not_after = row
+            if lookup_hash is not None:
+                index.add(lookup_hash, mxid, ts, not_before, not_after)
+            index.last_id = assoc_id
+
+    def _cachedAssociationsForThreepids(
+        self, threepid_tuples: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Tuple[_CachedAssociation, ...]]:
+        """Get all the associations for the given 3PIDs, regardless of whether
+        they're currently valid, from the lookup cache or, for the 3PIDs that aren't
+        cached yet, from the database.
+
+        :param threepid_tuples: List containing (medium, address) tuples.
+
+        :return: The associations, keyed on the lookup cache's key for each 3PID.
+        """
+        lookup_cache = self.sydent.lookup_cache
+        assert lookup_cache is not None
+
+        results = {}
+        missing = set()
+        for medium, address in threepid_tuples:
+            key = lookup_cache.threepid_key(medium, address)
+            cached = lookup_cache.threepids.get(key)
+            if cached is None:
+                missing.add(key)
+            else:
+                results[key] = cached
+
+        if not missing:
+            return results
+
+        fetched: Dict[Tuple[str, str], List[_CachedAssociation]] = {
+            key: [] for key in missing
+        }
+        cur = self.sydent.db.cursor()
+        was_in_transaction = self.sydent.db.in_transaction
+        cur.execute(
+            "CREATE TEMPORARY TABLE tmp_cached_threepids "
+            "(medium VARCHAR(16), address VARCHAR(256))"
+        )
+        try:
+            cur.executemany(
+                "INSERT INTO tmp_cached_threepids (medium, address) VALUES (?, ?)",
+                missing,
+            )
+            res = cur.execute(
+                # The keys are already lower case, but comparing with lower() lets
+                # SQLite use the index on (medium, lower(address)). See getMxids
+                # for the CROSS JOIN.
+                "SELECT tmp.medium, tmp.address, gte.id, gte.address, gte.mxid, "
+                "gte.ts, gte.notBefore, gte.notAfter "
+                "FROM tmp_cached_threepids tmp "
+                "CROSS JOIN global_threepid_associations gte ON gte.medium = tmp.medium "
+                "AND lower(gte.address) = lower(tmp.address)"
+            )
+            for row in res.fetchall():
+                fetched[(row[0], row[1])].append(_CachedAssociation(*row[2:]))
+        finally:
+            cur.execute("DROP TABLE tmp_cached_threepids")
+            _end_temporary_transaction(self.sydent.db, was_in_transaction)
+
+        for key, assocs in fetched.items():
+            results[key] = tuple(assocs)
+            lookup_cache.threepids.set(key, results[key])
+
+        return results
+
+    def _latestCachedAssociation(
+        self, medium: str, address: str
+    ) -> Optional[_CachedAssociation]:
+        """Get the most recent currently valid association for a 3PID, using the
+        lookup cache.
+
+        :param medium: The medium of the 3PID.
+        :param address: The address of the 3PID.
+
+        :return: The association, or None if there is no valid association for this
+            3PID.
+        """
+        assocs = next(
+            iter(self._cachedAssociationsForThreepids([(medium, address)]).values())
+        )
+        now = time_msec()
+        valid = [assoc for assoc in assocs if assoc.is_valid(now)]
+        self._recordFilterResults(1, 1 if valid else 0)
+        if not valid:
+            return None
+        return max(valid, key=lambda assoc: assoc.ts)
 
+    def _getMxidsFromCache(
+        self, threepid_tuples: List[Tuple[str, str]]
+    ) -> List[Tuple[str, str, str]]:
+        """Same as getMxids, but using the lookup cache."""
+        cached = self._cachedAssociationsForThreepids(threepid_tuples)
+
+        # Like getMxids, only use the most recent valid association for each
+        # (medium, address) in the database.
+        latest: Dict[Tuple[str, str], _CachedAssociation] = {}
+        now = time_msec()
+        for (medium, _), assocs in cached.items():
+            for assoc in assocs:
+                if not assoc.is_valid(now):
+                    continue
+                current = latest.get((medium, assoc.address))
+                if current is None or assoc.ts > current.ts:
+                    latest[(medium, assoc.address)] = assoc
+
+        results = sorted(
+            (medium, address, assoc.mxid) for (medium, address), assoc in latest.items()
+        )
+        self._recordFilterResults(len(threepid_tuples), len(results))
+        return results
+
+    def _retrieveMxidsForHashesFromCache(self, addresses: List[str]) -> Dict[str, str]:
+        """Same as retrieveMxidsForHashes, but using the lookup cache."""
+        lookup_cache = self.sydent.lookup_cache
+        assert lookup_cache is not None
+
+        cached = {}
+        missing = set()
+        for lookup_hash in addresses:
+            cached_assocs = lookup_cache.hashes.get(lookup_hash)
+            if cached_assocs is None:
+                missing.add(lookup_hash)
+            else:
+                cached[lookup_hash] = cached_assocs
+
+        if missing:
+            fetched: Dict[str, List[_CachedAssociation]] = {x: [] for x in missing}
+            cur = self.sydent.db.cursor()
+            was_in_transaction = self.sydent.db.in_transaction
+            cur.execute(
+                "CREATE TEMPORARY TABLE tmp_cached_hashes (lookup_hash VARCHAR)"
+            )
+            try:
+                cur.executemany(
+                    "INSERT INTO tmp_cached_hashes (lookup_hash) VALUES (?)",
+                    ((x,) for x in missing),
+                )
+                res = cur.execute(
+                    "SELECT gta.lookup_hash, gta.id, gta.address, gta.mxid, gta.ts, "
+                    "gta.notBefore, gta.notAfter "
+                    "FROM tmp_cached_hashes "
+                    "CROSS JOIN global_threepid_associations gta "
+                    "ON gta.lookup_hash = tmp_cached_hashes.lookup_hash"
+                )
+                for row in res.fetchall():
+                    fetched[row[0]].append(_CachedAssociation(*row[1:]))
+            finally:
+                cur.execute("DROP TABLE tmp_cached_hashes")
+                _end_temporary_transaction(self.sydent.db, was_in_transaction)
+
+            for lookup_hash, fetched_assocs in fetched.items():
+                cached[lookup_hash] = tuple(fetched_assocs)
+                lookup_cache.hashes.set(lookup_hash, cached[lookup_hash])
+
+        # Like retrieveMxidsForHashes, if there are several valid associations for
+        # a hash, use the one that comes last when ordered by MXID then timestamp.
+        results = {}
+        now = time_msec()
+        for lookup_hash, assocs in cached.items():
+            valid = [assoc for assoc in assocs if assoc.is_valid(now)]
+            if valid:
+                results[lookup_hash] = max(
+                    valid, key=lambda assoc: (assoc.mxid, assoc.ts)
+                ).mxid
+
+        self._recordFilterResults(len(addresses), len(results))
         return results
+
+    def buildAssociationFilter(
+        self, capacity: int, false_positive_rate: float
+    ) -> CountingBloomFilter:
+        """Build a Bloom filter of the lookup hashes and the 3PIDs of all the
+        associations in the global associations table, regardless of whether they're
+        currently valid.
+
+        :param capacity: The number of associations the filter should be sized for,
+            or 0 to size it for twice the number of associations currently stored.
+        :param false_positive_rate: The false positive rate the filter should be
+            sized for.
+
+        :return: The filter.
+        """
+        cur = self.sydent.db.cursor()
+
+        if capacity == 0:
+            res = cur.execute("SELECT COUNT(*) FROM global_threepid_associations")
+            row: Tuple[int] = res.fetchone()
+            capacity = max(2 * row[0], 10000)
+
+        # Each association adds two keys to the filter.
+        association_filter = CountingBloomFilter(2 * capacity, false_positive_rate)
+
+        res = cur.execute(
+            "SELECT medium, address, lookup_hash FROM global_threepid_associations"
+        )
+        for medium, address, lookup_hash in res:
+            self._addToFilter(association_filter, medium, address, lookup_hash)
+
+        _update_filter_metrics(association_filter)
+        logger.info(
+            "Built association filter with %d keys, using %d bytes",
+            association_filter.count,
+            association_filter.memory_usage(),
+        )
+        return association_filter
+
+    @staticmethod
+    def _addToFilter(
+        association_filter: CountingBloomFilter,
+        medium: str,
+        address: str,
+        lookup_hash: Optional[str],
+    ) -> None:
+        association_filter.add(_threepid_filter_key(medium, address))
+        if lookup_hash is not None:
+            association_filter.add(_hash_filter_key(lookup_hash))
+
+    def _filterKeys(self, keys: Iterable[str]) -> List[bool]:
+        """Check which of the given keys may be in the association filter. If there
+        is no filter, all of them may be.
+
+        :param keys: The keys to check.
+
+        :return: Whether each key may be in the filter, in the same order.
+        """
+        association_filter = self.sydent.association_filter
+        if association_filter is None:
+            return [True for _ in keys]
+
+        candidates = [key in association_filter for key in keys]
+        filtered = candidates.count(False)
+        if filtered:
+            association_filter_checks.labels("filtered").inc(filtered)
+        return candidates
+
+    def _recordFilterResults(self, checked: int, found: int) -> None:
+        """Record how many of the keys that passed the association filter turned out
+        to have an association.
+
+        :param checked: The number of keys that passed the filter and were looked
+            up.
+        :param found: The number of these keys for which an association was found.
+        """
+        if self.sydent.association_filter is None:
+            return
+
+        # There can be more results than keys looked up if several addresses only
+        # differ by their case.
+        association_filter_checks.labels("hit").inc(found)
+        association_filter_checks.labels("miss").inc(max(checked - found, 0))
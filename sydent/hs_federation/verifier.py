@@ -30,6 +30,8 @@ from sydent.hs_federation.types import (
 )
 from sydent.http.httpclient import FederationHttpClient
 from sydent.types import JsonDict
+from sydent.util import tracing
+from sydent.util.singleflight import SingleFlight
 from sydent.util.stringutils import is_valid_matrix_server_name
 
 if TYPE_CHECKING:
@@ -68,7 +70,11 @@ class Verifier:
         self.cache: Dict[str, CachedVerificationKeys] = {
             # server_name: <result from keys query>,
         }
+        # Key requests in flight, so concurrent verifications of requests from the
+        # same server only request its keys once.
+        self._key_requests: SingleFlight[str, VerifyKeys] = SingleFlight("server_keys")
 
+    @tracing.traced("federation.get_server_keys")
     async def _getKeysForServer(self, server_name: str) -> VerifyKeys:
         """Get the signing key data from a homeserver.
 
@@ -76,6 +82,7 @@ class Verifier:
 
         :return: The verification keys returned by the server.
         """
+        tracing.current_span().set_attribute("server_name", server_name)
 
         if server_name in self.cache:
             cached = self.cache[server_name]
@@ -83,6 +90,17 @@ class Verifier:
             if cached.valid_until_ts > now:
                 return cached.verify_keys
 
+        return await self._key_requests.do(
+            server_name, lambda: self._fetchKeysForServer(server_name)
+        )
+
+    async def _fetchKeysForServer(self, server_name: str) -> VerifyKeys:
+        """Request the signing key data from a homeserver, and cache it.
+
+        :param server_name: The name of the server to request the keys from.
+
+        :return: The verification keys returned by the server.
+        """
         client = FederationHttpClient(self.sydent)
         # Cast safety: we have validation logic below which checks that
         # - `verify_keys` is present
@@ -138,6 +156,7 @@ class Verifier:
 
         return verify_keys
 
+    @tracing.traced("crypto.verify_server_signed_json")
     async def verifyServerSignedJson(
         self,
         signed_json: SignedMatrixRequest,
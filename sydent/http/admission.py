@@ -0,0 +1,324 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Admission control, which limits the number of requests processed at once so
+that Sydent sheds load quickly when it's overloaded, instead of queueing work
+without limit until latency collapses for everyone.
+
+Endpoints are split into classes (see ADMISSION_CLASSES), each with its own limit
+on concurrent requests and its own bounded queue of requests waiting for their
+turn. Requests which don't fit in the queue are rejected with a 503 and a
+Retry-After header. There's also an optional limit on the number of requests of
+all classes processed at once, which the classes with a high priority aren't
+held back by.
+"""
+
+import logging
+import time
+from collections import deque
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Deque, Dict, List, Tuple, Union
+
+import attr
+from prometheus_client import Counter, Gauge, Histogram
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web import server
+from twisted.web.resource import IResource, Resource
+from twisted.web.server import Request
+
+from sydent.config.http import ADMISSION_CLASSES
+from sydent.http.servlets import dict_to_json_bytes, send_cors
+from sydent.util.ratelimiter import LimitExceededException
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+logger = logging.getLogger(__name__)
+
+# The priority of each class of endpoints. When requests are waiting, those of
+# the classes with the highest priority are processed first.
+PRIORITIES = {
+    "internal": 2,
+    "replication": 2,
+    "bind": 1,
+    "validation": 1,
+    "lookup": 0,
+}
+
+# Classes with at least this priority aren't held back by the global limit.
+EXEMPT_PRIORITY = 2
+
+assert set(PRIORITIES) == set(ADMISSION_CLASSES)
+
+in_flight_gauge = Gauge(
+    "sydent_admission_in_flight",
+    "Number of requests being processed, by class of endpoints",
+    labelnames=("class",),
+)
+queue_depth_gauge = Gauge(
+    "sydent_admission_queue_depth",
+    "Number of requests waiting to be processed, by class of endpoints",
+    labelnames=("class",),
+)
+rejections_counter = Counter(
+    "sydent_admission_rejections",
+    "Requests rejected because too many were already waiting, by class of endpoints",
+    labelnames=("class",),
+)
+queue_wait_histogram = Histogram(
+    "sydent_admission_queue_wait_seconds",
+    "Time requests waited before being processed, by class of endpoints",
+    labelnames=("class",),
+)
+
+
+class OverloadedException(LimitExceededException):
+    """Raised when a request is rejected because Sydent is overloaded."""
+
+    def __init__(self, retry_after_ms: int) -> None:
+        super().__init__(
+            "The server is overloaded, try again later", retry_after_ms=retry_after_ms
+        )
+        self.httpStatus = HTTPStatus.SERVICE_UNAVAILABLE
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _EndpointClass:
+    """The state of a class of endpoints.
+
+    :param name: The name of the class.
+    :param priority: The priority of its requests.
+    :param max_concurrent: The number of its requests processed at once, or 0
+        for no limit.
+    :param max_queued: The number of its requests waiting beyond that.
+    """
+
+    name: str
+    priority: int
+    max_concurrent: int
+    max_queued: int
+    in_flight: int = 0
+    waiting: Deque["defer.Deferred[None]"] = attr.Factory(deque)
+
+
+class AdmissionController:
+    """Decides when the requests of each class of endpoints are processed.
+
+    :param limits: Maps each class of endpoints to the number of its requests
+        processed at once (0 for no limit) and the number of its requests waiting
+        beyond that.
+    :param max_concurrent: The number of requests of all classes processed at
+        once, or 0 for no limit.
+    :param retry_after: The number of seconds rejected clients are told to wait.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[int, int]],
+        max_concurrent: int,
+        retry_after: int,
+    ) -> None:
+        self._classes = {
+            name: _EndpointClass(name, PRIORITIES[name], *limits[name])
+            for name in ADMISSION_CLASSES
+        }
+        # Highest priority first.
+        self._by_priority: List[_EndpointClass] = sorted(
+            self._classes.values(), key=lambda c: -c.priority
+        )
+        self._max_concurrent = max_concurrent
+        self._in_flight = 0
+        self.retry_after = retry_after
+        # Admitting a request can finish another one, which mustn't admit more
+        # requests recursively.
+        self._dispatching = False
+
+    @classmethod
+    def from_config(cls, sydent: "Sydent") -> "AdmissionController":
+        """Build the admission controller configured in Sydent's config."""
+        return cls(
+            sydent.config.http.admission_limits,
+            sydent.config.http.admission_max_concurrent,
+            sydent.config.http.admission_retry_after,
+        )
+
+    def _can_admit(self, endpoint_class: _EndpointClass) -> bool:
+        if (
+            endpoint_class.max_concurrent > 0
+            and endpoint_class.in_flight >= endpoint_class.max_concurrent
+        ):
+            return False
+        return (
+            endpoint_class.priority >= EXEMPT_PRIORITY
+            or self._max_concurrent <= 0
+            or self._in_flight < self._max_concurrent
+        )
+
+    def _admit(self, endpoint_class: _EndpointClass) -> None:
+        endpoint_class.in_flight += 1
+        self._in_flight += 1
+        in_flight_gauge.labels(endpoint_class.name).inc()
+
+    def try_admit(self, name: str) -> bool:
+        """Admit a request straight away, if there's room for it.
+
+        :param name: The class of the request's endpoint.
+
+        :return: Whether the request was admitted, in which case `release` must
+            be called once it's processed.
+        """
+        endpoint_class = self._classes[name]
+        # Don't overtake the requests already waiting.
+        if endpoint_class.waiting or not self._can_admit(endpoint_class):
+            return False
+        self._admit(endpoint_class)
+        return True
+
+    def wait(self, name: str) -> "defer.Deferred[None]":
+        """Queue a request until there's room for it.
+
+        :param name: The class of the request's endpoint.
+
+        :raises OverloadedException: if too many requests are already waiting.
+
+        :return: A Deferred which resolves once the request is admitted, after
+            which `release` must be called once it's processed. Cancelling it
+            removes the request from the queue.
+        """
+        endpoint_class = self._classes[name]
+        if len(endpoint_class.waiting) >= endpoint_class.max_queued:
+            rejections_counter.labels(name).inc()
+            raise OverloadedException(self.retry_after * 1000)
+
+        def cancel(d: "defer.Deferred[None]") -> None:
+            endpoint_class.waiting.remove(d)
+            queue_depth_gauge.labels(name).dec()
+
+        d: "defer.Deferred[None]" = defer.Deferred(cancel)
+        endpoint_class.waiting.append(d)
+        queue_depth_gauge.labels(name).inc()
+
+        start = time.perf_counter()
+
+        def admitted(result: None) -> None:
+            queue_wait_histogram.labels(name).observe(time.perf_counter() - start)
+
+        d.addCallback(admitted)
+        return d
+
+    def release(self, name: str) -> None:
+        """Record that an admitted request was processed, and admit the waiting
+        requests there's now room for.
+
+        :param name: The class of the request's endpoint.
+        """
+        endpoint_class = self._classes[name]
+        endpoint_class.in_flight -= 1
+        self._in_flight -= 1
+        in_flight_gauge.labels(name).dec()
+
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            for waiting_class in self._by_priority:
+                while waiting_class.waiting and self._can_admit(waiting_class):
+                    d = waiting_class.waiting.popleft()
+                    queue_depth_gauge.labels(waiting_class.name).dec()
+                    self._admit(waiting_class)
+                    d.callback(None)
+        finally:
+            self._dispatching = False
+
+    def wrap(self, name: str, resource: Resource) -> "AdmissionControlledResource":
+        """Limit the concurrency of the requests to a resource.
+
+        :param name: The class of the resource's endpoint.
+        :param resource: The resource.
+
+        :return: The resource to serve instead.
+        """
+        return AdmissionControlledResource(self, name, resource)
+
+
+class AdmissionControlledResource(Resource):
+    """Serves the requests to a resource once admission control admits them.
+
+    :param controller: The admission controller.
+    :param name: The class of the resource's endpoint.
+    :param resource: The resource.
+    """
+
+    def __init__(
+        self, controller: AdmissionController, name: str, resource: Resource
+    ) -> None:
+        super().__init__()
+        self._controller = controller
+        self._name = name
+        self._resource = resource
+        # Traverse the resource tree as the wrapped resource would.
+        self.isLeaf = resource.isLeaf  # type: ignore[misc]
+
+    def getChildWithDefault(self, path: bytes, request: Request) -> IResource:
+        return self._resource.getChildWithDefault(path, request)
+
+    def render(self, request: Request) -> object:
+        if self._controller.try_admit(self._name):
+            self._release_on_finish(request)
+            result: object = self._resource.render(request)
+            return result
+
+        try:
+            d = self._controller.wait(self._name)
+        except OverloadedException as e:
+            logger.warning(
+                "Rejecting request to %s: too many %s requests waiting",
+                request.path.decode("UTF-8", "replace"),
+                self._name,
+            )
+            send_cors(request)
+            request.setResponseCode(e.httpStatus)
+            request.setHeader("Content-Type", "application/json")
+            request.setHeader("Retry-After", str(self._controller.retry_after))
+            return dict_to_json_bytes(e.error_dict())
+
+        # Stop waiting if the client goes away.
+        request.notifyFinish().addErrback(lambda _: d.cancel())
+        d.addCallback(lambda _: self._render_admitted(request))
+        d.addErrback(lambda f: f.trap(defer.CancelledError))
+        return server.NOT_DONE_YET
+
+    def _release_on_finish(self, request: Request) -> None:
+        def finished(result: Union[None, Failure]) -> None:
+            self._controller.release(self._name)
+
+        request.notifyFinish().addBoth(finished)
+
+    def _render_admitted(self, request: Request) -> None:
+        """Render a request which waited to be admitted."""
+        self._release_on_finish(request)
+        try:
+            body = self._resource.render(request)
+        except Exception:
+            request.processingFailed(Failure())
+            return
+
+        if body is server.NOT_DONE_YET:
+            return
+
+        # What Request.render would have done with the body.
+        request.setHeader(b"Content-Length", b"%d" % (len(body),))
+        request.write(b"" if request.method == b"HEAD" else body)
+        request.finish()
@@ -15,10 +15,11 @@
 import logging
 from typing import TYPE_CHECKING, Optional
 
+from prometheus_client import Counter
 from twisted.web.server import Request
 
 from sydent.db.accounts import AccountStore
-from sydent.http.servlets import MatrixRestError, get_args
+from sydent.http.servlets import MatrixRestError, get_args, has_cbor_body
 from sydent.terms.terms import get_terms
 
 if TYPE_CHECKING:
@@ -27,6 +28,13 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+auth_results = Counter(
+    "sydent_auth_results",
+    "Results of authenticating v2 requests ('ok', 'missing_token', "
+    "'unknown_token' or 'terms_not_signed')",
+    labelnames=("result",),
+)
+
 
 def tokenFromRequest(request: Request) -> Optional[str]:
     """Extract token from header of query parameter.
@@ -41,8 +49,9 @@ def tokenFromRequest(request: Request) -> Optional[str]:
     if authHeader is not None and authHeader.startswith("Bearer "):
         token = authHeader[len("Bearer ") :]
 
-    # no? try access_token query param
-    if token is None:
+    # no? try access_token query param. CBOR bodies are left for the servlet
+    # (which must be a lookup) to read.
+    if token is None and not has_cbor_body(request):
         args = get_args(request, ("access_token",), required=False)
         token = args.get("access_token")
 
@@ -68,12 +77,14 @@ def authV2(
     token = tokenFromRequest(request)
 
     if token is None:
+        auth_results.labels("missing_token").inc()
         raise MatrixRestError(401, "M_UNAUTHORIZED", "Unauthorized")
 
     accountStore = AccountStore(sydent)
 
     account = accountStore.getAccountByToken(token)
     if account is None:
+        auth_results.labels("unknown_token").inc()
         raise MatrixRestError(401, "M_UNAUTHORIZED", "Unauthorized")
 
     if requireTermsAgreed:
@@ -82,6 +93,8 @@ def authV2(
             terms.getMasterVersion() is not None
             and account.consentVersion != terms.getMasterVersion()
         ):
+            auth_results.labels("terms_not_signed").inc()
             raise MatrixRestError(403, "M_TERMS_NOT_SIGNED", "Terms not signed")
 
+    auth_results.labels("ok").inc()
     return account
@@ -0,0 +1,230 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import zlib
+from typing import Dict, Optional, Set
+
+from twisted.web.iweb import IRequest, _IRequestEncoder, _IRequestEncoderFactory
+from twisted.web.resource import EncodingResourceWrapper, IResource, Resource
+from zope.interface import implementer
+
+try:
+    import brotli
+
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+logger = logging.getLogger(__name__)
+
+# The compression levels to use, trading off size for CPU time.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class _Compressor:
+    """Compresses a response body, one part at a time."""
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def flush(self) -> bytes:
+        """Return the compressed data buffered so far, so that the client can
+        decompress everything it was sent up to this point.
+        """
+        raise NotImplementedError()
+
+    def finish(self) -> bytes:
+        raise NotImplementedError()
+
+
+class _GzipCompressor(_Compressor):
+    def __init__(self) -> None:
+        self._compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliCompressor(_Compressor):
+    def __init__(self) -> None:
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        result: bytes = self._compressor.process(data)
+        return result
+
+    def flush(self) -> bytes:
+        result: bytes = self._compressor.flush()
+        return result
+
+    def finish(self) -> bytes:
+        result: bytes = self._compressor.finish()
+        return result
+
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    """Parse the value of an Accept-Encoding header.
+
+    :param accept_encoding: The value of the header.
+
+    :return: The (lowercased) content codings the client accepts, i.e. which it
+        lists with a non-zero quality.
+    """
+    encodings = set()
+    for accepted in accept_encoding.split(","):
+        coding, *params = accepted.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+@implementer(_IRequestEncoder)
+class _ThresholdEncoder:
+    """Compresses the response to a request, unless it's known to be smaller than
+    a given size.
+
+    Whether to compress the response is decided on its first write, which happens
+    before its headers are sent: the response is compressed if it's streamed (i.e.
+    has no Content-Length), or if its Content-Length is at least the given size.
+    Streamed responses are only sent without a Content-Length once they reach
+    STREAMED_RESPONSE_MIN_SIZE, so the given size is only ignored for them if
+    it's larger than that.
+
+    :param request: The request to compress the response to.
+    :param coding: The content coding to use.
+    :param min_size: The minimum size of the responses to compress, in bytes.
+    """
+
+    def __init__(self, request: IRequest, coding: str, min_size: int) -> None:
+        self._request = request
+        self._coding = coding
+        self._min_size = min_size
+        self._decided = False
+        self._compressor: Optional[_Compressor] = None
+        # Whether to flush the compressor after each write.
+        self._streamed = False
+
+    def _start(self) -> None:
+        self._decided = True
+
+        headers = self._request.responseHeaders
+        content_length = headers.getRawHeaders(b"Content-Length")
+        if content_length is not None and int(content_length[0]) < self._min_size:
+            return
+
+        self._streamed = content_length is None
+        # The length of the compressed response isn't known in advance.
+        headers.removeHeader(b"Content-Length")
+        headers.setRawHeaders(b"Content-Encoding", [self._coding.encode("ascii")])
+        if self._coding == "br":
+            self._compressor = _BrotliCompressor()
+        else:
+            self._compressor = _GzipCompressor()
+
+    def encode(self, data: bytes) -> bytes:
+        if not self._decided:
+            self._start()
+
+        if self._compressor is None:
+            return data
+
+        compressed = self._compressor.compress(data)
+        if self._streamed:
+            # Send each part of the response as it's produced, rather than once
+            # the compressor has accumulated enough of it.
+            compressed += self._compressor.flush()
+        return compressed
+
+    def finish(self) -> bytes:
+        if self._compressor is None:
+            return b""
+        return self._compressor.finish()
+
+
+@implementer(_IRequestEncoderFactory)
+class CompressionEncoderFactory:
+    """Compresses responses with brotli (if available) or gzip, depending on what
+    the client accepts.
+
+    :param min_size: The minimum size of the responses to compress, in bytes.
+    """
+
+    def __init__(self, min_size: int) -> None:
+        self._min_size = min_size
+
+    def encoderForRequest(self, request: IRequest) -> Optional[_IRequestEncoder]:
+        request.responseHeaders.addRawHeader(b"Vary", b"Accept-Encoding")
+
+        accept_encoding = request.getHeader("Accept-Encoding")
+        if accept_encoding is None:
+            return None
+
+        encodings = accepted_encodings(accept_encoding)
+        if HAS_BROTLI and "br" in encodings:
+            coding = "br"
+        elif "gzip" in encodings or "*" in encodings:
+            coding = "gzip"
+        else:
+            return None
+
+        return _ThresholdEncoder(request, coding, self._min_size)
+
+
+def compress_resources(root: Resource, endpoints: Dict[str, int]) -> None:
+    """Replace the resources at the given paths with resources compressing their
+    responses.
+
+    :param root: The root of the resource tree.
+    :param endpoints: The paths of the resources to compress the responses of,
+        relative to the root, mapped to the minimum size of the responses to
+        compress.
+    """
+    for path, min_size in endpoints.items():
+        segments = path.strip("/").encode("utf-8").split(b"/")
+
+        parent: Optional[Resource] = None
+        resource: Optional[IResource] = root
+        for segment in segments:
+            if not isinstance(resource, Resource):
+                resource = None
+                break
+            parent = resource
+            resource = parent.children.get(segment)
+
+        if parent is None or resource is None:
+            logger.warning("Can't compress responses of %s: no such endpoint", path)
+            continue
+
+        parent.putChild(
+            segments[-1],
+            EncodingResourceWrapper(resource, [CompressionEncoderFactory(min_size)]),
+        )
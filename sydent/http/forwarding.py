@@ -0,0 +1,125 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import quote
+
+from twisted.web.proxy import ReverseProxyResource
+from twisted.web.resource import IResource, Resource
+from twisted.web.server import Request
+
+from sydent.http.httpcommon import WORKER_SECRET_HEADER
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+logger = logging.getLogger(__name__)
+
+# The client API endpoints which client API workers serve themselves. They only
+# read from the database, and answer from it directly rather than from in-memory
+# caches, so they see the writes the master made as soon as they're committed.
+# Requests to any other endpoint are forwarded to the master.
+WORKER_PATHS = (
+    b"/_matrix/identity/api/v1/lookup",
+    b"/_matrix/identity/api/v1/bulk_lookup",
+    b"/_matrix/identity/api/v1/pubkey",
+    b"/_matrix/identity/v2/lookup",
+    b"/_matrix/identity/v2/hash_details",
+    b"/_matrix/identity/v2/pubkey",
+    b"/_matrix/identity/versions",
+)
+
+
+class ForwardingResource(ReverseProxyResource):
+    """Forwards requests for this resource, and the resources below it which
+    haven't been added as children, to the master process.
+
+    :param sydent: The worker's Sydent instance.
+    :param host: The address the master listens on for forwarded requests.
+    :param port: The port the master listens on for forwarded requests.
+    :param path: The path of this resource.
+    """
+
+    def __init__(self, sydent: "Sydent", host: str, port: int, path: bytes) -> None:
+        super().__init__(host, port, path, sydent.reactor)
+        self.sydent = sydent
+
+    def getChild(self, path: bytes, request: Request) -> "ForwardingResource":
+        return ForwardingResource(
+            self.sydent,
+            self.host,
+            self.port,
+            self.path + b"/" + quote(path, safe=b"").encode("utf-8"),
+        )
+
+    def render(self, request: Request) -> object:
+        # Let the master know that the request comes from a worker, and who made it,
+        # e.g. for ratelimiting.
+        assert self.sydent.worker_secret is not None
+        request.requestHeaders.setRawHeaders(
+            WORKER_SECRET_HEADER, [self.sydent.worker_secret.encode("ascii")]
+        )
+        ip = self.sydent.ip_from_request(request)
+        if ip is None:
+            request.requestHeaders.removeHeader(b"X-Forwarded-For")
+        else:
+            request.requestHeaders.setRawHeaders(b"X-Forwarded-For", [ip])
+        return super().render(request)
+
+
+def build_worker_resource(
+    sydent: "Sydent", root: Resource, host: str, port: int
+) -> ForwardingResource:
+    """Build the resource tree served by a client API worker, which serves the
+    endpoints in WORKER_PATHS itself and forwards all other requests to the master.
+
+    :param sydent: The worker's Sydent instance.
+    :param root: The root of the full client API resource tree.
+    :param host: The address the master listens on for forwarded requests.
+    :param port: The port the master listens on for forwarded requests.
+
+    :return: The root of the worker's resource tree.
+    """
+    worker_root = ForwardingResource(sydent, host, port, b"")
+
+    for path in WORKER_PATHS:
+        segments = path.strip(b"/").split(b"/")
+
+        # Find the resource serving the endpoint in the full tree...
+        resource: Optional[IResource] = root
+        for segment in segments:
+            if not isinstance(resource, Resource):
+                resource = None
+                break
+            resource = resource.children.get(segment)
+
+        # ... which can be missing, e.g. if v1 endpoints are disabled.
+        if resource is None:
+            continue
+
+        # Then add it to the worker's tree, forwarding everything else along its
+        # path.
+        parent: Resource = worker_root
+        prefix = b""
+        for segment in segments[:-1]:
+            prefix += b"/" + segment
+            child = parent.children.get(segment)
+            if not isinstance(child, Resource):
+                child = ForwardingResource(sydent, host, port, prefix)
+                parent.putChild(segment, child)
+            parent = child
+        parent.putChild(segments[-1], resource)
+
+    return worker_root
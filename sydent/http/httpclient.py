@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
 from io import BytesIO
 from typing import TYPE_CHECKING, Any, Dict, Generic, Optional, Tuple, TypeVar, cast
@@ -26,7 +25,8 @@ from sydent.http.federation_tls_options import ClientTLSOptionsFactory
 from sydent.http.httpcommon import read_body_with_max_size
 from sydent.http.matrixfederationagent import MatrixFederationAgent
 from sydent.types import JsonDict
-from sydent.util import json_decoder
+from sydent.util import tracing
+from sydent.util.json_codec import decode_json, encode_json
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -37,6 +37,14 @@ logger = logging.getLogger(__name__)
 AgentType = TypeVar("AgentType", bound=IAgent)
 
 
+def _span_attributes(method: str, uri: str) -> Dict[str, Any]:
+    """
+    :return: The attributes of the span of an outbound request. The URI's query
+        string is left out, as it can contain secrets.
+    """
+    return {"http.method": method, "http.url": uri.split("?", 1)[0]}
+
+
 class HTTPClient(Generic[AgentType]):
     """A base HTTP class that contains methods for making GET and POST HTTP
     requests.
@@ -55,14 +63,15 @@ class HTTPClient(Generic[AgentType]):
         """
         logger.debug("HTTP GET %s", uri)
 
-        response = await self.agent.request(
-            b"GET",
-            uri.encode("utf8"),
-        )
-        body = await read_body_with_max_size(response, max_size)
+        with tracing.trace("http.client", _span_attributes("GET", uri)) as span:
+            response = await self.agent.request(
+                b"GET",
+                uri.encode("utf8"),
+            )
+            span.set_attribute("http.status_code", response.code)
+            body = await read_body_with_max_size(response, max_size)
         try:
-            # json.loads doesn't allow bytes in Python 3.5
-            json_body = json_decoder.decode(body.decode("UTF-8"))
+            json_body = decode_json(body)
         except Exception:
             logger.warning("Error parsing JSON from %s", uri)
             raise
@@ -113,7 +122,7 @@ class HTTPClient(Generic[AgentType]):
         :return: a response from the remote server, and its decoded JSON body if any (None
             otherwise).
         """
-        json_bytes = json.dumps(post_json).encode("utf8")
+        json_bytes = encode_json(post_json)
 
         headers = opts.get(
             "headers",
@@ -126,25 +135,27 @@ class HTTPClient(Generic[AgentType]):
 
         logger.debug("HTTP POST %s -> %s", json_bytes, uri)
 
-        response = await self.agent.request(
-            b"POST",
-            uri.encode("utf8"),
-            headers,
-            bodyProducer=FileBodyProducer(BytesIO(json_bytes)),
-        )
-
-        # Ensure the body object is read otherwise we'll leak HTTP connections
-        # as per
-        # https://twistedmatrix.com/documents/current/web/howto/client.html
-        json_body = None
-        try:
-            # TODO Will this cause the server to think the request was a failure?
-            body = await read_body_with_max_size(response, max_size)
-            json_body = json_decoder.decode(body.decode("UTF-8"))
-        except Exception:
-            # We might get an exception here because the body exceeds the max_size, or it
-            # isn't valid JSON. In both cases, we don't care about it.
-            pass
+        with tracing.trace("http.client", _span_attributes("POST", uri)) as span:
+            response = await self.agent.request(
+                b"POST",
+                uri.encode("utf8"),
+                headers,
+                bodyProducer=FileBodyProducer(BytesIO(json_bytes)),
+            )
+            span.set_attribute("http.status_code", response.code)
+
+            # Ensure the body object is read otherwise we'll leak HTTP connections
+            # as per
+            # https://twistedmatrix.com/documents/current/web/howto/client.html
+            json_body = None
+            try:
+                # TODO Will this cause the server to think the request was a failure?
+                body = await read_body_with_max_size(response, max_size)
+                json_body = decode_json(body)
+            except Exception:
+                # We might get an exception here because the body exceeds the max_size, or it
+                # isn't valid JSON. In both cases, we don't care about it.
+                pass
 
         return response, json_body
 
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hmac
 import logging
 from io import BytesIO
 from typing import TYPE_CHECKING, Optional, cast
@@ -28,6 +29,7 @@ from twisted.web.http import PotentialDataLoss
 from twisted.web.iweb import UNKNOWN_LENGTH, IResponse
 
 if TYPE_CHECKING:
+    from sydent.config.http import HTTPConfig
     from sydent.sydent import Sydent
 
 
@@ -36,17 +38,31 @@ logger = logging.getLogger(__name__)
 # Arbitrarily limited to 512 KiB.
 MAX_REQUEST_SIZE = 512 * 1024
 
+# The header with which client API workers authenticate the requests they forward
+# to the master process.
+WORKER_SECRET_HEADER = b"X-Sydent-Worker-Secret"
+
 
 class SslComponents:
-    def __init__(self, sydent: "Sydent") -> None:
+    def __init__(
+        self, sydent: "Sydent", http_config: Optional["HTTPConfig"] = None
+    ) -> None:
+        """
+        :param sydent: The Sydent instance.
+        :param http_config: The HTTP config to read the certificates' paths from,
+            if not Sydent's current one, e.g. when reloading the config.
+        """
         self.sydent = sydent
+        self._config = http_config if http_config is not None else sydent.config.http
 
-        self.myPrivateCertificate = self.makeMyCertificate()
-        self.trustRoot = self.makeTrustRoot()
+        self.myPrivateCertificate: Optional[
+            twisted.internet.ssl.PrivateCertificate
+        ] = self.makeMyCertificate()
+        self.trustRoot: IOpenSSLTrustRoot = self.makeTrustRoot()
 
     def makeMyCertificate(self) -> Optional[twisted.internet.ssl.PrivateCertificate]:
         # TODO Move some of this loading into parse_config
-        privKeyAndCertFilename = self.sydent.config.http.cert_file
+        privKeyAndCertFilename = self._config.cert_file
 
         if privKeyAndCertFilename == "":
             logger.warning(
@@ -72,7 +88,7 @@ class SslComponents:
     def makeTrustRoot(self) -> IOpenSSLTrustRoot:
         # If this option is specified, use a specific root CA cert. This is useful for testing when it's not
         # practical to get the client cert signed by a real root CA but should never be used on a production server.
-        caCertFilename = self.sydent.config.http.ca_cert_file
+        caCertFilename = self._config.ca_cert_file
         if len(caCertFilename) > 0:
             try:
                 fp = open(caCertFilename)
@@ -205,8 +221,36 @@ class SizeLimitingRequest(server.Request):
                 # Formerly `self.client.host`, but `host` isn't provided by `IAddress`
                 self.client,
             )
-            assert self.transport is not None
-            self.transport.abortConnection()
+            if self.transport is not None:
+                self.transport.abortConnection()
+            else:
+                # The channel of HTTP/2 requests is their stream, which has no
+                # transport of its own: reset the stream, leaving the other
+                # requests on the connection alone.
+                self.channel.abortConnection()  # type: ignore[attr-defined]
             return
 
         return super().handleContentChunk(data)
+
+
+class ForwardedRequest(SizeLimitingRequest):
+    """A request to the port on which the master process listens for the requests
+    forwarded by client API workers.
+
+    Workers authenticate the requests they forward with WORKER_SECRET_HEADER, and
+    set X-Forwarded-For to the address of the client which made the request, so
+    it's trusted regardless of the `obey_x_forwarded_for` option. They leave it
+    out if they don't know the address, in which case it's unknown.
+    """
+
+    def is_from_worker(self, secret: Optional[str]) -> bool:
+        """Check whether the request was forwarded by a client API worker.
+
+        :param secret: The secret of the client API workers, if any were started.
+
+        :return: Whether the request carries the workers' secret.
+        """
+        sent = self.requestHeaders.getRawHeaders(WORKER_SECRET_HEADER)
+        if secret is None or sent is None:
+            return False
+        return hmac.compare_digest(sent[0], secret.encode("ascii"))
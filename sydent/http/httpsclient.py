@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
 from io import BytesIO
 from typing import TYPE_CHECKING, Optional
@@ -26,6 +25,8 @@ from twisted.web.iweb import IPolicyForHTTPS
 from zope.interface import implementer
 
 from sydent.types import JsonDict
+from sydent.util import tracing
+from sydent.util.json_codec import encode_json
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -72,12 +73,19 @@ class ReplicationHttpsClient:
             {"Content-Type": ["application/json"], "User-Agent": ["Sydent"]}
         )
 
-        json_bytes = json.dumps(jsonObject).encode("utf8")
-        reqDeferred = self.agent.request(
-            b"POST", uri.encode("utf8"), headers, FileBodyProducer(BytesIO(json_bytes))
+        json_bytes = encode_json(jsonObject)
+        span = tracing.start_span(
+            "http.client", {"http.method": "POST", "http.url": uri}
         )
-
-        return reqDeferred
+        with tracing.activate(span):
+            reqDeferred = self.agent.request(
+                b"POST",
+                uri.encode("utf8"),
+                headers,
+                FileBodyProducer(BytesIO(json_bytes)),
+            )
+
+        return tracing.finish_with(span, reqDeferred)
 
 
 @implementer(IPolicyForHTTPS)
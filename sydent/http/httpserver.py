@@ -15,13 +15,20 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+import socket
+from typing import TYPE_CHECKING, List, Optional
 
+import prometheus_client
 import twisted.internet.ssl
+from OpenSSL import SSL
+from twisted.internet.interfaces import IOpenSSLContextFactory
 from twisted.web.resource import Resource
-from twisted.web.server import Site
+from twisted.web.server import Request, Site
+from zope.interface import implementer
 
-from sydent.http.httpcommon import SizeLimitingRequest
+from sydent.http.compression import compress_resources
+from sydent.http.forwarding import build_worker_resource
+from sydent.http.httpcommon import ForwardedRequest, SizeLimitingRequest, SslComponents
 from sydent.http.servlets.accountservlet import AccountServlet
 from sydent.http.servlets.authenticated_bind_threepid_servlet import (
     AuthenticatedBindThreePidServlet,
@@ -30,7 +37,6 @@ from sydent.http.servlets.authenticated_unbind_threepid_servlet import (
     AuthenticatedUnbindThreePidServlet,
 )
 from sydent.http.servlets.blindlysignstuffservlet import BlindlySignStuffServlet
-from sydent.http.servlets.bulklookupservlet import BulkLookupServlet
 from sydent.http.servlets.cors_servlet import CorsServlet
 from sydent.http.servlets.emailservlet import (
     EmailRequestCodeServlet,
@@ -39,7 +45,7 @@ from sydent.http.servlets.emailservlet import (
 from sydent.http.servlets.getvalidated3pidservlet import GetValidated3pidServlet
 from sydent.http.servlets.hashdetailsservlet import HashDetailsServlet
 from sydent.http.servlets.logoutservlet import LogoutServlet
-from sydent.http.servlets.lookupservlet import LookupServlet
+from sydent.http.servlets.lookupdeltaservlet import LookupDeltaServlet
 from sydent.http.servlets.lookupv2servlet import LookupV2Servlet
 from sydent.http.servlets.msisdnservlet import (
     MsisdnRequestCodeServlet,
@@ -51,6 +57,7 @@ from sydent.http.servlets.pubkeyservlets import (
     PubkeyIsValidServlet,
 )
 from sydent.http.servlets.registerservlet import RegisterServlet
+from sydent.http.servlets.reloadservlet import ReloadServlet
 from sydent.http.servlets.replication import ReplicationPushServlet
 from sydent.http.servlets.store_invite_servlet import StoreInviteServlet
 from sydent.http.servlets.termsservlet import TermsServlet
@@ -64,6 +71,25 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+class ClientApiHttpsSite(Site):
+    """Serves the client API over HTTPS, offering HTTP/2 to the clients which pick
+    it with ALPN only if enabled (Twisted's Site offers it whenever it's installed).
+
+    :param resource: The root of the resource tree.
+    :param http2: Whether to offer HTTP/2.
+    """
+
+    def __init__(self, resource: Resource, http2: bool) -> None:
+        super().__init__(resource, SizeLimitingRequest)
+        self.displayTracebacks = False
+        self.http2 = http2
+
+    def acceptableProtocols(self) -> List[bytes]:
+        if self.http2:
+            return [b"h2", b"http/1.1"]
+        return [b"http/1.1"]
+
+
 class ClientApiHttpServer:
     def __init__(self, sydent: "Sydent", lookup_pepper: str) -> None:
         """
@@ -72,6 +98,8 @@ class ClientApiHttpServer:
 
         """
         self.sydent = sydent
+        # The certificate the client API is served over HTTPS with, if it is.
+        self.httpsCertificate: Optional[twisted.internet.ssl.PrivateCertificate] = None
 
         root = Resource()
         matrix = Resource()
@@ -89,7 +117,8 @@ class ClientApiHttpServer:
 
         threepid_v1 = Resource()
         threepid_v2 = Resource()
-        unbind = ThreePidUnbindServlet(sydent)
+        admission = sydent.admission
+        unbind = admission.wrap("bind", ThreePidUnbindServlet(sydent))
 
         pubkey = Resource()
         ephemeralPubkey = Resource()
@@ -107,32 +136,58 @@ class ClientApiHttpServer:
 
         # v1
         if self.sydent.config.general.enable_v1_access:
+            # Imported here as only the (deprecated) v1 API uses them.
+            from sydent.http.servlets.bulklookupservlet import BulkLookupServlet
+            from sydent.http.servlets.lookupservlet import LookupServlet
+
             api.putChild(b"v1", v1)
             validate.putChild(b"email", email)
             validate.putChild(b"msisdn", msisdn)
             v1.putChild(b"validate", validate)
 
-            v1.putChild(b"lookup", LookupServlet(sydent))
-            v1.putChild(b"bulk_lookup", BulkLookupServlet(sydent))
+            v1.putChild(b"lookup", admission.wrap("lookup", LookupServlet(sydent)))
+            v1.putChild(
+                b"bulk_lookup", admission.wrap("lookup", BulkLookupServlet(sydent))
+            )
 
             v1.putChild(b"pubkey", pubkey)
 
-            threepid_v1.putChild(b"getValidated3pid", GetValidated3pidServlet(sydent))
+            threepid_v1.putChild(
+                b"getValidated3pid",
+                admission.wrap("validation", GetValidated3pidServlet(sydent)),
+            )
             threepid_v1.putChild(b"unbind", unbind)
             v1.putChild(b"3pid", threepid_v1)
 
-            email.putChild(b"requestToken", EmailRequestCodeServlet(sydent))
-            email.putChild(b"submitToken", EmailValidateCodeServlet(sydent))
+            email.putChild(
+                b"requestToken",
+                admission.wrap("validation", EmailRequestCodeServlet(sydent)),
+            )
+            email.putChild(
+                b"submitToken",
+                admission.wrap("validation", EmailValidateCodeServlet(sydent)),
+            )
 
-            msisdn.putChild(b"requestToken", MsisdnRequestCodeServlet(sydent))
-            msisdn.putChild(b"submitToken", MsisdnValidateCodeServlet(sydent))
+            msisdn.putChild(
+                b"requestToken",
+                admission.wrap("validation", MsisdnRequestCodeServlet(sydent)),
+            )
+            msisdn.putChild(
+                b"submitToken",
+                admission.wrap("validation", MsisdnValidateCodeServlet(sydent)),
+            )
 
-            v1.putChild(b"store-invite", StoreInviteServlet(sydent))
+            v1.putChild(
+                b"store-invite",
+                admission.wrap("validation", StoreInviteServlet(sydent)),
+            )
 
             v1.putChild(b"sign-ed25519", BlindlySignStuffServlet(sydent))
 
         if self.sydent.config.general.enable_v1_associations:
-            threepid_v1.putChild(b"bind", ThreePidBindServlet(sydent))
+            threepid_v1.putChild(
+                b"bind", admission.wrap("bind", ThreePidBindServlet(sydent))
+            )
 
         # v2
         # note v2 loses the /api so goes on 'identity' not 'api'
@@ -142,23 +197,41 @@ class ClientApiHttpServer:
         validate_v2.putChild(b"msisdn", msisdn_v2)
 
         threepid_v2.putChild(
-            b"getValidated3pid", GetValidated3pidServlet(sydent, require_auth=True)
+            b"getValidated3pid",
+            admission.wrap(
+                "validation", GetValidated3pidServlet(sydent, require_auth=True)
+            ),
+        )
+        threepid_v2.putChild(
+            b"bind",
+            admission.wrap("bind", ThreePidBindServlet(sydent, require_auth=True)),
         )
-        threepid_v2.putChild(b"bind", ThreePidBindServlet(sydent, require_auth=True))
         threepid_v2.putChild(b"unbind", unbind)
 
         email_v2.putChild(
-            b"requestToken", EmailRequestCodeServlet(sydent, require_auth=True)
+            b"requestToken",
+            admission.wrap(
+                "validation", EmailRequestCodeServlet(sydent, require_auth=True)
+            ),
         )
         email_v2.putChild(
-            b"submitToken", EmailValidateCodeServlet(sydent, require_auth=True)
+            b"submitToken",
+            admission.wrap(
+                "validation", EmailValidateCodeServlet(sydent, require_auth=True)
+            ),
         )
 
         msisdn_v2.putChild(
-            b"requestToken", MsisdnRequestCodeServlet(sydent, require_auth=True)
+            b"requestToken",
+            admission.wrap(
+                "validation", MsisdnRequestCodeServlet(sydent, require_auth=True)
+            ),
         )
         msisdn_v2.putChild(
-            b"submitToken", MsisdnValidateCodeServlet(sydent, require_auth=True)
+            b"submitToken",
+            admission.wrap(
+                "validation", MsisdnValidateCodeServlet(sydent, require_auth=True)
+            ),
         )
 
         # v2 exclusive APIs
@@ -172,33 +245,139 @@ class ClientApiHttpServer:
         v2.putChild(b"validate", validate_v2)
         v2.putChild(b"pubkey", pubkey)
         v2.putChild(b"3pid", threepid_v2)
-        v2.putChild(b"store-invite", StoreInviteServlet(sydent, require_auth=True))
+        v2.putChild(
+            b"store-invite",
+            admission.wrap("validation", StoreInviteServlet(sydent, require_auth=True)),
+        )
         v2.putChild(b"sign-ed25519", BlindlySignStuffServlet(sydent, require_auth=True))
-        v2.putChild(b"lookup", LookupV2Servlet(sydent, lookup_pepper))
+        v2.putChild(
+            b"lookup", admission.wrap("lookup", LookupV2Servlet(sydent, lookup_pepper))
+        )
+        v2.putChild(
+            b"lookup_delta",
+            admission.wrap("lookup", LookupDeltaServlet(sydent, lookup_pepper)),
+        )
         v2.putChild(b"hash_details", HashDetailsServlet(sydent, lookup_pepper))
 
+        compress_resources(root, self.sydent.config.http.compressed_endpoints)
+
+        self.root = root
         self.factory = Site(root, SizeLimitingRequest)
         self.factory.displayTracebacks = False
 
+        # Serves the requests forwarded by client API workers, if there are any.
+        self.forwardedFactory = Site(root, ForwardedRequest)
+        self.forwardedFactory.displayTracebacks = False
+
     def setup(self) -> None:
-        httpPort = self.sydent.config.http.client_port
-        interface = self.sydent.config.http.client_bind_address
+        unix_socket = self.sydent.config.http.client_unix_socket
+        if unix_socket:
+            logger.info("Starting Client API HTTP server on %s", unix_socket)
+            listen_unix(
+                self.sydent,
+                unix_socket,
+                self.factory,
+                self.sydent.config.http.client_unix_socket_mode,
+            )
+        else:
+            httpPort = self.sydent.config.http.client_port
+            interface = self.sydent.config.http.client_bind_address
+
+            logger.info("Starting Client API HTTP server on %s:%d", interface, httpPort)
+            self.sydent.reactor.listenTCP(
+                httpPort,
+                self.factory,
+                backlog=50,  # taken from PosixReactorBase.listenTCP
+                interface=interface,
+            )
+        self.setup_https()
+
+    def setup_https(self) -> None:
+        """Serve the client API over HTTPS too, and over HTTP/2 if enabled, if an
+        HTTPS port is configured.
+        """
+        port = self.sydent.config.http.client_https_port
+        if port is None:
+            return
+        interface = self.sydent.config.http.client_https_bind_address
+
+        self.httpsCertificate = load_private_certificate(
+            self.sydent.config.http.client_https_cert_file
+        )
+
+        http2 = self.sydent.config.http.client_http2
+        self.httpsFactory = ClientApiHttpsSite(self.root, http2)
 
-        logger.info("Starting Client API HTTP server on %s:%d", interface, httpPort)
+        logger.info(
+            "Starting Client API HTTPS server on %s:%d (HTTP/2 %s)",
+            interface,
+            port,
+            "enabled" if http2 else "disabled",
+        )
+        self.sydent.reactor.listenSSL(
+            port,
+            self.httpsFactory,
+            ClientApiContextFactory(self),
+            backlog=50,  # taken from PosixReactorBase.listenTCP
+            interface=interface,
+        )
+
+    def setup_for_workers(self) -> None:
+        """Listen for the requests forwarded by client API workers, rather than for
+        requests from clients.
+        """
+        port = self.sydent.config.http.client_workers_master_port
+        interface = self.sydent.config.http.client_workers_master_bind_address
+
+        logger.info(
+            "Starting Client API HTTP server for workers on %s:%d", interface, port
+        )
         self.sydent.reactor.listenTCP(
-            httpPort,
-            self.factory,
+            port,
+            self.forwardedFactory,
             backlog=50,  # taken from PosixReactorBase.listenTCP
             interface=interface,
         )
+        # Workers only share the plain HTTP listener.
+        self.setup_https()
+
+
+class ClientApiWorkerHttpServer:
+    """Serves the client API in a worker process, on a listening socket inherited
+    from the master.
+    """
+
+    def __init__(self, sydent: "Sydent") -> None:
+        self.sydent = sydent
+
+        root = build_worker_resource(
+            sydent,
+            sydent.clientApiHttpServer.root,
+            sydent.config.http.client_workers_master_bind_address,
+            sydent.config.http.client_workers_master_port,
+        )
+        self.factory = Site(root, SizeLimitingRequest)
+        self.factory.displayTracebacks = False
+
+    def setup(self, fd: int) -> None:
+        """Start accepting connections on the given listening socket.
+
+        :param fd: The file descriptor of the socket.
+        """
+        sock = socket.socket(fileno=fd)
+        family = sock.family
+        # Twisted duplicates the file descriptor.
+        sock.detach()
+
+        logger.info("Starting Client API HTTP worker")
+        self.sydent.reactor.adoptStreamPort(fd, family, self.factory)
 
 
 class InternalApiHttpServer:
     def __init__(self, sydent: "Sydent") -> None:
         self.sydent = sydent
 
-    def setup(self, interface: str, port: int) -> None:
-        logger.info("Starting Internal API HTTP server on %s:%d", interface, port)
+    def setup(self) -> None:
         root = Resource()
 
         matrix = Resource()
@@ -210,22 +389,92 @@ class InternalApiHttpServer:
         internal = Resource()
         identity.putChild(b"internal", internal)
 
+        admission = self.sydent.admission
+
         authenticated_bind = AuthenticatedBindThreePidServlet(self.sydent)
-        internal.putChild(b"bind", authenticated_bind)
+        internal.putChild(b"bind", admission.wrap("internal", authenticated_bind))
 
         authenticated_unbind = AuthenticatedUnbindThreePidServlet(self.sydent)
-        internal.putChild(b"unbind", authenticated_unbind)
+        internal.putChild(b"unbind", admission.wrap("internal", authenticated_unbind))
 
-        factory = Site(root)
+        internal.putChild(b"reload", ReloadServlet(self.sydent))
+
+        self.factory = Site(root)
+        self.factory.displayTracebacks = False
+
+        port = self.sydent.config.http.internal_port
+        if port is not None:
+            interface = self.sydent.config.http.internal_bind_address
+            logger.info("Starting Internal API HTTP server on %s:%d", interface, port)
+            self.sydent.reactor.listenTCP(
+                port,
+                self.factory,
+                backlog=50,  # taken from PosixReactorBase.listenTCP
+                interface=interface,
+            )
+
+        unix_socket = self.sydent.config.http.internal_unix_socket
+        if unix_socket:
+            logger.info("Starting Internal API HTTP server on %s", unix_socket)
+            listen_unix(
+                self.sydent,
+                unix_socket,
+                self.factory,
+                self.sydent.config.http.internal_unix_socket_mode,
+            )
+
+
+class MetricsResource(Resource):
+    """Serves the Prometheus metrics."""
+
+    isLeaf = True
+
+    def render_GET(self, request: Request) -> bytes:
+        request.setHeader("Content-Type", prometheus_client.CONTENT_TYPE_LATEST)
+        return prometheus_client.generate_latest()
+
+
+class MetricsUnixServer:
+    """Serves the Prometheus metrics on a Unix socket.
+
+    prometheus_client can only serve them over TCP, from a thread of its own.
+    """
+
+    def __init__(self, sydent: "Sydent") -> None:
+        self.sydent = sydent
+
+    def setup(self) -> None:
+        unix_socket = self.sydent.config.general.prometheus_unix_socket
+        logger.info("Starting metrics HTTP server on %s", unix_socket)
+        factory = Site(MetricsResource())
         factory.displayTracebacks = False
-        self.sydent.reactor.listenTCP(
-            port,
+        listen_unix(
+            self.sydent,
+            unix_socket,
             factory,
-            backlog=50,  # taken from PosixReactorBase.listenTCP
-            interface=interface,
+            self.sydent.config.general.prometheus_unix_socket_mode,
         )
 
 
+def listen_unix(sydent: "Sydent", path: str, factory: Site, mode: int) -> None:
+    """Listen for HTTP requests on a Unix socket.
+
+    :param sydent: The Sydent instance.
+    :param path: The path of the socket. A stale socket left behind by a previous
+        run is replaced.
+    :param factory: The site to serve.
+    :param mode: The permissions of the socket.
+    """
+    sydent.reactor.listenUNIX(
+        path,
+        factory,
+        backlog=50,  # taken from PosixReactorBase.listenTCP
+        mode=mode,
+        # Twisted uses a lock file to tell whether the socket is stale.
+        wantPID=True,
+    )
+
+
 class ReplicationHttpsServer:
     def __init__(self, sydent: "Sydent") -> None:
         self.sydent = sydent
@@ -242,7 +491,10 @@ class ReplicationHttpsServer:
 
         identity.putChild(b"replicate", replicate)
         replicate.putChild(b"v1", replV1)
-        replV1.putChild(b"push", ReplicationPushServlet(sydent))
+        replV1.putChild(
+            b"push",
+            sydent.admission.wrap("replication", ReplicationPushServlet(sydent)),
+        )
 
         self.factory = Site(root)
         self.factory.displayTracebacks = False
@@ -253,13 +505,6 @@ class ReplicationHttpsServer:
 
         if self.sydent.sslComponents.myPrivateCertificate:
             # We will already have logged a warn if this is absent, so don't do it again
-            cert = self.sydent.sslComponents.myPrivateCertificate
-            certOptions = twisted.internet.ssl.CertificateOptions(
-                privateKey=cert.privateKey.original,
-                certificate=cert.original,
-                trustRoot=self.sydent.sslComponents.trustRoot,
-            )
-
             logger.info("Loaded server private key and certificate!")
             logger.info(
                 "Starting Replication HTTPS server on %s:%d", interface, httpPort
@@ -268,7 +513,76 @@ class ReplicationHttpsServer:
             self.sydent.reactor.listenSSL(
                 httpPort,
                 self.factory,
-                certOptions,
+                ReplicationContextFactory(self.sydent),
                 backlog=50,  # taken from PosixReactorBase.listenTCP
                 interface=interface,
             )
+
+
+def load_private_certificate(path: str) -> twisted.internet.ssl.PrivateCertificate:
+    """Load a certificate and its private key from a PEM file.
+
+    :param path: The path of the file.
+
+    :return: The certificate.
+    """
+    with open(path) as f:
+        return twisted.internet.ssl.PrivateCertificate.loadPEM(f.read())
+
+
+@implementer(IOpenSSLContextFactory)
+class ClientApiContextFactory:
+    """Builds the TLS context of the client API HTTPS server from its current
+    certificate, so that new connections use the certificate reloaded since.
+
+    :param server: The client API server.
+    """
+
+    def __init__(self, server: ClientApiHttpServer) -> None:
+        self.server = server
+        self._certificate: Optional[twisted.internet.ssl.PrivateCertificate] = None
+        self._options: Optional[twisted.internet.ssl.CertificateOptions] = None
+
+    def getContext(self) -> SSL.Context:
+        """
+        :return: The TLS context for a new connection.
+        """
+        certificate = self.server.httpsCertificate
+        assert certificate is not None
+        if self._options is None or certificate is not self._certificate:
+            self._options = twisted.internet.ssl.CertificateOptions(
+                privateKey=certificate.privateKey.original,
+                certificate=certificate.original,
+            )
+            self._certificate = certificate
+        return self._options.getContext()
+
+
+@implementer(IOpenSSLContextFactory)
+class ReplicationContextFactory:
+    """Builds the TLS context of the replication server from Sydent's current
+    SslComponents, so that new connections use the certificates reloaded since.
+
+    :param sydent: The Sydent instance.
+    """
+
+    def __init__(self, sydent: "Sydent") -> None:
+        self.sydent = sydent
+        self._components: Optional[SslComponents] = None
+        self._options: Optional[twisted.internet.ssl.CertificateOptions] = None
+
+    def getContext(self) -> SSL.Context:
+        """
+        :return: The TLS context for a new connection.
+        """
+        components = self.sydent.sslComponents
+        if self._options is None or components is not self._components:
+            cert = components.myPrivateCertificate
+            assert cert is not None
+            self._options = twisted.internet.ssl.CertificateOptions(
+                privateKey=cert.privateKey.original,
+                certificate=cert.original,
+                trustRoot=components.trustRoot,
+            )
+            self._components = components
+        return self._options.getContext()
@@ -42,7 +42,9 @@ from zope.interface import implementer
 from sydent.http.federation_tls_options import ClientTLSOptionsFactory
 from sydent.http.httpcommon import read_body_with_max_size
 from sydent.http.srvresolver import SrvResolver, pick_server_from_list
-from sydent.util import json_decoder
+from sydent.util import tracing
+from sydent.util.json_codec import decode_json
+from sydent.util.singleflight import SingleFlight
 from sydent.util.ttlcache import TTLCache
 
 # period to cache .well-known results for by default
@@ -62,6 +64,7 @@ WELL_KNOWN_MAX_SIZE = 50 * 1024  # 50 KiB
 
 logger = logging.getLogger(__name__)
 well_known_cache: TTLCache[bytes, Optional[bytes]] = TTLCache("well-known")
+well_known_requests: SingleFlight[bytes, Optional[bytes]] = SingleFlight("well_known")
 
 
 @implementer(IAgent)
@@ -80,6 +83,9 @@ class MatrixFederationAgent:
 
     :param _well_known_cache: TTLCache impl for storing cached well-known
         lookups. Omit to use a default implementation.
+
+    :param _well_known_requests: SingleFlight impl for sharing concurrent
+        well-known lookups. Omit to use a default implementation.
     """
 
     def __init__(
@@ -93,6 +99,9 @@ class MatrixFederationAgent:
         _well_known_tls_policy: Optional[IPolicyForHTTPS] = None,
         _srv_resolver: Optional[SrvResolver] = None,
         _well_known_cache: TTLCache[bytes, Optional[bytes]] = well_known_cache,
+        _well_known_requests: SingleFlight[
+            bytes, Optional[bytes]
+        ] = well_known_requests,
     ) -> None:
         self._reactor = reactor
 
@@ -121,6 +130,7 @@ class MatrixFederationAgent:
         #   `bytes`:     a valid server-name
         #   `None`:      there is no (valid) .well-known here
         self._well_known_cache = _well_known_cache
+        self._well_known_requests = _well_known_requests
 
     @defer.inlineCallbacks
     def request(
@@ -195,6 +205,7 @@ class MatrixFederationAgent:
         res = yield agent.request(method, uri, headers, bodyProducer)
         return res
 
+    @tracing.traced("federation.route")
     async def _route_matrix_uri(
         self, parsed_uri: "URI", lookup_well_known: bool = True
     ) -> "_RoutingResult":
@@ -327,15 +338,29 @@ class MatrixFederationAgent:
         try:
             result = self._well_known_cache[server_name]
         except KeyError:
-            # TODO: should we linearise so that we don't end up doing two .well-known
-            # requests for the same server in parallel?
-            result, cache_period = await self._do_get_well_known(server_name)
+            result = await self._well_known_requests.do(
+                server_name, lambda: self._fetch_and_cache_well_known(server_name)
+            )
+
+        return result
+
+    async def _fetch_and_cache_well_known(self, server_name: bytes) -> Optional[bytes]:
+        """Fetch and parse a .well-known file for the given server, and cache the
+        result.
+
+        :param server_name: Name of the server, from the requested url.
+
+        :returns either the new server name, from the .well-known, or None if
+            there was no .well-known file.
+        """
+        result, cache_period = await self._do_get_well_known(server_name)
 
-            if cache_period > 0:
-                self._well_known_cache.set(server_name, result, cache_period)
+        if cache_period > 0:
+            self._well_known_cache.set(server_name, result, cache_period)
 
         return result
 
+    @tracing.traced("federation.well_known")
     async def _do_get_well_known(
         self, server_name: bytes
     ) -> Tuple[Optional[bytes], float]:
@@ -358,7 +383,7 @@ class MatrixFederationAgent:
             if response.code != 200:
                 raise Exception("Non-200 response %s" % (response.code,))
 
-            parsed_body = json_decoder.decode(body.decode("utf-8"))
+            parsed_body = decode_json(body)
             logger.info("Response from .well-known: %s", parsed_body)
             if not isinstance(parsed_body, dict):
                 raise Exception("not a dict")
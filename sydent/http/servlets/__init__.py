@@ -14,21 +14,64 @@
 
 import copy
 import functools
-import json
+import hashlib
 import logging
-from typing import Any, Awaitable, Callable, Dict, Iterable, TypeVar
+import os
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from weakref import WeakKeyDictionary
 
-from prometheus_client import Counter
+import attr
+from prometheus_client import Counter, Gauge, Histogram
 from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.task import CooperativeTask, Cooperator, TaskFinished
+from twisted.python.failure import Failure
 from twisted.web import server
 from twisted.web.resource import Resource
 from twisted.web.server import Request
+from unpaddedbase64 import encode_base64
+from zope.interface import implementer
 
 from sydent.types import JsonDict
-from sydent.util import json_decoder
+from sydent.util import cbor, tracing
+from sydent.util.json_codec import decode_json, encode_json
+from sydent.util.jsonstream import parse_json_object
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+
+CBOR_CONTENT_TYPE = "application/cbor"
+
+# Streamed responses are only sent in parts once they're at least this long, in
+# bytes. Shorter ones are sent at once with a Content-Length, like any other
+# response, which lets compression skip the ones which aren't worth it.
+STREAMED_RESPONSE_MIN_SIZE = 64 * 1024
+
+# JSON bodies with an array argument (see get_array_args) are only parsed
+# incrementally once they're at least this long, in bytes. Decoding a body at once
+# with decode_json is about ten times quicker, and the body has already been read
+# into memory.
+INCREMENTAL_JSON_MIN_SIZE = 256 * 1024
+
 
 request_counter = Counter(
     "sydent_http_received_requests",
@@ -36,6 +79,58 @@ request_counter = Counter(
     labelnames=("servlet", "method"),
 )
 
+requests_in_flight = Gauge(
+    "sydent_http_requests_in_flight",
+    "Requests being processed",
+    labelnames=("servlet",),
+)
+
+request_duration = Histogram(
+    "sydent_http_request_duration_seconds",
+    "Time from receiving requests to finishing their responses",
+    labelnames=("servlet", "method", "code"),
+)
+
+response_size = Histogram(
+    "sydent_http_response_size_bytes",
+    "Size of the response bodies sent, after any compression",
+    labelnames=("servlet", "method", "code"),
+    buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+
+request_batch_size = Histogram(
+    "sydent_http_request_batch_size",
+    "Number of addresses or 3PIDs in lookup requests",
+    labelnames=("servlet", "method", "code"),
+    buckets=(1, 10, 100, 1000, 10000, 100000),
+)
+
+# The HTTP methods which get their own label in the request metrics. Requests with
+# any other method are labelled "other", so that clients can't create any number
+# of time series.
+_METRIC_METHODS = frozenset(
+    (b"GET", b"HEAD", b"POST", b"PUT", b"DELETE", b"OPTIONS", b"PATCH")
+)
+
+
+def _metric_method(request: Request) -> bytes:
+    """The method of a request, as labelled in the request metrics."""
+    return request.method if request.method in _METRIC_METHODS else b"other"
+
+
+# The batch sizes recorded for requests being processed, which are observed once
+# the requests' status codes are known.
+_batch_sizes: "WeakKeyDictionary[Request, int]" = WeakKeyDictionary()
+
+
+def record_batch_size(request: Request, size: int) -> None:
+    """Record the number of addresses or 3PIDs in a lookup request.
+
+    :param request: The request.
+    :param size: The number of addresses or 3PIDs it looks up.
+    """
+    _batch_sizes[request] = size
+
 
 class SydentResource(Resource):
     """A subclass of resource that tracks request metrics"""
@@ -45,8 +140,44 @@ class SydentResource(Resource):
         super().__init__()
 
     def render(self, request: Request) -> Any:
-        request_counter.labels(self._name, request.method).inc()
-        return super().render(request)
+        request_counter.labels(self._name, _metric_method(request)).inc()
+
+        in_flight = requests_in_flight.labels(self._name)
+        in_flight.inc()
+        start = time.perf_counter()
+        span = tracing.start_span(
+            "http.request",
+            {
+                "servlet": self._name,
+                "http.method": request.method.decode("ascii", "replace"),
+                "http.path": request.path.decode("UTF-8", "replace"),
+            },
+            start_trace=True,
+        )
+
+        # Servlets can finish their responses after render returns (with
+        # NOT_DONE_YET), so the request is measured once it's finished.
+        def finished(result: Union[None, Failure]) -> None:
+            in_flight.dec()
+
+            method = _metric_method(request).decode("ascii")
+            # Requests whose connection was lost never get a full response.
+            code = "disconnected" if isinstance(result, Failure) else str(request.code)
+
+            request_duration.labels(self._name, method, code).observe(
+                time.perf_counter() - start
+            )
+            response_size.labels(self._name, method, code).observe(request.sentLength)
+            batch_size = _batch_sizes.pop(request, None)
+            if batch_size is not None:
+                request_batch_size.labels(self._name, method, code).observe(batch_size)
+
+            span.set_attribute("http.status_code", code)
+            span.finish(result)
+
+        request.notifyFinish().addBoth(finished)
+        with tracing.activate(span):
+            return super().render(request)
 
 
 class MatrixRestError(Exception):
@@ -61,6 +192,12 @@ class MatrixRestError(Exception):
         self.errcode = errcode
         self.error = error
 
+    def error_dict(self) -> JsonDict:
+        """
+        :return: The body of the error response to send.
+        """
+        return {"errcode": self.errcode, "error": self.error}
+
 
 def get_args(
     request: Request, args: Iterable[str], required: bool = True
@@ -73,7 +210,7 @@ def get_args(
     ⚠️ BEWARE ⚠. If a v1 request provides its args in urlencoded form (either in
     a POST body or as URL query parameters), then we'll return `Dict[str, str]`.
     The caller may need to interpret these strings as e.g. an `int`, `bool`, etc.
-    Arguments given as a json body are processed with `json.JSONDecoder.decode`,
+    Arguments given as a json body are processed with `decode_json`,
     and so are automatically deserialised to a Python type. The caller should
     still validate that these have the correct type!
 
@@ -84,7 +221,8 @@ def get_args(
 
     :raises: MatrixRestError if required is True and a given parameter
         was not found in the request's query parameters.
-    :raises: MatrixRestError if we the request body contains bad JSON.
+    :raises: MatrixRestError if we the request body contains bad JSON, or is
+        CBOR (which only lookups accept, see get_lookup_args).
     :raises: MatrixRestError if arguments are given in www-form-urlencodedquery
         form, and some argument name or value is not a valid UTF-8-encoded
         string.
@@ -95,22 +233,12 @@ def get_args(
     assert request.path is not None
     v1_path = request.path.startswith(b"/_matrix/identity/api/v1")
 
+    _reject_cbor_body(request)
+
     request_args = None
-    # for v1 paths, only look for json args if content type is json
-    if request.method in (b"POST", b"PUT") and (
-        not v1_path
-        or (
-            request.requestHeaders.hasHeader("Content-Type")
-            # type safety: getRawHeaders() will return a nonempty list because
-            # the hasHeader call has returned True.
-            and request.requestHeaders.getRawHeaders("Content-Type")[0].startswith(  # type: ignore[index]
-                "application/json"
-            )
-        )
-    ):
+    if _has_json_args(request):
         try:
-            # json.loads doesn't allow bytes in Python 3.5
-            request_args = json_decoder.decode(request.content.read().decode("UTF-8"))
+            request_args = decode_json(request.content.read())
         except ValueError:
             raise MatrixRestError(400, "M_BAD_JSON", "Malformed JSON")
 
@@ -143,31 +271,298 @@ def get_args(
         request_args = {}
 
     if required:
-        # Check for any missing arguments
-        missing = []
-        for a in args:
-            if a not in request_args:
-                missing.append(a)
-
-        if len(missing) > 0:
-            request.setResponseCode(400)
-            msg = "Missing parameters: " + (",".join(missing))
-            raise MatrixRestError(400, "M_MISSING_PARAMS", msg)
+        _check_missing_args(request, request_args, args)
 
     return request_args
 
 
+def get_array_args(
+    request: Request,
+    args: Iterable[str],
+    array_key: str,
+    parse_item: Callable[[Any], T],
+    max_items: int,
+) -> Tuple[Dict[str, Any], List[T]]:
+    """
+    Helper function to get the arguments for an HTTP request which contain a
+    potentially large array, such as the 3PIDs of a lookup.
+
+    Works like get_args, except that the items of the array of large JSON bodies
+    (see INCREMENTAL_JSON_MIN_SIZE) are parsed one at a time as the body is read,
+    rather than decoding the whole body at once, so that invalid items or too many
+    of them are rejected before the rest of the body is parsed.
+
+    :param request: The request received by the servlet.
+    :param args: The args to look for in the request's parameters. If array_key
+        isn't one of them, the array is optional, and treated as empty if missing.
+    :param array_key: The arg whose value must be an array.
+    :param parse_item: Called with each item of the array to validate it and
+        convert it into the form the servlet works with. Should raise a
+        MatrixRestError if the item is invalid.
+    :param max_items: The maximum number of items allowed in the array.
+
+    :raises: MatrixRestError if a given parameter was not found in the request's
+        parameters, the array isn't an array, has too many items or any of its
+        items is invalid, or the request body contains bad JSON or is CBOR.
+
+    :return: A dict containing the requested args and their values, and a list of
+        the values returned by parse_item for each item of the array.
+    """
+    _reject_cbor_body(request)
+
+    parse = _limit_items(array_key, parse_item, max_items)
+
+    if not _has_json_args(request):
+        request_args = get_args(request, args)
+        return request_args, _parse_items(request_args, array_key, parse)
+
+    incremental = _body_size(request) >= INCREMENTAL_JSON_MIN_SIZE
+    try:
+        if incremental:
+            request_args = parse_json_object(request.content, array_key, parse)
+        else:
+            request_args = decode_json(request.content.read())
+    except ValueError:
+        raise MatrixRestError(400, "M_BAD_JSON", "Malformed JSON")
+    if not isinstance(request_args, dict):
+        raise MatrixRestError(400, "M_BAD_JSON", "Malformed JSON")
+    _check_missing_args(request, request_args, args)
+
+    if not incremental:
+        return request_args, _parse_items(request_args, array_key, parse)
+
+    items = request_args.get(array_key, [])
+    if not isinstance(items, list):
+        raise MatrixRestError(
+            400, "M_INVALID_PARAM", "%s must be a list" % (array_key,)
+        )
+    return request_args, items
+
+
+def _body_size(request: Request) -> int:
+    """Get the size of the part of the request's body which hasn't been read yet.
+
+    :param request: The request received by the servlet.
+
+    :return: The size, in bytes.
+    """
+    pos = request.content.tell()
+    size = request.content.seek(0, os.SEEK_END) - pos
+    request.content.seek(pos)
+    return size
+
+
+def get_lookup_args(
+    request: Request,
+    args: Iterable[str],
+    array_key: str,
+    parse_item: Callable[[Any], T],
+    max_items: int,
+) -> Tuple[Dict[str, Any], List[T]]:
+    """
+    Like get_array_args, but also accepts request bodies in CBOR, which only
+    lookups support. Their arrays can contain byte strings (e.g. raw hashes), so
+    parse_item must handle these.
+
+    :param request: The request received by the servlet.
+    :param args: The args to look for in the request's parameters.
+    :param array_key: The arg whose value must be an array.
+    :param parse_item: Called with each item of the array to validate it.
+    :param max_items: The maximum number of items allowed in the array.
+
+    :raises: MatrixRestError if the request is invalid, see get_array_args. The
+        names of the args in a CBOR body must be strings, and their values (other
+        than the items of the array) mustn't be byte strings.
+
+    :return: A dict containing the requested args and their values, and a list of
+        the values returned by parse_item for each item of the array.
+    """
+    if not has_cbor_body(request):
+        return get_array_args(request, args, array_key, parse_item, max_items)
+
+    try:
+        request_args = cbor.decode(request.content.read())
+    except ValueError:
+        raise MatrixRestError(400, "M_NOT_JSON", "Malformed CBOR")
+    if not isinstance(request_args, dict):
+        raise MatrixRestError(400, "M_NOT_JSON", "CBOR body must be a map")
+    for key, value in request_args.items():
+        if not isinstance(key, str):
+            raise MatrixRestError(400, "M_INVALID_PARAM", "Keys must be strings")
+        if isinstance(value, bytes):
+            raise MatrixRestError(
+                400, "M_INVALID_PARAM", "%s must not be a byte string" % (key,)
+            )
+    _check_missing_args(request, request_args, args)
+
+    parse = _limit_items(array_key, parse_item, max_items)
+    return request_args, _parse_items(request_args, array_key, parse)
+
+
+def _limit_items(
+    array_key: str, parse_item: Callable[[Any], T], max_items: int
+) -> Callable[[Any], T]:
+    """Wrap the parse_item function of get_array_args, to reject arrays with too
+    many items.
+    """
+    num_items = 0
+
+    def parse(item: Any) -> T:
+        nonlocal num_items
+        num_items += 1
+        if num_items > max_items:
+            raise MatrixRestError(
+                400,
+                "M_TOO_LARGE",
+                "More than the maximum amount of %s provided" % (array_key,),
+            )
+        return parse_item(item)
+
+    return parse
+
+
+def _parse_items(
+    request_args: Dict[str, Any], array_key: str, parse: Callable[[Any], T]
+) -> List[T]:
+    """Parse the items of the array of already decoded args, see get_array_args."""
+    items = request_args.get(array_key, [])
+    if not isinstance(items, list):
+        raise MatrixRestError(
+            400, "M_INVALID_PARAM", "%s must be a list" % (array_key,)
+        )
+    return [parse(item) for item in items]
+
+
+def _has_json_args(request: Request) -> bool:
+    """Whether the args of the given request should be read from a JSON body.
+
+    :param request: The request received by the servlet.
+
+    :return: True if the args should be read from the request's body.
+    """
+    assert request.path is not None
+    v1_path = request.path.startswith(b"/_matrix/identity/api/v1")
+
+    # for v1 paths, only look for json args if content type is json
+    return request.method in (b"POST", b"PUT") and (
+        not v1_path
+        or (
+            request.requestHeaders.hasHeader("Content-Type")
+            # type safety: getRawHeaders() will return a nonempty list because
+            # the hasHeader call has returned True.
+            and request.requestHeaders.getRawHeaders("Content-Type")[0].startswith(  # type: ignore[index]
+                "application/json"
+            )
+        )
+    )
+
+
+def has_cbor_body(request: Request) -> bool:
+    """Whether the given request has a CBOR body.
+
+    :param request: The request received by the servlet.
+
+    :return: True if the request's body is CBOR.
+    """
+    content_type = request.getHeader("Content-Type")
+    return (
+        request.method in (b"POST", b"PUT")
+        and content_type is not None
+        and content_type.startswith(CBOR_CONTENT_TYPE)
+    )
+
+
+def _reject_cbor_body(request: Request) -> None:
+    """Raise an error if the given request has a CBOR body, for servlets which
+    don't accept them.
+
+    :param request: The request received by the servlet.
+
+    :raises: MatrixRestError if the request's body is CBOR.
+    """
+    if has_cbor_body(request):
+        raise MatrixRestError(
+            400, "M_NOT_JSON", "Only lookups accept request bodies in CBOR"
+        )
+
+
+def _accept_quality(accept: str, media_type: str) -> float:
+    """Get the quality the given Accept header gives to a media type, ignoring
+    wildcards.
+
+    :param accept: The value of the Accept header.
+    :param media_type: The media type to look for.
+
+    :return: The quality of the media type, or 0 if it isn't listed.
+    """
+    for accepted in accept.split(","):
+        name, *params = accepted.split(";")
+        if name.strip().lower() != media_type:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value)
+                except ValueError:
+                    return 0.0
+        return 1.0
+    return 0.0
+
+
+def response_is_cbor(request: Request) -> bool:
+    """Whether to encode the response to the given request as CBOR rather than
+    JSON. This is the case if the client prefers CBOR to JSON according to its
+    Accept header or, if it didn't send one, if it sent its request as CBOR.
+
+    :param request: The request received by the servlet.
+
+    :return: True if the response should be CBOR.
+    """
+    accept = request.getHeader("Accept")
+    if accept is None:
+        return has_cbor_body(request)
+    cbor_quality = _accept_quality(accept, CBOR_CONTENT_TYPE)
+    return cbor_quality > 0 and cbor_quality >= _accept_quality(
+        accept, "application/json"
+    )
+
+
+def _check_missing_args(
+    request: Request, request_args: Dict[str, Any], args: Iterable[str]
+) -> None:
+    """Raise an error if any of the given args is missing from the request.
+
+    :param request: The request received by the servlet.
+    :param request_args: The args found in the request.
+    :param args: The args which are required.
+
+    :raises: MatrixRestError if a given arg is missing.
+    """
+    missing = []
+    for a in args:
+        if a not in request_args:
+            missing.append(a)
+
+    if len(missing) > 0:
+        request.setResponseCode(400)
+        msg = "Missing parameters: " + (",".join(missing))
+        raise MatrixRestError(400, "M_MISSING_PARAMS", msg)
+
+
 Res = TypeVar("Res", bound=Resource)
 
 
-def jsonwrap(f: Callable[[Res, Request], JsonDict]) -> Callable[[Res, Request], bytes]:
+def jsonwrap(
+    f: Callable[[Res, Request], Union[JsonDict, bytes]]
+) -> Callable[[Res, Request], bytes]:
     @functools.wraps(f)
     def inner(self: Res, request: Request) -> bytes:
 
         """
         Runs a web handler function with the given request and parameters, then
-        converts its result into JSON and returns it. If an error happens, also sets
-        the HTTP response code.
+        converts its result into JSON (unless it's already encoded) and returns it.
+        If an error happens, also sets the HTTP response code.
 
         :param self: The current object.
         :param request: The request to process.
@@ -176,10 +571,13 @@ def jsonwrap(f: Callable[[Res, Request], JsonDict]) -> Callable[[Res, Request],
         """
         try:
             request.setHeader("Content-Type", "application/json")
-            return dict_to_json_bytes(f(self, request))
+            result = f(self, request)
+            if isinstance(result, bytes):
+                return result
+            return dict_to_json_bytes(result)
         except MatrixRestError as e:
             request.setResponseCode(e.httpStatus)
-            return dict_to_json_bytes({"errcode": e.errcode, "error": e.error})
+            return dict_to_json_bytes(e.error_dict())
         except Exception:
             logger.exception("Exception processing request")
             request.setHeader("Content-Type", "application/json")
@@ -202,18 +600,19 @@ def asyncjsonwrap(f: AsyncRenderer[Res]) -> Callable[[Res, Request], object]:
         request.setHeader("Content-Type", "application/json")
         try:
             result = await f(self, request)
-            request.write(dict_to_json_bytes(result))
+            body = dict_to_json_bytes(result)
         except MatrixRestError as e:
             request.setResponseCode(e.httpStatus)
-            request.write(dict_to_json_bytes({"errcode": e.errcode, "error": e.error}))
+            body = dict_to_json_bytes(e.error_dict())
         except Exception:
             logger.exception("Request processing failed")
             request.setResponseCode(500)
-            request.write(
-                dict_to_json_bytes(
-                    {"errcode": "M_UNKNOWN", "error": "Internal Server Error"}
-                )
+            body = dict_to_json_bytes(
+                {"errcode": "M_UNKNOWN", "error": "Internal Server Error"}
             )
+        # As Twisted does for the responses of synchronous handlers.
+        request.setHeader("Content-Length", str(len(body)))
+        request.write(body)
         request.finish()
 
     @functools.wraps(f)
@@ -233,6 +632,206 @@ def asyncjsonwrap(f: AsyncRenderer[Res]) -> Callable[[Res, Request], object]:
     return inner
 
 
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class StreamedResponse:
+    """A response body which is written in parts, as they're produced.
+
+    Producing each part can take a while (e.g. if it needs a database query), so
+    the parts are produced through the cooperator, letting other requests be
+    processed in between. Producing stops whenever the client isn't reading the
+    response fast enough.
+    """
+
+    cooperator: Cooperator
+    parts: Iterator[bytes]
+
+
+def json_array_parts(key: str, batches: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """Encode a JSON object with a single key, whose value is the concatenation of
+    the given batches, one batch at a time.
+
+    :param key: The key of the object.
+    :param batches: The batches of items of the array.
+
+    :return: The parts of the encoded object.
+    """
+    yield b"{%s:[" % (encode_json(key),)
+    separator = b""
+    for batch in batches:
+        if batch:
+            yield separator + encode_json(list(batch))[1:-1]
+            separator = b","
+    yield b"]}"
+
+
+def json_object_parts(
+    key: str, batches: Iterable[Mapping[str, Any]]
+) -> Iterator[bytes]:
+    """Encode a JSON object with a single key, whose value is an object with the
+    entries from all the given batches, one batch at a time. The batches must not
+    have keys in common.
+
+    :param key: The key of the object.
+    :param batches: The batches of entries of the inner object.
+
+    :return: The parts of the encoded object.
+    """
+    yield b"{%s:{" % (encode_json(key),)
+    separator = b""
+    for batch in batches:
+        if batch:
+            yield separator + encode_json(dict(batch))[1:-1]
+            separator = b","
+    yield b"}}"
+
+
+def cbor_array_parts(key: str, batches: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """Like json_array_parts, but encodes the object in CBOR, using
+    indefinite-length items.
+
+    :param key: The key of the map.
+    :param batches: The batches of items of the array.
+
+    :return: The parts of the encoded map.
+    """
+    yield b"\xbf" + cbor.encode(key) + b"\x9f"
+    for batch in batches:
+        yield cbor.encode_items(batch)
+    yield cbor.BREAK + cbor.BREAK
+
+
+def cbor_object_parts(
+    key: str, batches: Iterable[Mapping[Any, Any]]
+) -> Iterator[bytes]:
+    """Like json_object_parts, but encodes the object in CBOR, using
+    indefinite-length items.
+
+    :param key: The key of the map.
+    :param batches: The batches of entries of the inner map.
+
+    :return: The parts of the encoded map.
+    """
+    yield b"\xbf" + cbor.encode(key) + b"\xbf"
+    for batch in batches:
+        yield cbor.encode_entries(dict(batch))
+    yield cbor.BREAK + cbor.BREAK
+
+
+@implementer(IPushProducer)
+class _CooperativeTaskProducer:
+    """Pauses a cooperative task whenever the transport's buffers are full."""
+
+    def __init__(self, task: CooperativeTask) -> None:
+        self._task = task
+
+    def pauseProducing(self) -> None:
+        self._task.pause()
+
+    def resumeProducing(self) -> None:
+        self._task.resume()
+
+    def stopProducing(self) -> None:
+        try:
+            self._task.stop()
+        except TaskFinished:
+            pass
+
+
+def _write_streamed_response(request: Request, response: StreamedResponse) -> None:
+    """Write a streamed response to the request, then finish it.
+
+    :param request: The request to respond to.
+    :param response: The response body.
+    """
+
+    def write_parts() -> Iterator[None]:
+        parts = iter(response.parts)
+
+        # Hold the first parts back until they're long enough, and send the whole
+        # response at once if it ends before then.
+        first_parts = []
+        first_parts_size = 0
+        for part in parts:
+            first_parts.append(part)
+            first_parts_size += len(part)
+            if first_parts_size >= STREAMED_RESPONSE_MIN_SIZE:
+                break
+            yield None
+        else:
+            request.setHeader("Content-Length", str(first_parts_size))
+            request.write(b"".join(first_parts))
+            return
+
+        request.write(b"".join(first_parts))
+        yield None
+        for part in parts:
+            request.write(part)
+            yield None
+
+    task = response.cooperator.cooperate(write_parts())
+    producer = _CooperativeTaskProducer(task)
+    request.registerProducer(producer, True)
+
+    def done(_: object) -> None:
+        request.unregisterProducer()
+        request.finish()
+
+    def failed(failure: Failure) -> None:
+        if request._disconnected:
+            # The client went away, and the task was stopped.
+            return
+        request.unregisterProducer()
+        logger.error("Failed to produce response: %s", failure.getTraceback())
+        # Part of the response has probably been sent already, so we can't send
+        # an error instead.
+        request.loseConnection()
+
+    task.whenDone().addCallbacks(done, failed)
+    request.notifyFinish().addErrback(lambda _: producer.stopProducing())
+
+
+def streamingjsonwrap(
+    f: Callable[[Res, Request], Union[JsonDict, StreamedResponse]]
+) -> Callable[[Res, Request], object]:
+    """Like jsonwrap, but also allows the wrapped function to return a
+    StreamedResponse, which is then written to the request as it's produced.
+
+    Responses are encoded as CBOR rather than JSON if the client asks for it (see
+    response_is_cbor).
+    """
+
+    @functools.wraps(f)
+    def inner(self: Res, request: Request) -> object:
+        if response_is_cbor(request):
+            request.setHeader("Content-Type", CBOR_CONTENT_TYPE)
+            encode: Callable[[JsonDict], bytes] = cbor.encode
+        else:
+            request.setHeader("Content-Type", "application/json")
+            encode = dict_to_json_bytes
+
+        try:
+            result = f(self, request)
+        except MatrixRestError as e:
+            request.setResponseCode(e.httpStatus)
+            return encode(e.error_dict())
+        except Exception:
+            logger.exception("Exception processing request")
+            request.setResponseCode(500)
+            return encode(
+                {
+                    "errcode": "M_UNKNOWN",
+                    "error": "Internal Server Error",
+                }
+            )
+
+        if isinstance(result, StreamedResponse):
+            _write_streamed_response(request, result)
+            return server.NOT_DONE_YET
+        return encode(result)
+
+    return inner
+
+
 def send_cors(request: Request) -> None:
     request.setHeader("Access-Control-Allow-Origin", "*")
     request.setHeader("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
@@ -245,4 +844,80 @@ def dict_to_json_bytes(content: JsonDict) -> bytes:
 
     :return: The JSON bytes.
     """
-    return json.dumps(content).encode("UTF-8")
+    return encode_json(content)
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class PrecomputedResponse:
+    """A JSON response encoded in advance, for endpoints whose responses rarely
+    change, along with a strong ETag for it.
+    """
+
+    body: bytes
+    etag: bytes
+
+    @classmethod
+    def from_json(cls, content: JsonDict) -> "PrecomputedResponse":
+        body = dict_to_json_bytes(content)
+        digest = encode_base64(hashlib.sha256(body).digest(), urlsafe=True)
+        return cls(body, b'"%s"' % (digest.encode("ascii"),))
+
+
+class PrecomputedResponseCache(Generic[K]):
+    """Holds the precomputed response for an endpoint, recomputing it only when
+    the data it's built from changes.
+
+    :param build: A function building the response from that data.
+    """
+
+    def __init__(self, build: Callable[[K], JsonDict]) -> None:
+        self._build = build
+        self._cached: Optional[Tuple[K, PrecomputedResponse]] = None
+
+    def get(self, key: K) -> PrecomputedResponse:
+        """
+        :param key: The data to build the response from, which must be hashable
+            and comparable.
+
+        :return: The response.
+        """
+        cached = self._cached
+        if cached is None or cached[0] != key:
+            cached = (key, PrecomputedResponse.from_json(self._build(key)))
+            self._cached = cached
+        return cached[1]
+
+
+def _etag_matches(request: Request, etag: bytes) -> bool:
+    """Check whether the If-None-Match header of a request matches an ETag."""
+    if_none_match = request.getHeader(b"If-None-Match")
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(b","):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison.
+        if tag.startswith(b"W/"):
+            tag = tag[2:]
+        if tag == etag or tag == b"*":
+            return True
+    return False
+
+
+def send_precomputed(
+    request: Request, response: PrecomputedResponse, cache_control: str
+) -> bytes:
+    """Prepare sending a precomputed response, answering conditional requests for
+    a response the client already has with a 304.
+
+    :param request: The request to respond to.
+    :param response: The response.
+    :param cache_control: The value of the Cache-Control header of the response.
+
+    :return: The body to send.
+    """
+    request.setHeader(b"ETag", response.etag)
+    request.setHeader(b"Cache-Control", cache_control.encode("ascii"))
+    if request.method in (b"GET", b"HEAD") and _etag_matches(request, response.etag):
+        request.setResponseCode(304)
+        return b""
+    return response.body
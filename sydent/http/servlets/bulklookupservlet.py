@@ -13,19 +13,25 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Tuple, Union
 
 from twisted.web.server import Request
 
-from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.db.threepid_associations import GlobalAssociationStore, unique_threepids
 from sydent.http.servlets import (
     MatrixRestError,
+    StreamedResponse,
     SydentResource,
-    get_args,
-    jsonwrap,
+    cbor_array_parts,
+    get_lookup_args,
+    json_array_parts,
+    record_batch_size,
+    response_is_cbor,
     send_cors,
+    streamingjsonwrap,
 )
 from sydent.types import JsonDict
+from sydent.util.chunked import chunks
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -33,6 +39,26 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+def parse_threepid(threepid: Any) -> Tuple[str, str]:
+    """Validate a 3PID of a bulk lookup request.
+
+    :param threepid: The 3PID, as given in the request.
+
+    :raises: MatrixRestError if the 3PID isn't a list of a medium and an address.
+
+    :return: The medium and address of the 3PID.
+    """
+    if (
+        not isinstance(threepid, list)
+        or len(threepid) != 2
+        or not all(isinstance(x, str) for x in threepid)
+    ):
+        raise MatrixRestError(
+            400, "M_INVALID_PARAM", "threepids must be [medium, address] pairs"
+        )
+    return threepid[0], threepid[1]
+
+
 class BulkLookupServlet(SydentResource):
     isLeaf = True
 
@@ -40,30 +66,49 @@ class BulkLookupServlet(SydentResource):
         super().__init__()
         self.sydent = syd
 
-    @jsonwrap
-    def render_POST(self, request: Request) -> JsonDict:
+    @streamingjsonwrap
+    def render_POST(self, request: Request) -> Union[JsonDict, StreamedResponse]:
         """
         Bulk-lookup for threepids.
         Params: 'threepids': list of threepids, each of which is a list of medium, address
         Returns: Object with key 'threepids', which is a list of results where each result
                  is a 3 item list of medium, address, mxid
-                 Note that results are not streamed to the client.
+                 Results for large lookups are streamed to the client.
         Threepids for which no mapping is found are omitted.
         """
         send_cors(request)
 
-        args = get_args(request, ("threepids",))
+        _, threepids = get_lookup_args(
+            request,
+            ("threepids",),
+            "threepids",
+            parse_threepid,
+            self.sydent.config.general.bulk_lookup_limit,
+        )
 
-        threepids = args["threepids"]
-        if not isinstance(threepids, list):
-            raise MatrixRestError(400, "M_INVALID_PARAM", "threepids must be a list")
+        record_batch_size(request, len(threepids))
+        self.sydent.ratelimit_lookup(request, None, len(threepids))
 
         logger.info("Bulk lookup of %d threepids", len(threepids))
 
         globalAssocStore = GlobalAssociationStore(self.sydent)
-        results = globalAssocStore.getMxids(threepids)
 
-        return {"threepids": results}
+        chunk_size = self.sydent.config.lookup.chunk_size
+        if len(threepids) <= chunk_size:
+            return {"threepids": globalAssocStore.getMxids(threepids)}
+
+        # Look up the 3PIDs in sorted chunks, so that the results are (mostly)
+        # sorted too, and so that no association is returned in several chunks.
+        results = (
+            globalAssocStore.getMxids(list(chunk))
+            for chunk in chunks(unique_threepids(threepids), chunk_size)
+        )
+        array_parts = (
+            cbor_array_parts if response_is_cbor(request) else json_array_parts
+        )
+        return StreamedResponse(
+            self.sydent.cooperator, array_parts("threepids", results)
+        )
 
     def render_OPTIONS(self, request: Request) -> bytes:
         send_cors(request)
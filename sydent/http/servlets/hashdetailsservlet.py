@@ -18,8 +18,13 @@ from typing import TYPE_CHECKING
 from twisted.web.server import Request
 
 from sydent.http.auth import authV2
-from sydent.http.servlets import SydentResource, jsonwrap, send_cors
-from sydent.types import JsonDict
+from sydent.http.servlets import (
+    PrecomputedResponse,
+    SydentResource,
+    jsonwrap,
+    send_cors,
+    send_precomputed,
+)
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -35,9 +40,15 @@ class HashDetailsServlet(SydentResource):
         super().__init__()
         self.sydent = syd
         self.lookup_pepper = lookup_pepper
+        self._response = PrecomputedResponse.from_json(
+            {
+                "algorithms": self.known_algorithms,
+                "lookup_pepper": self.lookup_pepper,
+            }
+        )
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> bytes:
         """
         Return the hashing algorithms and pepper that this IS supports. The
         pepper included in the response is stored in the database, or
@@ -52,10 +63,10 @@ class HashDetailsServlet(SydentResource):
 
         authV2(self.sydent, request)
 
-        return {
-            "algorithms": self.known_algorithms,
-            "lookup_pepper": self.lookup_pepper,
-        }
+        # The response requires authentication, so mustn't be stored by shared
+        # caches. Clients revalidate it every time, since lookups fail if it's out
+        # of date.
+        return send_precomputed(request, self._response, "private, no-cache")
 
     def render_OPTIONS(self, request: Request) -> bytes:
         send_cors(request)
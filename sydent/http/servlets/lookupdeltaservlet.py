@@ -0,0 +1,239 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Tuple, Union
+
+from twisted.web.server import Request
+
+from sydent.db.lookup_delta import LookupDeltaStore
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.http.auth import authV2
+from sydent.http.servlets import (
+    MatrixRestError,
+    SydentResource,
+    get_lookup_args,
+    record_batch_size,
+    response_is_cbor,
+    send_cors,
+    streamingjsonwrap,
+)
+from sydent.http.servlets.lookupv2servlet import parse_lookup_hash
+from sydent.types import JsonDict
+from sydent.users.accounts import Account
+from sydent.util.hash_index import decode_lookup_hash
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+logger = logging.getLogger(__name__)
+
+
+def parse_sync_token(sync_token: Any) -> Tuple[str, int]:
+    """Parse a sync token returned by a delta lookup.
+
+    :param sync_token: The sync token, as given in the request.
+
+    :raises: MatrixRestError if the sync token is malformed.
+
+    :return: The token of the set of lookup hashes, and the stream position the
+        token was issued at.
+    """
+    if isinstance(sync_token, str):
+        set_token, _, position = sync_token.rpartition("_")
+        if set_token and position.isdigit():
+            return set_token, int(position)
+
+    raise MatrixRestError(400, "M_INVALID_PARAM", "Malformed sync_token")
+
+
+def _raw_digests(lookup_hashes: Iterable[str]) -> List[Union[str, bytes]]:
+    """Turn lookup hashes into the raw digests they encode, for CBOR responses.
+
+    :param lookup_hashes: The lookup hashes.
+
+    :return: The raw digests, or the lookup hashes which don't encode one.
+    """
+    result: List[Union[str, bytes]] = []
+    for lookup_hash in lookup_hashes:
+        digest = decode_lookup_hash(lookup_hash)
+        result.append(digest if digest is not None else lookup_hash)
+    return result
+
+
+def _response_mappings(
+    request: Request, mappings: Dict[str, str]
+) -> Dict[Union[str, bytes], str]:
+    """Use raw digests as the keys of the mappings of CBOR responses.
+
+    :param request: The request.
+    :param mappings: The mappings, keyed by lookup hash.
+
+    :return: The mappings to include in the response.
+    """
+    if not response_is_cbor(request):
+        return dict(mappings.items())
+    return dict(zip(_raw_digests(mappings.keys()), mappings.values()))
+
+
+class LookupDeltaServlet(SydentResource):
+    isLeaf = True
+
+    def __init__(self, syd: "Sydent", lookup_pepper: str) -> None:
+        super().__init__()
+        self.sydent = syd
+        self.globalAssociationStore = GlobalAssociationStore(self.sydent)
+        self.lookupDeltaStore = LookupDeltaStore(self.sydent)
+        self.lookup_pepper = lookup_pepper
+
+    @streamingjsonwrap
+    def render_POST(self, request: Request) -> JsonDict:
+        """
+        Perform lookups of a set of hashed 3PIDs which is looked up repeatedly,
+        only returning what changed since the previous lookup.
+
+        The client first registers the set of hashes it wants to look up, which
+        returns the current mappings for these hashes as well as a sync token. It
+        then sends this sync token to get the mappings which changed since, and a
+        new sync token to use next time.
+
+        Params: A JSON object containing either:
+                * 'addresses': List of 3PID addresses and mediums hashed using
+                               the sha256 algorithm, either encoded as url-safe
+                               base64 or (in CBOR requests) as raw digests.
+                * 'algorithm': The algorithm the client has used to process
+                               the 3PIDs. Must be 'sha256'.
+                * 'pepper': The pepper the client has attached to the 3PIDs.
+                to register a set of hashes, or:
+                * 'sync_token': The sync token returned by the previous lookup.
+
+        Returns: Object with the following keys:
+                 * 'mappings': A dictionary of the hashes which are (now) bound to
+                               a Matrix User ID, and that user ID. When using a sync
+                               token, only the hashes whose mapping may have
+                               changed are included.
+                 * 'removed': When using a sync token, a list of the hashes which
+                              aren't bound to a Matrix User ID anymore.
+                 * 'sync_token': The token to use for the next lookup.
+
+                 If the response is CBOR (see response_is_cbor), the hashes are
+                 raw digests rather than base64.
+        """
+        send_cors(request)
+
+        account = authV2(self.sydent, request)
+
+        args, addresses = get_lookup_args(
+            request,
+            (),
+            "addresses",
+            parse_lookup_hash,
+            self.sydent.config.general.address_lookup_limit,
+        )
+        record_batch_size(request, len(addresses))
+
+        if "sync_token" in args:
+            return self._sync(request, account, args["sync_token"])
+
+        missing = [a for a in ("addresses", "algorithm", "pepper") if a not in args]
+        if missing:
+            raise MatrixRestError(
+                400, "M_MISSING_PARAMS", "Missing parameters: " + ",".join(missing)
+            )
+
+        if args["algorithm"] != "sha256":
+            raise MatrixRestError(400, "M_INVALID_PARAM", "algorithm is not supported")
+
+        if args["pepper"] != self.lookup_pepper:
+            request.setResponseCode(400)
+            return {
+                "errcode": "M_INVALID_PEPPER",
+                "error": "pepper does not match '%s'" % (self.lookup_pepper,),
+                "algorithm": "sha256",
+                "lookup_pepper": self.lookup_pepper,
+            }
+
+        self.sydent.ratelimit_lookup(request, account.userId, len(addresses))
+
+        # Get the position before looking up the mappings, so that any change made
+        # afterwards is returned by the next lookup.
+        position = self.lookupDeltaStore.getStreamPosition()
+        set_token = self.lookupDeltaStore.addSet(
+            account.userId, self.lookup_pepper, addresses
+        )
+
+        logger.info("Registered %d hash(es) for delta lookups", len(addresses))
+
+        mappings = self.globalAssociationStore.retrieveMxidsForHashes(addresses)
+        return {
+            "mappings": _response_mappings(request, mappings),
+            "sync_token": "%s_%d" % (set_token, position),
+        }
+
+    def _sync(self, request: Request, account: Account, sync_token: Any) -> JsonDict:
+        """Return the mappings which changed for the set of hashes identified by the
+        given sync token, since the token was issued.
+
+        :param request: The request.
+        :param account: The account making the request.
+        :param sync_token: The sync token given in the request.
+
+        :return: The response to the request.
+        """
+        set_token, since = parse_sync_token(sync_token)
+
+        delta_set = self.lookupDeltaStore.getSet(set_token)
+        position = self.lookupDeltaStore.getStreamPosition()
+        if (
+            delta_set is None
+            or delta_set.user_id != account.userId
+            or since > position
+            or since < self.lookupDeltaStore.getEarliestStreamPosition()
+        ):
+            raise MatrixRestError(
+                400, "M_INVALID_PARAM", "Unknown or expired sync_token"
+            )
+
+        if delta_set.lookup_pepper != self.lookup_pepper:
+            raise MatrixRestError(
+                400, "M_INVALID_PEPPER", "The set was hashed with an old pepper"
+            )
+
+        changed_hashes = self.lookupDeltaStore.getChangedHashes(
+            delta_set.id, since, position
+        )
+
+        # Only the hashes which changed are looked up again.
+        self.sydent.ratelimit_lookup(request, account.userId, len(changed_hashes))
+
+        mappings = {}
+        if changed_hashes:
+            mappings = self.globalAssociationStore.retrieveMxidsForHashes(
+                changed_hashes
+            )
+        removed: List[str] = [x for x in changed_hashes if x not in mappings]
+
+        logger.info(
+            "Delta lookup returned %d change(s) since %d", len(changed_hashes), since
+        )
+
+        return {
+            "mappings": _response_mappings(request, mappings),
+            "removed": _raw_digests(removed) if response_is_cbor(request) else removed,
+            "sync_token": "%s_%d" % (set_token, position),
+        }
+
+    def render_OPTIONS(self, request: Request) -> bytes:
+        send_cors(request)
+        return b""
@@ -14,15 +14,22 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Union
 
 import signedjson.sign
 from twisted.web.server import Request
 
 from sydent.db.threepid_associations import GlobalAssociationStore
-from sydent.http.servlets import SydentResource, get_args, jsonwrap, send_cors
+from sydent.http.servlets import (
+    SydentResource,
+    dict_to_json_bytes,
+    get_args,
+    jsonwrap,
+    send_cors,
+)
 from sydent.types import JsonDict
-from sydent.util import json_decoder
+from sydent.util import tracing
+from sydent.util.json_codec import decode_json
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -38,7 +45,7 @@ class LookupServlet(SydentResource):
         self.sydent = syd
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> Union[JsonDict, bytes]:
         """
         Look up an individual threepid.
 
@@ -52,20 +59,39 @@ class LookupServlet(SydentResource):
 
         args = get_args(request, ("medium", "address"))
 
+        self.sydent.ratelimit_lookup(request, None, 1)
+
         medium = args["medium"]
         address = args["address"]
 
         globalAssocStore = GlobalAssociationStore(self.sydent)
 
-        sgassoc_raw = globalAssocStore.signedAssociationStringForThreepid(
-            medium, address
-        )
+        result = globalAssocStore.signedAssociationForThreepid(medium, address)
 
-        if not sgassoc_raw:
+        if not result:
             return {}
 
+        # Signing the association is expensive, so cache the final response.
+        association_id, sgassoc_raw = result
+        cache = self.sydent.signed_lookup_cache
+        if cache is not None:
+            response = cache.get(association_id)
+            if response is None:
+                response = dict_to_json_bytes(self._sign(sgassoc_raw))
+                cache.set(association_id, response)
+            return response
+
+        return self._sign(sgassoc_raw)
+
+    def _sign(self, sgassoc_raw: str) -> JsonDict:
+        """Add our signature to a signed association, if it doesn't have it already.
+
+        :param sgassoc_raw: The JSON of the signed association.
+
+        :return: The signed association.
+        """
         # TODO validate this really is a dict
-        sgassoc: JsonDict = json_decoder.decode(sgassoc_raw)
+        sgassoc: JsonDict = decode_json(sgassoc_raw)
         if self.sydent.config.general.server_name not in sgassoc["signatures"]:
             # We have not yet worked out what the proper trust model should be.
             #
@@ -84,11 +110,12 @@ class LookupServlet(SydentResource):
             # We do this when we return assocs, not when we receive them over
             # replication, so that we can undo this decision in the future if
             # we wish, without having destroyed the raw underlying data.
-            sgassoc = signedjson.sign.sign_json(
-                sgassoc,
-                self.sydent.config.general.server_name,
-                self.sydent.keyring.ed25519,
-            )
+            with tracing.trace("crypto.sign"):
+                sgassoc = signedjson.sign.sign_json(
+                    sgassoc,
+                    self.sydent.config.general.server_name,
+                    self.sydent.keyring.ed25519,
+                )
         return sgassoc
 
     def render_OPTIONS(self, request: Request) -> bytes:
@@ -13,21 +13,68 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Dict, List, Union
 
 from twisted.web.server import Request
+from unpaddedbase64 import encode_base64
 
-from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.db.threepid_associations import GlobalAssociationStore, unique_threepids
 from sydent.http.auth import authV2
-from sydent.http.servlets import SydentResource, get_args, jsonwrap, send_cors
+from sydent.http.servlets import (
+    MatrixRestError,
+    StreamedResponse,
+    SydentResource,
+    cbor_object_parts,
+    get_lookup_args,
+    json_object_parts,
+    record_batch_size,
+    response_is_cbor,
+    send_cors,
+    streamingjsonwrap,
+)
 from sydent.http.servlets.hashdetailsservlet import HashDetailsServlet
 from sydent.types import JsonDict
+from sydent.util.chunked import chunks
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
 
 logger = logging.getLogger(__name__)
 
+SHA256_DIGEST_LENGTH = 32
+
+
+def parse_address(address: Any) -> Union[str, bytes]:
+    """Validate an address of a lookup request.
+
+    :param address: The address, as given in the request.
+
+    :raises: MatrixRestError if the address isn't a string, or a raw SHA-256 digest
+        (which can be sent in CBOR requests).
+
+    :return: The address.
+    """
+    if isinstance(address, bytes) and len(address) == SHA256_DIGEST_LENGTH:
+        return address
+    if not isinstance(address, str):
+        raise MatrixRestError(400, "M_INVALID_PARAM", "addresses must be strings")
+    return address
+
+
+def parse_lookup_hash(address: Any) -> str:
+    """Validate a hashed address of a lookup request.
+
+    :param address: The address, as given in the request.
+
+    :raises: MatrixRestError if the address is invalid.
+
+    :return: The lookup hash, i.e. the address as a url-safe base64 string.
+    """
+    parsed = parse_address(address)
+    if isinstance(parsed, bytes):
+        return encode_base64(parsed, urlsafe=True)
+    return parsed
+
 
 class LookupV2Servlet(SydentResource):
     isLeaf = True
@@ -38,8 +85,8 @@ class LookupV2Servlet(SydentResource):
         self.globalAssociationStore = GlobalAssociationStore(self.sydent)
         self.lookup_pepper = lookup_pepper
 
-    @jsonwrap
-    def render_POST(self, request: Request) -> JsonDict:
+    @streamingjsonwrap
+    def render_POST(self, request: Request) -> Union[JsonDict, StreamedResponse]:
         """
         Perform lookups with potentially hashed 3PID details.
 
@@ -62,31 +109,31 @@ class LookupV2Servlet(SydentResource):
                  the matching Matrix User ID that claims to own that 3PID.
 
                  User IDs for which no mapping is found are omitted.
+
+                 Results for large lookups are streamed to the client.
         """
         send_cors(request)
 
-        authV2(self.sydent, request)
+        account = authV2(self.sydent, request)
 
-        args = get_args(request, ("addresses", "algorithm", "pepper"))
-
-        addresses = args["addresses"]
-        if not isinstance(addresses, list):
-            request.setResponseCode(400)
-            return {"errcode": "M_INVALID_PARAM", "error": "addresses must be a list"}
+        args, addresses = get_lookup_args(
+            request,
+            ("addresses", "algorithm", "pepper"),
+            "addresses",
+            parse_address,
+            self.sydent.config.general.address_lookup_limit,
+        )
+        record_batch_size(request, len(addresses))
 
         algorithm = str(args["algorithm"])
         if algorithm not in HashDetailsServlet.known_algorithms:
             request.setResponseCode(400)
             return {"errcode": "M_INVALID_PARAM", "error": "algorithm is not supported"}
 
-        # Ensure address count is under the configured limit
-        limit = self.sydent.config.general.address_lookup_limit
-        if len(addresses) > limit:
-            request.setResponseCode(400)
-            return {
-                "errcode": "M_TOO_LARGE",
-                "error": "More than the maximum amount of " "addresses provided",
-            }
+        # Lookups of more addresses than this are streamed
+        chunk_size = self.sydent.config.lookup.chunk_size
+        cbor_response = response_is_cbor(request)
+        object_parts = cbor_object_parts if cbor_response else json_object_parts
 
         pepper = str(args["pepper"])
         if pepper != self.lookup_pepper:
@@ -98,6 +145,8 @@ class LookupV2Servlet(SydentResource):
                 "lookup_pepper": self.lookup_pepper,
             }
 
+        self.sydent.ratelimit_lookup(request, account.userId, len(addresses))
+
         logger.info(
             "Lookup of %d threepid(s) with algorithm %s", len(addresses), algorithm
         )
@@ -105,6 +154,11 @@ class LookupV2Servlet(SydentResource):
             # Lookup without hashing
             medium_address_tuples = []
             for address_and_medium in addresses:
+                if not isinstance(address_and_medium, str):
+                    raise MatrixRestError(
+                        400, "M_INVALID_PARAM", "addresses must be strings"
+                    )
+
                 # Parse medium, address components
                 address_medium_split = address_and_medium.split()
 
@@ -121,23 +175,63 @@ class LookupV2Servlet(SydentResource):
                 address, medium = address_medium_split
                 medium_address_tuples.append((medium, address))
 
-            # Lookup the mxids
-            medium_address_mxid_tuples = self.globalAssociationStore.getMxids(
-                medium_address_tuples
-            )
+            if len(medium_address_tuples) <= chunk_size:
+                # Lookup the mxids
+                medium_address_mxid_tuples = self.globalAssociationStore.getMxids(
+                    medium_address_tuples
+                )
 
-            # Return a dictionary of lookup_string: mxid values
-            return {
-                "mappings": {
-                    "%s %s" % (x[1], x[0]): x[2] for x in medium_address_mxid_tuples
+                # Return a dictionary of lookup_string: mxid values
+                return {
+                    "mappings": {
+                        "%s %s" % (x[1], x[0]): x[2] for x in medium_address_mxid_tuples
+                    }
                 }
-            }
 
-        elif algorithm == "sha256":
-            # Lookup using SHA256 with URL-safe base64 encoding
-            mappings = self.globalAssociationStore.retrieveMxidsForHashes(addresses)
+            threepid_mappings = (
+                {
+                    "%s %s" % (x[1], x[0]): x[2]
+                    for x in self.globalAssociationStore.getMxids(list(chunk))
+                }
+                for chunk in chunks(unique_threepids(medium_address_tuples), chunk_size)
+            )
+            return StreamedResponse(
+                self.sydent.cooperator,
+                object_parts("mappings", threepid_mappings),
+            )
 
-            return {"mappings": mappings}
+        elif algorithm == "sha256":
+            # Lookup using SHA256 with URL-safe base64 encoding. Raw digests are
+            # looked up by their base64 encoding too, and returned as they were
+            # sent if the response is CBOR.
+            raw_digests: Dict[str, bytes] = {}
+            lookup_hashes = []
+            for hashed_address in addresses:
+                if isinstance(hashed_address, bytes):
+                    lookup_hash = encode_base64(hashed_address, urlsafe=True)
+                    raw_digests[lookup_hash] = hashed_address
+                else:
+                    lookup_hash = hashed_address
+                lookup_hashes.append(lookup_hash)
+
+            if not cbor_response:
+                raw_digests = {}
+
+            def lookup(hashes: List[str]) -> Dict[Union[str, bytes], str]:
+                mappings = self.globalAssociationStore.retrieveMxidsForHashes(hashes)
+                return {raw_digests.get(k, k): v for k, v in mappings.items()}
+
+            if len(lookup_hashes) <= chunk_size:
+                return {"mappings": lookup(lookup_hashes)}
+
+            hash_mappings = (
+                lookup(list(chunk))
+                for chunk in chunks(list(dict.fromkeys(lookup_hashes)), chunk_size)
+            )
+            return StreamedResponse(
+                self.sydent.cooperator,
+                object_parts("mappings", hash_mappings),
+            )
 
         request.setResponseCode(400)
         return {"errcode": "M_INVALID_PARAM", "error": "algorithm is not supported"}
@@ -16,7 +16,6 @@
 import logging
 from typing import TYPE_CHECKING
 
-import phonenumbers
 from twisted.web.server import Request
 
 from sydent.http.auth import authV2
@@ -61,6 +60,17 @@ class MsisdnRequestCodeServlet(SydentResource):
             syd.config.sms.country_ratelimit_burst,
             syd.config.sms.country_ratelimit_rate_hz,
         )
+        syd.config_reload_callbacks.append(self._reconfigure_ratelimiters)
+
+    def _reconfigure_ratelimiters(self) -> None:
+        self._msisdn_ratelimiter.reconfigure(
+            self.sydent.config.sms.msisdn_ratelimit_burst,
+            self.sydent.config.sms.msisdn_ratelimit_rate_hz,
+        )
+        self._country_ratelimiter.reconfigure(
+            self.sydent.config.sms.country_ratelimit_burst,
+            self.sydent.config.sms.country_ratelimit_rate_hz,
+        )
 
     @asyncjsonwrap
     async def render_POST(self, request: Request) -> JsonDict:
@@ -94,6 +104,9 @@ class MsisdnRequestCodeServlet(SydentResource):
                 "error": "Invalid client_secret provided",
             }
 
+        # Imported here as it's slow to import, and only needed to send SMS.
+        import phonenumbers
+
         try:
             phone_number_object = phonenumbers.parse(raw_phone_number, country)
 
@@ -12,18 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional, Tuple
 
 from twisted.web.server import Request
 from unpaddedbase64 import encode_base64
 
 from sydent.db.invite_tokens import JoinTokenStore
-from sydent.http.servlets import SydentResource, get_args, jsonwrap
+from sydent.http.servlets import (
+    PrecomputedResponse,
+    PrecomputedResponseCache,
+    SydentResource,
+    get_args,
+    jsonwrap,
+    send_precomputed,
+)
 from sydent.types import JsonDict
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
 
+# Clients can cache the responses about our long-term public key for a while, as
+# it rarely changes.
+PUBKEY_CACHE_CONTROL = "public, max-age=300"
+
+VALID_RESPONSE = PrecomputedResponse.from_json({"valid": True})
+INVALID_RESPONSE = PrecomputedResponse.from_json({"valid": False})
+
+
+def _public_key_response(public_key: bytes) -> JsonDict:
+    return {"public_key": encode_base64(public_key)}
+
 
 class Ed25519Servlet(SydentResource):
     isLeaf = True
@@ -31,13 +49,14 @@ class Ed25519Servlet(SydentResource):
     def __init__(self, syd: "Sydent") -> None:
         super().__init__()
         self.sydent = syd
+        self._response = PrecomputedResponseCache(_public_key_response)
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> bytes:
         pubKey = self.sydent.keyring.ed25519.verify_key
-        pubKeyBase64 = encode_base64(pubKey.encode())
 
-        return {"public_key": pubKeyBase64}
+        response = self._response.get(pubKey.encode())
+        return send_precomputed(request, response, PUBKEY_CACHE_CONTROL)
 
 
 class PubkeyIsValidServlet(SydentResource):
@@ -46,15 +65,21 @@ class PubkeyIsValidServlet(SydentResource):
     def __init__(self, syd: "Sydent") -> None:
         super().__init__()
         self.sydent = syd
+        self._pubKeyBase64: Optional[Tuple[bytes, str]] = None
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> bytes:
         args = get_args(request, ("public_key",))
 
-        pubKey = self.sydent.keyring.ed25519.verify_key
-        pubKeyBase64 = encode_base64(pubKey.encode())
+        pubKey = self.sydent.keyring.ed25519.verify_key.encode()
+        if self._pubKeyBase64 is None or self._pubKeyBase64[0] != pubKey:
+            self._pubKeyBase64 = (pubKey, encode_base64(pubKey))
 
-        return {"valid": args["public_key"] == pubKeyBase64}
+        if args["public_key"] == self._pubKeyBase64[1]:
+            response = VALID_RESPONSE
+        else:
+            response = INVALID_RESPONSE
+        return send_precomputed(request, response, PUBKEY_CACHE_CONTROL)
 
 
 class EphemeralPubkeyIsValidServlet(SydentResource):
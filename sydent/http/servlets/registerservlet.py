@@ -16,7 +16,7 @@ import logging
 import urllib
 from http import HTTPStatus
 from json import JSONDecodeError
-from typing import TYPE_CHECKING, Dict
+from typing import TYPE_CHECKING, Dict, Tuple
 
 from twisted.internet.error import ConnectError, DNSLookupError
 from twisted.web.client import ResponseFailed
@@ -26,6 +26,7 @@ from sydent.http.httpclient import FederationHttpClient
 from sydent.http.servlets import SydentResource, asyncjsonwrap, get_args, send_cors
 from sydent.types import JsonDict
 from sydent.users.tokens import issueToken
+from sydent.util.singleflight import SingleFlight
 from sydent.util.stringutils import is_valid_matrix_server_name
 
 if TYPE_CHECKING:
@@ -41,6 +42,11 @@ class RegisterServlet(SydentResource):
         super().__init__()
         self.sydent = syd
         self.client = FederationHttpClient(self.sydent)
+        # Userinfo requests in flight, keyed on server name and access token, so
+        # that retried registrations don't query the homeserver again.
+        self._userinfo_requests: SingleFlight[Tuple[str, str], JsonDict] = SingleFlight(
+            "openid_userinfo"
+        )
 
     @asyncjsonwrap
     async def render_POST(self, request: Request) -> JsonDict:
@@ -77,13 +83,16 @@ class RegisterServlet(SydentResource):
             }
 
         try:
-            result = await self.client.get_json(
-                "matrix://%s/_matrix/federation/v1/openid/userinfo?access_token=%s"
-                % (
-                    matrix_server,
-                    urllib.parse.quote(args["access_token"]),
+            result = await self._userinfo_requests.do(
+                (matrix_server, args["access_token"]),
+                lambda: self.client.get_json(
+                    "matrix://%s/_matrix/federation/v1/openid/userinfo?access_token=%s"
+                    % (
+                        matrix_server,
+                        urllib.parse.quote(args["access_token"]),
+                    ),
+                    1024 * 5,
                 ),
-                1024 * 5,
             )
         except (DNSLookupError, ConnectError, ResponseFailed) as e:
             return federation_request_problem(
@@ -0,0 +1,50 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import TYPE_CHECKING
+
+from twisted.web.server import Request
+
+from sydent.http.servlets import MatrixRestError, SydentResource, jsonwrap
+from sydent.types import JsonDict
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+
+class ReloadServlet(SydentResource):
+    """A servlet which reloads what can be changed without restarting Sydent, as
+    SIGHUP does.
+
+    It is assumed that authentication happens out of band
+    """
+
+    isLeaf = True
+
+    def __init__(self, sydent: "Sydent") -> None:
+        super().__init__()
+        self.sydent = sydent
+
+    @jsonwrap
+    def render_POST(self, request: Request) -> JsonDict:
+        result = self.sydent.reload()
+        if result.error is not None:
+            raise MatrixRestError(
+                500, "M_UNKNOWN", "Failed to reload the config: %s" % (result.error,)
+            )
+
+        return {
+            "config_reloaded": result.config_reloaded,
+            "restart_required": result.restart_required,
+        }
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
 from typing import TYPE_CHECKING, List, cast
 
@@ -27,8 +26,8 @@ from sydent.db.threepid_associations import GlobalAssociationStore, SignedAssoci
 from sydent.http.servlets import MatrixRestError, SydentResource, jsonwrap
 from sydent.threepid import threePidAssocFromDict
 from sydent.types import JsonDict
-from sydent.util import json_decoder
 from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.json_codec import decode_json, encode_json
 from sydent.util.stringutils import normalise_address
 
 if TYPE_CHECKING:
@@ -82,8 +81,7 @@ class ReplicationPushServlet(SydentResource):
             raise MatrixRestError(400, "M_NOT_JSON", "This endpoint expects JSON")
 
         try:
-            # json.loads doesn't allow bytes in Python 3.5
-            inJson = json_decoder.decode(request.content.read().decode("UTF-8"))
+            inJson = decode_json(request.content.read())
         except ValueError:
             logger.warning(
                 "Peer %s made push connection with malformed JSON", peer.servername
@@ -138,7 +136,7 @@ class ReplicationPushServlet(SydentResource):
                     # Add this association
                     globalAssocsStore.addAssociation(
                         assocObj,
-                        json.dumps(sgAssoc),
+                        encode_json(sgAssoc).decode("UTF-8"),
                         peer.servername,
                         originId,
                         commit=False,
@@ -174,4 +172,5 @@ class ReplicationPushServlet(SydentResource):
             }
         else:
             self.sydent.db.commit()
+            globalAssocsStore.syncLookupHashIndex()
             return {"success": True}
@@ -22,12 +22,14 @@ from sydent.db.terms import TermsStore
 from sydent.http.auth import authV2
 from sydent.http.servlets import (
     MatrixRestError,
+    PrecomputedResponseCache,
     SydentResource,
     get_args,
     jsonwrap,
     send_cors,
+    send_precomputed,
 )
-from sydent.terms.terms import get_terms
+from sydent.terms.terms import Terms, get_terms
 from sydent.types import JsonDict
 
 if TYPE_CHECKING:
@@ -42,18 +44,23 @@ class TermsServlet(SydentResource):
     def __init__(self, syd: "Sydent") -> None:
         super().__init__()
         self.sydent = syd
+        # Terms are immutable and replaced on reload, so they identify themselves.
+        self._response: PrecomputedResponseCache[Terms] = PrecomputedResponseCache(
+            lambda terms: terms.getForClient()
+        )
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> bytes:
         """
         Get the terms that must be agreed to in order to use this service
         Returns: Object describing the terms that require agreement
         """
         send_cors(request)
 
-        terms = get_terms(self.sydent)
+        response = self._response.get(get_terms(self.sydent))
 
-        return terms.getForClient()
+        # The terms can change at any time, so clients must revalidate them.
+        return send_precomputed(request, response, "public, no-cache")
 
     @jsonwrap
     def render_POST(self, request: Request) -> JsonDict:
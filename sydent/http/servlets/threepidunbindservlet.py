@@ -28,7 +28,7 @@ from sydent.db.valsession import ThreePidValSessionStore
 from sydent.hs_federation.verifier import InvalidServerName, NoAuthenticationError
 from sydent.http.servlets import SydentResource, dict_to_json_bytes
 from sydent.types import JsonDict
-from sydent.util import json_decoder
+from sydent.util.json_codec import decode_json
 from sydent.util.stringutils import is_valid_client_secret
 from sydent.validators import (
     IncorrectClientSecretException,
@@ -58,10 +58,7 @@ class ThreePidUnbindServlet(SydentResource):
             try:
                 # TODO: we should really validate that this gives us a dict, and
                 #   not some other json value like str, list, int etc
-                # json.loads doesn't allow bytes in Python 3.5
-                body: JsonDict = json_decoder.decode(
-                    request.content.read().decode("UTF-8")
-                )
+                body: JsonDict = decode_json(request.content.read())
             except ValueError:
                 request.setResponseCode(HTTPStatus.BAD_REQUEST)
                 request.write(
@@ -14,33 +14,43 @@
 
 from twisted.web.server import Request
 
-from sydent.http.servlets import SydentResource, jsonwrap, send_cors
-from sydent.types import JsonDict
+from sydent.http.servlets import (
+    PrecomputedResponse,
+    SydentResource,
+    jsonwrap,
+    send_cors,
+    send_precomputed,
+)
+
+VERSIONS_RESPONSE = PrecomputedResponse.from_json(
+    {
+        "versions": [
+            "r0.1.0",
+            "r0.2.0",
+            "r0.2.1",
+            "r0.3.0",
+            "v1.1",
+            "v1.2",
+            "v1.3",
+            "v1.4",
+            "v1.5",
+        ]
+    }
+)
 
 
 class VersionsServlet(SydentResource):
     isLeaf = True
 
     @jsonwrap
-    def render_GET(self, request: Request) -> JsonDict:
+    def render_GET(self, request: Request) -> bytes:
         """
         Return the supported Matrix versions.
         """
         send_cors(request)
 
-        return {
-            "versions": [
-                "r0.1.0",
-                "r0.2.0",
-                "r0.2.1",
-                "r0.3.0",
-                "v1.1",
-                "v1.2",
-                "v1.3",
-                "v1.4",
-                "v1.5",
-            ]
-        }
+        # The versions only change when Sydent is upgraded.
+        return send_precomputed(request, VERSIONS_RESPONSE, "public, max-age=3600")
 
     def render_OPTIONS(self, request: Request) -> bytes:
         send_cors(request)
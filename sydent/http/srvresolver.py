@@ -24,6 +24,9 @@ from twisted.names import client, dns
 from twisted.names.dns import Record_SRV, RRHeader
 from twisted.names.error import DNSNameError, DomainError
 
+from sydent.util import tracing
+from sydent.util.singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 SERVER_CACHE: Dict[bytes, List["Server"]] = {}
@@ -89,16 +92,14 @@ def pick_server_from_list(server_list: List[Server]) -> Tuple[bytes, int]:
 #    will be Record_SRVs. I made RRHeader's stub generic over the type of its
 #    payload to reflect this. But that's a lie compared to Twisted's actual
 #    RRHeader Type, so we need to enclose these in strings.
-LookupService = Callable[
-    [str],
-    Awaitable[
-        Tuple[
-            List["RRHeader[Record_SRV]"],
-            List["RRHeader[object]"],
-            List["RRHeader[object]"],
-        ]
-    ],
+LookupServiceResult = Tuple[
+    List["RRHeader[Record_SRV]"],
+    List["RRHeader[object]"],
+    List["RRHeader[object]"],
 ]
+LookupService = Callable[[str], Awaitable[LookupServiceResult]]
+
+SERVER_LOOKUPS: SingleFlight[bytes, LookupServiceResult] = SingleFlight("srv")
 
 
 class SrvResolver:
@@ -110,6 +111,9 @@ class SrvResolver:
 
     :param cache: cache object
 
+    :param lookups: SingleFlight object, shares concurrent lookups of the same
+        record
+
     :param get_time: Clock implementation. Should return seconds since the epoch.
     """
 
@@ -118,11 +122,14 @@ class SrvResolver:
         lookup_service: LookupService = client.lookupService,
         cache: Dict[bytes, List[Server]] = SERVER_CACHE,
         get_time: Callable[[], SupportsInt] = time.time,
+        lookups: SingleFlight[bytes, LookupServiceResult] = SERVER_LOOKUPS,
     ) -> None:
         self._lookup_service = lookup_service
         self._cache = cache
+        self._lookups = lookups
         self._get_time = get_time
 
+    @tracing.traced("federation.srv")
     async def resolve_service(self, service_name: bytes) -> List["Server"]:
         """Look up a SRV record
 
@@ -139,7 +146,9 @@ class SrvResolver:
                 return servers
 
         try:
-            answers, _, _ = await self._lookup_service(service_name.decode())
+            answers, _, _ = await self._lookups.do(
+                service_name, lambda: self._lookup_service(service_name.decode())
+            )
         except DNSNameError:
             # TODO: cache this. We can get the SOA out of the exception, and use
             # the negative-TTL value.
@@ -14,7 +14,6 @@
 # limitations under the License.
 
 import binascii
-import json
 import logging
 from abc import abstractmethod
 from typing import TYPE_CHECKING, Dict, Generic, Optional, Sequence, TypeVar
@@ -33,8 +32,8 @@ from sydent.db.hashing_metadata import HashingMetadataStore
 from sydent.db.threepid_associations import GlobalAssociationStore, SignedAssociations
 from sydent.threepid import threePidAssocFromDict
 from sydent.types import JsonDict
-from sydent.util import json_decoder
 from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.json_codec import decode_json, encode_json
 from sydent.util.stringutils import normalise_address
 
 PushUpdateReturn = TypeVar("PushUpdateReturn")
@@ -116,7 +115,7 @@ class LocalPeer(Peer[bool]):
                     # be good as a sanity check)
                     globalAssocStore.addAssociation(
                         assocObj,
-                        json.dumps(sgAssocs[localId]),
+                        encode_json(sgAssocs[localId]).decode("UTF-8"),
                         self.sydent.config.general.server_name,
                         localId,
                     )
@@ -279,7 +278,7 @@ class RemotePeer(Peer[IResponse]):
         :param body: The response body.
         :param updateDeferred: The deferred to call the error callback of.
         """
-        errObj = json_decoder.decode(body.decode("utf8"))
+        errObj = decode_json(body)
         e = RemotePeerError(errObj)
         updateDeferred.errback(e)
 
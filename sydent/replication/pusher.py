@@ -23,7 +23,7 @@ from twisted.internet import defer
 from sydent.db.peers import PeerStore
 from sydent.db.threepid_associations import LocalAssociationStore
 from sydent.replication.peer import LocalPeer, RemotePeer
-from sydent.util import time_msec
+from sydent.util import time_msec, tracing
 
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
@@ -76,6 +76,7 @@ class Pusher:
             dl.append(defer.ensureDeferred(self._push_to_peer(p)))
         return defer.DeferredList(dl)
 
+    @tracing.traced("replication.push", start_trace=True)
     async def _push_to_peer(self, p: "RemotePeer") -> None:
         """
         For a given peer, retrieves the list of associations that were created since
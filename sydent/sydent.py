@@ -18,8 +18,9 @@ import gc
 import logging
 import logging.handlers
 import os
+import signal
 import sqlite3
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, List, Optional
 
 import attr
 import prometheus_client
@@ -29,44 +30,73 @@ from signedjson.types import SigningKey
 from twisted.internet import address, task
 from twisted.internet.interfaces import (
     IReactorCore,
+    IReactorFromThreads,
     IReactorPluggableNameResolver,
+    IReactorProcess,
+    IReactorSocket,
     IReactorSSL,
     IReactorTCP,
     IReactorTime,
+    IReactorUNIX,
 )
 from twisted.python import log
 from twisted.web.http import Request
 from zope.interface import Interface
 
 from sydent.config import SydentConfig
+from sydent.config.exceptions import ConfigError
+from sydent.db.accounts import AccountCache
 from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.db.lookup_delta import LookupDeltaStore
 from sydent.db.sqlitedb import SqliteDatabase
+from sydent.db.threepid_associations import GlobalAssociationStore, LookupCache
 from sydent.db.valsession import ThreePidValSessionStore
 from sydent.hs_federation.verifier import Verifier
-from sydent.http.httpcommon import SslComponents
+from sydent.http.admission import AdmissionController
+from sydent.http.httpcommon import ForwardedRequest, SslComponents
 from sydent.http.httpsclient import ReplicationHttpsClient
 from sydent.http.httpserver import (
     ClientApiHttpServer,
     InternalApiHttpServer,
+    MetricsUnixServer,
     ReplicationHttpsServer,
+    load_private_certificate,
 )
 from sydent.replication.pusher import Pusher
+from sydent.terms.terms import TermsReloader
 from sydent.threepid.bind import ThreepidBinder
+from sydent.util import tracing
+from sydent.util.bloom import CountingBloomFilter
 from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.hash_index import LookupHashIndex
+from sydent.util.lrucache import LruTtlCache
 from sydent.util.ratelimiter import Ratelimiter
 from sydent.util.tokenutils import generateAlphanumericTokenOfLength
 from sydent.validators.emailvalidator import EmailValidator
 from sydent.validators.msisdnvalidator import MsisdnValidator
 
+if TYPE_CHECKING:
+    from sydent.workers import WorkerManager
+
 logger = logging.getLogger(__name__)
 
+config_reloads = prometheus_client.Counter(
+    "sydent_config_reloads",
+    "Reloads of the config, by result ('ok' or 'error')",
+    labelnames=("result",),
+)
+
 
 class SydentReactor(
     IReactorCore,
+    IReactorFromThreads,
     IReactorTCP,
     IReactorSSL,
     IReactorTime,
     IReactorPluggableNameResolver,
+    IReactorProcess,
+    IReactorSocket,
+    IReactorUNIX,
     Interface,
 ):
     pass
@@ -84,8 +114,22 @@ class Sydent:
         self.reactor = reactor
         self.use_tls_for_federation = use_tls_for_federation
 
+        # Splits long-running work into slices run on separate reactor iterations.
+        self.cooperator = task.Cooperator(
+            scheduler=lambda work: self.reactor.callLater(0, work)
+        )
+
         logger.info("Starting Sydent server")
 
+        # Called after the config is reloaded, to apply it to the objects built
+        # from it.
+        self.config_reload_callbacks: List[Callable[[], None]] = []
+        # Called on the config whenever it's read again, before it's applied, to
+        # override the options this process sets itself (e.g. client API workers).
+        self.config_overrides: List[Callable[[SydentConfig], None]] = []
+
+        self._setup_tracing()
+
         self.db: sqlite3.Connection = SqliteDatabase(self).db
 
         if self.config.general.sentry_enabled:
@@ -105,6 +149,39 @@ class Sydent:
             cb.clock = self.reactor
             cb.start(1.0)
 
+        self.lookup_cache: Optional[LookupCache] = None
+        if self.config.lookup.cache_enabled:
+            self.lookup_cache = LookupCache(
+                self.config.lookup.cache_max_entries,
+                self.config.lookup.cache_ttl,
+                self.reactor.seconds,
+            )
+
+        # The responses to v1 lookups, keyed by the ID of the association they
+        # return. Associations are never updated, only deleted.
+        self.signed_lookup_cache: Optional[LruTtlCache[int, bytes]] = None
+        if self.config.lookup.signed_cache_max_entries > 0:
+            self.signed_lookup_cache = LruTtlCache(
+                "signed_lookups",
+                self.config.lookup.signed_cache_max_entries,
+                self.config.lookup.cache_ttl,
+                self.reactor.seconds,
+            )
+
+        # The accounts of recently used access tokens, so that authenticating
+        # requests doesn't need a database query.
+        self.account_cache: Optional[AccountCache] = None
+        if self.config.general.account_cache_max_entries > 0:
+            self.account_cache = AccountCache(
+                self.config.general.account_cache_max_entries,
+                self.config.general.account_cache_ttl,
+                self.reactor.seconds,
+            )
+
+        # The terms of service, which are read once and then reloaded when their
+        # file changes.
+        self.terms_reloader: TermsReloader = TermsReloader(self)
+
         # See if a pepper already exists in the database
         # Note: This MUST be run before we start serving requests, otherwise lookups for
         # 3PID hashes may come in before we've completed generating them
@@ -119,6 +196,21 @@ class Sydent:
                 sha256_and_url_safe_base64, lookup_pepper
             )
 
+        # This must also be built before we start serving requests, and after the
+        # lookup hashes have been (re)computed.
+        self.lookup_hash_index: Optional[LookupHashIndex] = None
+        self.association_filter: Optional[CountingBloomFilter] = None
+        global_assoc_store = GlobalAssociationStore(self)
+        if self.config.lookup.hash_index_enabled:
+            self.lookup_hash_index = global_assoc_store.buildLookupHashIndex(
+                self.config.lookup.hash_index_overlay_size
+            )
+        if self.config.lookup.bloom_filter_enabled:
+            self.association_filter = global_assoc_store.buildAssociationFilter(
+                self.config.lookup.bloom_filter_capacity,
+                self.config.lookup.bloom_filter_false_positive_rate,
+            )
+
         self.validators: Validators = Validators(
             EmailValidator(self), MsisdnValidator(self)
         )
@@ -132,7 +224,12 @@ class Sydent:
 
         self.sslComponents: SslComponents = SslComponents(self)
 
-        self.clientApiHttpServer = ClientApiHttpServer(self, lookup_pepper)
+        # Limits the number of requests processed at once, for all the servers.
+        self.admission: AdmissionController = AdmissionController.from_config(self)
+
+        self.clientApiHttpServer: ClientApiHttpServer = ClientApiHttpServer(
+            self, lookup_pepper
+        )
         self.replicationHttpsServer = ReplicationHttpsServer(self)
         self.replicationHttpsClient: ReplicationHttpsClient = ReplicationHttpsClient(
             self
@@ -140,17 +237,44 @@ class Sydent:
 
         self.pusher: Pusher = Pusher(self)
 
+        # Only set in the main process, when running client API workers.
+        self.workerManager: Optional["WorkerManager"] = None
+        # The secret with which client API workers authenticate the requests they
+        # forward to the main process. Generated by the main process for each run,
+        # and passed on to the workers it starts.
+        self.worker_secret: Optional[str] = None
+
         self.email_sender_ratelimiter: Ratelimiter[str] = Ratelimiter(
             self.reactor,
             burst=self.config.email.email_sender_ratelimit_burst,
             rate_hz=self.config.email.email_sender_ratelimit_rate_hz,
         )
 
+        self.lookup_account_ratelimiter: Ratelimiter[str] = Ratelimiter(
+            self.reactor,
+            burst=self.config.lookup.account_ratelimit_burst,
+            rate_hz=self.config.lookup.account_ratelimit_rate_hz,
+        )
+        self.lookup_ip_ratelimiter: Ratelimiter[str] = Ratelimiter(
+            self.reactor,
+            burst=self.config.lookup.ip_ratelimit_burst,
+            rate_hz=self.config.lookup.ip_ratelimit_rate_hz,
+        )
+
     def run(self) -> None:
-        self.clientApiHttpServer.setup()
+        if self.config.http.client_workers > 0:
+            # Imported here as the workers' entry point imports this module.
+            from sydent.workers import WorkerManager
+
+            self.workerManager = WorkerManager(self)
+            self.workerManager.start()
+            self.clientApiHttpServer.setup_for_workers()
+        else:
+            self.clientApiHttpServer.setup()
         self.replicationHttpsServer.setup()
         self.pusher.setup()
         self.maybe_start_prometheus_server()
+        self.terms_reloader.start()
 
         # A dedicated validation session store just to clean up old sessions every N minutes
         self.cleanupValSession = ThreePidValSessionStore(self)
@@ -158,12 +282,30 @@ class Sydent:
         cb.clock = self.reactor
         cb.start(10 * 60.0)
 
-        if self.config.http.internal_port is not None:
-            internalport = self.config.http.internal_port
-            interface = self.config.http.internal_bind_address
+        # Clean up the history used for delta lookups, and record the associations
+        # which expired in it, every hour
+        self.cleanupLookupDelta = LookupDeltaStore(self)
+        cb = task.LoopingCall(
+            self.cleanupLookupDelta.deleteOldEntries,
+            self.config.lookup.delta_lookup_retention_ms,
+        )
+        cb.clock = self.reactor
+        cb.start(60 * 60.0)
+        cb = task.LoopingCall(self.cleanupLookupDelta.recordExpiredAssociations)
+        cb.clock = self.reactor
+        cb.start(60 * 60.0)
+
+        if self.lookup_hash_index is not None:
+            cb = task.LoopingCall(self.lookup_hash_index.merge)
+            cb.clock = self.reactor
+            cb.start(self.config.lookup.hash_index_merge_interval, now=False)
 
+        if (
+            self.config.http.internal_port is not None
+            or self.config.http.internal_unix_socket
+        ):
             self.internalApiHttpServer = InternalApiHttpServer(self)
-            self.internalApiHttpServer.setup(interface, internalport)
+            self.internalApiHttpServer.setup()
 
         if self.config.general.pidfile:
             with open(self.config.general.pidfile, "w") as pidfile:
@@ -171,6 +313,132 @@ class Sydent:
 
         self.reactor.run()
 
+    def reload(self) -> "ReloadResult":
+        """Reload what can be changed without restarting, and have the client API
+        workers (if any) do the same.
+
+        That's the options of the config file which are reloadable (see
+        BaseConfig.reloadable), the templates, the replication and client API
+        certificates and the terms. If any of the config can't be reloaded, none of
+        it is, and the current config stays in use.
+
+        :return: What was reloaded.
+        """
+        logger.info("Reloading")
+        result = ReloadResult()
+        if self.config.config_file is None:
+            logger.warning("Not reloading the config, as it wasn't read from a file")
+        else:
+            try:
+                result.restart_required = self._reload_config(self.config.config_file)
+            except Exception as e:
+                logger.exception("Failed to reload the config, keeping the current one")
+                config_reloads.labels("error").inc()
+                result.error = str(e)
+            else:
+                logger.info("Reloaded the config from %s", self.config.config_file)
+                config_reloads.labels("ok").inc()
+                result.config_reloaded = True
+                if result.restart_required:
+                    logger.warning(
+                        "These options changed, but only take effect after a restart: %s",
+                        ", ".join(result.restart_required),
+                    )
+
+        self.terms_reloader.reload()
+
+        if self.workerManager is not None:
+            self.workerManager.reload()
+
+        return result
+
+    def _reload_config(self, config_file: str) -> List[str]:
+        """Read the config file again, and apply the options which can be changed
+        without restarting.
+
+        :param config_file: The path of the config file.
+
+        :raises Exception: if the config, the replication certificates or the
+            client API's HTTPS certificate can't be loaded, in which case nothing is
+            applied.
+
+        :return: The options which changed, but which only take effect after a
+            restart.
+        """
+        new_config = SydentConfig()
+        new_config.parse_config_file(config_file)
+        for override in self.config_overrides:
+            override(new_config)
+
+        restart_required = []
+
+        # Enabling or disabling replication starts or stops its server, which needs
+        # a restart.
+        replication_enabled = self.sslComponents.myPrivateCertificate is not None
+        if replication_enabled != (new_config.http.cert_file != ""):
+            restart_required.append("http.cert_file")
+            new_config.http.cert_file = self.config.http.cert_file
+
+        ssl_components = None
+        if replication_enabled:
+            # Even if their paths didn't change, e.g. to use renewed certificates.
+            ssl_components = SslComponents(self, new_config.http)
+            if ssl_components.myPrivateCertificate is None:
+                raise ConfigError(
+                    "Can't read the replication certificate at %s"
+                    % (new_config.http.cert_file,)
+                )
+
+        https_certificate = None
+        if (
+            self.clientApiHttpServer.httpsCertificate is not None
+            and new_config.http.client_https_cert_file != ""
+        ):
+            # Likewise for the client API's HTTPS certificate.
+            try:
+                https_certificate = load_private_certificate(
+                    new_config.http.client_https_cert_file
+                )
+            except Exception as e:
+                raise ConfigError(
+                    "Can't read the client API certificate at %s"
+                    % (new_config.http.client_https_cert_file,)
+                ) from e
+
+        # Nothing can fail from here on, so the new config is applied as a whole.
+        restart_required.extend(self.config.reload(new_config))
+        if ssl_components is not None:
+            self.sslComponents = ssl_components
+        if https_certificate is not None:
+            self.clientApiHttpServer.httpsCertificate = https_certificate
+
+        self.email_sender_ratelimiter.reconfigure(
+            self.config.email.email_sender_ratelimit_burst,
+            self.config.email.email_sender_ratelimit_rate_hz,
+        )
+        self.lookup_account_ratelimiter.reconfigure(
+            self.config.lookup.account_ratelimit_burst,
+            self.config.lookup.account_ratelimit_rate_hz,
+        )
+        self.lookup_ip_ratelimiter.reconfigure(
+            self.config.lookup.ip_ratelimit_burst,
+            self.config.lookup.ip_ratelimit_rate_hz,
+        )
+        for callback in self.config_reload_callbacks:
+            callback()
+
+        return restart_required
+
+    def _setup_tracing(self) -> None:
+        exporters: List[tracing.SpanExporter] = []
+        if self.config.general.tracing_exporter == "log":
+            exporters.append(tracing.LogSpanExporter())
+        elif self.config.general.tracing_exporter == "json":
+            exporters.append(
+                tracing.JsonFileSpanExporter(self.config.general.tracing_json_path)
+            )
+        tracing.configure(exporters, self.config.general.tracing_sample_rate)
+
     def maybe_start_prometheus_server(self) -> None:
         if self.config.general.prometheus_enabled:
             assert self.config.general.prometheus_addr is not None
@@ -179,9 +447,19 @@ class Sydent:
                 port=self.config.general.prometheus_port,
                 addr=self.config.general.prometheus_addr,
             )
+        if self.config.general.prometheus_unix_socket:
+            MetricsUnixServer(self).setup()
 
     def ip_from_request(self, request: Request) -> Optional[str]:
-        if self.config.http.obey_x_forwarded_for and request.requestHeaders.hasHeader(
+        if isinstance(request, ForwardedRequest):
+            if request.is_from_worker(self.worker_secret):
+                # The connection is from the worker, which leaves X-Forwarded-For
+                # out if it doesn't know the client's address either (e.g. on a Unix
+                # socket).
+                forwarded_for = request.requestHeaders.getRawHeaders("X-Forwarded-For")
+                return None if forwarded_for is None else forwarded_for[0]
+            # Otherwise only the address of the connection can be trusted.
+        elif self.config.http.obey_x_forwarded_for and request.requestHeaders.hasHeader(
             "X-Forwarded-For"
         ):
             # Type safety: hasHeaders returning True means that getRawHeaders
@@ -193,6 +471,35 @@ class Sydent:
         else:
             return None
 
+    def ratelimit_lookup(
+        self, request: Request, user_id: Optional[str], cost: int
+    ) -> None:
+        """
+        Check that a lookup is within the rate limits of the account making it and
+        of the client's IP address.
+
+        :param request: The lookup request.
+        :param user_id: The ID of the account making the lookup, if it's
+            authenticated.
+        :param cost: The number of addresses (or 3PIDs) looked up.
+
+        :raises: LimitExceededException if the lookup should be denied.
+        """
+        # Every lookup costs something, since it still queries the database.
+        cost = max(cost, 1)
+        account_error = "Too many lookups for this account"
+        # Check both limits before counting the lookup towards either, so that
+        # lookups denied by one limit don't use up the allowance of the other.
+        if user_id is not None:
+            self.lookup_account_ratelimiter.check(user_id, account_error, cost)
+        ip = self.ip_from_request(request)
+        if ip is not None:
+            self.lookup_ip_ratelimiter.ratelimit(
+                ip, "Too many lookups from this address", cost
+            )
+        if user_id is not None:
+            self.lookup_account_ratelimiter.ratelimit(user_id, account_error, cost)
+
     def brand_from_request(self, request: Request) -> Optional[str]:
         """
         If the brand GET parameter is passed, returns that as a string, otherwise returns None.
@@ -245,6 +552,16 @@ class Sydent:
             return os.path.join(root_template_path, brand, template_name)
 
 
+@attr.s(slots=True, auto_attribs=True)
+class ReloadResult:
+    # Whether the config file was read again, and its reloadable options applied.
+    config_reloaded: bool = False
+    # The options which changed, but which only take effect after a restart.
+    restart_required: List[str] = attr.Factory(list)
+    # Why the config couldn't be reloaded, if it couldn't.
+    error: Optional[str] = None
+
+
 @attr.s(frozen=True, slots=True, auto_attribs=True)
 class Validators:
     email: EmailValidator
@@ -268,14 +585,19 @@ def run_gc() -> None:
             gc.collect(i)
 
 
-def setup_logging(config: SydentConfig) -> None:
+def setup_logging(config: SydentConfig, worker_index: Optional[int] = None) -> None:
     """
     Setup logging using the options specified in the config
 
     :param config: the configuration to use
+    :param worker_index: the index of the client API worker to set up logging for,
+        if any. Workers log to their own file, so that they don't rotate the main
+        process' log file.
     """
     log_path = config.general.log_path
     log_level = config.general.log_level
+    if worker_index is not None and log_path != "":
+        log_path = "%s.worker%d" % (log_path, worker_index)
 
     log_format = "%(asctime)s - %(name)s - %(lineno)d - %(levelname)s" " - %(message)s"
     formatter = logging.Formatter(log_format)
@@ -299,12 +621,27 @@ def setup_logging(config: SydentConfig) -> None:
     observer.start()
 
 
+def install_reload_handler(sydent: Sydent) -> None:
+    """Reload Sydent when it receives SIGHUP.
+
+    :param sydent: The Sydent instance to reload.
+    """
+
+    def handler(signum: int, frame: object) -> None:
+        # Signal handlers can run in the middle of anything, so defer the work to
+        # the reactor.
+        sydent.reactor.callFromThread(sydent.reload)
+
+    signal.signal(signal.SIGHUP, handler)
+
+
 def main() -> None:
     sydent_config = SydentConfig()
     sydent_config.parse_config_file(get_config_file_path())
     setup_logging(sydent_config)
 
     syd = Sydent(sydent_config)
+    install_reload_handler(syd)
     syd.run()
 
 
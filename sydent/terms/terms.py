@@ -13,9 +13,21 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Set, Union
+import os
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-import yaml
+from prometheus_client import Counter
+from twisted.internet import task
 from typing_extensions import TypedDict
 
 if TYPE_CHECKING:
@@ -23,6 +35,12 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+terms_reloads = Counter(
+    "sydent_terms_reloads",
+    "Reloads of the terms, by result ('ok' or 'error')",
+    labelnames=("result",),
+)
+
 
 class TermConfig(TypedDict):
     master_version: str
@@ -44,11 +62,33 @@ VersionOrLang = Union[str, LocalisedPolicy]
 
 class Terms:
     def __init__(self, yamlObj: Optional[TermConfig]) -> None:
-        """
+        """The terms of service of the server. They're immutable, so everything
+        derived from them is computed once, here.
+
         :param yamlObj: The parsed YAML.
         """
         self._rawTerms = yamlObj
 
+        policies: Dict[str, Dict[str, VersionOrLang]] = {}
+        docsByUrl: Dict[str, Set[str]] = {}
+        if yamlObj is not None:
+            for docName, doc in yamlObj["docs"].items():
+                policies[docName] = {
+                    "version": doc["version"],
+                }
+                policies[docName].update(doc["langs"])
+                for lang in doc["langs"].values():
+                    docsByUrl.setdefault(lang["url"], set()).add(docName)
+
+        # The documents each URL belongs to, as the same URL can be used for
+        # several documents.
+        self._docsByUrl: Dict[str, FrozenSet[str]] = {
+            url: frozenset(docNames) for url, docNames in docsByUrl.items()
+        }
+        self._forClient = {"policies": policies}
+        self._urlSet = frozenset(self._docsByUrl)
+        self._requiredDocs = frozenset(policies)
+
     def getMasterVersion(self) -> Optional[str]:
         """
         :return: The global (master) version of the terms, or None if there
@@ -65,27 +105,15 @@ class Terms:
         """
         :return: A dict which value for the "policies" key is a dict which contains the
             "docs" part of the terms' YAML. That nested dict is empty if no terms.
+            It's shared, so mustn't be modified.
         """
-        policies: Dict[str, Dict[str, VersionOrLang]] = {}
-        if self._rawTerms is not None:
-            for docName, doc in self._rawTerms["docs"].items():
-                policies[docName] = {
-                    "version": doc["version"],
-                }
-                policies[docName].update(doc["langs"])
-        return {"policies": policies}
+        return self._forClient
 
-    def getUrlSet(self) -> Set[str]:
+    def getUrlSet(self) -> FrozenSet[str]:
         """
         :return: All the URLs for the terms in a set. Empty set if no terms.
         """
-        urls = set()
-        if self._rawTerms is not None:
-            for docName, doc in self._rawTerms["docs"].items():
-                for langName, lang in doc["langs"].items():
-                    url = lang["url"]
-                    urls.add(url)
-        return urls
+        return self._urlSet
 
     def urlListIsSufficient(self, urls: List[str]) -> bool:
         """
@@ -97,37 +125,124 @@ class Terms:
         :return: Whether the list is sufficient to allow the creation of the user's
             account.
         """
-        agreed = set()
-        urlset = set(urls)
-
         if self._rawTerms is None:
             if urls:
                 raise ValueError("No configured terms, but user accepted some terms")
             else:
                 return True
 
-        else:
-            for docName, doc in self._rawTerms["docs"].items():
-                for lang in doc["langs"].values():
-                    if lang["url"] in urlset:
-                        agreed.add(docName)
-                        break
+        agreed: Set[str] = set()
+        for url in urls:
+            agreed.update(self._docsByUrl.get(url, ()))
+        return agreed == self._requiredDocs
+
+
+def _file_version(path: str) -> Tuple[int, int]:
+    """
+    :return: The modification time and size of a file, which identify its
+        version.
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
 
-            required = set(self._rawTerms["docs"].keys())
-            return agreed == required
+class TermsReloader:
+    """Holds the server's terms, which are read once, then again whenever their
+    file changes (or on demand, e.g. on SIGHUP).
+
+    If the terms can't be read on startup, an exception is raised. If they can't be
+    reloaded, the error is logged and the previous terms are kept.
+
+    :param sydent: The Sydent instance.
+    """
+
+    def __init__(self, sydent: "Sydent") -> None:
+        self._sydent = sydent
+        self._path = sydent.config.general.terms_path
+        self._version: Optional[Tuple[int, int]] = None
+
+        # Replaced as a whole on reload, so readers always see consistent terms.
+        self.terms = Terms(None)
+        if self._path != "":
+            self._version = _file_version(self._path)
+            self.terms = read_terms(self._path)
+
+    def start(self) -> None:
+        """Start checking the terms' file for changes periodically."""
+        interval = self._sydent.config.general.terms_reload_interval
+        if self._path == "" or interval <= 0:
+            return
+
+        cb = task.LoopingCall(self.check)
+        cb.clock = self._sydent.reactor
+        cb.start(interval, now=False)
+
+    def check(self) -> None:
+        """Reload the terms if their file changed since they were last read."""
+        if self._path == "":
+            return
+
+        try:
+            version = _file_version(self._path)
+        except OSError as e:
+            if self._version is not None:
+                logger.error("Can't check the terms at %s: %s", self._path, e)
+                terms_reloads.labels("error").inc()
+                # Log that only once, until the file is back.
+                self._version = None
+            return
+
+        if version != self._version:
+            self.reload(version)
+
+    def reload(self, version: Optional[Tuple[int, int]] = None) -> bool:
+        """Reload the terms.
+
+        :param version: The version of the terms' file, if known.
+
+        :return: Whether the terms were reloaded.
+        """
+        if self._path == "":
+            return False
+
+        try:
+            if version is None:
+                version = _file_version(self._path)
+            # Don't try again until the file changes, even if reading it fails.
+            self._version = version
+            terms = read_terms(self._path)
+        except Exception:
+            logger.exception(
+                "Failed to reload the terms at %s, keeping the previous ones",
+                self._path,
+            )
+            terms_reloads.labels("error").inc()
+            return False
+
+        self.terms = terms
+        logger.info(
+            "Reloaded the terms at %s (master version %s)",
+            self._path,
+            terms.getMasterVersion(),
+        )
+        terms_reloads.labels("ok").inc()
+        return True
 
 
 def get_terms(sydent: "Sydent") -> Terms:
-    """Read and parse terms as specified in the config.
+    """
+    :return: The server's current terms.
+    """
+    return sydent.terms_reloader.terms
 
-    Errors in reading, parsing and validating the config
-    are raised as exceptions."""
-    # TODO - move some of this to parse_config
 
-    termsPath = sydent.config.general.terms_path
+def read_terms(termsPath: str) -> Terms:
+    """Read and parse terms from a file.
 
-    if termsPath == "":
-        return Terms(None)
+    Errors in reading, parsing and validating the config
+    are raised as exceptions."""
+    # Imported here as it's slow to import, and only needed if there are terms.
+    import yaml
 
     with open(termsPath) as fp:
         termsYaml = yaml.safe_load(fp)
@@ -27,7 +27,7 @@ from sydent.db.threepid_associations import LocalAssociationStore
 from sydent.http.httpclient import FederationHttpClient
 from sydent.threepid import ThreepidAssociation
 from sydent.threepid.signer import Signer
-from sydent.util import time_msec
+from sydent.util import time_msec, tracing
 from sydent.util.hash import sha256_and_url_safe_base64
 from sydent.util.stringutils import is_valid_matrix_server_name, normalise_address
 
@@ -135,6 +135,8 @@ class ThreepidBinder:
         localAssocStore.removeAssociation(threepid, mxid)
         self.sydent.pusher.doLocalPush()
 
+    # Retries aren't part of the request which made the binding.
+    @tracing.traced("bind.notify", start_trace=True)
     async def _notify(self, assoc: Dict[str, Any], attempt: int) -> None:
         """
         Sends data about a new association (and, if necessary, the associated invites)
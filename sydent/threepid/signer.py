@@ -16,6 +16,8 @@ from typing import TYPE_CHECKING, Any, Dict
 
 import signedjson.sign
 
+from sydent.util import tracing
+
 if TYPE_CHECKING:
     from sydent.sydent import Sydent
     from sydent.threepid import ThreepidAssociation
@@ -25,6 +27,7 @@ class Signer:
     def __init__(self, sydent: "Sydent") -> None:
         self.sydent = sydent
 
+    @tracing.traced("crypto.sign_association")
     def signedThreePidAssociation(self, assoc: "ThreepidAssociation") -> Dict[str, Any]:
         """
         Signs a 3PID association.
@@ -0,0 +1,82 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import math
+from typing import List
+
+# Counters stop being incremented or decremented once they reach this value, as
+# we can't know any more how many keys they are counting.
+_COUNTER_MAX = 255
+
+
+class CountingBloomFilter:
+    """A Bloom filter which supports removing keys, by keeping a (one byte)
+    counter rather than a single bit for each slot.
+
+    Like any Bloom filter, it can tell for sure that a key was never added, but
+    may report keys that weren't added as present.
+
+    :param capacity: The number of keys the filter is expected to hold.
+    :param false_positive_rate: The desired rate of false positives once the
+        filter holds `capacity` keys.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float) -> None:
+        capacity = max(capacity, 1)
+        self._size = max(
+            int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)), 8
+        )
+        self._hash_count = max(int(round(self._size / capacity * math.log(2))), 1)
+        self._counters = bytearray(self._size)
+
+        # The number of keys currently in the filter.
+        self.count = 0
+
+    def _indexes(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hash_count)]
+
+    def add(self, key: str) -> None:
+        for i in self._indexes(key):
+            if self._counters[i] < _COUNTER_MAX:
+                self._counters[i] += 1
+        self.count += 1
+
+    def remove(self, key: str) -> None:
+        """Remove a key from the filter. The key must have been added first,
+        otherwise the filter could start reporting keys that were added as absent.
+        """
+        for i in self._indexes(key):
+            if 0 < self._counters[i] < _COUNTER_MAX:
+                self._counters[i] -= 1
+        self.count -= 1
+
+    def __contains__(self, key: str) -> bool:
+        counters = self._counters
+        return all(counters[i] for i in self._indexes(key))
+
+    def memory_usage(self) -> int:
+        """The size of the filter's counters, in bytes."""
+        return self._size
+
+    def false_positive_rate(self) -> float:
+        """The expected rate of false positives, given how many keys the filter
+        currently holds.
+        """
+        return (
+            1 - math.exp(-self._hash_count * self.count / self._size)
+        ) ** self._hash_count
@@ -0,0 +1,398 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encoding and decoding of CBOR (RFC 8949), supporting the same data model as JSON
+plus byte strings, which lets lookups exchange raw hashes rather than their base64
+encoding.
+
+This uses cbor2's C extension if it's installed, and a minimal implementation in
+pure Python otherwise, which is several times slower. Both backends reject what's
+outside of the data model when decoding, such as tags and NaN. Only 64-bit floats
+are produced when encoding.
+"""
+
+import io
+import math
+import struct
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import cbor2
+
+    HAS_CBOR2 = True
+except ImportError:
+    HAS_CBOR2 = False
+
+# The major types of data items.
+MAJOR_UINT = 0
+MAJOR_NEGINT = 1
+MAJOR_BYTES = 2
+MAJOR_TEXT = 3
+MAJOR_ARRAY = 4
+MAJOR_MAP = 5
+MAJOR_TAG = 6
+MAJOR_SIMPLE = 7
+
+# The additional information which marks an indefinite-length item.
+INDEFINITE = 31
+
+# Ends an indefinite-length item.
+BREAK = b"\xff"
+
+# How deeply arrays and maps can be nested in decoded items.
+MAX_DEPTH = 64
+
+_FALSE = b"\xf4"
+_TRUE = b"\xf5"
+_NULL = b"\xf6"
+
+
+def encode_head(major: int, value: int) -> bytes:
+    """Encode the head of a data item.
+
+    :param major: The major type of the item.
+    :param value: The argument of the head, e.g. the length of a string.
+
+    :return: The encoded head.
+    """
+    if value < 24:
+        return bytes((major << 5 | value,))
+    if value < 0x100:
+        return struct.pack(">BB", major << 5 | 24, value)
+    if value < 0x10000:
+        return struct.pack(">BH", major << 5 | 25, value)
+    if value < 0x100000000:
+        return struct.pack(">BI", major << 5 | 26, value)
+    if value < 0x10000000000000000:
+        return struct.pack(">BQ", major << 5 | 27, value)
+    raise ValueError("Integer too large to encode: %d" % (value,))
+
+
+def _encode(obj: Any, out: List[bytes]) -> None:
+    """Encode an item, appending the parts of its encoding to the given list."""
+    # Check for the most common types first.
+    if isinstance(obj, str):
+        encoded = obj.encode("utf-8")
+        out.append(encode_head(MAJOR_TEXT, len(encoded)))
+        out.append(encoded)
+    elif isinstance(obj, bytes):
+        out.append(encode_head(MAJOR_BYTES, len(obj)))
+        out.append(obj)
+    elif isinstance(obj, dict):
+        out.append(encode_head(MAJOR_MAP, len(obj)))
+        for key, value in obj.items():
+            _encode(key, out)
+            _encode(value, out)
+    elif isinstance(obj, (list, tuple)):
+        out.append(encode_head(MAJOR_ARRAY, len(obj)))
+        for item in obj:
+            _encode(item, out)
+    elif obj is None:
+        out.append(_NULL)
+    elif obj is True:
+        out.append(_TRUE)
+    elif obj is False:
+        out.append(_FALSE)
+    elif isinstance(obj, int):
+        if obj >= 0:
+            out.append(encode_head(MAJOR_UINT, obj))
+        else:
+            out.append(encode_head(MAJOR_NEGINT, -1 - obj))
+    elif isinstance(obj, float):
+        out.append(struct.pack(">Bd", MAJOR_SIMPLE << 5 | 27, obj))
+    else:
+        raise TypeError("Object of type %s can't be encoded" % (type(obj).__name__,))
+
+
+def _encode_python(obj: Any) -> bytes:
+    out: List[bytes] = []
+    _encode(obj, out)
+    return b"".join(out)
+
+
+class _Decoder:
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self._pos = 0
+
+    def _read(self, length: int) -> bytes:
+        end = self._pos + length
+        if end > len(self._data):
+            raise ValueError("Unexpected end of CBOR data")
+        data = self._data[self._pos : end]
+        self._pos = end
+        return data
+
+    def _read_head(self) -> Tuple[int, int, int]:
+        """Read the head of a data item.
+
+        :return: The major type, the additional information and the argument.
+        """
+        initial = self._read(1)[0]
+        major = initial >> 5
+        info = initial & 0x1F
+        if info < 24:
+            return major, info, info
+        if info == 24:
+            return major, info, self._read(1)[0]
+        if info == 25:
+            return major, info, struct.unpack(">H", self._read(2))[0]
+        if info == 26:
+            return major, info, struct.unpack(">I", self._read(4))[0]
+        if info == 27:
+            return major, info, struct.unpack(">Q", self._read(8))[0]
+        if info == INDEFINITE and major in (
+            MAJOR_BYTES,
+            MAJOR_TEXT,
+            MAJOR_ARRAY,
+            MAJOR_MAP,
+        ):
+            return major, info, 0
+        raise ValueError("Invalid CBOR head: 0x%02x" % (initial,))
+
+    def _at_break(self) -> bool:
+        if self._pos >= len(self._data):
+            raise ValueError("Unexpected end of CBOR data")
+        if self._data[self._pos] == BREAK[0]:
+            self._pos += 1
+            return True
+        return False
+
+    def _read_chunks(self, major: int) -> bytes:
+        """Read the chunks of an indefinite-length string."""
+        chunks = []
+        while not self._at_break():
+            chunk_major, info, length = self._read_head()
+            if chunk_major != major or info == INDEFINITE:
+                raise ValueError("Invalid chunk in indefinite-length string")
+            chunks.append(self._read(length))
+        return b"".join(chunks)
+
+    def decode(self, depth: int = 0) -> Any:
+        """Decode the next data item."""
+        if depth > MAX_DEPTH:
+            raise ValueError("CBOR data is nested too deeply")
+
+        # Fast path for short strings (such as hashes and MXIDs), which make up most
+        # of the data items in lookups.
+        data = self._data
+        pos = self._pos
+        if pos + 1 < len(data) and 0x40 <= data[pos] <= 0x78:
+            initial = data[pos]
+            info = initial & 0x1F
+            if info < 24:
+                start = pos + 1
+                end = start + info
+            elif info == 24:
+                start = pos + 2
+                end = start + data[pos + 1]
+            else:
+                end = -1
+            if 0 <= end <= len(data):
+                self._pos = end
+                if initial >= 0x60:
+                    return data[start:end].decode("utf-8")
+                return data[start:end]
+
+        major, info, arg = self._read_head()
+
+        if major == MAJOR_UINT:
+            return arg
+        if major == MAJOR_NEGINT:
+            return -1 - arg
+        if major == MAJOR_BYTES or major == MAJOR_TEXT:
+            if info == INDEFINITE:
+                data = self._read_chunks(major)
+            else:
+                data = self._read(arg)
+            return data.decode("utf-8") if major == MAJOR_TEXT else data
+        if major == MAJOR_ARRAY:
+            items = []
+            if info == INDEFINITE:
+                while not self._at_break():
+                    items.append(self.decode(depth + 1))
+            else:
+                for _ in range(arg):
+                    items.append(self.decode(depth + 1))
+            return items
+        if major == MAJOR_MAP:
+            result = {}
+            count = 0
+            while (not self._at_break()) if info == INDEFINITE else count < arg:
+                key = self.decode(depth + 1)
+                if isinstance(key, (list, dict)):
+                    raise ValueError("Invalid CBOR map key")
+                result[key] = self.decode(depth + 1)
+                count += 1
+            return result
+        if major == MAJOR_TAG:
+            raise ValueError("CBOR tags aren't supported")
+
+        # Simple values and floats
+        if info == 20:
+            return False
+        if info == 21:
+            return True
+        if info == 22:
+            return None
+        if info == 25:
+            value = struct.unpack(">e", struct.pack(">H", arg))[0]
+        elif info == 26:
+            value = struct.unpack(">f", struct.pack(">I", arg))[0]
+        elif info == 27:
+            value = struct.unpack(">d", struct.pack(">Q", arg))[0]
+        else:
+            raise ValueError("Unsupported CBOR simple value: %d" % (info,))
+
+        # Same as our JSON decoder.
+        if math.isnan(value) or math.isinf(value):
+            raise ValueError("Invalid CBOR value: %r" % (value,))
+        return value
+
+    def at_end(self) -> bool:
+        return self._pos == len(self._data)
+
+
+def _decode_python(data: bytes) -> Any:
+    decoder = _Decoder(data)
+    result = decoder.decode()
+    if not decoder.at_end():
+        raise ValueError("Extra data after the CBOR data item")
+    return result
+
+
+def _encode_cbor2(obj: Any) -> bytes:
+    # Strings, byte strings and containers are encoded the same way as by
+    # _encode_python, and floats as 64-bit ones too.
+    try:
+        return cbor2.dumps(obj)
+    except cbor2.CBOREncodeError as e:
+        raise TypeError(str(e)) from e
+
+
+# The types of decoded items which don't contain other items, and are always valid.
+_LEAF_TYPES = (str, bytes, bool, type(None))
+
+
+def _check_decoded(item: Any, depth: int) -> None:
+    """Check that an item decoded by cbor2 is in the data model the pure Python
+    decoder supports. cbor2 decodes tags into objects of other types (such as
+    datetimes), and lets arrays be map keys by decoding them into tuples.
+
+    :raises: ValueError if the item isn't in the data model.
+    """
+    if depth > MAX_DEPTH:
+        raise ValueError("CBOR data is nested too deeply")
+
+    item_type = type(item)
+    if item_type is list:
+        for child in item:
+            if type(child) not in _LEAF_TYPES:
+                _check_decoded(child, depth + 1)
+    elif item_type is dict:
+        for key, value in item.items():
+            if type(key) not in _LEAF_TYPES:
+                _check_decoded(key, depth + 1)
+            if type(value) not in _LEAF_TYPES:
+                _check_decoded(value, depth + 1)
+    elif item_type is int:
+        # Larger integers can only come from tags.
+        if not -0x10000000000000000 <= item < 0x10000000000000000:
+            raise ValueError("CBOR tags aren't supported")
+    elif item_type is float:
+        # Same as our JSON decoder.
+        if math.isnan(item) or math.isinf(item):
+            raise ValueError("Invalid CBOR value: %r" % (item,))
+    elif item_type not in _LEAF_TYPES:
+        raise ValueError("Unsupported CBOR item: %s" % (item_type.__name__,))
+
+
+def _decode_cbor2(data: bytes) -> Any:
+    fp = io.BytesIO(data)
+    try:
+        result = cbor2.CBORDecoder(fp).decode()
+    except (cbor2.CBORError, RecursionError) as e:
+        raise ValueError(str(e)) from e
+    if fp.tell() != len(data):
+        raise ValueError("Extra data after the CBOR data item")
+    _check_decoded(result, 0)
+    return result
+
+
+Encoder = Callable[[Any], bytes]
+Decoder = Callable[[bytes], Any]
+
+# The available backends, by name.
+BACKENDS: Dict[str, Tuple[Encoder, Decoder]] = {
+    "python": (_encode_python, _decode_python),
+}
+if HAS_CBOR2:
+    BACKENDS["cbor2"] = (_encode_cbor2, _decode_cbor2)
+
+# The name of the backend in use.
+BACKEND = "cbor2" if HAS_CBOR2 else "python"
+
+_encode_item, _decode_item = BACKENDS[BACKEND]
+
+
+def encode(obj: Any) -> bytes:
+    """Encode an item in CBOR.
+
+    :param obj: The item to encode. Can be made of dicts, lists, tuples, strings,
+        bytes, ints, floats, booleans and None.
+
+    :raises: TypeError if the item contains objects of another type.
+
+    :return: The encoded item.
+    """
+    return _encode_item(obj)
+
+
+def encode_items(items: Any) -> bytes:
+    """Encode the items of an array without the array's head, e.g. to add them to
+    an indefinite-length array.
+
+    :param items: The items to encode.
+
+    :return: The concatenation of the encoded items.
+    """
+    return b"".join([_encode_item(item) for item in items])
+
+
+def encode_entries(entries: Dict[Any, Any]) -> bytes:
+    """Encode the entries of a map without the map's head, e.g. to add them to an
+    indefinite-length map.
+
+    :param entries: The entries to encode.
+
+    :return: The concatenation of the encoded keys and values.
+    """
+    parts = []
+    for key, value in entries.items():
+        parts.append(_encode_item(key))
+        parts.append(_encode_item(value))
+    return b"".join(parts)
+
+
+def decode(data: bytes) -> Any:
+    """Decode a CBOR data item.
+
+    :param data: The encoded item.
+
+    :raises: ValueError if the data isn't a single valid CBOR data item, or uses
+        features which aren't supported.
+
+    :return: The decoded item.
+    """
+    return _decode_item(data)
@@ -0,0 +1,29 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def chunks(items: Sequence[T], chunk_size: int) -> Iterator[Sequence[T]]:
+    """Split a list into consecutive slices.
+
+    :param items: The list to split.
+    :param chunk_size: The maximum length of the slices.
+
+    :return: The slices.
+    """
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
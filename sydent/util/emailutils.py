@@ -25,7 +25,7 @@ from typing import TYPE_CHECKING, Dict
 import twisted.python.log
 from prometheus_client import Counter
 
-from sydent.util import time_msec
+from sydent.util import time_msec, tracing
 from sydent.util.tokenutils import generateAlphanumericTokenOfLength
 
 if TYPE_CHECKING:
@@ -36,6 +36,7 @@ logger = logging.getLogger(__name__)
 email_counter = Counter("sydent_emails_sent", "Number of emails we attempted to send")
 
 
+@tracing.traced("email.send")
 def sendEmail(
     sydent: "Sydent",
     templateFile: str,
@@ -97,6 +98,7 @@ def sendEmail(
     mailUsername = sydent.config.email.smtp_username
     mailPassword = sydent.config.email.smtp_password
     mailTLSMode = sydent.config.email.tls_mode
+    tracing.current_span().set_attribute("smtp.host", mailServer)
 
     logger.info(
         "Sending mail to %s with mail server: %s"
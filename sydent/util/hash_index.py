@@ -0,0 +1,396 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import attr
+import unpaddedbase64
+
+logger = logging.getLogger(__name__)
+
+# The size of a SHA-256 digest, in bytes.
+DIGEST_SIZE = 32
+
+# The length of an unpadded base64 encoding of a SHA-256 digest.
+ENCODED_DIGEST_LENGTH = 43
+
+
+def decode_lookup_hash(lookup_hash: str) -> Optional[bytes]:
+    """Turn a lookup hash (url-safe unpadded base64 of a SHA-256 digest) back into
+    the raw digest.
+
+    :param lookup_hash: The lookup hash, as stored in the database or sent by a
+        client.
+
+    :return: The 32-byte digest, or None if the lookup hash isn't the canonical
+        encoding of a SHA-256 digest (in which case it can't be in the index).
+    """
+    if len(lookup_hash) != ENCODED_DIGEST_LENGTH:
+        return None
+    try:
+        digest = unpaddedbase64.decode_base64(lookup_hash)
+    except (binascii.Error, ValueError):
+        return None
+    # Base64 strings with non-zero padding bits decode to the same digest as the
+    # canonical encoding, but would never match it in the database.
+    if unpaddedbase64.encode_base64(digest, urlsafe=True) != lookup_hash:
+        return None
+    return digest
+
+
+class _DigestView:
+    """A read-only sequence of the digests in a sorted buffer, so that the buffer
+    can be searched with `bisect`.
+    """
+
+    def __init__(self, buf: Union[bytes, bytearray]) -> None:
+        self._buf = buf
+
+    def __len__(self) -> int:
+        return len(self._buf) // DIGEST_SIZE
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self._buf[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE])
+
+
+class _StringTable:
+    """A deduplicated table of strings, stored as one UTF-8 encoded buffer and the
+    offset of each string in it.
+
+    The strings the table was built from are expected to be sorted by their UTF-8
+    encoding, so that `intern` can find them with a binary search. Strings added
+    later on are tracked in a (hopefully small) dict instead.
+    """
+
+    def __init__(self, strings: Iterable[str] = ()) -> None:
+        self._blob = bytearray()
+        self._offsets = array("Q", [0])
+        for s in strings:
+            self._blob += s.encode("utf-8")
+            self._offsets.append(len(self._blob))
+
+        self._sorted_count = len(self)
+        self._extra: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _get_encoded(self, i: int) -> bytes:
+        return bytes(self._blob[self._offsets[i] : self._offsets[i + 1]])
+
+    def get(self, i: int) -> str:
+        return self._get_encoded(i).decode("utf-8")
+
+    def intern(self, s: str) -> int:
+        """Return the ID of the given string, adding it to the table if needed."""
+        encoded = s.encode("utf-8")
+        i = bisect_left(_SortedStringsView(self), encoded)
+        if i < self._sorted_count and self._get_encoded(i) == encoded:
+            return i
+
+        string_id = self._extra.get(s)
+        if string_id is None:
+            string_id = len(self)
+            self._blob += encoded
+            self._offsets.append(len(self._blob))
+            self._extra[s] = string_id
+        return string_id
+
+    def memory_usage(self) -> int:
+        return (
+            len(self._blob)
+            + len(self._offsets) * self._offsets.itemsize
+            + sys.getsizeof(self._extra)
+        )
+
+
+class _SortedStringsView:
+    """The sorted part of a string table, as a sequence that `bisect` can search."""
+
+    def __init__(self, table: _StringTable) -> None:
+        self._table = table
+
+    def __len__(self) -> int:
+        return self._table._sorted_count
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._table._get_encoded(i)
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class _OverlayEntry:
+    mxid: str
+    ts: int
+    not_before: int
+    not_after: int
+
+
+# A row to build the index from: (digest, mxid ID, ts, notBefore, notAfter).
+IndexRow = Tuple[bytes, int, int, int, int]
+
+
+class LookupHashIndex:
+    """An in-memory index from lookup hashes to MXIDs, meant to answer hashed
+    lookups on large deployments without hitting the database.
+
+    The digests are stored back to back in a single sorted buffer, with the MXID
+    (as an ID in a deduplicated string table) and validity period of each
+    association in arrays alongside it. A batch of lookups is sorted, then
+    answered with a single pass of binary searches over the buffer.
+
+    Changes go into a small dict ("the overlay"), which takes precedence over
+    the sorted buffer and is merged into it periodically with `merge`.
+    Deletions are recorded in the overlay as tombstones.
+
+    If there are several associations for the same lookup hash, the most recent
+    one (by `ts`) wins. Lookups report the lookup hashes for which it isn't
+    valid, so that older associations can be looked for in the database.
+    """
+
+    def __init__(self, overlay_size: int = 10000) -> None:
+        self._overlay_size = overlay_size
+
+        self._digests = b""
+        self._mxid_ids = array("I")
+        self._ts = array("q")
+        self._not_before = array("q")
+        self._not_after = array("q")
+        self._strings = _StringTable()
+
+        # Changes not yet merged into the buffers. `None` marks a deletion.
+        self._overlay: Dict[bytes, Optional[_OverlayEntry]] = {}
+
+        # The highest ID from the global associations table that this index
+        # reflects.
+        self.last_id = -1
+
+    @classmethod
+    def build(
+        cls,
+        rows: Iterable[IndexRow],
+        mxids: Iterable[str],
+        last_id: int,
+        overlay_size: int = 10000,
+    ) -> "LookupHashIndex":
+        """Build an index.
+
+        :param rows: The associations to index, sorted by digest and then by ts.
+        :param mxids: The MXIDs referenced by ID from `rows`, sorted.
+        :param last_id: The highest association ID the rows were read up to.
+        :param overlay_size: How many changes to buffer before merging.
+
+        :return: The new index.
+        """
+        index = cls(overlay_size)
+        index._strings = _StringTable(mxids)
+
+        digests = bytearray()
+        prev_digest = None
+        for digest, mxid_id, ts, not_before, not_after in rows:
+            if digest == prev_digest:
+                # A more recent association for the same hash: replace the
+                # previous one.
+                index._mxid_ids[-1] = mxid_id
+                index._ts[-1] = ts
+                index._not_before[-1] = not_before
+                index._not_after[-1] = not_after
+                continue
+
+            digests += digest
+            index._mxid_ids.append(mxid_id)
+            index._ts.append(ts)
+            index._not_before.append(not_before)
+            index._not_after.append(not_after)
+            prev_digest = digest
+
+        index._digests = bytes(digests)
+        index.last_id = last_id
+        return index
+
+    def __len__(self) -> int:
+        """The number of entries in the sorted buffer, excluding the overlay."""
+        return len(self._digests) // DIGEST_SIZE
+
+    def memory_usage(self) -> int:
+        """An estimate of the memory used by the index, in bytes."""
+        arrays_size = sum(
+            len(a) * a.itemsize
+            for a in (self._mxid_ids, self._ts, self._not_before, self._not_after)
+        )
+        overlay_size = sys.getsizeof(self._overlay) + len(self._overlay) * (
+            sys.getsizeof(b"") + DIGEST_SIZE + 100
+        )
+        return (
+            len(self._digests)
+            + arrays_size
+            + self._strings.memory_usage()
+            + overlay_size
+        )
+
+    def _find(self, digest: bytes, lo: int = 0) -> int:
+        """Find the position of a digest in the sorted buffer, or where it would be
+        inserted.
+        """
+        return bisect_left(_DigestView(self._digests), digest, lo)
+
+    def _is_at(self, digest: bytes, i: int) -> bool:
+        return (
+            i < len(self)
+            and self._digests[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE] == digest
+        )
+
+    def lookup_many(
+        self, lookup_hashes: Iterable[str], now: int
+    ) -> Tuple[Dict[str, str], List[str]]:
+        """Look up the MXIDs for a batch of lookup hashes.
+
+        :param lookup_hashes: The lookup hashes to look up.
+        :param now: The current time, in milliseconds. Associations are only
+            returned if it is within their validity period.
+
+        :return: A dict mapping lookup hashes to the MXIDs found for them, and the
+            lookup hashes whose most recent association isn't valid at `now`. An
+            older association might still be valid for those, but the index
+            doesn't keep them, so they have to be looked up elsewhere. Lookup hashes
+            with no association at all are omitted from both.
+        """
+        queries: List[Tuple[bytes, str]] = []
+        for lookup_hash in lookup_hashes:
+            digest = decode_lookup_hash(lookup_hash)
+            if digest is not None:
+                queries.append((digest, lookup_hash))
+
+        # Sorting the batch means that every binary search can start from where
+        # the previous one ended.
+        queries.sort()
+
+        results: Dict[str, str] = {}
+        expired: List[str] = []
+        lo = 0
+        for digest, lookup_hash in queries:
+            if digest in self._overlay:
+                entry = self._overlay[digest]
+                if entry is None:
+                    continue
+                if entry.not_before < now < entry.not_after:
+                    results[lookup_hash] = entry.mxid
+                else:
+                    expired.append(lookup_hash)
+                continue
+
+            lo = self._find(digest, lo)
+            if not self._is_at(digest, lo):
+                continue
+            if self._not_before[lo] < now < self._not_after[lo]:
+                results[lookup_hash] = self._strings.get(self._mxid_ids[lo])
+            else:
+                expired.append(lookup_hash)
+
+        return results, expired
+
+    def add(
+        self, lookup_hash: str, mxid: str, ts: int, not_before: int, not_after: int
+    ) -> None:
+        """Add an association to the index, unless a more recent one is already
+        indexed for the same lookup hash.
+        """
+        digest = decode_lookup_hash(lookup_hash)
+        if digest is None:
+            logger.warning("Not indexing malformed lookup hash %r", lookup_hash)
+            return
+
+        current_ts: Optional[int] = None
+        if digest in self._overlay:
+            current = self._overlay[digest]
+            if current is not None:
+                current_ts = current.ts
+        else:
+            i = self._find(digest)
+            if self._is_at(digest, i):
+                current_ts = self._ts[i]
+
+        if current_ts is not None and current_ts > ts:
+            return
+
+        self._overlay[digest] = _OverlayEntry(mxid, ts, not_before, not_after)
+        self._maybe_merge()
+
+    def remove(self, lookup_hash: str) -> None:
+        """Remove any association for the given lookup hash from the index."""
+        digest = decode_lookup_hash(lookup_hash)
+        if digest is None:
+            return
+        self._overlay[digest] = None
+        self._maybe_merge()
+
+    def _maybe_merge(self) -> None:
+        if len(self._overlay) >= self._overlay_size:
+            self.merge()
+
+    def merge(self) -> None:
+        """Merge the overlay into the sorted buffer."""
+        if not self._overlay:
+            return
+
+        digests = bytearray()
+        mxid_ids = array("I")
+        ts = array("q")
+        not_before = array("q")
+        not_after = array("q")
+
+        def copy_range(start: int, end: int) -> None:
+            digests.extend(self._digests[start * DIGEST_SIZE : end * DIGEST_SIZE])
+            mxid_ids.extend(self._mxid_ids[start:end])
+            ts.extend(self._ts[start:end])
+            not_before.extend(self._not_before[start:end])
+            not_after.extend(self._not_after[start:end])
+
+        # Copy the unchanged runs of the buffer in one go, and splice the overlay
+        # entries in between them.
+        prev = 0
+        for digest, entry in sorted(self._overlay.items(), key=lambda kv: kv[0]):
+            i = self._find(digest, prev)
+            copy_range(prev, i)
+            if self._is_at(digest, i):
+                # Skip the entry this one replaces or deletes.
+                i += 1
+            prev = i
+
+            if entry is not None:
+                digests.extend(digest)
+                mxid_ids.append(self._strings.intern(entry.mxid))
+                ts.append(entry.ts)
+                not_before.append(entry.not_before)
+                not_after.append(entry.not_after)
+
+        copy_range(prev, len(self))
+
+        logger.debug(
+            "Merged %d changes into lookup hash index (%d -> %d entries)",
+            len(self._overlay),
+            len(self),
+            len(digests) // DIGEST_SIZE,
+        )
+
+        self._digests = bytes(digests)
+        self._mxid_ids = mxid_ids
+        self._ts = ts
+        self._not_before = not_before
+        self._not_after = not_after
+        self._overlay = {}
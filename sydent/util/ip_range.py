@@ -79,7 +79,7 @@ def generate_ip_set(
     Returns:
         A new IP set.
     """
-    result = IPSet()
+    networks = []
     for ip in itertools.chain(ip_addresses or (), extra_addresses or ()):
         try:
             network = IPNetwork(ip)
@@ -87,15 +87,17 @@ def generate_ip_set(
             raise Exception(
                 "Invalid IP range provided: %s." % (ip,), config_path
             ) from e
-        result.add(network)
+        networks.append(network)
 
         # It is possible that these already exist in the set, but that's OK.
         if ":" not in str(network):
-            result.add(IPNetwork(network).ipv6(ipv4_compatible=True))
-            result.add(IPNetwork(network).ipv6(ipv4_compatible=False))
-            result.add(_6to4(network))
+            networks.append(IPNetwork(network).ipv6(ipv4_compatible=True))
+            networks.append(IPNetwork(network).ipv6(ipv4_compatible=False))
+            networks.append(_6to4(network))
 
-    return result
+    # Merging the networks all at once is much quicker than adding them one by
+    # one, as IPSet.add merges them with the whole set every time.
+    return IPSet(networks)
 
 
 def _6to4(network: IPNetwork) -> IPNetwork:
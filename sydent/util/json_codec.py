@@ -0,0 +1,141 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encoding and decoding of JSON, using orjson if it's installed and the standard
+library's json module otherwise.
+
+Both backends produce compact UTF-8 JSON, and reject the Python extensions to
+JSON (NaN, Infinity and -Infinity) and unpaired surrogates (which can't be encoded
+in UTF-8) when decoding. Values orjson can't encode, such as integers which don't
+fit in 64 bits, are encoded with the json module instead. orjson would decode
+such integers into floats, which would change signed JSON, so JSON which may
+contain them is decoded with the json module too.
+
+Encoding signed JSON must still go through signedjson, which produces the
+canonical JSON signatures are computed over.
+"""
+
+import json
+import re
+import sys
+from typing import Any, Callable, Dict, Tuple, Union
+
+from sydent.util import json_decoder
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# Escapes of surrogates, which the json module decodes even when they aren't part
+# of a pair.
+_SURROGATE_ESCAPE = re.compile(r"\\u[dD][89a-fA-F]")
+
+# Maps digits to "0", and every other byte to a space. A run of this many digits
+# may be an integer which doesn't fit in 64 bits. Translating is much quicker than
+# searching with a regular expression.
+_DIGITS_TO_ZEROS = bytes(0x30 if 0x30 <= i <= 0x39 else 0x20 for i in range(256))
+_LONG_NUMBER = b"0" * 19
+
+
+def _encode_stdlib(value: Any) -> bytes:
+    return _json_encoder.encode(value).encode("UTF-8")
+
+
+def _decode_stdlib(data: Union[bytes, str]) -> Any:
+    if isinstance(data, bytes):
+        data = data.decode("UTF-8")
+    value = json_decoder.decode(data)
+    reject_unpaired_surrogates(value, data)
+    return value
+
+
+def _encode_orjson(value: Any) -> bytes:
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return _encode_stdlib(value)
+
+
+def _decode_orjson(data: Union[bytes, str]) -> Any:
+    raw = data if isinstance(data, bytes) else data.encode("UTF-8", "surrogatepass")
+    if _LONG_NUMBER in raw.translate(_DIGITS_TO_ZEROS):
+        return _decode_stdlib(data)
+    # orjson is strict already: it rejects NaN, Infinity, -Infinity and unpaired
+    # surrogates.
+    return orjson.loads(data)
+
+
+Encoder = Callable[[Any], bytes]
+Decoder = Callable[[Union[bytes, str]], Any]
+
+# The available backends, by name.
+BACKENDS: Dict[str, Tuple[Encoder, Decoder]] = {
+    "json": (_encode_stdlib, _decode_stdlib),
+}
+if HAS_ORJSON:
+    BACKENDS["orjson"] = (_encode_orjson, _decode_orjson)
+
+# The name of the backend in use.
+BACKEND = "orjson" if HAS_ORJSON else "json"
+
+_encode, _decode = BACKENDS[BACKEND]
+
+
+def reject_unpaired_surrogates(
+    value: Any, text: str, start: int = 0, end: int = sys.maxsize
+) -> None:
+    """Check that a value decoded with the json module doesn't contain unpaired
+    surrogates, which it decodes from their escapes.
+
+    :param value: The decoded value.
+    :param text: The JSON the value was decoded from.
+    :param start: Where the value starts in the text.
+    :param end: Where the value ends in the text.
+
+    :raises ValueError: if the value contains an unpaired surrogate.
+    """
+    if _SURROGATE_ESCAPE.search(text, start, end):
+        # Surrogate pairs encode fine, only unpaired surrogates fail.
+        try:
+            _encode_stdlib(value)
+        except UnicodeEncodeError:
+            raise ValueError("Unpaired surrogate in JSON string")
+
+
+def encode_json(value: Any) -> bytes:
+    """Encode a value as JSON.
+
+    :param value: The value to encode.
+
+    :return: The UTF-8 encoded JSON.
+    """
+    return _encode(value)
+
+
+def decode_json(data: Union[bytes, str]) -> Any:
+    """Decode JSON.
+
+    :param data: The JSON, as UTF-8 encoded bytes or as a string.
+
+    :return: The decoded value.
+
+    :raises ValueError: if the data isn't valid UTF-8 or JSON, or if it contains
+        NaN, Infinity or -Infinity.
+    """
+    return _decode(data)
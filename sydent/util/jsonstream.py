@@ -0,0 +1,190 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import re
+from typing import IO, Any, Callable, Dict
+
+from sydent.util import json_decoder
+from sydent.util.json_codec import reject_unpaired_surrogates
+
+# How many bytes of the stream to read and decode at a time.
+BLOCK_SIZE = 16 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+# Matches what's left of the buffer after a number, if the number could carry on
+# past the end of the buffer.
+_NUMBER_TAIL = re.compile(r"[0-9+\-.eE]*\Z")
+
+
+class _JsonReader:
+    """Reads JSON tokens and values from a stream of UTF-8 encoded bytes, only
+    keeping the part of the stream which hasn't been parsed yet in memory.
+
+    :param stream: The stream to read.
+    :param block_size: How many bytes to read from the stream at a time.
+    """
+
+    def __init__(self, stream: IO[bytes], block_size: int) -> None:
+        self._stream = stream
+        self._block_size = block_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Read the next block of the stream into the buffer.
+
+        :return: False if the whole stream has already been read, True otherwise.
+        """
+        if self._eof:
+            return False
+
+        data = self._stream.read(self._block_size)
+        if data:
+            text = self._decoder.decode(data)
+        else:
+            self._eof = True
+            text = self._decoder.decode(b"", final=True)
+
+        # Drop the part of the buffer which has already been parsed.
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip any whitespace and return the next character, without consuming it.
+
+        :return: The next character, or an empty string at the end of the stream.
+        """
+        while True:
+            while (
+                self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE
+            ):
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Skip any whitespace and consume the next character.
+
+        :param chars: The characters allowed at this point.
+
+        :raises: ValueError if the next character isn't one of the allowed ones.
+
+        :return: The character consumed.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of %r, got %r" % (chars, char))
+        self._pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Skip any whitespace and parse the next JSON value.
+
+        :raises: ValueError if the next value isn't valid JSON, or contains an
+            unpaired surrogate (which json_codec rejects too).
+
+        :return: The parsed value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # The value may just be cut off by the end of the buffer.
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer may carry on in the next block, e.g.
+            # "1.5" may have been cut off as "1." and parsed as 1.
+            if (
+                isinstance(value, (int, float))
+                and _NUMBER_TAIL.match(self._buffer, end)
+                and self._fill()
+            ):
+                continue
+
+            reject_unpaired_surrogates(value, self._buffer, self._pos, end)
+            self._pos = end
+            return value
+
+
+def parse_json_object(
+    stream: IO[bytes],
+    array_key: str,
+    parse_item: Callable[[Any], Any],
+    block_size: int = BLOCK_SIZE,
+) -> Dict[str, Any]:
+    """Parse a JSON object from a stream of UTF-8 encoded bytes, parsing the items
+    of one of its arrays one at a time, as they are read.
+
+    This avoids holding the whole body, its decoded text and the parsed result in
+    memory at the same time, and lets the caller reject the body as soon as one of
+    the items is found to be invalid, or there are too many of them.
+
+    :param stream: The stream to read the object from.
+    :param array_key: The key of the array whose items to parse one at a time.
+    :param parse_item: Called with each item of the array as soon as it's parsed.
+        Its return value replaces the item in the result. Any exception it raises
+        stops the parsing.
+    :param block_size: How many bytes to read from the stream at a time.
+
+    :raises: ValueError if the stream doesn't contain a valid JSON object.
+
+    :return: The parsed object. If the value for the given key is an array, it's
+        replaced by a list of the values returned by parse_item.
+    """
+    reader = _JsonReader(stream, block_size)
+    result: Dict[str, Any] = {}
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.expect("}")
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError("Expecting property name enclosed in double quotes")
+            reader.expect(":")
+
+            if key == array_key and reader.peek() == "[":
+                reader.expect("[")
+                items = []
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        items.append(parse_item(reader.value()))
+                        if reader.expect(",]") == "]":
+                            break
+                result[key] = items
+            else:
+                result[key] = reader.value()
+
+            if reader.expect(",}") == "}":
+                break
+
+    if reader.peek():
+        raise ValueError("Extra data after the JSON object")
+
+    return result
@@ -0,0 +1,114 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from prometheus_client import Counter
+
+cache_hits = Counter("sydent_cache_hits", "Number of cache hits", ["name"])
+cache_misses = Counter("sydent_cache_misses", "Number of cache misses", ["name"])
+cache_evictions = Counter(
+    "sydent_cache_evictions",
+    "Number of entries removed from a cache, by reason ('size', 'expired' or "
+    "'invalidated')",
+    ["name", "reason"],
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LruTtlCache(Generic[K, V]):
+    """A key/value cache holding at most a given number of entries, evicting the
+    least recently used ones first. Entries also expire after a fixed amount of
+    time.
+
+    :param cache_name: The name of the cache, used in metrics.
+    :param max_size: The maximum number of entries in the cache.
+    :param ttl: How long entries stay in the cache, in seconds.
+    :param timer: A function returning the current time, in seconds.
+    """
+
+    def __init__(
+        self,
+        cache_name: str,
+        max_size: int,
+        ttl: float,
+        timer: Callable[[], float],
+    ) -> None:
+        self._max_size = max_size
+        self._ttl = ttl
+        self._timer = timer
+
+        # Maps keys to their expiry time and value, least recently used first.
+        self._data: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+
+        self._hits = cache_hits.labels(cache_name)
+        self._misses = cache_misses.labels(cache_name)
+        self._evicted_size = cache_evictions.labels(cache_name, "size")
+        self._evicted_expired = cache_evictions.labels(cache_name, "expired")
+        self._evicted_invalidated = cache_evictions.labels(cache_name, "invalidated")
+
+    def get(self, key: K) -> Optional[V]:
+        """Get a value from the cache.
+
+        :param key: The key to look up.
+
+        :return: The value, or None if the key isn't in the cache or has expired.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self._misses.inc()
+            return None
+
+        expiry_time, value = entry
+        if expiry_time <= self._timer():
+            del self._data[key]
+            self._evicted_expired.inc()
+            self._misses.inc()
+            return None
+
+        self._data.move_to_end(key)
+        self._hits.inc()
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        """Add or update an entry in the cache, evicting the least recently used
+        entry if the cache is full.
+
+        :param key: Key for this entry.
+        :param value: Value for this entry.
+        """
+        self._data[key] = (self._timer() + self._ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+            self._evicted_size.inc()
+
+    def invalidate(self, key: K) -> None:
+        """Remove an entry from the cache, if it's in there.
+
+        :param key: The key to remove.
+        """
+        if self._data.pop(key, None) is not None:
+            self._evicted_invalidated.inc()
+
+    def clear(self) -> None:
+        """Remove all the entries from the cache."""
+        self._evicted_invalidated.inc(len(self._data))
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
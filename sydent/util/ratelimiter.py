@@ -12,25 +12,46 @@
 #  limitations under the License.
 
 import logging
+import math
 from http import HTTPStatus
-from typing import Dict, Generic, Optional, TypeVar
+from typing import Dict, Generic, Optional, Tuple, TypeVar
 
 from twisted.internet import task
 from twisted.internet.interfaces import IReactorTime
 
 from sydent.http.servlets import MatrixRestError
+from sydent.types import JsonDict
 
 logger = logging.getLogger(__name__)
 
 K = TypeVar("K")
 
+# How often to remove the buckets which have emptied, in seconds.
+_CLEANUP_INTERVAL = 60.0
+
 
 class LimitExceededException(MatrixRestError):
-    def __init__(self, error: Optional[str] = None) -> None:
+    def __init__(
+        self, error: Optional[str] = None, retry_after_ms: Optional[int] = None
+    ) -> None:
         if error is None:
             error = "Too many requests"
 
-        super().__init__(HTTPStatus.TOO_MANY_REQUESTS, "M_UNKNOWN", error)
+        super().__init__(HTTPStatus.TOO_MANY_REQUESTS, "M_LIMIT_EXCEEDED", error)
+        self.retry_after_ms = retry_after_ms
+
+    def error_dict(self) -> JsonDict:
+        result = super().error_dict()
+        if self.retry_after_ms is not None:
+            result["retry_after_ms"] = self.retry_after_ms
+        return result
+
+
+def _check_rate(burst: Optional[int], rate_hz: float) -> None:
+    # Buckets which never leak would deny requests forever, and the time to wait
+    # couldn't be computed.
+    if burst is not None and rate_hz <= 0:
+        raise ValueError("rate_hz must be greater than 0, got %r" % (rate_hz,))
 
 
 class Ratelimiter(Generic[K]):
@@ -38,48 +59,123 @@ class Ratelimiter(Generic[K]):
 
     Args:
         reactor
-        burst: the number of requests that can happen at once before we start
-            ratelimiting
-        rate_hz: The maximum average sustained rate in hertz of requests we'll
-            accept.
+        burst: the number of requests (or, more generally, the total cost of the
+            requests) that can happen at once before we start ratelimiting, or
+            None to not ratelimit at all
+        rate_hz: The maximum average sustained rate in hertz of requests (or cost)
+            we'll accept. Must be positive, unless burst is None.
+
+    Raises:
+        ValueError: if rate_hz isn't positive.
     """
 
-    def __init__(self, reactor: IReactorTime, burst: int, rate_hz: float) -> None:
+    def __init__(
+        self, reactor: IReactorTime, burst: Optional[int], rate_hz: float
+    ) -> None:
+        _check_rate(burst, rate_hz)
+        self._reactor = reactor
+
         # The "burst" count (or the capacity of each bucket in leaky bucket
         # algorithm).
         self._burst = burst
+        self._rate_hz = rate_hz
 
-        # A map from key to number of tokens in its bucket. We ratelimit when
-        # the number of tokens is greater than `burst`.
-        #
-        # Entries are removed when token count hits zero.
-        self._buckets: Dict[K, int] = {}
+        # A map from key to the number of tokens in its bucket, and the time at
+        # which that number was computed. Buckets leak continuously at `rate_hz`
+        # tokens per second, and we ratelimit when adding a request's tokens would
+        # make the number of tokens greater than `burst`.
+        self._buckets: Dict[K, Tuple[float, float]] = {}
 
-        # We remove tokens from all buckets at `rate_hz` hertz.
+        # Periodically remove the buckets which have emptied.
         call = task.LoopingCall(self._periodic_call)
         call.clock = reactor
-        call.start(1 / rate_hz)
+        call.start(_CLEANUP_INTERVAL)
+
+    def _current_tokens(self, key: K, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (0.0, now))
+        return max(0.0, tokens - (now - updated_at) * self._rate_hz)
 
     def _periodic_call(self) -> None:
-        # Take one away from all active buckets. If a bucket reaches zero then
-        # remove it from the dict.
-        self._buckets = {
-            key: tokens - 1 for key, tokens in self._buckets.items() if tokens > 1
-        }
+        now = self._reactor.seconds()
+        buckets = {}
+        for key in self._buckets:
+            tokens = self._current_tokens(key, now)
+            if tokens > 0:
+                buckets[key] = (tokens, now)
+        self._buckets = buckets
+
+    def reconfigure(self, burst: Optional[int], rate_hz: float) -> None:
+        """Change the limits, e.g. when the config is reloaded. Requests already
+        counted stay counted.
+
+        Args:
+            burst: the new number of requests that can happen at once, or None to
+                stop ratelimiting.
+            rate_hz: the new maximum average sustained rate of requests.
+
+        Raises:
+            ValueError: if rate_hz isn't positive.
+        """
+        _check_rate(burst, rate_hz)
+        # Bring the buckets up to date at the old rate first.
+        self._periodic_call()
+        self._burst = burst
+        self._rate_hz = rate_hz
+
+    def check(self, key: K, error: Optional[str] = None, cost: int = 1) -> None:
+        """Check if we should ratelimit the request with the given key, without
+        counting it. This lets a request be checked against several ratelimiters
+        before it's counted by any of them.
 
-    def ratelimit(self, key: K, error: Optional[str] = None) -> None:
-        """Check if we should ratelimit the request with the given key.
+        Args:
+            key: the key to ratelimit the request by.
+            error: the error message to send if the request is denied.
+            cost: the number of tokens the request costs.
 
         Raises:
             LimitExceededException: if the request should be denied.
         """
+        if self._burst is not None:
+            self._check(key, error, min(cost, self._burst), self._reactor.seconds())
+
+    def ratelimit(self, key: K, error: Optional[str] = None, cost: int = 1) -> None:
+        """Check if we should ratelimit the request with the given key, and count it
+        if not.
+
+        Args:
+            key: the key to ratelimit the request by.
+            error: the error message to send if the request is denied.
+            cost: the number of tokens the request costs. Requests costing more
+                than `burst` are counted as costing `burst`, so that they can
+                still happen once the bucket is empty.
+
+        Raises:
+            LimitExceededException: if the request should be denied.
+        """
+        if self._burst is None:
+            return
+
+        cost = min(cost, self._burst)
+        now = self._reactor.seconds()
+        current_tokens = self._check(key, error, cost, now)
+        self._buckets[key] = (current_tokens + cost, now)
+
+    def _check(self, key: K, error: Optional[str], cost: int, now: float) -> float:
+        """Raise if the request with the given key and cost should be denied, and
+        otherwise return the current number of tokens in its bucket.
+        """
+        assert self._burst is not None
+
         if error is None:
             error = "Too many requests"
 
-        # We get the current token count and compare it with the `burst`.
-        current_tokens = self._buckets.get(key, 0)
-        if current_tokens >= self._burst:
+        # We get the current token count and check it leaves room for the cost of
+        # the request.
+        current_tokens = self._current_tokens(key, now)
+        excess = current_tokens + cost - self._burst
+        if excess > 0:
             logger.warning("Ratelimit hit: %s: %s", error, key)
-            raise LimitExceededException(error)
-
-        self._buckets[key] = current_tokens + 1
+            raise LimitExceededException(
+                error, retry_after_ms=math.ceil(excess / self._rate_hz * 1000)
+            )
+        return current_tokens
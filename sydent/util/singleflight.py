@@ -0,0 +1,81 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, TypeVar, Union
+
+from prometheus_client import Counter
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+coalesced_calls = Counter(
+    "sydent_singleflight_coalesced_calls",
+    "Number of calls which waited for an identical call already in flight",
+    ["name"],
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """Makes concurrent calls with the same key share a single call, rather than
+    each doing the same work.
+
+    :param name: The name of the calls, used in metrics.
+    """
+
+    def __init__(self, name: str) -> None:
+        # Maps the keys of the calls in flight to the Deferreds of the callers
+        # waiting for them, other than the first one.
+        self._in_flight: Dict[K, List["defer.Deferred[V]"]] = {}
+        self._coalesced = coalesced_calls.labels(name)
+
+    def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> "defer.Deferred[V]":
+        """Call the given function, unless a call with the same key is already in
+        flight, in which case wait for its result instead.
+
+        :param key: The key identifying the call.
+        :param fn: The function to call. It's only called if there is no call with
+            the same key in flight.
+
+        :return: The result of the call, or its failure.
+        """
+        waiters = self._in_flight.get(key)
+        if waiters is not None:
+            self._coalesced.inc()
+            d: "defer.Deferred[V]" = defer.Deferred()
+            waiters.append(d)
+            return d
+
+        waiters = []
+        self._in_flight[key] = waiters
+
+        def done(result: Union[V, Failure]) -> Union[V, Failure]:
+            del self._in_flight[key]
+            for waiter in waiters:
+                if isinstance(result, Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+            return result
+
+        async def call() -> V:
+            return await fn()
+
+        first = defer.ensureDeferred(call())
+        first.addBoth(done)
+        return first
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,316 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lightweight tracing, recording how long requests spend in each step of
+processing them (database queries, signing, outbound HTTP requests, ...).
+
+Each step is a span, and spans started while another one is active become its
+children, forming a trace. The active span is held in a context variable, which
+Twisted propagates to coroutines run with `defer.ensureDeferred` (and to
+`inlineCallbacks` functions), so spans carry across awaits.
+
+Finished spans are passed to the configured exporters. When tracing is disabled
+(the default), starting a span costs next to nothing.
+"""
+
+import functools
+import inspect
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+    cast,
+)
+
+import attr
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+from sydent.util.json_codec import encode_json
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@attr.s(slots=True, auto_attribs=True, eq=False)
+class Span:
+    """A step of processing a request.
+
+    :param name: What the step is, e.g. "db.execute".
+    :param trace_id: The ID of the trace the span belongs to.
+    :param span_id: The ID of the span.
+    :param parent_id: The ID of the span's parent, or None if it's the root of
+        its trace.
+    :param recording: Whether the span is recorded. Spans which aren't are
+        shared, and ignore attributes.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    recording: bool = True
+    attributes: Dict[str, Any] = attr.Factory(dict)
+    # The wall-clock time the span started at, in seconds since the epoch.
+    start: float = attr.Factory(time.time)
+    duration: Optional[float] = None
+    error: Optional[str] = None
+    _started: float = attr.Factory(time.perf_counter)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Attach some information to the span.
+
+        :param key: The name of the information.
+        :param value: The information, which must be JSON-serialisable.
+        """
+        if self.recording:
+            self.attributes[key] = value
+
+    def finish(self, error: Union[None, str, BaseException, Failure] = None) -> None:
+        """Mark the span as finished, and export it. Only the first call has any
+        effect.
+
+        :param error: The error the step failed with, if any.
+        """
+        if not self.recording or self.duration is not None:
+            return
+
+        self.duration = time.perf_counter() - self._started
+        if isinstance(error, Failure):
+            error = error.value
+        if isinstance(error, BaseException):
+            error = "%s: %s" % (type(error).__name__, error)
+        self.error = error
+
+        for exporter in _exporters:
+            try:
+                exporter.export(self)
+            except Exception:
+                logger.exception("Failed to export span %s", self.name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The span, as a JSON-serialisable dict.
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """Receives finished spans."""
+
+    def export(self, span: Span) -> None:
+        raise NotImplementedError()
+
+
+class LogSpanExporter(SpanExporter):
+    """Logs finished spans, as JSON."""
+
+    def export(self, span: Span) -> None:
+        logger.info("Span: %s", encode_json(span.to_dict()).decode("UTF-8"))
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """Appends finished spans to a file, one JSON object per line.
+
+    :param path: The path of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file: IO[bytes] = open(path, "ab")
+
+    def export(self, span: Span) -> None:
+        self._file.write(encode_json(span.to_dict()) + b"\n")
+        # Avoid a write per span: root spans finish last (usually).
+        if span.parent_id is None:
+            self._file.flush()
+
+
+_exporters: List[SpanExporter] = []
+_sample_rate = 1.0
+
+# The span which isn't recorded. It's active while processing requests which
+# aren't sampled, so that their steps aren't recorded either.
+_NOT_RECORDING = Span("", "", "", None, recording=False)
+
+_current_span: ContextVar[Optional[Span]] = ContextVar(
+    "sydent_current_span", default=None
+)
+
+
+def configure(exporters: Sequence[SpanExporter], sample_rate: float = 1.0) -> None:
+    """Set up tracing. Tracing is disabled if there are no exporters.
+
+    :param exporters: Where to send finished spans.
+    :param sample_rate: The ratio of traces to record, between 0 and 1.
+    """
+    global _sample_rate
+    _exporters[:] = exporters
+    _sample_rate = sample_rate
+
+
+def is_enabled() -> bool:
+    """
+    :return: Whether tracing is enabled.
+    """
+    return bool(_exporters)
+
+
+def _new_id(bits: int) -> str:
+    return "%0*x" % (bits // 4, random.getrandbits(bits))
+
+
+def current_span() -> Span:
+    """
+    :return: The active span, or a span which isn't recorded if there's none.
+    """
+    return _current_span.get() or _NOT_RECORDING
+
+
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    start_trace: bool = False,
+) -> Span:
+    """Start a span, as a child of the active one, without making it active.
+
+    :param name: What the step is.
+    :param attributes: Information about the step.
+    :param start_trace: Whether to start a new trace if there's no active span.
+        Otherwise, steps happening outside of any trace aren't recorded.
+
+    :return: The span, which must be finished.
+    """
+    if not _exporters:
+        return _NOT_RECORDING
+
+    parent = _current_span.get()
+    if parent is None:
+        if not start_trace or random.random() >= _sample_rate:
+            return _NOT_RECORDING
+        trace_id = _new_id(128)
+        parent_id = None
+    elif not parent.recording:
+        return _NOT_RECORDING
+    else:
+        trace_id = parent.trace_id
+        parent_id = parent.span_id
+
+    span = Span(name, trace_id, _new_id(64), parent_id)
+    if attributes:
+        span.attributes.update(attributes)
+    return span
+
+
+@contextmanager
+def activate(span: Span) -> Iterator[Span]:
+    """Make a span the active one while in the context.
+
+    :param span: The span.
+    """
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    start_trace: bool = False,
+) -> Iterator[Span]:
+    """Record a span covering the context, and make it the active one in it.
+
+    See `start_span` for the parameters.
+    """
+    if not _exporters or (not start_trace and _current_span.get() is None):
+        # Leave the context free for steps starting their own traces.
+        yield _NOT_RECORDING
+        return
+
+    span = start_span(name, attributes, start_trace)
+    with activate(span):
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        span.finish()
+
+
+def traced(name: str, start_trace: bool = False) -> Callable[[F], F]:
+    """Decorate a function or coroutine function, to record a span covering each of
+    its calls.
+
+    See `start_span` for the parameters.
+    """
+
+    def decorator(f: F) -> F:
+        if inspect.iscoroutinefunction(f):
+
+            @functools.wraps(f)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with trace(name, start_trace=start_trace):
+                    return await f(*args, **kwargs)
+
+            return cast(F, async_wrapper)
+
+        @functools.wraps(f)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with trace(name, start_trace=start_trace):
+                return f(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def finish_with(span: Span, d: "Deferred[T]") -> "Deferred[T]":
+    """Finish a span once a Deferred completes.
+
+    :param span: The span.
+    :param d: The Deferred.
+
+    :return: The Deferred.
+    """
+
+    def finished(result: Any) -> Any:
+        span.finish(result if isinstance(result, Failure) else None)
+        return result
+
+    return d.addBoth(finished)
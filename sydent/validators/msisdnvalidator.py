@@ -14,9 +14,7 @@
 # limitations under the License.
 
 import logging
-from typing import TYPE_CHECKING, Dict, Optional
-
-import phonenumbers
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 from sydent.db.valsession import ThreePidValSessionStore
 from sydent.sms.openmarket import OpenMarketSMS
@@ -24,6 +22,8 @@ from sydent.util import time_msec
 from sydent.validators import DestinationRejectedException, common
 
 if TYPE_CHECKING:
+    import phonenumbers
+
     from sydent.sydent import Sydent
 
 logger = logging.getLogger(__name__)
@@ -34,13 +34,20 @@ class MsisdnValidator:
         self.sydent = sydent
         self.omSms = OpenMarketSMS(sydent)
 
-        # cache originators & sms rules from config file
-        self.originators = self.sydent.config.sms.originators
-        self.smsRules = self.sydent.config.sms.smsRules
+    # Originators and SMS rules are read from the config whenever they're needed,
+    # as the config can be reloaded.
+
+    @property
+    def originators(self) -> Dict[str, List[Dict[str, str]]]:
+        return self.sydent.config.sms.originators
+
+    @property
+    def smsRules(self) -> Dict[str, str]:
+        return self.sydent.config.sms.smsRules
 
     async def requestToken(
         self,
-        phoneNumber: phonenumbers.PhoneNumber,
+        phoneNumber: "phonenumbers.PhoneNumber",
         clientSecret: str,
         send_attempt: int,
         brand: Optional[str] = None,
@@ -61,6 +68,9 @@ class MsisdnValidator:
             if action == "reject":
                 raise DestinationRejectedException()
 
+        # Imported here as it's slow to import, and only needed to send SMS.
+        import phonenumbers
+
         valSessionStore = ThreePidValSessionStore(self.sydent)
 
         msisdn = phonenumbers.format_number(
@@ -101,7 +111,7 @@ class MsisdnValidator:
         return valSession.id
 
     def getOriginator(
-        self, destPhoneNumber: phonenumbers.PhoneNumber
+        self, destPhoneNumber: "phonenumbers.PhoneNumber"
     ) -> Dict[str, str]:
         """
         Gets an originator for a given phone number.
@@ -128,6 +138,8 @@ class MsisdnValidator:
         # a consistent number (if there's any chance that some originators are
         # more likley to work than others, we may want to change, but it feels
         # like this should be something other than just picking one randomly).
+        import phonenumbers
+
         msisdn = phonenumbers.format_number(
             destPhoneNumber, phonenumbers.PhoneNumberFormat.E164
         )[1:]
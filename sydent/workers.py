@@ -0,0 +1,286 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client API workers, which serve the client API in separate processes so that it
+can use more than one CPU core.
+
+The main process creates the client API's listening socket and passes it to the
+workers, which all accept connections on it. Workers serve lookups themselves, and
+forward every other request to the main process (see sydent.http.forwarding).
+
+Workers are started by the main process, as `python -m sydent.workers <index>`.
+"""
+
+import logging
+import os
+import secrets
+import socket
+import stat
+import sys
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from twisted.internet import protocol, task
+from twisted.internet.error import CannotListenError, ProcessExitedAlready
+from twisted.internet.interfaces import IProcessTransport
+from twisted.python.failure import Failure
+from twisted.python.lockfile import FilesystemLock
+
+from sydent.config import SydentConfig
+from sydent.http.httpserver import ClientApiWorkerHttpServer
+
+if TYPE_CHECKING:
+    from sydent.sydent import Sydent
+
+logger = logging.getLogger(__name__)
+
+# The file descriptor of the listening socket in worker processes.
+LISTENING_FD = 3
+
+# How long to wait before restarting a worker which exited, in seconds.
+RESTART_DELAY = 1.0
+
+# How often workers check that the main process is still running, in seconds.
+PARENT_CHECK_INTERVAL = 1.0
+
+# The environment variable passing the secret with which workers authenticate the
+# requests they forward to the main process.
+WORKER_SECRET_ENV = "SYDENT_WORKER_SECRET"
+
+
+def _listen(interface: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in interface else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((interface, port))
+    sock.listen(50)  # taken from PosixReactorBase.listenTCP
+    sock.setblocking(False)
+    return sock
+
+
+def _listen_unix(path: str, mode: int) -> Tuple[socket.socket, FilesystemLock]:
+    """Listen on a Unix socket, locking it like Twisted's listenUNIX does with
+    wantPID: an existing socket is only replaced if the process which created it
+    isn't running anymore.
+
+    :param path: The path of the socket.
+    :param mode: The permissions to give the socket.
+
+    :raises CannotListenError: if another process is listening on the socket.
+
+    :return: The listening socket, and the lock to release once done with it.
+    """
+    lock = FilesystemLock(path + ".lock")
+    if not lock.lock():
+        raise CannotListenError(None, path, "Cannot acquire lock")
+    if not lock.clean:
+        # The socket was left behind by a process which didn't exit cleanly.
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except OSError:
+            pass
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+    except OSError as e:
+        lock.unlock()
+        raise CannotListenError(None, path, e)
+    os.chmod(path, mode)
+    sock.listen(50)  # taken from PosixReactorBase.listenTCP
+    sock.setblocking(False)
+    return sock, lock
+
+
+class _WorkerProcessProtocol(protocol.ProcessProtocol):
+    def __init__(self, manager: "WorkerManager", index: int) -> None:
+        self.manager = manager
+        self.index = index
+
+    def processEnded(self, reason: Failure) -> None:
+        self.manager.worker_ended(self.index, reason)
+
+
+class WorkerManager:
+    """Runs the client API workers, restarting them if they exit.
+
+    :param sydent: The main process' Sydent instance.
+    """
+
+    def __init__(self, sydent: "Sydent") -> None:
+        self.sydent = sydent
+        self._socket: Optional[socket.socket] = None
+        # The lock on the Unix socket, if listening on one.
+        self._lock: Optional[FilesystemLock] = None
+        self._processes: Dict[int, IProcessTransport] = {}
+        self._stopping = False
+        sydent.worker_secret = secrets.token_urlsafe(32)
+
+    def start(self) -> None:
+        """Create the client API's listening socket and start the workers."""
+        unix_socket = self.sydent.config.http.client_unix_socket
+        if unix_socket:
+            logger.info(
+                "Starting %d Client API worker(s) on %s",
+                self.sydent.config.http.client_workers,
+                unix_socket,
+            )
+            self._socket, self._lock = _listen_unix(
+                unix_socket, self.sydent.config.http.client_unix_socket_mode
+            )
+        else:
+            interface = self.sydent.config.http.client_bind_address
+            port = self.sydent.config.http.client_port
+
+            logger.info(
+                "Starting %d Client API worker(s) on %s:%d",
+                self.sydent.config.http.client_workers,
+                interface,
+                port,
+            )
+            self._socket = _listen(interface, port)
+        for index in range(self.sydent.config.http.client_workers):
+            self._spawn(index)
+
+        self.sydent.reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+    def _spawn(self, index: int) -> None:
+        assert self._socket is not None
+        assert self.sydent.worker_secret is not None
+        env = os.environ.copy()
+        env[WORKER_SECRET_ENV] = self.sydent.worker_secret
+        self._processes[index] = self.sydent.reactor.spawnProcess(
+            _WorkerProcessProtocol(self, index),
+            sys.executable,
+            [sys.executable, "-m", "sydent.workers", str(index)],
+            env=env,
+            path=os.getcwd(),
+            # IReactorProcess doesn't allow it, but reactors take None to mean the
+            # current user and group.
+            uid=None,  # type: ignore[arg-type]
+            gid=None,  # type: ignore[arg-type]
+            usePTY=False,
+            childFDs={1: 1, 2: 2, LISTENING_FD: self._socket.fileno()},
+        )
+
+    def worker_ended(self, index: int, reason: Failure) -> None:
+        """Called when a worker exits, to restart it.
+
+        :param index: The index of the worker.
+        :param reason: Why the worker exited.
+        """
+        self._processes.pop(index, None)
+        if self._stopping:
+            return
+
+        logger.warning(
+            "Client API worker %d exited (%s), restarting it",
+            index,
+            reason.getErrorMessage(),
+        )
+        self.sydent.reactor.callLater(RESTART_DELAY, self._spawn, index)
+
+    def reload(self) -> None:
+        """Have the workers reload what can be changed without restarting."""
+        self._signal_workers("HUP")
+
+    def stop(self) -> None:
+        """Stop the workers, and remove the Unix socket if listening on one."""
+        self._stopping = True
+        self._signal_workers("TERM")
+
+        if self._lock is not None:
+            # As Twisted does when it stops listening on a Unix socket.
+            try:
+                os.unlink(self.sydent.config.http.client_unix_socket)
+            except FileNotFoundError:
+                pass
+            self._lock.unlock()
+            self._lock = None
+
+    def _signal_workers(self, signal_name: str) -> None:
+        for process in self._processes.values():
+            try:
+                process.signalProcess(signal_name)
+            except ProcessExitedAlready:
+                pass
+
+
+def _check_parent(sydent: "Sydent", parent_pid: int) -> None:
+    """Stop a worker once the main process isn't running anymore."""
+    if os.getppid() != parent_pid:
+        logger.warning("The main process exited, stopping")
+        sydent.reactor.stop()
+
+
+def apply_worker_overrides(config: SydentConfig, index: int) -> None:
+    """Override the options which client API workers set themselves.
+
+    :param config: The config, as read from the config file.
+    :param index: The index of the worker.
+    """
+    # Lookups are served from the database rather than from in-memory caches,
+    # which writes made by the main process wouldn't invalidate.
+    config.lookup.hash_index_enabled = False
+    config.lookup.bloom_filter_enabled = False
+    config.lookup.cache_enabled = False
+    config.lookup.signed_cache_max_entries = 0
+    # Neither are accounts, since logouts and terms agreements go to the main
+    # process.
+    config.general.account_cache_max_entries = 0
+    # Workers only read from the database, which doesn't need to wait for the main
+    # process' writes in WAL mode. Don't let a stuck lock hold requests up for long.
+    config.database.busy_timeout = 0.5
+
+    # Each process exports traces to its own file, so that lines don't interleave.
+    config.general.tracing_json_path += ".worker%d" % (index,)
+
+
+def main() -> None:
+    # Imported here rather than at the top of the module, so that the main process
+    # doesn't import it a second time when it's run with `python -m sydent.sydent`,
+    # which would register its metrics twice.
+    from sydent.sydent import (
+        Sydent,
+        get_config_file_path,
+        install_reload_handler,
+        setup_logging,
+    )
+
+    index = int(sys.argv[1])
+
+    sydent_config = SydentConfig()
+    sydent_config.parse_config_file(get_config_file_path())
+    setup_logging(sydent_config, worker_index=index)
+    apply_worker_overrides(sydent_config, index)
+
+    syd = Sydent(sydent_config)
+    syd.worker_secret = os.environ.pop(WORKER_SECRET_ENV)
+    # Apply them to the config read again on reloads too, so that the options they
+    # override aren't reported as changed.
+    syd.config_overrides.append(lambda config: apply_worker_overrides(config, index))
+    ClientApiWorkerHttpServer(syd).setup(LISTENING_FD)
+    # Lookups check whether the terms have been agreed to.
+    syd.terms_reloader.start()
+    install_reload_handler(syd)
+
+    cb = task.LoopingCall(_check_parent, syd, os.getppid())
+    cb.clock = syd.reactor
+    cb.start(PARENT_CHECK_INTERVAL)
+
+    syd.reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from sydent.config.http import ADMISSION_CLASSES
+from sydent.http.admission import AdmissionController, OverloadedException
+from tests.utils import FakeChannel, make_request, make_sydent
+
+
+class AdmissionControllerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        limits = {name: (0, 10) for name in ADMISSION_CLASSES}
+        limits["lookup"] = (1, 1)
+        self.controller = AdmissionController(limits, max_concurrent=2, retry_after=5)
+
+    def test_class_limit(self) -> None:
+        """Tests that requests beyond a class' limit wait, up to the size of its
+        queue.
+        """
+        self.assertTrue(self.controller.try_admit("lookup"))
+        self.assertFalse(self.controller.try_admit("lookup"))
+        d = self.controller.wait("lookup")
+        with self.assertRaises(OverloadedException) as cm:
+            self.controller.wait("lookup")
+        self.assertEqual(cm.exception.httpStatus, 503)
+        self.assertEqual(cm.exception.error_dict()["retry_after_ms"], 5000)
+
+        # Other classes aren't affected.
+        self.assertTrue(self.controller.try_admit("bind"))
+
+        self.assertNoResult(d)
+        self.controller.release("lookup")
+        self.successResultOf(d)
+
+    def test_cancel(self) -> None:
+        """Tests that cancelled requests leave the queue."""
+        self.assertTrue(self.controller.try_admit("lookup"))
+        cancelled = self.controller.wait("lookup")
+        cancelled.cancel()
+        self.failureResultOf(cancelled, defer.CancelledError)
+
+        d = self.controller.wait("lookup")
+        self.controller.release("lookup")
+        self.successResultOf(d)
+
+    def test_priorities(self) -> None:
+        """Tests that the global limit holds back lower priority classes first, and
+        not replication or internal requests at all.
+        """
+        self.assertTrue(self.controller.try_admit("lookup"))
+        self.assertTrue(self.controller.try_admit("validation"))
+        self.assertFalse(self.controller.try_admit("bind"))
+        self.assertTrue(self.controller.try_admit("replication"))
+        self.assertTrue(self.controller.try_admit("internal"))
+
+        lookup = self.controller.wait("lookup")
+        bind = self.controller.wait("bind")
+
+        # Replication and internal requests count towards the global limit.
+        self.controller.release("replication")
+        self.controller.release("internal")
+        self.assertNoResult(bind)
+
+        self.controller.release("lookup")
+        self.successResultOf(bind)
+        self.assertNoResult(lookup)
+
+        self.controller.release("bind")
+        self.successResultOf(lookup)
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true"},
+                "http": {
+                    "admission.lookup.max_concurrent": "1",
+                    "admission.lookup.max_queued": "1",
+                    "admission.retry_after": "2",
+                },
+                "lookup": {"chunk_size": "10"},
+            }
+        )
+        self.sydent.run()
+
+    def _request(self, method: str, path: str, content: object = None) -> FakeChannel:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            method,
+            path,
+            content,
+        )
+        return channel
+
+    def _bulk_lookup(self) -> FakeChannel:
+        return self._request(
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": [["email", "%d@example.com" % n] for n in range(20)]},
+        )
+
+    def test_shed_load(self) -> None:
+        """Tests that lookups beyond the limit wait for their turn, and are
+        rejected quickly once the queue is full.
+        """
+        # The response to a bulk lookup is streamed, so it's still being
+        # processed after make_request returns.
+        first = self._bulk_lookup()
+        second = self._bulk_lookup()
+        self.assertFalse(first.result.get("done"))
+        self.assertFalse(second.result.get("done"))
+
+        third = self._bulk_lookup()
+        self.assertEqual(third.code, 503)
+        self.assertEqual(third.json_body["errcode"], "M_LIMIT_EXCEEDED")
+        self.assertEqual(third.headers.getRawHeaders(b"Retry-After"), [b"2"])
+
+        # Single lookups share the limit of bulk lookups...
+        lookup_path = "/_matrix/identity/api/v1/lookup?medium=email&address=a@b.com"
+        self.assertEqual(self._request("GET", lookup_path).code, 503)
+        # ... but other endpoints aren't affected.
+        pubkey_path = "/_matrix/identity/v2/pubkey/ed25519:0"
+        self.assertEqual(self._request("GET", pubkey_path).code, 200)
+
+        self.sydent.reactor.advance(0)
+        self.sydent.reactor.advance(0)
+        self.assertEqual(first.code, 200)
+        self.assertEqual(second.code, 200)
+        self.assertEqual(second.json_body, {"threepids": []})
+
+        self.assertEqual(self._request("GET", lookup_path).code, 200)
@@ -12,9 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+
 from twisted.trial import unittest
 
+from sydent.db.accounts import AccountCache, AccountStore
 from sydent.http.auth import tokenFromRequest
+from sydent.users.accounts import Account
 from tests.utils import make_request, make_sydent
 
 
@@ -72,3 +77,97 @@ class AuthTestCase(unittest.TestCase):
         token = tokenFromRequest(request)
 
         self.assertEqual(token, self.test_token)
+
+
+TERMS_YAML = """
+master_version: "1"
+docs:
+  terms_of_service:
+    version: "1"
+    langs:
+      en:
+        name: "Terms of Service"
+        url: "https://example.com/tos.html"
+"""
+
+
+class AccountCacheTestCase(unittest.TestCase):
+    """Tests that the accounts of access tokens are cached, and invalidated when
+    they change.
+    """
+
+    def setUp(self) -> None:
+        fd, terms_path = tempfile.mkstemp(suffix=".yaml")
+        with os.fdopen(fd, "w") as f:
+            f.write(TERMS_YAML)
+        self.addCleanup(os.unlink, terms_path)
+
+        self.sydent = make_sydent({"general": {"terms.path": terms_path}})
+        self.sydent.run()
+        self.user_id = "@bob:localhost"
+        self.token = "testingtoken"
+
+        cur = self.sydent.db.cursor()
+        cur.execute(
+            "INSERT INTO accounts (user_id, created_ts, consent_version)"
+            "VALUES (?, ?, ?)",
+            (self.user_id, 101010101, "1"),
+        )
+        cur.execute(
+            "INSERT INTO tokens (user_id, token) VALUES (?, ?)",
+            (self.user_id, self.token),
+        )
+        self.sydent.db.commit()
+
+    def _request(self, method: str, path: str) -> int:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            method,
+            path,
+            access_token=self.token,
+        )
+        return channel.code
+
+    def test_cached(self) -> None:
+        """Tests that accounts are cached, until their token is deleted."""
+        self.assertEqual(self._request("GET", "/_matrix/identity/v2/hash_details"), 200)
+
+        # Remove the token behind the cache's back.
+        cur = self.sydent.db.cursor()
+        cur.execute("DELETE FROM tokens")
+        self.sydent.db.commit()
+        self.assertEqual(self._request("GET", "/_matrix/identity/v2/hash_details"), 200)
+
+        self.assertEqual(
+            self._request("POST", "/_matrix/identity/v2/account/logout"), 200
+        )
+        self.assertEqual(self._request("GET", "/_matrix/identity/v2/hash_details"), 401)
+
+    def test_consent_invalidates(self) -> None:
+        """Tests that a user's cached accounts are invalidated when they accept the
+        terms.
+        """
+        store = AccountStore(self.sydent)
+        store.setConsentVersion(self.user_id, None)
+        self.assertEqual(self._request("GET", "/_matrix/identity/v2/hash_details"), 403)
+
+        store.setConsentVersion(self.user_id, "1")
+        self.assertEqual(self._request("GET", "/_matrix/identity/v2/hash_details"), 200)
+
+    def test_invalidate_user(self) -> None:
+        """Tests that invalidating a user invalidates all their tokens."""
+        cache = AccountCache(10, 60, self.sydent.reactor.seconds)
+        cache.set("a", Account(self.user_id, 0, "1"))
+        cache.set("b", Account(self.user_id, 0, "1"))
+        cache.set("c", Account("@alice:localhost", 0, "1"))
+
+        cache.invalidate_user(self.user_id)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+        cache.set("a", Account(self.user_id, 0, None))
+        cached = cache.get("a")
+        assert cached is not None
+        self.assertIsNone(cached.consentVersion)
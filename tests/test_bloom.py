@@ -0,0 +1,92 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+
+from sydent.db.threepid_associations import (
+    GlobalAssociationStore,
+    association_filter_checks,
+)
+from sydent.threepid import ThreepidAssociation
+from sydent.util.bloom import CountingBloomFilter
+from tests.utils import make_sydent
+
+
+class CountingBloomFilterTestCase(unittest.TestCase):
+    def test_add_and_remove(self) -> None:
+        bloom = CountingBloomFilter(1000, 0.01)
+        for n in range(1000):
+            bloom.add("key%d" % n)
+
+        # There can't be false negatives.
+        for n in range(1000):
+            self.assertIn("key%d" % n, bloom)
+
+        false_positives = sum(("other%d" % n) in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertLess(bloom.false_positive_rate(), 0.015)
+
+        for n in range(500):
+            bloom.remove("key%d" % n)
+        self.assertEqual(bloom.count, 500)
+        for n in range(500, 1000):
+            self.assertIn("key%d" % n, bloom)
+        self.assertLess(sum(("key%d" % n) in bloom for n in range(500)), 50)
+
+
+class AssociationFilterTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent({"lookup": {"bloom_filter.enabled": "true"}})
+        self.store = GlobalAssociationStore(self.sydent)
+
+    def _add_association(self, address: str, mxid: str, origin_id: int) -> None:
+        assoc = ThreepidAssociation(
+            "email", address, "hash_" + address, mxid, 1, 0, 99999999999999
+        )
+        self.store.addAssociation(assoc, "{}", "example.com", origin_id)
+
+    def _filtered_count(self) -> float:
+        return association_filter_checks.labels("filtered")._value.get()
+
+    def test_lookups(self) -> None:
+        self._add_association("alice@example.com", "@alice:hs", 1)
+
+        filtered = self._filtered_count()
+        self.assertEqual(self.store.getMxid("email", "Alice@example.com"), "@alice:hs")
+        self.assertEqual(
+            self.store.retrieveMxidsForHashes(["hash_alice@example.com", "hash_x"]),
+            {"hash_alice@example.com": "@alice:hs"},
+        )
+        self.assertEqual(
+            self.store.getMxids(
+                [("email", "alice@example.com"), ("email", "bob@example.com")]
+            ),
+            [("email", "alice@example.com", "@alice:hs")],
+        )
+        self.assertIsNone(self.store.getMxid("email", "bob@example.com"))
+        self.assertEqual(self._filtered_count(), filtered + 3)
+
+        self.store.removeAssociation("email", "alice@example.com")
+        self.assertIsNone(self.store.getMxid("email", "alice@example.com"))
+        self.assertEqual(
+            self.store.retrieveMxidsForHashes(["hash_alice@example.com"]), {}
+        )
+        self.assertEqual(self._filtered_count(), filtered + 5)
+
+    def test_filter_built_from_database(self) -> None:
+        self._add_association("carol@example.com", "@carol:hs", 1)
+
+        association_filter = self.store.buildAssociationFilter(0, 0.01)
+        self.assertEqual(association_filter.count, 2)
+        self.assertGreater(association_filter.memory_usage(), 0)
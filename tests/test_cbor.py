@@ -0,0 +1,77 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+
+from sydent.util.cbor import BACKENDS
+
+
+class CborTestCase(unittest.TestCase):
+    """Tests that all the available backends behave the same."""
+
+    def test_vectors(self) -> None:
+        # Examples from appendix A of RFC 8949.
+        for value, encoded in (
+            (0, "00"),
+            (23, "17"),
+            (24, "1818"),
+            (1000000, "1a000f4240"),
+            (18446744073709551615, "1bffffffffffffffff"),
+            (-1000, "3903e7"),
+            (1.1, "fb3ff199999999999a"),
+            (False, "f4"),
+            (None, "f6"),
+            (b"\x01\x02\x03\x04", "4401020304"),
+            ("ü", "62c3bc"),
+            ([1, [2, 3], [4, 5]], "8301820203820405"),
+            ({"a": 1, "b": [2, 3]}, "a26161016162820203"),
+        ):
+            for name, (encode, decode) in BACKENDS.items():
+                self.assertEqual(encode(value).hex(), encoded, name)
+                self.assertEqual(decode(bytes.fromhex(encoded)), value, name)
+
+        # Encodings we don't produce, but should decode.
+        for encoded, value in (
+            ("f93c00", 1.0),
+            ("fa47c35000", 100000.0),
+            ("5f42010243030405ff", b"\x01\x02\x03\x04\x05"),
+            ("7f657374726561646d696e67ff", "streaming"),
+            ("9f018202039f0405ffff", [1, [2, 3], [4, 5]]),
+            ("bf61610161629f0203ffff", {"a": 1, "b": [2, 3]}),
+        ):
+            for name, (_, decode) in BACKENDS.items():
+                self.assertEqual(decode(bytes.fromhex(encoded)), value, name)
+
+    def test_malformed(self) -> None:
+        for encoded in (
+            "",
+            "18",
+            "62c3",
+            "8301",
+            "9f01",
+            "0000",
+            "c11a514b67b0",
+            "f97e00",
+            "62c328",
+            "a1810000",
+            "81" * 100 + "00",
+            # Undefined, and an array as a map key.
+            "f7",
+            "a1820102f6",
+        ):
+            for _, decode in BACKENDS.values():
+                self.assertRaises(ValueError, decode, bytes.fromhex(encoded))
+
+        for encode, _ in BACKENDS.values():
+            self.assertRaises(TypeError, encode, {"a": object()})
@@ -0,0 +1,130 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+from typing import Any, List, Optional, Tuple
+from unittest.mock import patch
+
+from twisted.trial import unittest
+
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.http.compression import accepted_encodings
+from sydent.threepid import ThreepidAssociation
+from tests.utils import FakeChannel, make_request, make_sydent
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true"},
+                "http": {
+                    "clientapi.compression.endpoints": (
+                        "/_matrix/identity/api/v1/bulk_lookup=200, "
+                        "/_matrix/identity/v2/nonexistent"
+                    ),
+                },
+                "lookup": {"chunk_size": "10"},
+            }
+        )
+        self.sydent.run()
+
+        store = GlobalAssociationStore(self.sydent)
+        for n in range(20):
+            assoc = ThreepidAssociation(
+                "email",
+                "%d@example.com" % n,
+                None,
+                "@user%d:hs" % n,
+                1,
+                0,
+                99999999999999,
+            )
+            store.addAssociation(assoc, "{}", "example.com", n)
+
+    def _lookup(
+        self, count: int, accept_encoding: Optional[bytes]
+    ) -> Tuple[FakeChannel, Any]:
+        headers: List[Tuple[bytes, bytes]] = []
+        if accept_encoding is not None:
+            headers.append((b"Accept-Encoding", accept_encoding))
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": [["email", "%d@example.com" % n] for n in range(count)]},
+            custom_headers=headers,
+        )
+        self.sydent.reactor.advance(0)
+        self.assertEqual(channel.code, 200)
+
+        body = channel.result["body"]
+        if channel.headers.getRawHeaders(b"Content-Encoding") == [b"gzip"]:
+            body = gzip.decompress(body)
+        return channel, json.loads(body)
+
+    def test_compressed(self) -> None:
+        channel, body = self._lookup(5, b"deflate, gzip;q=0.5")
+        self.assertEqual(channel.headers.getRawHeaders(b"Content-Encoding"), [b"gzip"])
+        self.assertEqual(channel.headers.getRawHeaders(b"Vary"), [b"Accept-Encoding"])
+        self.assertIsNone(channel.headers.getRawHeaders(b"Content-Length"))
+        self.assertEqual(len(body["threepids"]), 5)
+
+    def test_streamed_response_compressed(self) -> None:
+        channel, body = self._lookup(20, b"gzip")
+        self.assertEqual(channel.headers.getRawHeaders(b"Content-Encoding"), [b"gzip"])
+        self.assertEqual(len(body["threepids"]), 20)
+
+    def test_small_streamed_response_not_compressed(self) -> None:
+        """Tests that streamed responses shorter than the minimum size are sent at
+        once, with a Content-Length, and not compressed.
+        """
+        self.sydent.config.lookup.chunk_size = 1
+        channel, body = self._lookup(3, b"gzip")
+        self.assertIsNone(channel.headers.getRawHeaders(b"Content-Encoding"))
+        self.assertEqual(
+            channel.headers.getRawHeaders(b"Content-Length"),
+            [b"%d" % (len(channel.result["body"]),)],
+        )
+        self.assertEqual(len(body["threepids"]), 3)
+
+    def test_long_streamed_response_sent_in_parts(self) -> None:
+        """Tests that streamed responses longer than STREAMED_RESPONSE_MIN_SIZE are
+        sent in parts, and compressed.
+        """
+        with patch("sydent.http.servlets.STREAMED_RESPONSE_MIN_SIZE", 100):
+            channel, body = self._lookup(20, b"gzip")
+        self.assertEqual(channel.headers.getRawHeaders(b"Content-Encoding"), [b"gzip"])
+        self.assertIsNone(channel.headers.getRawHeaders(b"Content-Length"))
+        self.assertEqual(len(body["threepids"]), 20)
+
+    def test_small_response_not_compressed(self) -> None:
+        channel, body = self._lookup(1, b"gzip")
+        self.assertIsNone(channel.headers.getRawHeaders(b"Content-Encoding"))
+        self.assertEqual(channel.headers.getRawHeaders(b"Vary"), [b"Accept-Encoding"])
+        self.assertEqual(len(body["threepids"]), 1)
+
+    def test_not_accepted(self) -> None:
+        for accept_encoding in (None, b"gzip;q=0, deflate", b"identity"):
+            channel, body = self._lookup(5, accept_encoding)
+            self.assertIsNone(channel.headers.getRawHeaders(b"Content-Encoding"))
+            self.assertEqual(len(body["threepids"]), 5)
+
+    def test_accepted_encodings(self) -> None:
+        self.assertEqual(
+            accepted_encodings("GZIP, br;q=0.8, deflate;q=0, identity;q=x"),
+            {"gzip", "br"},
+        )
@@ -0,0 +1,200 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+
+from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.threepid import ThreepidAssociation
+from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.hash_index import LookupHashIndex, decode_lookup_hash
+from tests.utils import make_request, make_sydent
+
+NOW = 1000
+
+
+def _hash(n: int) -> str:
+    return sha256_and_url_safe_base64("address%d email pepper" % n)
+
+
+class LookupHashIndexTestCase(unittest.TestCase):
+    def _build(self, count: int) -> LookupHashIndex:
+        mxids = sorted("@user%d:example.com" % n for n in range(count))
+        rows = sorted(
+            (
+                decode_lookup_hash(_hash(n)),
+                mxids.index("@user%d:example.com" % n),
+                n,
+                0,
+                NOW * 2,
+            )
+            for n in range(count)
+        )
+        return LookupHashIndex.build(rows, mxids, last_id=count, overlay_size=5)
+
+    def test_decode_lookup_hash(self) -> None:
+        self.assertEqual(len(decode_lookup_hash(_hash(1))), 32)
+        self.assertIsNone(decode_lookup_hash("not a hash"))
+        # Right length, but not valid base64.
+        self.assertIsNone(decode_lookup_hash("!" * 43))
+        # Non-canonical encoding of a digest (non-zero padding bits).
+        canonical = _hash(1)
+        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+        last = alphabet[alphabet.index(canonical[-1]) ^ 1]
+        self.assertIsNone(decode_lookup_hash(canonical[:-1] + last))
+
+    def test_lookup_many(self) -> None:
+        index = self._build(100)
+        self.assertEqual(len(index), 100)
+
+        queries = [_hash(n) for n in (3, 50, 99, 1000)] + ["nonsense"]
+        self.assertEqual(
+            index.lookup_many(queries, NOW),
+            (
+                {
+                    _hash(3): "@user3:example.com",
+                    _hash(50): "@user50:example.com",
+                    _hash(99): "@user99:example.com",
+                },
+                [],
+            ),
+        )
+
+    def test_validity_period(self) -> None:
+        index = self._build(10)
+        self.assertEqual(index.lookup_many([_hash(1)], 0), ({}, [_hash(1)]))
+        self.assertEqual(index.lookup_many([_hash(1)], NOW * 2), ({}, [_hash(1)]))
+
+        # Also in the overlay.
+        index.add(_hash(20), "@user20:example.com", 100, 0, NOW)
+        self.assertEqual(index.lookup_many([_hash(20)], NOW), ({}, [_hash(20)]))
+
+    def test_add_and_remove(self) -> None:
+        index = self._build(10)
+
+        index.add(_hash(1), "@new:example.com", 100, 0, NOW * 2)
+        index.add(_hash(20), "@user20:example.com", 100, 0, NOW * 2)
+        index.remove(_hash(2))
+        # Older than what's indexed for that hash, so ignored.
+        index.add(_hash(5), "@old:example.com", -1, 0, NOW * 2)
+
+        expected = {
+            _hash(1): "@new:example.com",
+            _hash(3): "@user3:example.com",
+            _hash(5): "@user5:example.com",
+            _hash(20): "@user20:example.com",
+        }
+        queries = [_hash(n) for n in (1, 2, 3, 5, 20)]
+        self.assertEqual(index.lookup_many(queries, NOW), (expected, []))
+
+        # Merging the overlay doesn't change the results.
+        index.merge()
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index.lookup_many(queries, NOW), (expected, []))
+
+    def test_merge_on_overlay_size(self) -> None:
+        index = self._build(0)
+        for n in range(12):
+            index.add(_hash(n), "@user:example.com", n, 0, NOW * 2)
+
+        # The overlay was merged after the 5th and 10th additions.
+        self.assertEqual(len(index), 10)
+        results, _ = index.lookup_many([_hash(n) for n in range(12)], NOW)
+        self.assertEqual(len(results), 12)
+
+
+class LookupHashIndexIntegrationTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent({"lookup": {"hash_index.enabled": "true"}})
+        self.pepper = HashingMetadataStore(self.sydent).get_lookup_pepper()
+
+        cur = self.sydent.db.cursor()
+        cur.execute(
+            "INSERT INTO accounts (user_id, created_ts, consent_version) "
+            "VALUES ('@bob:localhost', 1, NULL)"
+        )
+        cur.execute(
+            "INSERT INTO tokens (user_id, token) VALUES ('@bob:localhost', 't')"
+        )
+        self.sydent.db.commit()
+
+        self.sydent.run()
+
+    def _add_association(self, address: str, mxid: str, origin_id: int) -> str:
+        lookup_hash = sha256_and_url_safe_base64("%s email %s" % (address, self.pepper))
+        assoc = ThreepidAssociation(
+            "email", address, lookup_hash, mxid, 1, 0, 99999999999999
+        )
+        GlobalAssociationStore(self.sydent).addAssociation(
+            assoc, "{}", "example.com", origin_id
+        )
+        return lookup_hash
+
+    def _lookup(self, lookup_hash: str) -> dict:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            {
+                "addresses": [lookup_hash],
+                "algorithm": "sha256",
+                "pepper": self.pepper,
+            },
+            access_token="t",
+        )
+        self.assertEqual(channel.code, 200)
+        return channel.json_body["mappings"]
+
+    def test_lookup_follows_changes(self) -> None:
+        lookup_hash = self._add_association("alice@example.com", "@alice:hs", 1)
+        self.assertEqual(self._lookup(lookup_hash), {lookup_hash: "@alice:hs"})
+
+        GlobalAssociationStore(self.sydent).removeAssociation(
+            "email", "alice@example.com"
+        )
+        self.assertEqual(self._lookup(lookup_hash), {})
+
+    def test_older_valid_association(self) -> None:
+        """Tests that an older association is returned if the most recent one for
+        the same lookup hash has expired, as it would be without the index.
+        """
+        address = "dave@example.com"
+        lookup_hash = sha256_and_url_safe_base64("%s email %s" % (address, self.pepper))
+        store = GlobalAssociationStore(self.sydent)
+        store.addAssociation(
+            ThreepidAssociation(
+                "email", address, lookup_hash, "@old:hs", 1, 0, 99999999999999
+            ),
+            "{}",
+            "example.com",
+            1,
+        )
+        store.addAssociation(
+            ThreepidAssociation("email", address, lookup_hash, "@new:hs", 2, 0, 3),
+            "{}",
+            "example.com",
+            2,
+        )
+
+        self.assertEqual(self._lookup(lookup_hash), {lookup_hash: "@old:hs"})
+
+    def test_index_built_from_database(self) -> None:
+        lookup_hash = self._add_association("carol@example.com", "@carol:hs", 1)
+
+        index = GlobalAssociationStore(self.sydent).buildLookupHashIndex(10)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(
+            index.lookup_many([lookup_hash], 1000), ({lookup_hash: "@carol:hs"}, [])
+        )
@@ -0,0 +1,101 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from twisted.trial import unittest
+from twisted.web.http import H2_ENABLED
+
+from sydent.config.exceptions import ConfigError
+from sydent.http.httpcommon import MAX_REQUEST_SIZE, SizeLimitingRequest
+from tests.utils import make_sydent, write_key_and_cert
+
+
+class ClientApiHttpsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cert_path = write_key_and_cert()
+        self.addCleanup(os.unlink, self.cert_path)
+
+    def test_https_listener(self) -> None:
+        """Tests that the client API is served over HTTPS too, if configured."""
+        sydent = make_sydent(
+            {
+                "http": {
+                    "clientapi.https.port": "8443",
+                    "clientapi.https.certfile": self.cert_path,
+                }
+            }
+        )
+        sydent.run()
+
+        ports = [server[0] for server in sydent.reactor.sslServers]
+        self.assertIn(8443, ports)
+        _, factory, _, _, _ = sydent.reactor.sslServers[ports.index(8443)]
+        self.assertIs(factory.resource, sydent.clientApiHttpServer.root)
+        self.assertEqual(factory.acceptableProtocols(), [b"http/1.1"])
+
+    def test_https_requires_cert(self) -> None:
+        with self.assertRaises(ConfigError):
+            make_sydent({"http": {"clientapi.https.port": "8443"}})
+
+    def test_http2(self) -> None:
+        """Tests that HTTP/2 is offered with ALPN if enabled, and that enabling it
+        without Twisted's HTTP/2 support fails early.
+        """
+        config = {
+            "http": {
+                "clientapi.https.port": "8443",
+                "clientapi.https.certfile": self.cert_path,
+                "clientapi.https.http2": "true",
+            }
+        }
+        if not H2_ENABLED:
+            with self.assertRaises(ConfigError):
+                make_sydent(config)
+            return
+
+        sydent = make_sydent(config)
+        sydent.run()
+        _, factory, _, _, _ = sydent.reactor.sslServers[-1]
+        self.assertEqual(factory.acceptableProtocols(), [b"h2", b"http/1.1"])
+
+
+class _FakeH2Stream:
+    """The bits of Twisted's H2Stream which requests use."""
+
+    # Streams have no transport of their own.
+    transport = None
+    aborted = False
+
+    def abortConnection(self) -> None:
+        self.aborted = True
+
+    def getPeer(self) -> None:
+        return None
+
+    def getHost(self) -> None:
+        return None
+
+
+class SizeLimitingRequestTestCase(unittest.TestCase):
+    def test_http2_stream_aborted(self) -> None:
+        """Tests that oversized HTTP/2 requests reset their stream."""
+        stream = _FakeH2Stream()
+        request = SizeLimitingRequest(stream, queued=False)  # type: ignore[call-arg, arg-type]
+        request.gotLength(None)
+
+        request.handleContentChunk(b"x" * MAX_REQUEST_SIZE)
+        self.assertFalse(stream.aborted)
+        request.handleContentChunk(b"x")
+        self.assertTrue(stream.aborted)
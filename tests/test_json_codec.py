@@ -0,0 +1,71 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+
+from sydent.util.json_codec import BACKENDS
+
+
+class JsonCodecTestCase(unittest.TestCase):
+    """Tests that all the available backends behave the same."""
+
+    def test_roundtrip(self) -> None:
+        value = {
+            "mappings": {"hash": "@alice:example.com"},
+            "list": [1, -2, 3.5, True, False, None],
+            "unicode": "café \U0001f600",
+        }
+        for name, (encode, decode) in BACKENDS.items():
+            encoded = encode(value)
+            self.assertIsInstance(encoded, bytes, name)
+            self.assertEqual(decode(encoded), value, name)
+            self.assertEqual(decode(encoded.decode("UTF-8")), value, name)
+
+    def test_compact(self) -> None:
+        for name, (encode, _) in BACKENDS.items():
+            self.assertEqual(encode({"a": [1, "é"]}), '{"a":[1,"é"]}'.encode(), name)
+
+    def test_reject_constants(self) -> None:
+        """Tests that NaN, Infinity and -Infinity are rejected."""
+        for name, (_, decode) in BACKENDS.items():
+            for data in (b"NaN", b"[Infinity]", b'{"a": -Infinity}'):
+                self.assertRaises(ValueError, decode, data)
+
+    def test_reject_invalid(self) -> None:
+        for name, (_, decode) in BACKENDS.items():
+            for data in (b"", b"{", b"\xff", b"{'a': 1}"):
+                self.assertRaises(ValueError, decode, data)
+
+    def test_encode_fallback(self) -> None:
+        """Tests that values not all backends can encode natively are encoded."""
+        for name, (encode, _) in BACKENDS.items():
+            self.assertEqual(encode({"n": 2**70}), b'{"n":%d}' % (2**70,), name)
+            self.assertEqual(encode({1: 2}), b'{"1":2}', name)
+
+    def test_reject_unpaired_surrogates(self) -> None:
+        """Tests that strings which can't be encoded in UTF-8 are rejected."""
+        for name, (_, decode) in BACKENDS.items():
+            for data in (b'"\\ud800"', b'{"a": "\\udc00"}', b'"\\uDBFF\\uDBFF"'):
+                self.assertRaises(ValueError, decode, data)
+            self.assertEqual(decode(b'"\\ud83d\\ude00"'), "\U0001f600", name)
+
+    def test_large_integers(self) -> None:
+        """Tests that integers which don't fit in 64 bits aren't turned into
+        floats.
+        """
+        for name, (_, decode) in BACKENDS.items():
+            for data in (b"[18446744073709551616]", "[-9223372036854775809]"):
+                value = decode(data)
+                self.assertIsInstance(value[0], int, name)
+                self.assertEqual(value[0], int(data[1:-1]), name)
@@ -0,0 +1,79 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from io import BytesIO
+from typing import Any, Dict, List
+
+from twisted.trial import unittest
+
+from sydent.util.jsonstream import parse_json_object
+
+
+class ParseJsonObjectTestCase(unittest.TestCase):
+    def _parse(self, body: bytes, block_size: int = 3) -> Dict[str, Any]:
+        return parse_json_object(BytesIO(body), "items", lambda x: x, block_size)
+
+    def test_parse(self) -> None:
+        obj = {
+            "items": [12345, "é☃", {"a": [1, 2]}, None, True, -1.5e3],
+            "pepper": "matrixrocks",
+            "other": [1, 2, 3],
+        }
+        body = json.dumps(obj).encode("utf-8")
+        # Small blocks split numbers, strings and multi-byte characters.
+        for block_size in (1, 2, 3, 5, 1024):
+            self.assertEqual(self._parse(body, block_size), obj)
+
+        self.assertEqual(self._parse(b' { "items" : [ ] } \n'), {"items": []})
+        self.assertEqual(self._parse(b"{}"), {})
+        self.assertEqual(self._parse(b'{"items": 12}'), {"items": 12})
+
+    def test_items_are_parsed_incrementally(self) -> None:
+        seen: List[Any] = []
+
+        def parse_item(item: Any) -> Any:
+            seen.append(item)
+            if item == "bad":
+                raise KeyError(item)
+            return item
+
+        stream = BytesIO(b'{"items": [1, "bad", 3' + b" " * 10000 + b"]}")
+        self.assertRaises(KeyError, parse_json_object, stream, "items", parse_item, 16)
+        self.assertEqual(seen, [1, "bad"])
+        # The rest of the body hasn't been read.
+        self.assertLess(stream.tell(), 100)
+
+    def test_malformed(self) -> None:
+        for body in (
+            b"",
+            b"[]",
+            b"null",
+            b'{"items": [1, 2}',
+            b'{"items": [1 2]}',
+            b'{"items": [1, 2]',
+            b'{"items": [NaN]}',
+            b'{"items": [1], }',
+            b'{"items": [1]} {}',
+            b"{1: 2}",
+            b'{"a": "\xff"}',
+            b'{"items": ["\\ud800"]}',
+            b'{"\\udc00": 1}',
+        ):
+            self.assertRaises(ValueError, self._parse, body)
+
+    def test_surrogate_pair(self) -> None:
+        self.assertEqual(
+            self._parse(b'{"items": ["\\ud83d\\ude00"]}'), {"items": ["\U0001f600"]}
+        )
@@ -0,0 +1,431 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import patch
+
+from twisted.trial import unittest
+from unpaddedbase64 import decode_base64
+
+from sydent.config.exceptions import ConfigError
+from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.http.servlets import INCREMENTAL_JSON_MIN_SIZE
+from sydent.threepid import ThreepidAssociation
+from sydent.util import cbor
+from sydent.util.hash import sha256_and_url_safe_base64
+from tests.utils import FakeChannel, make_request, make_sydent
+
+
+class ChunkedLookupTestCase(unittest.TestCase):
+    """Tests lookups of more addresses than fit in a single chunk, whose
+    responses are streamed."""
+
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true", "bulk_lookup_limit": "6"},
+                "lookup": {"chunk_size": "2"},
+            }
+        )
+        self.pepper = HashingMetadataStore(self.sydent).get_lookup_pepper()
+
+        cur = self.sydent.db.cursor()
+        cur.execute(
+            "INSERT INTO accounts (user_id, created_ts, consent_version) "
+            "VALUES ('@bob:localhost', 1, NULL)"
+        )
+        cur.execute(
+            "INSERT INTO tokens (user_id, token) VALUES ('@bob:localhost', 't')"
+        )
+        self.sydent.db.commit()
+
+        self.sydent.run()
+
+        store = GlobalAssociationStore(self.sydent)
+        for n, address in enumerate(("a@example.com", "c@example.com")):
+            assoc = ThreepidAssociation(
+                "email",
+                address,
+                self._hash(address),
+                "@user%d:hs" % n,
+                1,
+                0,
+                99999999999999,
+            )
+            store.addAssociation(assoc, "{}", "example.com", n)
+
+    def _hash(self, address: str) -> str:
+        return sha256_and_url_safe_base64("%s email %s" % (address, self.pepper))
+
+    def test_bulk_lookup(self) -> None:
+        threepids = [
+            ["email", "c@example.com"],
+            ["email", "b@example.com"],
+            ["email", "a@example.com"],
+            ["email", "c@example.com"],
+            ["email", "d@example.com"],
+        ]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": threepids},
+        )
+        # The lookup is spread over several iterations of the reactor.
+        self.assertFalse(channel.result.get("done"))
+        self.sydent.reactor.advance(0)
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body["threepids"],
+            [
+                ["email", "a@example.com", "@user0:hs"],
+                ["email", "c@example.com", "@user1:hs"],
+            ],
+        )
+
+    def test_invalid_chunk_size(self) -> None:
+        for chunk_size in ("0", "-1"):
+            with self.assertRaises(ConfigError):
+                make_sydent({"lookup": {"chunk_size": chunk_size}})
+
+    def test_bulk_lookup_limit(self) -> None:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": [["email", "a@example.com"]] * 7},
+        )
+        self.assertEqual(channel.code, 400)
+        self.assertEqual(channel.json_body["errcode"], "M_TOO_LARGE")
+
+    def test_v2_lookup(self) -> None:
+        addresses = [self._hash("%s@example.com" % x) for x in "abcde"]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            {"addresses": addresses, "algorithm": "sha256", "pepper": self.pepper},
+            access_token="t",
+        )
+        self.sydent.reactor.advance(0)
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body["mappings"],
+            {addresses[0]: "@user0:hs", addresses[2]: "@user1:hs"},
+        )
+
+    def test_bulk_lookup_paused(self) -> None:
+        threepids = [["email", "%s@example.com" % x] for x in "abcde"]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": threepids},
+        )
+        # Nothing more is written while the client isn't reading the response.
+        assert channel._producer is not None
+        channel._producer.pauseProducing()
+        self.sydent.reactor.advance(0)
+        self.assertFalse(channel.result.get("done"))
+
+        channel._producer.resumeProducing()
+        self.sydent.reactor.advance(0)
+        self.assertEqual(
+            channel.json_body["threepids"],
+            [
+                ["email", "a@example.com", "@user0:hs"],
+                ["email", "c@example.com", "@user1:hs"],
+            ],
+        )
+
+    def test_v2_lookup_plaintext(self) -> None:
+        addresses = ["%s@example.com email" % x for x in "abcde"]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            {"addresses": addresses, "algorithm": "none", "pepper": self.pepper},
+            access_token="t",
+        )
+        self.sydent.reactor.advance(0)
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body["mappings"],
+            {addresses[0]: "@user0:hs", addresses[2]: "@user1:hs"},
+        )
+
+    def test_bulk_lookup_invalid(self) -> None:
+        for body, errcode in (
+            ({"threepids": [["email", "a@example.com"], ["email"]]}, "M_INVALID_PARAM"),
+            ({"threepids": "email a@example.com"}, "M_INVALID_PARAM"),
+            ({}, "M_MISSING_PARAMS"),
+            (b'{"threepids": [["email", "a@example.com"],', "M_BAD_JSON"),
+            (b'{"threepids": [["email", "\\ud800"]]}', "M_BAD_JSON"),
+            (b"5", "M_BAD_JSON"),
+        ):
+            # Whether the body is decoded at once or parsed incrementally.
+            for min_size in (INCREMENTAL_JSON_MIN_SIZE, 0):
+                with patch("sydent.http.servlets.INCREMENTAL_JSON_MIN_SIZE", min_size):
+                    _, channel = make_request(
+                        self.sydent.reactor,
+                        self.sydent.clientApiHttpServer.factory,
+                        "POST",
+                        "/_matrix/identity/api/v1/bulk_lookup",
+                        body,
+                    )
+                self.assertEqual(channel.code, 400, body)
+                self.assertEqual(channel.json_body["errcode"], errcode)
+
+    def test_v2_lookup_invalid(self) -> None:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            {"addresses": ["abc", 1], "algorithm": "sha256", "pepper": self.pepper},
+            access_token="t",
+        )
+        self.assertEqual(channel.code, 400)
+        self.assertEqual(channel.json_body["errcode"], "M_INVALID_PARAM")
+
+    def test_v2_lookup_cbor(self) -> None:
+        digests = [decode_base64(self._hash("%s@example.com" % x)) for x in "abcde"]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            cbor.encode(
+                {"addresses": digests, "algorithm": "sha256", "pepper": self.pepper}
+            ),
+            access_token="t",
+            content_type=b"application/cbor",
+        )
+        self.sydent.reactor.advance(0)
+
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.headers.getRawHeaders(b"Content-Type"), [b"application/cbor"]
+        )
+        self.assertEqual(
+            cbor.decode(channel.result["body"]),
+            {"mappings": {digests[0]: "@user0:hs", digests[2]: "@user1:hs"}},
+        )
+
+    def test_v2_lookup_cbor_invalid(self) -> None:
+        """Tests that byte strings are only accepted as addresses, and that only
+        strings are accepted as keys.
+        """
+        for body in (
+            {"addresses": [], "algorithm": b"sha256", "pepper": self.pepper},
+            {"addresses": [], "algorithm": "sha256", "pepper": self.pepper, 1: "a"},
+        ):
+            _, channel = make_request(
+                self.sydent.reactor,
+                self.sydent.clientApiHttpServer.factory,
+                "POST",
+                "/_matrix/identity/v2/lookup",
+                cbor.encode(body),
+                access_token="t",
+                content_type=b"application/cbor",
+            )
+            self.assertEqual(channel.code, 400)
+            self.assertEqual(
+                cbor.decode(channel.result["body"])["errcode"], "M_INVALID_PARAM"
+            )
+
+    def test_cbor_only_for_lookups(self) -> None:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/validate/email/requestToken",
+            cbor.encode(
+                {
+                    "client_secret": b"secret",
+                    "email": b"alice@example.com",
+                    "send_attempt": 1,
+                }
+            ),
+            access_token="t",
+            content_type=b"application/cbor",
+        )
+        self.assertEqual(channel.code, 400)
+        self.assertEqual(channel.json_body["errcode"], "M_NOT_JSON")
+
+    def test_bulk_lookup_cbor_response(self) -> None:
+        for threepids in (
+            [["email", "a@example.com"]],
+            [["email", "%s@example.com" % x] for x in "abcde"],
+        ):
+            _, channel = make_request(
+                self.sydent.reactor,
+                self.sydent.clientApiHttpServer.factory,
+                "POST",
+                "/_matrix/identity/api/v1/bulk_lookup",
+                {"threepids": threepids},
+                custom_headers=[
+                    (b"Accept", b"application/json;q=0.5, application/cbor")
+                ],
+            )
+            self.sydent.reactor.advance(0)
+
+            self.assertEqual(channel.code, 200)
+            self.assertEqual(
+                cbor.decode(channel.result["body"])["threepids"][0],
+                ["email", "a@example.com", "@user0:hs"],
+            )
+
+
+class LookupRatelimitTestCase(unittest.TestCase):
+    """Tests that lookups are ratelimited by the number of addresses looked up."""
+
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true"},
+                "lookup": {
+                    "ratelimit.account.burst": "5",
+                    "ratelimit.account.rate_hz": "2",
+                    "ratelimit.ip.burst": "8",
+                    "ratelimit.ip.rate_hz": "2",
+                },
+            }
+        )
+        self.pepper = HashingMetadataStore(self.sydent).get_lookup_pepper()
+
+        cur = self.sydent.db.cursor()
+        for user_id, token in (("@bob:localhost", "t"), ("@alice:localhost", "u")):
+            cur.execute(
+                "INSERT INTO accounts (user_id, created_ts, consent_version) "
+                "VALUES (?, 1, NULL)",
+                (user_id,),
+            )
+            cur.execute(
+                "INSERT INTO tokens (user_id, token) VALUES (?, ?)", (user_id, token)
+            )
+        self.sydent.db.commit()
+
+        self.sydent.run()
+
+    def _v2_lookup(self, count: int, access_token: str) -> FakeChannel:
+        addresses = ["%d@example.com email" % n for n in range(count)]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup",
+            {"addresses": addresses, "algorithm": "none", "pepper": self.pepper},
+            access_token=access_token,
+        )
+        return channel
+
+    def _bulk_lookup(self, count: int) -> FakeChannel:
+        threepids = [["email", "%d@example.com" % n] for n in range(count)]
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": threepids},
+        )
+        return channel
+
+    def test_account_limit(self) -> None:
+        self.assertEqual(self._v2_lookup(4, "t").code, 200)
+
+        channel = self._v2_lookup(3, "t")
+        self.assertEqual(channel.code, 429)
+        self.assertEqual(channel.json_body["errcode"], "M_LIMIT_EXCEEDED")
+        self.assertEqual(channel.json_body["retry_after_ms"], 1000)
+
+        # Other accounts have their own limit.
+        self.assertEqual(self._v2_lookup(1, "u").code, 200)
+
+        self.sydent.reactor.advance(1)
+        self.assertEqual(self._v2_lookup(3, "t").code, 200)
+
+    def test_ip_limit(self) -> None:
+        self.assertEqual(self._bulk_lookup(5).code, 200)
+        self.assertEqual(self._bulk_lookup(3).code, 200)
+
+        channel = self._bulk_lookup(1)
+        self.assertEqual(channel.code, 429)
+        self.assertEqual(channel.json_body["errcode"], "M_LIMIT_EXCEEDED")
+
+        # Authenticated lookups count towards the limit of the client's IP address
+        # too.
+        self.assertEqual(self._v2_lookup(1, "t").code, 429)
+
+    def test_denied_lookups_not_counted(self) -> None:
+        """Tests that lookups denied by one limit don't count towards the other."""
+        self.assertEqual(self._v2_lookup(5, "t").code, 200)
+        self.assertEqual(self._v2_lookup(3, "t").code, 429)
+        # The lookup denied for the account didn't use up the IP address' allowance.
+        self.assertEqual(self._bulk_lookup(3).code, 200)
+
+        self.sydent.reactor.advance(4)
+        # Let the IP address limit recover faster than the account's.
+        self.sydent.lookup_ip_ratelimiter.reconfigure(8, 10)
+        self.assertEqual(self._bulk_lookup(8).code, 200)
+        self.assertEqual(self._v2_lookup(5, "t").code, 429)
+
+        self.sydent.reactor.advance(1)
+        # The lookup denied for the IP address didn't use up the account's
+        # allowance.
+        self.assertEqual(self._v2_lookup(5, "t").code, 200)
+
+
+class LookupNoRatelimitTestCase(unittest.TestCase):
+    """Tests that lookups aren't ratelimited by default."""
+
+    def test_no_limit(self) -> None:
+        sydent = make_sydent({"general": {"enable_v1_access": "true"}})
+        sydent.run()
+
+        threepids = [["email", "%d@example.com" % n] for n in range(1000)]
+        for _ in range(200):
+            _, channel = make_request(
+                sydent.reactor,
+                sydent.clientApiHttpServer.factory,
+                "POST",
+                "/_matrix/identity/api/v1/bulk_lookup",
+                {"threepids": threepids},
+            )
+            self.assertEqual(channel.code, 200)
+
+    def test_invalid_rate(self) -> None:
+        for option in ("account", "ip"):
+            with self.assertRaises(ConfigError):
+                make_sydent(
+                    {
+                        "lookup": {
+                            "ratelimit.%s.burst" % (option,): "10",
+                            "ratelimit.%s.rate_hz" % (option,): "0",
+                        }
+                    }
+                )
+            # The rate doesn't matter if lookups aren't ratelimited that way.
+            make_sydent({"lookup": {"ratelimit.%s.rate_hz" % (option,): "0"}})
+
+        with self.assertRaises(ConfigError):
+            make_sydent({"email": {"email.ratelimit_sender.rate_hz": "0"}})
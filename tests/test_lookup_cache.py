@@ -0,0 +1,230 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from typing import List
+from unittest.mock import patch
+
+from signedjson.sign import sign_json
+from twisted.trial import unittest
+
+from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.threepid import ThreepidAssociation
+from sydent.types import JsonDict
+from sydent.util.hash import sha256_and_url_safe_base64
+from sydent.util.lrucache import LruTtlCache
+from tests.utils import make_request, make_sydent
+
+
+class LruTtlCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.cache: LruTtlCache[str, int] = LruTtlCache(
+            "test", max_size=2, ttl=10, timer=lambda: self.now
+        )
+
+    def test_lru_eviction(self) -> None:
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        # Using "a" makes "b" the least recently used entry.
+        self.assertEqual(self.cache.get("a"), 1)
+        self.cache.set("c", 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_expiry(self) -> None:
+        self.cache.set("a", 1)
+        self.now = 9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self) -> None:
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.invalidate("a")
+        self.cache.invalidate("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+
+class LookupCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent({"lookup": {"cache.enabled": "true"}})
+        self.store = GlobalAssociationStore(self.sydent)
+        self.origin_id = 0
+
+    def _add_association(
+        self, address: str, mxid: str, ts: int = 1, not_after: int = 99999999999999
+    ) -> str:
+        lookup_hash = "hash_" + address
+        assoc = ThreepidAssociation(
+            "email", address, lookup_hash, mxid, ts, 0, not_after
+        )
+        self.origin_id += 1
+        self.store.addAssociation(assoc, '{"mxid": "%s"}' % mxid, "hs", self.origin_id)
+        return lookup_hash
+
+    def _lookup_all(self, address: str) -> List[object]:
+        return [
+            self.store.getMxid("email", address),
+            self.store.signedAssociationStringForThreepid("email", address),
+            self.store.getMxids([("email", address)]),
+            self.store.retrieveMxidsForHashes(["hash_" + address]),
+        ]
+
+    def test_results_follow_changes(self) -> None:
+        self.assertEqual(self._lookup_all("alice@example.com"), [None, None, [], {}])
+
+        self._add_association("alice@example.com", "@alice:hs")
+        self.assertEqual(
+            self._lookup_all("alice@example.com"),
+            [
+                "@alice:hs",
+                '{"mxid": "@alice:hs"}',
+                [("email", "alice@example.com", "@alice:hs")],
+                {"hash_alice@example.com": "@alice:hs"},
+            ],
+        )
+
+        # A more recent association replaces the previous one.
+        self._add_association("alice@example.com", "@alice2:hs", ts=2)
+        self.assertEqual(self.store.getMxid("email", "ALICE@example.com"), "@alice2:hs")
+        self.assertEqual(
+            self.store.getMxids([("email", "alice@example.com")]),
+            [("email", "alice@example.com", "@alice2:hs")],
+        )
+
+        self.store.removeAssociation("email", "alice@example.com")
+        self.assertEqual(self._lookup_all("alice@example.com"), [None, None, [], {}])
+
+    def test_matches_uncached_results(self) -> None:
+        self._add_association("bob@example.com", "@bob:hs")
+        self._add_association("Bob@example.com", "@bob2:hs", ts=2)
+        self._add_association("carol@example.com", "@carol:hs", not_after=2)
+
+        cached = [self._lookup_all(a) for a in ("bob@example.com", "carol@example.com")]
+        # Looking up again is answered from the cache.
+        self.assertEqual(
+            [self._lookup_all(a) for a in ("bob@example.com", "carol@example.com")],
+            cached,
+        )
+        self.assertEqual(len(self.sydent.lookup_cache.threepids), 2)
+
+        self.sydent.lookup_cache = None
+        self.assertEqual(
+            [self._lookup_all(a) for a in ("bob@example.com", "carol@example.com")],
+            cached,
+        )
+
+    def test_lookups_end_transaction(self) -> None:
+        """Filling the cache through temporary tables doesn't leave a transaction
+        open, which would keep a lock on the database."""
+        self._add_association("bob@example.com", "@bob:hs")
+
+        self.store.getMxids([("email", "bob@example.com")])
+        self.assertFalse(self.sydent.db.in_transaction)
+        self.store.retrieveMxidsForHashes(["hash_bob@example.com"])
+        self.assertFalse(self.sydent.db.in_transaction)
+
+    def test_temporary_table_joins_use_indexes(self) -> None:
+        """Joins against the temporary tables of looked up 3PIDs and hashes
+        search global_threepid_associations by index rather than scanning it."""
+        self._add_association("bob@example.com", "@bob:hs")
+
+        queries: List[str] = []
+        self.sydent.db.set_trace_callback(queries.append)
+        try:
+            self._lookup_all("bob@example.com")
+            self.sydent.lookup_cache = None
+            self._lookup_all("bob@example.com")
+        finally:
+            self.sydent.db.set_trace_callback(None)
+
+        # The lookups drop their temporary tables, so create them again to
+        # explain the queries.
+        for query in queries:
+            if query.startswith("CREATE TEMPORARY TABLE"):
+                self.sydent.db.execute(query)
+        joins = [q for q in queries if q.startswith("SELECT") and "tmp_" in q]
+        # The cached and uncached getMxids and retrieveMxidsForHashes queries.
+        self.assertEqual(len(joins), 4)
+        for query in joins:
+            plan = [
+                row[3] for row in self.sydent.db.execute("EXPLAIN QUERY PLAN " + query)
+            ]
+            self.assertFalse([step for step in plan if step.startswith("SCAN g")], plan)
+
+    def test_pepper_change_clears_cache(self) -> None:
+        self.store.retrieveMxidsForHashes(["some_hash"])
+        self.assertEqual(len(self.sydent.lookup_cache.hashes), 1)
+
+        HashingMetadataStore(self.sydent).store_lookup_pepper(
+            sha256_and_url_safe_base64, "newpepper"
+        )
+        self.assertEqual(len(self.sydent.lookup_cache.hashes), 0)
+
+
+class SignedLookupCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent({"general": {"enable_v1_access": "true"}})
+        self.sydent.run()
+        self.store = GlobalAssociationStore(self.sydent)
+
+    def _add_association(self, mxid: str, origin_id: int) -> None:
+        assoc = ThreepidAssociation(
+            "email", "alice@example.com", None, mxid, 1, 0, 99999999999999
+        )
+        self.store.addAssociation(
+            assoc, json.dumps({"mxid": mxid, "signatures": {}}), "hs", origin_id
+        )
+
+    def _lookup(self) -> JsonDict:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "GET",
+            "/_matrix/identity/api/v1/lookup?medium=email&address=alice@example.com",
+        )
+        self.assertEqual(channel.code, 200)
+        return channel.json_body
+
+    def test_cached_response(self) -> None:
+        self._add_association("@alice:hs", 1)
+
+        with patch("signedjson.sign.sign_json", wraps=sign_json) as mock_sign:
+            first = self._lookup()
+            self.assertEqual(self._lookup(), first)
+            mock_sign.assert_called_once()
+
+        self.assertEqual(first["mxid"], "@alice:hs")
+        self.assertIn(self.sydent.config.general.server_name, first["signatures"])
+
+    def test_invalidated_on_removal(self) -> None:
+        self._add_association("@alice:hs", 1)
+        self.assertEqual(self._lookup()["mxid"], "@alice:hs")
+
+        # The new association reuses the ID of the removed one.
+        self.store.removeAssociation("email", "alice@example.com")
+        self.assertEqual(self._lookup(), {})
+        self._add_association("@bob:hs", 2)
+        self.assertEqual(self._lookup()["mxid"], "@bob:hs")
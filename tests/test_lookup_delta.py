@@ -0,0 +1,198 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional
+
+from twisted.trial import unittest
+from unpaddedbase64 import decode_base64
+
+from sydent.db.hashing_metadata import HashingMetadataStore
+from sydent.db.lookup_delta import LookupDeltaStore
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.threepid import ThreepidAssociation
+from sydent.types import JsonDict
+from sydent.util import cbor, time_msec
+from sydent.util.hash import sha256_and_url_safe_base64
+from tests.utils import make_request, make_sydent
+
+
+class LookupDeltaTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent()
+        self.pepper = HashingMetadataStore(self.sydent).get_lookup_pepper()
+
+        cur = self.sydent.db.cursor()
+        for user_id, token in (("@bob:localhost", "t"), ("@eve:localhost", "u")):
+            cur.execute(
+                "INSERT INTO accounts (user_id, created_ts, consent_version) "
+                "VALUES (?, 1, NULL)",
+                (user_id,),
+            )
+            cur.execute(
+                "INSERT INTO tokens (user_id, token) VALUES (?, ?)", (user_id, token)
+            )
+        self.sydent.db.commit()
+
+        self.sydent.run()
+
+        self.store = GlobalAssociationStore(self.sydent)
+        self.hashes = [self._hash("%s@example.com" % x) for x in "abc"]
+        self._bind("a@example.com", "@a:hs", 0)
+
+    def _hash(self, address: str) -> str:
+        return sha256_and_url_safe_base64("%s email %s" % (address, self.pepper))
+
+    def _bind(self, address: str, mxid: str, origin_id: int) -> None:
+        assoc = ThreepidAssociation(
+            "email", address, self._hash(address), mxid, 1, 0, 99999999999999
+        )
+        self.store.addAssociation(assoc, "{}", "example.com", origin_id)
+
+    def _lookup(self, content: JsonDict, token: str = "t") -> Optional[JsonDict]:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/v2/lookup_delta",
+            content,
+            access_token=token,
+        )
+        if channel.code != 200:
+            self.assertEqual(channel.code, 400)
+            return None
+        return channel.json_body
+
+    def _register(self) -> str:
+        body = self._lookup(
+            {"addresses": self.hashes, "algorithm": "sha256", "pepper": self.pepper}
+        )
+        assert body is not None
+        self.assertEqual(body["mappings"], {self.hashes[0]: "@a:hs"})
+        return body["sync_token"]
+
+    def test_delta(self) -> None:
+        sync_token = self._register()
+
+        self._bind("b@example.com", "@b:hs", 1)
+        self._bind("z@example.com", "@z:hs", 2)
+        self.store.removeAssociation("email", "a@example.com")
+
+        body = self._lookup({"sync_token": sync_token})
+        assert body is not None
+        self.assertEqual(body["mappings"], {self.hashes[1]: "@b:hs"})
+        self.assertEqual(body["removed"], [self.hashes[0]])
+
+        # Nothing changed since the last delta.
+        body = self._lookup({"sync_token": body["sync_token"]})
+        assert body is not None
+        self.assertEqual(body["mappings"], {})
+        self.assertEqual(body["removed"], [])
+
+        # The previous sync token still works.
+        body = self._lookup({"sync_token": sync_token})
+        assert body is not None
+        self.assertEqual(body["mappings"], {self.hashes[1]: "@b:hs"})
+
+    def test_delta_cbor(self) -> None:
+        """Tests that CBOR responses use raw digests, if the client accepts them."""
+        digests = [decode_base64(x) for x in self.hashes]
+
+        def lookup(content: JsonDict) -> JsonDict:
+            _, channel = make_request(
+                self.sydent.reactor,
+                self.sydent.clientApiHttpServer.factory,
+                "POST",
+                "/_matrix/identity/v2/lookup_delta",
+                content,
+                access_token="t",
+                custom_headers=[(b"Accept", b"application/cbor")],
+            )
+            self.assertEqual(channel.code, 200)
+            self.assertEqual(
+                channel.headers.getRawHeaders(b"Content-Type"), [b"application/cbor"]
+            )
+            return cbor.decode(channel.result["body"])
+
+        body = lookup(
+            {"addresses": self.hashes, "algorithm": "sha256", "pepper": self.pepper}
+        )
+        self.assertEqual(body["mappings"], {digests[0]: "@a:hs"})
+
+        self._bind("b@example.com", "@b:hs", 1)
+        self.store.removeAssociation("email", "a@example.com")
+
+        body = lookup({"sync_token": body["sync_token"]})
+        self.assertEqual(body["mappings"], {digests[1]: "@b:hs"})
+        self.assertEqual(body["removed"], [digests[0]])
+
+    def test_invalid_sync_token(self) -> None:
+        sync_token = self._register()
+
+        # Another user can't use the sync token.
+        self.assertIsNone(self._lookup({"sync_token": sync_token}, token="u"))
+
+        for bad_token in ("abc", sync_token + "0", "x" + sync_token):
+            self.assertIsNone(self._lookup({"sync_token": bad_token}))
+
+    def test_expired_changes(self) -> None:
+        sync_token = self._register()
+        self._bind("b@example.com", "@b:hs", 1)
+
+        cur = self.sydent.db.cursor()
+        cur.execute("UPDATE global_threepid_association_changes SET ts = 0")
+        self.sydent.db.commit()
+        LookupDeltaStore(self.sydent).deleteOldEntries(1000)
+
+        # The changes since the sync token were deleted, so it can't be used.
+        self.assertIsNone(self._lookup({"sync_token": sync_token}))
+
+    def test_expired_associations(self) -> None:
+        """Tests that associations are returned as removed once they expire."""
+        sync_token = self._register()
+
+        cur = self.sydent.db.cursor()
+        cur.execute(
+            "UPDATE global_threepid_associations SET notAfter = ? WHERE lookup_hash = ?",
+            (time_msec(), self.hashes[0]),
+        )
+        cur.execute("UPDATE lookup_delta_expiry_position SET ts = 0")
+        self.sydent.db.commit()
+        LookupDeltaStore(self.sydent).recordExpiredAssociations()
+
+        body = self._lookup({"sync_token": sync_token})
+        assert body is not None
+        self.assertEqual(body["mappings"], {})
+        self.assertEqual(body["removed"], [self.hashes[0]])
+
+        # The expiry is only recorded once.
+        LookupDeltaStore(self.sydent).recordExpiredAssociations()
+        body = self._lookup({"sync_token": body["sync_token"]})
+        assert body is not None
+        self.assertEqual(body["removed"], [])
+
+    def test_max_sets(self) -> None:
+        """Tests that registering too many sets deletes the least recently used."""
+        self.sydent.config.lookup.delta_lookup_max_sets = 2
+        sync_tokens = [self._register() for _ in range(3)]
+
+        self.assertIsNone(self._lookup({"sync_token": sync_tokens[0]}))
+        self.assertIsNotNone(self._lookup({"sync_token": sync_tokens[1]}))
+        self.assertIsNotNone(self._lookup({"sync_token": sync_tokens[2]}))
+
+        # Other accounts have their own limit.
+        self._lookup(
+            {"addresses": self.hashes, "algorithm": "sha256", "pepper": self.pepper},
+            token="u",
+        )
+        self.assertIsNotNone(self._lookup({"sync_token": sync_tokens[1]}))
@@ -0,0 +1,130 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict
+
+from prometheus_client import REGISTRY
+from twisted.trial import unittest
+
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.threepid import ThreepidAssociation
+from tests.utils import make_request, make_sydent
+
+
+def _sample(name: str, labels: Dict[str, str]) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true"},
+                "lookup": {"chunk_size": "10"},
+            }
+        )
+        self.sydent.run()
+
+        store = GlobalAssociationStore(self.sydent)
+        for n in range(20):
+            assoc = ThreepidAssociation(
+                "email",
+                "%d@example.com" % n,
+                None,
+                "@user%d:hs" % n,
+                1,
+                0,
+                99999999999999,
+            )
+            store.addAssociation(assoc, "{}", "example.com", n)
+
+    def test_request(self) -> None:
+        """Tests that the latency and size of responses are measured."""
+        labels = {"servlet": "VersionsServlet", "method": "GET", "code": "200"}
+        count = _sample("sydent_http_request_duration_seconds_count", labels)
+        size = _sample("sydent_http_response_size_bytes_sum", labels)
+
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "GET",
+            "/_matrix/identity/versions",
+        )
+        self.assertEqual(channel.code, 200)
+
+        self.assertEqual(
+            _sample("sydent_http_request_duration_seconds_count", labels), count + 1
+        )
+        self.assertEqual(
+            _sample("sydent_http_response_size_bytes_sum", labels),
+            size + len(channel.result["body"]),
+        )
+
+    def test_unknown_method(self) -> None:
+        """Tests that requests with methods the metrics don't know about share a
+        label.
+        """
+        labels = {"servlet": "VersionsServlet", "method": "other", "code": "501"}
+        count = _sample("sydent_http_request_duration_seconds_count", labels)
+
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "FROBNICATE",
+            "/_matrix/identity/versions",
+        )
+        self.assertEqual(channel.code, 501)
+
+        self.assertEqual(
+            _sample("sydent_http_request_duration_seconds_count", labels), count + 1
+        )
+        self.assertEqual(
+            _sample(
+                "sydent_http_request_duration_seconds_count",
+                {**labels, "method": "FROBNICATE"},
+            ),
+            0,
+        )
+
+    def test_streamed_request(self) -> None:
+        """Tests that requests which finish after render returns are measured once
+        they finish, along with the number of 3PIDs they look up.
+        """
+        labels = {"servlet": "BulkLookupServlet", "method": "POST", "code": "200"}
+        in_flight_labels = {"servlet": "BulkLookupServlet"}
+        count = _sample("sydent_http_request_duration_seconds_count", labels)
+        batch = _sample("sydent_http_request_batch_size_sum", labels)
+
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": [["email", "%d@example.com" % n] for n in range(20)]},
+        )
+        self.assertFalse(channel.result.get("done"))
+        self.assertEqual(_sample("sydent_http_requests_in_flight", in_flight_labels), 1)
+        self.assertEqual(
+            _sample("sydent_http_request_duration_seconds_count", labels), count
+        )
+
+        self.sydent.reactor.advance(0)
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(_sample("sydent_http_requests_in_flight", in_flight_labels), 0)
+        self.assertEqual(
+            _sample("sydent_http_request_duration_seconds_count", labels), count + 1
+        )
+        self.assertEqual(
+            _sample("sydent_http_request_batch_size_sum", labels), batch + 20
+        )
@@ -0,0 +1,124 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from typing import List, Tuple
+
+from twisted.trial import unittest
+from unpaddedbase64 import encode_base64
+
+from tests.utils import FakeChannel, make_request, make_sydent
+
+TERMS_YAML = """
+master_version: "%s"
+docs:
+  terms_of_service:
+    version: "%s"
+    langs:
+      en:
+        name: "Terms of Service"
+        url: "https://example.com/tos_%s.html"
+"""
+
+
+class PrecomputedResponsesTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.terms_path = tempfile.mkstemp(suffix=".yaml")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.terms_path)
+        self._write_terms("1.0")
+
+        self.sydent = make_sydent({"general": {"terms.path": self.terms_path}})
+        self.sydent.run()
+
+    def _write_terms(self, version: str) -> None:
+        with open(self.terms_path, "w") as f:
+            f.write(TERMS_YAML % (version, version, version))
+
+    def _request(self, path: str, if_none_match: bytes = b"") -> FakeChannel:
+        headers: List[Tuple[bytes, bytes]] = []
+        if if_none_match:
+            headers.append((b"If-None-Match", if_none_match))
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.clientApiHttpServer.factory,
+            "GET",
+            path,
+            custom_headers=headers,
+        )
+        return channel
+
+    def _etag(self, channel: FakeChannel) -> bytes:
+        etags = channel.headers.getRawHeaders(b"ETag")
+        assert etags is not None
+        return etags[0]
+
+    def test_conditional_requests(self) -> None:
+        """Tests that precomputed responses have an ETag, and that requests with a
+        matching If-None-Match get a 304 without a body.
+        """
+        pubkey = encode_base64(self.sydent.keyring.ed25519.verify_key.encode())
+        for path in (
+            "/_matrix/identity/versions",
+            "/_matrix/identity/v2/pubkey/ed25519:0",
+            "/_matrix/identity/v2/pubkey/isvalid?public_key=" + pubkey,
+            "/_matrix/identity/v2/terms",
+        ):
+            channel = self._request(path)
+            self.assertEqual(channel.code, 200, path)
+            self.assertIsNotNone(channel.headers.getRawHeaders(b"Cache-Control"))
+            etag = self._etag(channel)
+
+            channel = self._request(path, etag)
+            self.assertEqual(channel.code, 304, path)
+            self.assertEqual(channel.result.get("body", b""), b"")
+
+            channel = self._request(path, b'"other", W/' + etag)
+            self.assertEqual(channel.code, 304, path)
+
+            channel = self._request(path, b'"other"')
+            self.assertEqual(channel.code, 200, path)
+
+    def test_pubkey_isvalid(self) -> None:
+        """Tests that the validity of public keys is still checked."""
+        pubkey = encode_base64(self.sydent.keyring.ed25519.verify_key.encode())
+        path = "/_matrix/identity/v2/pubkey/isvalid?public_key="
+
+        valid = self._request(path + pubkey)
+        self.assertEqual(valid.json_body, {"valid": True})
+        invalid = self._request(path + "nope")
+        self.assertEqual(invalid.json_body, {"valid": False})
+        self.assertNotEqual(self._etag(valid), self._etag(invalid))
+
+    def test_terms_change(self) -> None:
+        """Tests that the terms' response is recomputed when the terms change."""
+        channel = self._request("/_matrix/identity/v2/terms")
+        self.assertEqual(
+            channel.json_body["policies"]["terms_of_service"]["version"], "1.0"
+        )
+        etag = self._etag(channel)
+
+        self._write_terms("2.0")
+        # Make sure the modification time changes, even on coarse filesystems.
+        mtime = os.stat(self.terms_path).st_mtime
+        os.utime(self.terms_path, (mtime + 10, mtime + 10))
+        self.sydent.reactor.advance(self.sydent.config.general.terms_reload_interval)
+
+        channel = self._request("/_matrix/identity/v2/terms", etag)
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body["policies"]["terms_of_service"]["version"], "2.0"
+        )
+        self.assertNotEqual(self._etag(channel), etag)
@@ -89,3 +89,40 @@ class RatelimiterTest(unittest.TestCase):
 
         with self.assertRaises(LimitExceededException):
             self.ratelimiter.ratelimit(key)
+
+    def test_cost(self):
+        """Test that requests can cost several tokens"""
+        key = "key"
+
+        self.ratelimiter.ratelimit(key, cost=3)
+
+        with self.assertRaises(LimitExceededException) as cm:
+            self.ratelimiter.ratelimit(key, cost=3)
+
+        # One token leaks every two seconds.
+        self.assertEqual(cm.exception.retry_after_ms, 2000)
+        self.assertEqual(cm.exception.errcode, "M_LIMIT_EXCEEDED")
+
+        self.clock.advance(2)
+        self.ratelimiter.ratelimit(key, cost=3)
+
+    def test_cost_above_burst(self):
+        """Test that requests costing more than `burst` can still happen once the
+        bucket is empty"""
+        key = "key"
+
+        self.ratelimiter.ratelimit(key, cost=100)
+
+        with self.assertRaises(LimitExceededException) as cm:
+            self.ratelimiter.ratelimit(key)
+        self.assertEqual(cm.exception.retry_after_ms, 2000)
+
+    def test_invalid_rate(self) -> None:
+        """Test that ratelimiters must leak, unless they don't ratelimit at all"""
+        with self.assertRaises(ValueError):
+            Ratelimiter(self.clock, burst=5, rate_hz=0)
+        with self.assertRaises(ValueError):
+            self.ratelimiter.reconfigure(burst=5, rate_hz=-1)
+
+        ratelimiter: Ratelimiter[str] = Ratelimiter(self.clock, burst=None, rate_hz=0)
+        ratelimiter.ratelimit("key", cost=100)
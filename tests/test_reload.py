@@ -0,0 +1,214 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from configparser import ConfigParser
+from typing import Dict
+
+from netaddr import IPAddress
+from twisted.trial import unittest
+
+from sydent.http.httpserver import ClientApiContextFactory, ReplicationContextFactory
+from sydent.workers import apply_worker_overrides
+from tests.utils import make_request, make_sydent, write_key_and_cert
+
+
+class ReloadTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.config_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.config_dir, "sydent.conf")
+        self.config: Dict[str, Dict[str, str]] = {
+            "http": {"internalapi.http.port": "8091"},
+            "lookup": {"ratelimit.ip.burst": "10"},
+        }
+        self.sydent = make_sydent(self.config)
+        self._write_config()
+        self.sydent.config.config_file = self.config_path
+        self.sydent.run()
+
+    def _write_config(self) -> None:
+        cfg = ConfigParser()
+        cfg.read_dict(self.config)
+        with open(self.config_path, "w") as f:
+            cfg.write(f)
+
+    def test_reload(self) -> None:
+        """Tests that the reloadable options are applied, and the others reported."""
+        ip_blacklist = self.sydent.config.general.ip_blacklist
+        self.assertNotIn(IPAddress("5.1.2.3"), ip_blacklist)
+
+        self.config["general"]["ip.blacklist"] = "5.0.0.0/8"
+        self.config["lookup"]["ratelimit.ip.burst"] = "20"
+        self.config["http"]["clientapi.http.port"] = "8095"
+        self._write_config()
+
+        result = self.sydent.reload()
+        self.assertTrue(result.config_reloaded)
+        self.assertEqual(result.restart_required, ["http.client_port"])
+        self.assertEqual(self.sydent.config.http.client_port, 8090)
+
+        # The IP blacklist is updated in place, as the HTTP clients use it.
+        self.assertIs(self.sydent.config.general.ip_blacklist, ip_blacklist)
+        self.assertIn(IPAddress("5.1.2.3"), ip_blacklist)
+
+        self.assertEqual(self.sydent.config.lookup.ip_ratelimit_burst, 20)
+        self.assertEqual(self.sydent.lookup_ip_ratelimiter._burst, 20)
+
+    def test_invalid_config(self) -> None:
+        """Tests that nothing is applied if the new config is invalid."""
+        self.config["lookup"]["ratelimit.ip.burst"] = "20"
+        self.config["http"]["internalapi.unix_socket.mode"] = "rwx"
+        self._write_config()
+
+        result = self.sydent.reload()
+        self.assertFalse(result.config_reloaded)
+        self.assertIsNotNone(result.error)
+        self.assertEqual(self.sydent.config.lookup.ip_ratelimit_burst, 10)
+        self.flushLoggedErrors()
+
+    def test_worker_overrides(self) -> None:
+        """Tests that the options client API workers override aren't reported as
+        changed.
+        """
+        apply_worker_overrides(self.sydent.config, 0)
+        self.sydent.config_overrides.append(
+            lambda config: apply_worker_overrides(config, 0)
+        )
+
+        result = self.sydent.reload()
+        self.assertTrue(result.config_reloaded)
+        self.assertEqual(result.restart_required, [])
+        self.assertFalse(self.sydent.config.lookup.cache_enabled)
+
+    def test_internal_api(self) -> None:
+        self.config["http"]["clientapi.http.port"] = "8095"
+        self._write_config()
+
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.internalApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/internal/reload",
+        )
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(
+            channel.json_body,
+            {"config_reloaded": True, "restart_required": ["http.client_port"]},
+        )
+
+        self.config["http"]["internalapi.unix_socket.mode"] = "rwx"
+        self._write_config()
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.sydent.internalApiHttpServer.factory,
+            "POST",
+            "/_matrix/identity/internal/reload",
+        )
+        self.assertEqual(channel.code, 500)
+        self.flushLoggedErrors()
+
+
+class ReplicationCertificateReloadTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cert_path = write_key_and_cert()
+        self.addCleanup(os.unlink, self.cert_path)
+
+        config = {"http": {"replication.https.certfile": self.cert_path}}
+        self.sydent = make_sydent(config)
+        config_path = os.path.join(tempfile.mkdtemp(), "sydent.conf")
+        cfg = ConfigParser()
+        cfg.read_dict(config)
+        with open(config_path, "w") as f:
+            cfg.write(f)
+        self.sydent.config.config_file = config_path
+        self.sydent.run()
+
+    def _digest(self) -> str:
+        cert = self.sydent.sslComponents.myPrivateCertificate
+        assert cert is not None
+        return cert.digest()
+
+    def test_renewed_certificate(self) -> None:
+        """Tests that new replication connections use the renewed certificate."""
+        _, _, context_factory, _, _ = self.sydent.reactor.sslServers[-1]
+        self.assertIsInstance(context_factory, ReplicationContextFactory)
+        context = context_factory.getContext()
+        digest = self._digest()
+
+        write_key_and_cert(self.cert_path)
+        self.assertTrue(self.sydent.reload().config_reloaded)
+        self.assertNotEqual(self._digest(), digest)
+        self.assertIsNot(context_factory.getContext(), context)
+
+    def test_unreadable_certificate(self) -> None:
+        """Tests that the current certificate is kept if the new one is broken."""
+        digest = self._digest()
+        with open(self.cert_path, "w") as f:
+            f.write("not a certificate")
+
+        self.assertFalse(self.sydent.reload().config_reloaded)
+        self.assertEqual(self._digest(), digest)
+        self.flushLoggedErrors()
+
+
+class ClientApiCertificateReloadTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cert_path = write_key_and_cert()
+        self.addCleanup(os.unlink, self.cert_path)
+
+        config = {
+            "http": {
+                "clientapi.https.port": "8443",
+                "clientapi.https.certfile": self.cert_path,
+            }
+        }
+        self.sydent = make_sydent(config)
+        config_path = os.path.join(tempfile.mkdtemp(), "sydent.conf")
+        cfg = ConfigParser()
+        cfg.read_dict(config)
+        with open(config_path, "w") as f:
+            cfg.write(f)
+        self.sydent.config.config_file = config_path
+        self.sydent.run()
+
+    def _digest(self) -> str:
+        cert = self.sydent.clientApiHttpServer.httpsCertificate
+        assert cert is not None
+        return cert.digest()
+
+    def test_renewed_certificate(self) -> None:
+        """Tests that new HTTPS connections use the renewed certificate."""
+        ports = [server[0] for server in self.sydent.reactor.sslServers]
+        _, _, context_factory, _, _ = self.sydent.reactor.sslServers[ports.index(8443)]
+        self.assertIsInstance(context_factory, ClientApiContextFactory)
+        context = context_factory.getContext()
+        digest = self._digest()
+
+        write_key_and_cert(self.cert_path)
+        result = self.sydent.reload()
+        self.assertTrue(result.config_reloaded)
+        self.assertEqual(result.restart_required, [])
+        self.assertNotEqual(self._digest(), digest)
+        self.assertIsNot(context_factory.getContext(), context)
+
+    def test_unreadable_certificate(self) -> None:
+        """Tests that the current certificate is kept if the new one is broken."""
+        digest = self._digest()
+        with open(self.cert_path, "w") as f:
+            f.write("not a certificate")
+
+        self.assertFalse(self.sydent.reload().config_reloaded)
+        self.assertEqual(self._digest(), digest)
+        self.flushLoggedErrors()
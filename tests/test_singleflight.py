@@ -0,0 +1,82 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+from unittest.mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from sydent.types import JsonDict
+from sydent.util.singleflight import SingleFlight
+from tests.utils import make_sydent
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.single_flight: SingleFlight[str, int] = SingleFlight("test")
+        self.calls: List["defer.Deferred[int]"] = []
+
+    def _call(self) -> "defer.Deferred[int]":
+        d: "defer.Deferred[int]" = defer.Deferred()
+        self.calls.append(d)
+        return d
+
+    def test_concurrent_calls_are_shared(self) -> None:
+        d1 = self.single_flight.do("key", self._call)
+        d2 = self.single_flight.do("key", self._call)
+        d3 = self.single_flight.do("other", self._call)
+        self.assertEqual(len(self.calls), 2)
+        self.assertNoResult(d1)
+        self.assertNoResult(d2)
+
+        self.calls[0].callback(1)
+        self.assertEqual(self.successResultOf(d1), 1)
+        self.assertEqual(self.successResultOf(d2), 1)
+        self.assertNoResult(d3)
+
+        # The call isn't in flight anymore, so a new call is made.
+        d4 = self.single_flight.do("key", self._call)
+        self.assertEqual(len(self.calls), 3)
+        self.assertNoResult(d4)
+        self.assertEqual(len(self.single_flight), 2)
+
+    def test_failures_are_shared(self) -> None:
+        d1 = self.single_flight.do("key", self._call)
+        d2 = self.single_flight.do("key", self._call)
+
+        self.calls[0].errback(ValueError("oh no"))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+        self.assertEqual(len(self.single_flight), 0)
+
+
+class VerifierKeyRequestsTestCase(unittest.TestCase):
+    def test_concurrent_key_requests(self) -> None:
+        sydent = make_sydent()
+        response: "defer.Deferred[JsonDict]" = defer.Deferred()
+
+        get_json = Mock(return_value=response)
+        with patch("sydent.http.httpclient.FederationHttpClient.get_json", get_json):
+            d1 = defer.ensureDeferred(
+                sydent.sig_verifier._getKeysForServer("example.com")
+            )
+            d2 = defer.ensureDeferred(
+                sydent.sig_verifier._getKeysForServer("example.com")
+            )
+            response.callback({"verify_keys": {"ed25519:a": {"key": "abc"}}})
+
+        self.assertEqual(get_json.call_count, 1)
+        self.assertEqual(self.successResultOf(d1), {"ed25519:a": {"key": "abc"}})
+        self.assertEqual(self.successResultOf(d2), {"ed25519:a": {"key": "abc"}})
@@ -0,0 +1,51 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+from twisted.trial import unittest
+
+# Modules which are slow to import, and only needed by optional features.
+LAZY_MODULES = (
+    "jinja2",
+    "phonenumbers",
+    "sentry_sdk",
+    "yaml",
+    "sydent.http.servlets.lookupservlet",
+)
+
+
+class LazyImportsTestCase(unittest.TestCase):
+    def test_lazy_imports(self) -> None:
+        """Tests that starting Sydent doesn't import the modules only needed by
+        optional features, when they're disabled.
+        """
+        script = (
+            "import sys\n"
+            "from tests.utils import make_sydent\n"
+            "make_sydent({'general': {'enable_v1_access': 'false'}})\n"
+            "print(' '.join(sys.modules))\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.split()
+
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, output)
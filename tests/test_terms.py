@@ -0,0 +1,133 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from twisted.trial import unittest
+
+from sydent.terms.terms import Terms, get_terms
+from tests.utils import make_sydent
+
+TERMS_YAML = """
+master_version: "%s"
+docs:
+  terms_of_service:
+    version: "%s"
+    langs:
+      en:
+        name: "Terms of Service"
+        url: "https://example.com/tos_%s.html"
+"""
+
+
+class TermsTestCase(unittest.TestCase):
+    def test_shared_url(self) -> None:
+        """Tests that accepting a URL used by several documents accepts all of
+        them.
+        """
+        terms = Terms(
+            {
+                "master_version": "1.0",
+                "docs": {
+                    name: {
+                        "version": "1.0",
+                        "langs": {
+                            "en": {"name": name, "url": "https://example.com/terms"},
+                            "fr": {
+                                "name": name,
+                                "url": "https://example.com/%s" % name,
+                            },
+                        },
+                    }
+                    for name in ("terms_of_service", "privacy_policy")
+                },
+            }
+        )
+        self.assertTrue(terms.urlListIsSufficient(["https://example.com/terms"]))
+        self.assertTrue(
+            terms.urlListIsSufficient(
+                ["https://example.com/privacy_policy", "https://example.com/terms"]
+            )
+        )
+        self.assertFalse(
+            terms.urlListIsSufficient(["https://example.com/privacy_policy"])
+        )
+
+
+class TermsReloadTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.terms_path = tempfile.mkstemp(suffix=".yaml")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.terms_path)
+        self._write_terms(TERMS_YAML % ("1.0", "1.0", "1.0"))
+
+        self.sydent = make_sydent({"general": {"terms.path": self.terms_path}})
+        self.sydent.run()
+        self.interval = self.sydent.config.general.terms_reload_interval
+
+    def _write_terms(self, content: str) -> None:
+        with open(self.terms_path, "w") as f:
+            f.write(content)
+        # Make sure the modification time changes, even on coarse filesystems.
+        mtime = os.stat(self.terms_path).st_mtime + 10
+        os.utime(self.terms_path, (mtime, mtime))
+
+    def test_loaded_once(self) -> None:
+        """Tests that the terms are only read again when their file changes."""
+        terms = get_terms(self.sydent)
+        self.assertEqual(terms.getMasterVersion(), "1.0")
+        self.assertEqual(terms.getUrlSet(), {"https://example.com/tos_1.0.html"})
+        self.assertTrue(terms.urlListIsSufficient(["https://example.com/tos_1.0.html"]))
+        self.assertFalse(terms.urlListIsSufficient(["https://example.com/other"]))
+
+        self.sydent.reactor.advance(self.interval)
+        self.assertIs(get_terms(self.sydent), terms)
+
+        self._write_terms(TERMS_YAML % ("2.0", "2.0", "2.0"))
+        # Not before the next check.
+        self.assertIs(get_terms(self.sydent), terms)
+        self.sydent.reactor.advance(self.interval)
+        self.assertEqual(get_terms(self.sydent).getMasterVersion(), "2.0")
+
+    def test_broken_file(self) -> None:
+        """Tests that the previous terms are kept if the new ones can't be parsed,
+        until they're fixed.
+        """
+        terms = get_terms(self.sydent)
+
+        self._write_terms("master_version: [")
+        self.sydent.reactor.advance(self.interval)
+        self.assertIs(get_terms(self.sydent), terms)
+        self.flushLoggedErrors()
+
+        os.unlink(self.terms_path)
+        self.sydent.reactor.advance(self.interval)
+        self.assertIs(get_terms(self.sydent), terms)
+
+        self._write_terms(TERMS_YAML % ("2.0", "2.0", "2.0"))
+        self.sydent.reactor.advance(self.interval)
+        self.assertEqual(get_terms(self.sydent).getMasterVersion(), "2.0")
+
+    def test_reload(self) -> None:
+        """Tests that reloading Sydent (e.g. on SIGHUP) reloads the terms, even if
+        their file's modification time didn't change.
+        """
+        mtime = os.stat(self.terms_path).st_mtime
+        with open(self.terms_path, "w") as f:
+            f.write(TERMS_YAML % ("3.0", "3.0", "3.0"))
+        os.utime(self.terms_path, (mtime, mtime))
+
+        self.sydent.reload()
+        self.assertEqual(get_terms(self.sydent).getMasterVersion(), "3.0")
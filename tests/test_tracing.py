@@ -0,0 +1,189 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+from typing import List
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.util import tracing
+from tests.utils import make_request, make_sydent
+
+
+class _ListExporter(tracing.SpanExporter):
+    def __init__(self) -> None:
+        self.spans: List[tracing.Span] = []
+
+    def export(self, span: tracing.Span) -> None:
+        self.spans.append(span)
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.exporter = _ListExporter()
+        tracing.configure([self.exporter])
+        self.addCleanup(tracing.configure, [])
+
+    def test_nested_spans(self) -> None:
+        with tracing.trace("root", {"a": 1}, start_trace=True) as root:
+            with tracing.trace("child") as child:
+                child.set_attribute("b", 2)
+
+        self.assertEqual([s.name for s in self.exporter.spans], ["child", "root"])
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual(child.trace_id, root.trace_id)
+        self.assertEqual(root.attributes, {"a": 1})
+        self.assertEqual(child.attributes, {"b": 2})
+        self.assertIsNotNone(root.duration)
+
+    def test_error(self) -> None:
+        with self.assertRaises(ValueError):
+            with tracing.trace("root", start_trace=True):
+                raise ValueError("oops")
+
+        self.assertEqual(self.exporter.spans[0].error, "ValueError: oops")
+
+    def test_no_trace(self) -> None:
+        """Tests that spans outside of any trace aren't recorded, unless they start
+        a trace.
+        """
+        with tracing.trace("orphan"):
+            with tracing.trace("root", start_trace=True):
+                pass
+
+        self.assertEqual([s.name for s in self.exporter.spans], ["root"])
+
+    def test_disabled(self) -> None:
+        for exporters, sample_rate in (([], 1.0), ([self.exporter], 0.0)):
+            tracing.configure(exporters, sample_rate)
+            with tracing.trace("root", start_trace=True):
+                with tracing.trace("child"):
+                    pass
+
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_coroutines(self) -> None:
+        """Tests that the active span carries across awaits."""
+        clock = Clock()
+
+        @tracing.traced("step")
+        async def step() -> None:
+            d: "defer.Deferred[None]" = defer.Deferred()
+            clock.callLater(1, d.callback, None)
+            await d
+
+        @tracing.traced("handler", start_trace=True)
+        async def handler() -> None:
+            await step()
+            await step()
+
+        d1 = defer.ensureDeferred(handler())
+        d2 = defer.ensureDeferred(handler())
+        clock.advance(1)
+        clock.advance(1)
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+
+        roots = [s for s in self.exporter.spans if s.name == "handler"]
+        self.assertEqual(len(roots), 2)
+        for root in roots:
+            steps = [s for s in self.exporter.spans if s.parent_id == root.span_id]
+            self.assertEqual([s.name for s in steps], ["step", "step"])
+            self.assertEqual({s.trace_id for s in steps}, {root.trace_id})
+
+    def test_finish_with(self) -> None:
+        with tracing.trace("root", start_trace=True):
+            span = tracing.start_span("deferred")
+        d: "defer.Deferred[None]" = defer.Deferred()
+        tracing.finish_with(span, d)
+        self.assertEqual(self.exporter.spans[-1].name, "root")
+
+        d.errback(ValueError("oops"))
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.exporter.spans[-1].name, "deferred")
+        self.assertEqual(self.exporter.spans[-1].error, "ValueError: oops")
+
+
+class RequestTracingTestCase(unittest.TestCase):
+    def test_request_traced(self) -> None:
+        """Tests that requests and their database queries are traced, and exported
+        to a JSON file.
+        """
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.addCleanup(tracing.configure, [])
+
+        sydent = make_sydent(
+            {
+                "general": {
+                    "enable_v1_access": "true",
+                    "tracing.exporter": "json",
+                    "tracing.json_path": path,
+                }
+            }
+        )
+        sydent.run()
+
+        _, channel = make_request(
+            sydent.reactor,
+            sydent.clientApiHttpServer.factory,
+            "GET",
+            "/_matrix/identity/api/v1/lookup?medium=email&address=a@example.com",
+        )
+        self.assertEqual(channel.code, 200)
+
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+
+        roots = [s for s in spans if s["name"] == "http.request"]
+        self.assertEqual(len(roots), 1)
+        root = roots[0]
+        self.assertEqual(root["attributes"]["servlet"], "LookupServlet")
+        self.assertEqual(root["attributes"]["http.status_code"], "200")
+
+        queries = [s for s in spans if s["parent_id"] == root["span_id"]]
+        self.assertTrue(queries)
+        for query in queries:
+            self.assertEqual(query["name"], "db.execute")
+            self.assertEqual(query["trace_id"], root["trace_id"])
+
+    def test_index_build_traced(self) -> None:
+        """Tests that the queries building the lookup hash index are traced."""
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.addCleanup(tracing.configure, [])
+
+        sydent = make_sydent(
+            {"general": {"tracing.exporter": "json", "tracing.json_path": path}}
+        )
+        with tracing.trace("build", start_trace=True):
+            GlobalAssociationStore(sydent).buildLookupHashIndex(10)
+
+        with open(path) as f:
+            statements = [
+                json.loads(line)["attributes"].get("db.statement", "") for line in f
+            ]
+        for query in (
+            "SELECT mxid FROM tmp_lookup_index_mxids",
+            "SELECT * FROM ( SELECT sydent_lookup_digest",
+        ):
+            self.assertTrue(any(s.startswith(query) for s in statements), query)
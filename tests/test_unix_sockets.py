@@ -0,0 +1,137 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import subprocess
+import tempfile
+
+from twisted.internet.address import UNIXAddress
+from twisted.internet.error import CannotListenError
+from twisted.trial import unittest
+
+from sydent.config.exceptions import ConfigError
+from sydent.http.httpserver import MetricsResource
+from sydent.workers import _listen_unix
+from tests.utils import make_request, make_sydent
+
+
+class UnixSocketTestCase(unittest.TestCase):
+    def test_listeners(self) -> None:
+        """Tests that the client API, internal API and metrics are served on Unix
+        sockets, if configured.
+        """
+        sydent = make_sydent(
+            {
+                "general": {
+                    "prometheus_unix_socket.path": "/run/sydent/metrics.sock",
+                },
+                "http": {
+                    "clientapi.unix_socket.path": "/run/sydent/client.sock",
+                    "clientapi.unix_socket.mode": "666",
+                    "internalapi.unix_socket.path": "/run/sydent/internal.sock",
+                    "internalapi.unix_socket.mode": "600",
+                },
+            }
+        )
+        sydent.run()
+
+        # The client API isn't served over TCP.
+        self.assertNotIn(8090, [server[0] for server in sydent.reactor.tcpServers])
+
+        servers = {
+            path: (factory, mode, want_pid)
+            for path, factory, _, mode, want_pid in sydent.reactor.unixServers
+        }
+        self.assertEqual(
+            servers["/run/sydent/client.sock"],
+            (sydent.clientApiHttpServer.factory, 0o666, True),
+        )
+
+        internal_factory, mode, _ = servers["/run/sydent/internal.sock"]
+        self.assertEqual(mode, 0o600)
+        self.assertIn(b"_matrix", internal_factory.resource.children)
+
+        metrics_factory, mode, _ = servers["/run/sydent/metrics.sock"]
+        self.assertEqual(mode, 0o660)
+        self.assertIsInstance(metrics_factory.resource, MetricsResource)
+
+    def test_invalid_mode(self) -> None:
+        with self.assertRaises(ConfigError):
+            make_sydent({"http": {"internalapi.unix_socket.mode": "rw-rw----"}})
+        with self.assertRaises(ConfigError):
+            make_sydent({"http": {"clientapi.unix_socket.mode": "1777"}})
+
+    def test_forwarded_client_address(self) -> None:
+        """Tests that a reverse proxy connecting over a Unix socket can pass on
+        clients' addresses with X-Forwarded-For.
+        """
+        sydent = make_sydent(
+            {
+                "http": {
+                    "clientapi.unix_socket.path": "/run/sydent/client.sock",
+                    "obey_x_forwarded_for": "true",
+                }
+            }
+        )
+        sydent.run()
+
+        for headers, expected in (
+            ([(b"X-Forwarded-For", b"10.0.0.1")], "10.0.0.1"),
+            ([], None),
+        ):
+            request, _ = make_request(
+                sydent.reactor,
+                sydent.clientApiHttpServer.factory,
+                "GET",
+                "/_matrix/identity/v2",
+                custom_headers=headers,
+            )
+            request.client = UNIXAddress(b"/run/sydent/client.sock")
+            self.assertEqual(sydent.ip_from_request(request), expected)
+
+    def test_worker_socket(self) -> None:
+        """Tests that the socket shared with workers replaces a stale one, and has
+        the configured permissions.
+        """
+        path = os.path.join(tempfile.mkdtemp(), "client.sock")
+        # A socket and lock left behind by a process which isn't running anymore.
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        process = subprocess.Popen(["true"])
+        process.wait()
+        os.symlink(str(process.pid), path + ".lock")
+
+        sock, lock = _listen_unix(path, 0o640)
+        self.addCleanup(sock.close)
+        self.addCleanup(lock.unlock)
+        self.assertEqual(sock.family, socket.AF_UNIX)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_worker_socket_in_use(self) -> None:
+        """Tests that the socket shared with workers isn't taken over from a running
+        process.
+        """
+        path = os.path.join(tempfile.mkdtemp(), "client.sock")
+        sock, lock = _listen_unix(path, 0o640)
+        self.addCleanup(sock.close)
+        self.addCleanup(lock.unlock)
+
+        with self.assertRaises(CannotListenError):
+            _listen_unix(path, 0o640)
+        # The running process' socket is still there.
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(path)
@@ -0,0 +1,154 @@
+# Copyright 2022 The Matrix.org Foundation C.I.C.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from twisted.trial import unittest
+from twisted.web.proxy import ProxyClientFactory
+
+from sydent.config.exceptions import ConfigError
+from sydent.db.threepid_associations import GlobalAssociationStore
+from sydent.http.httpcommon import (
+    WORKER_SECRET_HEADER,
+    ForwardedRequest,
+    SizeLimitingRequest,
+)
+from sydent.http.httpserver import ClientApiWorkerHttpServer
+from tests.utils import make_request, make_sydent
+
+
+class ClientApiWorkerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sydent = make_sydent(
+            {
+                "general": {"enable_v1_access": "true"},
+                "http": {"clientapi.workers.master_port": "8091"},
+            }
+        )
+        self.sydent.worker_secret = "secret"
+        self.worker = ClientApiWorkerHttpServer(self.sydent)
+
+    def test_lookups_served_locally(self) -> None:
+        _, channel = make_request(
+            self.sydent.reactor,
+            self.worker.factory,
+            "POST",
+            "/_matrix/identity/api/v1/bulk_lookup",
+            {"threepids": [["email", "alice@example.com"]]},
+        )
+        self.assertEqual(channel.code, 200)
+        self.assertEqual(channel.json_body, {"threepids": []})
+        self.assertEqual(self.sydent.reactor.tcpClients, [])
+
+    def test_writes_forwarded(self) -> None:
+        make_request(
+            self.sydent.reactor,
+            self.worker.factory,
+            "POST",
+            "/_matrix/identity/v2/account/register?x=1",
+            {"matrix_server_name": "example.com", "access_token": "t"},
+            custom_headers=[
+                (b"X-Forwarded-For", b"10.0.0.1"),
+                (WORKER_SECRET_HEADER, b"forged"),
+            ],
+        )
+
+        host, port, factory, _, _ = self.sydent.reactor.tcpClients[0]
+        self.assertEqual((host, port), ("127.0.0.1", 8091))
+        assert isinstance(factory, ProxyClientFactory)
+        self.assertEqual(factory.rest, b"/_matrix/identity/v2/account/register?x=1")
+        # The worker doesn't trust X-Forwarded-For by default, and sends the
+        # client's actual address instead.
+        self.assertEqual(factory.headers[b"x-forwarded-for"], b"127.0.0.1")
+        self.assertEqual(factory.headers[WORKER_SECRET_HEADER.lower()], b"secret")
+
+    def test_forwarded_client_address(self) -> None:
+        secret = (WORKER_SECRET_HEADER, b"secret")
+        forwarded_for = (b"X-Forwarded-For", b"10.0.0.1")
+        for request_class, headers, expected in (
+            (ForwardedRequest, [secret, forwarded_for], "10.0.0.1"),
+            (SizeLimitingRequest, [secret, forwarded_for], "127.0.0.1"),
+            # The worker didn't know the client's address, and the connection is
+            # from the worker rather than from the client.
+            (ForwardedRequest, [secret], None),
+            # Requests which weren't forwarded by a worker are attributed to the
+            # connection's address.
+            (ForwardedRequest, [forwarded_for], "127.0.0.1"),
+            (
+                ForwardedRequest,
+                [(WORKER_SECRET_HEADER, b"wrong"), forwarded_for],
+                "127.0.0.1",
+            ),
+        ):
+            request, _ = make_request(
+                self.sydent.reactor,
+                self.sydent.clientApiHttpServer.forwardedFactory,
+                "GET",
+                "/_matrix/identity/v2",
+                request=request_class,
+                custom_headers=headers,
+            )
+            self.assertEqual(self.sydent.ip_from_request(request), expected)
+
+    def test_master_bind_address_loopback(self) -> None:
+        for bind_address in ("0.0.0.0", "::", "10.0.0.1", "localhost"):
+            with self.assertRaises(ConfigError):
+                make_sydent(
+                    {"http": {"clientapi.workers.master_bind_address": bind_address}}
+                )
+        make_sydent({"http": {"clientapi.workers.master_bind_address": "::1"}})
+
+
+class WorkerDatabaseTestCase(unittest.TestCase):
+    def test_lookups_dont_lock_database(self) -> None:
+        """Tests that lookups made without caches, like workers make them, don't
+        stop another process from writing to the database.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        db_file = os.path.join(directory, "sydent.db")
+        sydent = make_sydent(
+            {
+                "db": {"db.file": db_file},
+                "http": {"clientapi.workers": "1"},
+                "lookup": {
+                    "hash_index.enabled": "false",
+                    "bloom_filter.enabled": "false",
+                    "cache.enabled": "false",
+                },
+            }
+        )
+        store = GlobalAssociationStore(sydent)
+        store.getMxids([("email", "alice@example.com")])
+        store.retrieveMxidsForHashes(["somehash"])
+        self.assertFalse(sydent.db.in_transaction)
+
+        # Stands in for the main process.
+        other = sqlite3.connect(db_file, timeout=0)
+        self.addCleanup(other.close)
+        self.assertEqual(other.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+        other.execute(
+            "INSERT INTO global_threepid_association_changes (lookup_hash, ts) "
+            "VALUES ('somehash', 0)"
+        )
+        other.commit()
+
+        # And the lookups still see what the other process committed.
+        res = sydent.db.execute(
+            "SELECT COUNT(*) FROM global_threepid_association_changes"
+        )
+        self.assertEqual(res.fetchone(), (1,))
@@ -1,12 +1,18 @@
+import datetime
 import json
 import logging
 import os
+import tempfile
 from io import BytesIO
 from typing import Dict, Optional
 from unittest.mock import MagicMock
 
 import attr
 import twisted.logger
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 from OpenSSL import crypto
 from twisted.internet import address
 from twisted.internet._resolver import SimpleResolverComplexifier
@@ -94,6 +100,42 @@ def make_sydent(test_config: Optional[dict] = None) -> Sydent:
     )
 
 
+def write_key_and_cert(path: Optional[str] = None) -> str:
+    """Write a new self-signed certificate and its private key to a file.
+
+    :param path: The path of the file, or None for a new temporary file.
+
+    :return: The path of the file.
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(1)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .sign(key, hashes.SHA256())
+    )
+
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".pem")
+        os.close(fd)
+    with open(path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            )
+        )
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return path
+
+
 @attr.s
 class FakeChannel:
     """
@@ -195,6 +237,8 @@ def make_request(
     request=Request,
     shorthand=True,
     federation_auth_origin=None,
+    content_type=b"application/json",
+    custom_headers=None,
 ):
     """
     Make a web request using the given method and path, feed it the
@@ -215,6 +259,9 @@ def make_request(
         with the usual REST API path, if it doesn't contain it.
         federation_auth_origin (bytes|None): if set to not-None, we will add a fake
             Authorization header pretenting to be the given server name.
+        content_type (bytes): The content type of the request's body, if any.
+        custom_headers (Iterable[Tuple[bytes, bytes]]|None): Other headers to add to
+            the request.
 
     Returns:
         Tuple[synapse.http.site.SynapseRequest, channel]
@@ -256,7 +303,10 @@ def make_request(
         )
 
     if content:
-        req.requestHeaders.addRawHeader(b"Content-Type", b"application/json")
+        req.requestHeaders.addRawHeader(b"Content-Type", content_type)
+
+    for name, value in custom_headers or ():
+        req.requestHeaders.addRawHeader(name, value)
 
     req.requestReceived(method, path, b"1.1")
 